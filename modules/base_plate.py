@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+# В файле modules/base_plate.py
+"""
+Кэш декодированной подложки для картинки сарказма (assets/Барон.png).
+
+Раньше каждая отрисовка заново открывала PNG, декодировала и переводила его в RGBA и пересчитывала
+геометрию области текста (правая половина с отступами), хотя подложка не меняется.
+
+Теперь:
+    - пиксели RGBA подложки хранятся в памяти процесса (LRU на BASE_PLATE.max_plates файлов,
+      ключ - путь, размер и mtime файла: замена картинки сбрасывает кэш);
+    - при BASE_PLATE.persist_raw (по умолчанию выключено) пиксели один раз записываются сырым файлом
+      в рабочую область (modules/scratch.py, подпапка base_plates/), и следующие процессы на той же
+      машине отображают его в память (mmap) вместо декодирования PNG. Имеет смысл только на
+      постоянной машине: на новом раннере CI файла нет, а первая запись медленнее простого
+      декодирования; reclaim_stale удаляет base_plates/ старше SCRATCH.stale_after_hours. Если корнем
+      рабочей области оказалась текущая директория, файл не пишется (он попал бы в рабочую копию);
+    - clone() отдает Image.frombuffer поверх общих пикселей: изображение только для чтения,
+      Pillow копирует буфер при первой записи (ImageDraw.Draw), так что общие пиксели не портятся;
+    - text_region(padding_fraction) - область текста, посчитанная один раз на отступ.
+"""
+import hashlib
+import mmap
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+try:
+    from .logger import get_logger
+    from .config_manager import ConfigManager
+    from .scratch import get_scratch_root, is_cwd_fallback
+    logger = get_logger("base_plate")
+except ImportError:
+    from modules.logger import get_logger
+    from modules.config_manager import ConfigManager
+    from modules.scratch import get_scratch_root, is_cwd_fallback
+    logger = get_logger("base_plate")
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+DEFAULT_SETTINGS = {
+    "enabled": True,
+    "persist_raw": False,
+    "max_plates": 4,
+}
+RAW_SUBDIR = "base_plates"
+
+
+def get_base_plate_settings(config=None) -> dict:
+    config = config or ConfigManager()
+    return {key: config.get(f"BASE_PLATE.{key}", default) for key, default in DEFAULT_SETTINGS.items()}
+
+
+class BasePlate:
+    """Декодированная подложка: пиксели RGBA (bytes или mmap), размер и области текста."""
+
+    def __init__(self, path: Path, size: tuple[int, int], pixels, source: str):
+        self.path = path
+        self.size = size
+        self.pixels = pixels
+        self.source = source # "png" (декодирован) или "raw" (mmap сырого файла)
+        self._regions = {}
+
+    def clone(self):
+        """Изображение RGBA поверх общих пикселей (только чтение, копия при первой записи)."""
+        return Image.frombuffer("RGBA", self.size, self.pixels, "raw", "RGBA", 0, 1)
+
+    def text_region(self, padding_fraction: float) -> dict:
+        """Правая половина с отступами: x_start, y_start, width, height и середина midline."""
+        region = self._regions.get(padding_fraction)
+        if region is None:
+            img_width, img_height = self.size
+            padding_x = int(img_width * padding_fraction)
+            padding_y = int(img_height * padding_fraction)
+            region = self._regions[padding_fraction] = {
+                "x_start": img_width // 2 + padding_x, "y_start": padding_y,
+                "width": img_width // 2 - 2 * padding_x, "height": img_height - 2 * padding_y,
+                "midline": img_width // 2,
+            }
+        return region
+
+
+def _raw_path(path: Path, stat: os.stat_result, size: tuple[int, int]) -> Path:
+    digest = hashlib.sha1(f"{path}|{stat.st_size}|{stat.st_mtime_ns}".encode("utf-8")).hexdigest()[:16]
+    return get_scratch_root() / RAW_SUBDIR / f"plate_{size[0]}x{size[1]}_{digest}.rgba"
+
+
+def raw_plate_path(path) -> Path:
+    """Путь сырого файла подложки (зависит от пути, размера и mtime картинки)."""
+    path = Path(path).resolve()
+    with Image.open(path) as probe:
+        size = probe.size
+    return _raw_path(path, path.stat(), size)
+
+
+def _map_raw(raw_path: Path, expected_bytes: int):
+    """mmap сырого файла или None, если его нет или размер не совпадает."""
+    try:
+        with open(raw_path, "rb") as f:
+            if os.fstat(f.fileno()).st_size != expected_bytes:
+                return None
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_raw(raw_path: Path, pixels: bytes) -> bool:
+    try:
+        raw_path.parent.mkdir(mode=0o700, exist_ok=True)
+        temp_path = raw_path.with_name(f"{raw_path.name}.{os.getpid()}.tmp")
+        with open(temp_path, "wb") as f:
+            f.write(pixels)
+        os.replace(temp_path, raw_path)
+        return True
+    except OSError as e:
+        logger.warning(f"⚠️ Не удалось сохранить сырую подложку {raw_path}: {e}")
+        return False
+
+
+def load_base_plate(path, persist_raw: bool = False) -> BasePlate:
+    """Подложка без кэша в памяти: mmap сырого файла, если он есть, иначе декодирование PNG (и запись сырого файла)."""
+    path = Path(path).resolve()
+    stat = path.stat()
+    if persist_raw:
+        # Размер изображения читается из заголовка PNG, без декодирования пикселей
+        with Image.open(path) as probe:
+            size = probe.size
+        raw_path = _raw_path(path, stat, size)
+        pixels = _map_raw(raw_path, size[0] * size[1] * 4)
+        if pixels is not None:
+            return BasePlate(path, size, pixels, "raw")
+    with Image.open(path) as img:
+        rgba = img.convert("RGBA")
+    pixels = rgba.tobytes()
+    if persist_raw:
+        _write_raw(_raw_path(path, stat, rgba.size), pixels)
+    return BasePlate(path, rgba.size, pixels, "png")
+
+
+_plates = OrderedDict()
+_plates_lock = threading.Lock()
+
+
+def get_base_plate(path, config=None) -> BasePlate:
+    """Подложка из кэша процесса (LRU). При BASE_PLATE.enabled=false - каждый раз заново из PNG."""
+    settings = get_base_plate_settings(config)
+    if not settings["enabled"]:
+        return load_base_plate(path, persist_raw=False)
+    path = Path(path).resolve()
+    stat = path.stat()
+    key = (str(path), stat.st_size, stat.st_mtime_ns)
+    with _plates_lock:
+        plate = _plates.get(key)
+        if plate is not None:
+            _plates.move_to_end(key)
+            return plate
+        started = time.perf_counter()
+        plate = load_base_plate(path, persist_raw=bool(settings["persist_raw"]) and not is_cwd_fallback())
+        logger.info(f"🖼️ Подложка {path.name} ({plate.size[0]}x{plate.size[1]}) загружена из "
+                    f"{'сырого файла (mmap)' if plate.source == 'raw' else 'PNG'} за {(time.perf_counter() - started) * 1000:.0f} мс.")
+        _plates[key] = plate
+        while len(_plates) > max(1, int(settings["max_plates"])):
+            _plates.popitem(last=False)
+        return plate
+
+
+def clear_cache():
+    """Очищает кэш подложек процесса (сырые файлы остаются)."""
+    with _plates_lock:
+        _plates.clear()
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+# В файле modules/compositing.py
+"""
+Наложение дымки и подложки под текстом для изображения-заголовка (utils.add_text_to_image).
+
+Раньше дымка строилась полнокадровым белым слоем RGBA и накладывалась alpha_composite на весь кадр
+1792x1024, а для размытия/затемнения под текстом создавался второй полнокадровый прозрачный слой.
+
+Теперь:
+    - apply_haze: для непрозрачного изображения (альфа везде 255 - картинки MJ) наложение
+      однотонного слоя - это независимая таблица для каждого канала, поэтому дымка применяется
+      одной операцией Image.point без полнокадрового слоя. Таблица один раз снимается с самого
+      Image.alpha_composite на градиенте 0..255, поэтому результат совпадает попиксельно
+      (проверка: scripts/compositing_check.py). Для изображений с прозрачностью - прежний путь;
+    - apply_text_background: слой размытия/затемнения размером с прямоугольник текста
+      накладывается на месте (Image.alpha_composite с dest), пиксели вне прямоугольника не трогаются.
+"""
+from functools import lru_cache
+
+try:
+    from .logger import get_logger
+    logger = get_logger("compositing")
+except ImportError:
+    from modules.logger import get_logger
+    logger = get_logger("compositing")
+
+try:
+    from PIL import Image, ImageDraw, ImageFilter
+except ImportError:
+    Image = ImageDraw = ImageFilter = None
+
+
+@lru_cache(maxsize=32)
+def _haze_lut(color: tuple[int, int, int], opacity: int) -> tuple[int, ...]:
+    """Таблица для Image.point (R, G, B, A по 256 значений) = alpha_composite однотонного слоя поверх непрозрачного пикселя."""
+    ramp = Image.new("RGBA", (256, 1))
+    ramp.putdata([(value, value, value, 255) for value in range(256)])
+    composited = Image.alpha_composite(ramp, Image.new("RGBA", ramp.size, color + (opacity,)))
+    pixels = list(composited.getdata())
+    return tuple(pixel[band] for band in range(4) for pixel in pixels)
+
+
+def apply_haze(img, opacity: int, color: tuple[int, int, int] = (255, 255, 255)):
+    """Накладывает однотонную дымку (color, прозрачность opacity 0-255) на RGBA-изображение и возвращает результат."""
+    opacity = max(0, min(255, int(opacity)))
+    if opacity == 0:
+        return img
+    if img.mode == "RGBA" and img.getextrema()[3] == (255, 255):
+        return img.point(_haze_lut(tuple(color), opacity))
+    return Image.alpha_composite(img.convert("RGBA"), Image.new("RGBA", img.size, tuple(color) + (opacity,)))
+
+
+def apply_text_background(img, box: tuple[int, int, int, int], blur_radius: float = 0, opacity: int = 0, log=None):
+    """
+    Размытие (blur_radius) и/или черное затемнение (opacity) под текстом в прямоугольнике box
+    (left, top, right, bottom) - на месте, только в пределах box. Как и прежний полнокадровый слой:
+    размытая область вставляется в слой, затемнение рисуется поверх нее (rectangle включает правый
+    и нижний край), затем слой накладывается alpha_composite. Возвращает img.
+    """
+    log = log or logger
+    left, top, right, bottom = box
+    layer_box = (left, top, min(img.width, right + 1), min(img.height, bottom + 1))
+    layer_size = (layer_box[2] - left, layer_box[3] - top)
+    if layer_size[0] <= 0 or layer_size[1] <= 0:
+        return img
+    layer = Image.new("RGBA", layer_size, (0, 0, 0, 0))
+    if blur_radius > 0:
+        try:
+            layer.paste(img.crop(box).filter(ImageFilter.GaussianBlur(blur_radius)), (0, 0))
+        except Exception as blur_err:
+            log.warning(f"Не удалось применить размытие под текстом: {blur_err}")
+    if opacity > 0:
+        ImageDraw.Draw(layer).rectangle([(0, 0), (right - left, bottom - top)], fill=(0, 0, 0, int(opacity)))
+    img.alpha_composite(layer, dest=(left, top))
+    return img
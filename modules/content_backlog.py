@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+# В файле modules/content_backlog.py
+"""
+Бэклог заранее сгенерированного контента в B2.
+
+generate_content.py --backlog складывает готовые JSON в папку CONTENT_BACKLOG.folder (по умолчанию pending/),
+b2_storage_manager.py забирает самый старый элемент в 666/ вместо синхронной генерации
+и пополняет бэклог до CONTENT_BACKLOG.target_depth.
+"""
+import os
+import re
+from datetime import datetime, timezone
+
+try:
+    from .logger import get_logger
+    from .utils import list_b2_folder_contents, move_b2_object
+    logger = get_logger("content_backlog")
+except ImportError:
+    from modules.logger import get_logger
+    from modules.utils import list_b2_folder_contents, move_b2_object
+    logger = get_logger("content_backlog")
+
+try:
+    from botocore.exceptions import ClientError
+except ImportError:
+    ClientError = Exception
+
+DEFAULT_BACKLOG_FOLDER = "pending/"
+GENERATION_ID_PATTERN = re.compile(r"^\d{8}-\d{4}$")
+
+
+def _normalize_folder(folder: str) -> str:
+    return folder.rstrip('/') + '/'
+
+
+def _parse_id_timestamp(generation_id: str) -> datetime | None:
+    """Извлекает время создания из ID формата YYYYMMDD-HHMM (UTC)."""
+    try:
+        return datetime.strptime(generation_id, "%Y%m%d-%H%M").replace(tzinfo=timezone.utc)
+    except (TypeError, ValueError):
+        return None
+
+
+def list_backlog(s3_client, bucket_name: str, folder: str = DEFAULT_BACKLOG_FOLDER) -> list[dict]:
+    """
+    Возвращает элементы бэклога, отсортированные от самого старого к самому новому:
+    [{"generation_id", "key", "last_modified"}].
+    """
+    items = []
+    for obj in list_b2_folder_contents(s3_client, bucket_name, _normalize_folder(folder)):
+        key = obj.get('Key', '')
+        base_name, ext = os.path.splitext(os.path.basename(key))
+        if ext.lower() != '.json' or not GENERATION_ID_PATTERN.match(base_name):
+            continue
+        items.append({"generation_id": base_name, "key": key, "last_modified": obj.get('LastModified')})
+    items.sort(key=lambda item: item["generation_id"])
+    return items
+
+
+def get_backlog_stats(items: list[dict], now: datetime | None = None) -> dict:
+    """Считает глубину бэклога и возраст самого старого элемента (в секундах)."""
+    now = now or datetime.now(timezone.utc)
+    stats = {"depth": len(items), "oldest_id": None, "oldest_age_seconds": None}
+    if not items:
+        return stats
+    oldest = items[0]
+    created_at = oldest.get("last_modified")
+    if isinstance(created_at, datetime):
+        if created_at.tzinfo is None:
+            created_at = created_at.replace(tzinfo=timezone.utc)
+    else:
+        created_at = _parse_id_timestamp(oldest["generation_id"])
+    stats["oldest_id"] = oldest["generation_id"]
+    if created_at:
+        stats["oldest_age_seconds"] = max(0, int((now - created_at).total_seconds()))
+    return stats
+
+
+def format_backlog_stats(stats: dict, target_depth: int | None = None) -> str:
+    """Строка для итоговой сводки запуска."""
+    depth_str = f"{stats.get('depth', 0)}/{target_depth}" if target_depth is not None else str(stats.get('depth', 0))
+    if not stats.get("oldest_id"):
+        return f"глубина {depth_str}, элементов нет"
+    age = stats.get("oldest_age_seconds")
+    age_str = f"{age / 3600:.1f} ч" if age is not None else "неизвестен"
+    return f"глубина {depth_str}, самый старый: {stats['oldest_id']} (возраст {age_str})"
+
+
+def promote_backlog_item(s3_client, bucket_name: str, item: dict, target_folder: str = "666/") -> bool:
+    """Перемещает JSON контента из бэклога в рабочую папку (по умолчанию 666/)."""
+    dest_key = f"{_normalize_folder(target_folder)}{item['generation_id']}.json"
+    logger.info(f"📦 Перенос контента из бэклога: {item['key']} -> {dest_key}")
+    return move_b2_object(s3_client, bucket_name, item["key"], dest_key)
+
+
+def generation_id_is_free(s3_client, bucket_name: str, generation_id: str, folders: list[str]) -> bool:
+    """Проверяет, что {generation_id}.json отсутствует во всех перечисленных папках."""
+    for folder in folders:
+        key = f"{_normalize_folder(folder)}{generation_id}.json"
+        try:
+            s3_client.head_object(Bucket=bucket_name, Key=key)
+            logger.info(f"ID {generation_id} уже занят: найден {key}.")
+            return False
+        except ClientError as e:
+            error_code = getattr(e, 'response', {}).get('Error', {}).get('Code') if hasattr(e, 'response') else None
+            if error_code in ('404', 'NoSuchKey', 'NotFound'):
+                continue
+            logger.error(f"Ошибка проверки {key}: {e}")
+            return False
+        except Exception as e:
+            logger.error(f"Неизвестная ошибка проверки {key}: {e}", exc_info=True)
+            return False
+    return True
@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+# В файле modules/content_schema.py
+"""
+Схема документа контента генерации ({generation_id}.json в 666/ / archive/).
+
+Одна схема на писателя (generate_content: валидация перед сохранением) и читателей
+(generate_media и др.). Схема компилируется один раз при импорте в список проверок полей;
+decode_content_document проходит документ за один проход, разбирает вложенные JSON-строки
+(content -> {"текст"}, sarcasm.comment -> {"комментарий"}) и возвращает ContentDocument
+с типизированными свойствами, чтобы читателям не нужно было парсить их повторно.
+
+Режимы:
+    strict=True  - правила ТЗ для записи (бывшая validate_output_json);
+    strict=False - чтение старых документов: sarcasm.comment может быть словарем с "comment",
+                   JSON-строкой со строкой или просто текстом; ошибки полей становятся предупреждениями.
+"""
+import json
+
+try:
+    from .logger import get_logger
+    logger = get_logger("content_schema")
+except ImportError:
+    from modules.logger import get_logger
+    logger = get_logger("content_schema")
+
+# Ключи, отсутствие или null которых заслуживает предупреждения (но не ошибки)
+EXPECTED_KEYS = ["topic", "content", "sarcasm", "script", "first_frame_description",
+                 "creative_brief", "final_mj_prompt", "final_runway_prompt", "hashtags"]
+CONTENT_TEXT_KEY = "текст"
+SARCASM_COMMENT_KEY = "комментарий"
+
+
+class ContentDocument:
+    """Разобранный документ контента: исходный словарь + декодированные вложенные поля."""
+
+    def __init__(self, raw: dict):
+        self.raw = raw
+        self.text = None
+        self.sarcasm_comment = None
+        self.warnings = []
+
+    def _get_str(self, key: str, default: str = "") -> str:
+        value = self.raw.get(key)
+        return value if isinstance(value, str) else default
+
+    @property
+    def topic(self) -> str:
+        return self._get_str("topic")
+
+    @property
+    def selected_focus(self) -> str | None:
+        return self.raw.get("selected_focus") if isinstance(self.raw.get("selected_focus"), str) else None
+
+    @property
+    def sarcasm_poll(self) -> dict | None:
+        sarcasm = self.raw.get("sarcasm")
+        poll = sarcasm.get("poll") if isinstance(sarcasm, dict) else None
+        return poll if isinstance(poll, dict) else None
+
+    @property
+    def hashtags(self) -> list[str]:
+        return list(self.raw.get("hashtags") or [])
+
+    @property
+    def creative_brief(self) -> dict | None:
+        brief = self.raw.get("creative_brief")
+        return brief if isinstance(brief, dict) else None
+
+    @property
+    def script(self) -> str:
+        return self._get_str("script")
+
+    @property
+    def first_frame_description(self) -> str:
+        return self._get_str("first_frame_description")
+
+    @property
+    def final_mj_prompt(self) -> str:
+        return self._get_str("final_mj_prompt")
+
+    @property
+    def final_runway_prompt(self) -> str:
+        return self._get_str("final_runway_prompt")
+
+    def get_ru(self, key: str) -> str | None:
+        """Русская версия поля (script_ru, final_mj_prompt_ru, ...), если есть."""
+        value = self.raw.get(f"{key}_ru")
+        return value if isinstance(value, str) else None
+
+
+# --- Проверки полей (каждая получает (значение, документ, strict) и возвращает текст ошибки или None) ---
+
+def _check_content(value, document: ContentDocument, strict: bool):
+    if not isinstance(value, str):
+        return "Поле 'content' не является строкой."
+    try:
+        content_json = json.loads(value)
+    except json.JSONDecodeError:
+        return "Не удалось распарсить JSON-строку в поле 'content'."
+    if not isinstance(content_json, dict):
+        return "Поле 'content' не содержит валидный JSON-объект."
+    if strict and list(content_json.keys()) != [CONTENT_TEXT_KEY]:
+        return f"JSON в поле 'content' должен содержать ровно один ключ '{CONTENT_TEXT_KEY}'. Найдено: {list(content_json.keys())}"
+    main_text = content_json.get(CONTENT_TEXT_KEY)
+    if not isinstance(main_text, str):
+        return f"Значение по ключу '{CONTENT_TEXT_KEY}' в поле 'content' не является строкой."
+    if not main_text.strip():
+        return f"Значение по ключу '{CONTENT_TEXT_KEY}' в поле 'content' пустое."
+    # Допускаем одну строку без двойного переноса
+    if strict and "\n\n" not in main_text and "\n" in main_text:
+        return f"Текст в поле 'content'['{CONTENT_TEXT_KEY}'] не разбит на абзацы с помощью '\\n\\n'."
+    document.text = main_text
+    return None
+
+
+def _decode_comment_lenient(comment_value):
+    """Разбор sarcasm.comment старых форматов (логика generate_media)."""
+    if isinstance(comment_value, dict):
+        return comment_value.get("comment") or comment_value.get(SARCASM_COMMENT_KEY)
+    if not isinstance(comment_value, str):
+        return None
+    try:
+        parsed = json.loads(comment_value)
+    except json.JSONDecodeError:
+        return comment_value.strip('"')
+    if isinstance(parsed, dict):
+        return parsed.get("comment") or parsed.get(SARCASM_COMMENT_KEY)
+    return parsed if isinstance(parsed, str) else None
+
+
+def _check_sarcasm(value, document: ContentDocument, strict: bool):
+    # Допускаем отсутствие 'sarcasm' или 'sarcasm.comment'
+    if not isinstance(value, dict):
+        return None
+    comment_value = value.get("comment")
+    if comment_value is None or comment_value == "":
+        return None
+    if not strict:
+        document.sarcasm_comment = _decode_comment_lenient(comment_value) or None
+        return None
+    if not isinstance(comment_value, str):
+        return "Поле 'sarcasm.comment' не является строкой (и не None/пустое)."
+    try:
+        comment_json = json.loads(comment_value)
+    except json.JSONDecodeError:
+        return "Не удалось распарсить JSON-строку в поле 'sarcasm.comment'."
+    if not isinstance(comment_json, dict):
+        return "Поле 'sarcasm.comment' не содержит валидный JSON-объект."
+    if list(comment_json.keys()) != [SARCASM_COMMENT_KEY]:
+        return f"JSON в поле 'sarcasm.comment' должен содержать ровно один ключ '{SARCASM_COMMENT_KEY}'. Найдено: {list(comment_json.keys())}"
+    comment_text = comment_json.get(SARCASM_COMMENT_KEY)
+    if not isinstance(comment_text, str):
+        return f"Значение по ключу '{SARCASM_COMMENT_KEY}' в поле 'sarcasm.comment' не является строкой."
+    document.sarcasm_comment = comment_text or None
+    return None
+
+
+def _check_hashtags(value, document: ContentDocument, strict: bool):
+    # Допускаем отсутствие хештегов
+    if value is None:
+        return None
+    if not isinstance(value, list):
+        return "Поле 'hashtags' не является списком (и не None)."
+    if not all(isinstance(tag, str) for tag in value):
+        return "Не все элементы в списке 'hashtags' являются строками."
+    return None
+
+
+def _check_optional_str(key: str):
+    def check(value, document: ContentDocument, strict: bool):
+        if value is not None and not isinstance(value, str):
+            return f"Поле '{key}' не является строкой."
+        return None
+    return check
+
+
+def _check_optional_dict(key: str):
+    def check(value, document: ContentDocument, strict: bool):
+        if value is not None and not isinstance(value, dict):
+            return f"Поле '{key}' не является объектом."
+        return None
+    return check
+
+
+CONTENT_SCHEMA_SPEC = {
+    "topic": _check_optional_str("topic"),
+    "content": _check_content,
+    "selected_focus": _check_optional_str("selected_focus"),
+    "sarcasm": _check_sarcasm,
+    "script": _check_optional_str("script"),
+    "first_frame_description": _check_optional_str("first_frame_description"),
+    "creative_brief": _check_optional_dict("creative_brief"),
+    "final_mj_prompt": _check_optional_str("final_mj_prompt"),
+    "final_runway_prompt": _check_optional_str("final_runway_prompt"),
+    "hashtags": _check_hashtags,
+}
+
+
+class ContentSchema:
+    """Скомпилированная схема: упорядоченный кортеж (ключ, проверка, ожидается ли ключ)."""
+
+    def __init__(self, spec: dict, expected_keys: list[str]):
+        expected = set(expected_keys)
+        self._checks = tuple((key, check, key in expected) for key, check in spec.items())
+        self._expected_only = tuple(k for k in expected_keys if k not in spec)
+
+    def decode(self, data, strict: bool = True) -> tuple[ContentDocument | None, str | None]:
+        """Проверяет и декодирует документ за один проход. Возвращает (документ, None) или (None, ошибка)."""
+        if not isinstance(data, dict):
+            return None, "Документ контента не является словарем."
+        document = ContentDocument(data)
+        missing, null_keys = [], []
+        for key, check, is_expected in self._checks:
+            value = data.get(key)
+            if is_expected and value is None:
+                (null_keys if key in data else missing).append(key)
+            error = check(value, document, strict)
+            if error:
+                if strict:
+                    return None, f"Ошибка валидации: {error}"
+                # Читателю достаточно тех полей, которые удалось разобрать
+                document.warnings.append(error)
+        for key in self._expected_only:
+            if data.get(key) is None:
+                (null_keys if key in data else missing).append(key)
+        if missing: document.warnings.append(f"Отсутствуют ключи: {missing}.")
+        if null_keys: document.warnings.append(f"Ключи с null: {null_keys}.")
+        return document, None
+
+
+CONTENT_SCHEMA = ContentSchema(CONTENT_SCHEMA_SPEC, EXPECTED_KEYS)
+
+
+def decode_content_document(data, strict: bool = True, logger_instance=None) -> tuple[ContentDocument | None, str | None]:
+    """Обертка над CONTENT_SCHEMA.decode с логированием результата."""
+    log = logger_instance or logger
+    document, error = CONTENT_SCHEMA.decode(data, strict=strict)
+    if error:
+        log.error(error)
+        return None, error
+    for warning in document.warnings:
+        log.warning(f"⚠️ {warning}")
+    return document, None
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+# В файле modules/creative_brief.py
+"""
+Правила валидации креативного брифа (шаги 6.1-6.3 generate_content.py).
+
+Используются и многошаговым режимом (три вызова OpenAI), и объединенным режимом
+(multi_step.fused_brief - один вызов, ответ {"core": ..., "driver": ..., "aesthetic": ...}),
+чтобы оба режима принимали и отклоняли одни и те же ответы.
+"""
+try:
+    from .logger import get_logger
+    logger = get_logger("creative_brief")
+except ImportError:
+    from modules.logger import get_logger
+    logger = get_logger("creative_brief")
+
+CORE_KEYS = ["chosen_type", "chosen_value", "justification"]
+DRIVER_KEYS = ["chosen_driver_type", "chosen_driver_value", "justification"]
+AESTHETIC_KEYS = ["style_needed", "chosen_style_type", "chosen_style_value", "style_keywords", "justification"]
+AESTHETIC_NULLABLE_KEYS = ["chosen_style_type", "chosen_style_value", "style_keywords", "justification"]
+FUSED_SECTIONS = ["core", "driver", "aesthetic"]
+
+
+def validate_core_brief(core_brief) -> bool:
+    """Шаг 6.1: словарь с chosen_type, chosen_value, justification."""
+    return isinstance(core_brief, dict) and all(k in core_brief for k in CORE_KEYS)
+
+
+def validate_driver_brief(driver_brief) -> bool:
+    """Шаг 6.2: словарь с chosen_driver_type, chosen_driver_value, justification."""
+    return isinstance(driver_brief, dict) and all(k in driver_brief for k in DRIVER_KEYS)
+
+
+def validate_aesthetic_brief(aesthetic_brief) -> bool:
+    """
+    Шаг 6.3: при style_needed=false остальные ключи должны быть null (иначе обнуляются на месте),
+    при style_needed=true - заполнены, а style_keywords является списком.
+    """
+    if not isinstance(aesthetic_brief, dict):
+        logger.error("Шаг 6.3: Ответ не словарь.")
+        return False
+    if not all(k in aesthetic_brief for k in AESTHETIC_KEYS):
+        logger.error("Шаг 6.3: Отсутствуют базовые ключи.")
+        return False
+    if not aesthetic_brief.get("style_needed", False):
+        if any(aesthetic_brief.get(k) is not None for k in AESTHETIC_NULLABLE_KEYS):
+            logger.warning("Шаг 6.3: style_needed=false, но ключи не null. Исправляем.")
+            aesthetic_brief.update({k: None for k in AESTHETIC_NULLABLE_KEYS})
+        return True
+    if all([aesthetic_brief.get("chosen_style_type"), aesthetic_brief.get("chosen_style_value"),
+            isinstance(aesthetic_brief.get("style_keywords"), list), aesthetic_brief.get("justification")]):
+        return True
+    logger.error("Шаг 6.3: style_needed=true, но значения некорректны.")
+    return False
+
+
+def split_fused_brief(fused_brief) -> dict | None:
+    """
+    Разбирает ответ объединенного режима и применяет к частям правила шагов 6.1-6.3.
+    Возвращает {"core", "driver", "aesthetic"} или None, если хотя бы одна часть неверна.
+    """
+    if not isinstance(fused_brief, dict) or not all(k in fused_brief for k in FUSED_SECTIONS):
+        logger.error(f"Объединенный бриф: отсутствуют разделы {FUSED_SECTIONS}.")
+        return None
+    core_brief = fused_brief["core"]
+    driver_brief = fused_brief["driver"]
+    aesthetic_brief = fused_brief["aesthetic"]
+    if not validate_core_brief(core_brief):
+        logger.error(f"Объединенный бриф: неверный раздел core {core_brief}.")
+        return None
+    if not validate_driver_brief(driver_brief):
+        logger.error(f"Объединенный бриф: неверный раздел driver {driver_brief}.")
+        return None
+    if not validate_aesthetic_brief(aesthetic_brief):
+        logger.error("Объединенный бриф: неверный раздел aesthetic.")
+        return None
+    return {"core": core_brief, "driver": driver_brief, "aesthetic": aesthetic_brief}
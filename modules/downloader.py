@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+# В файле modules/downloader.py
+"""
+Загрузчик медиа (картинки MJ, апскейлы, видео Runway) с общим пулом соединений.
+
+- Один requests.Session на процесс с HTTPAdapter (пул pool_maxsize соединений на хост), поэтому
+  повторные загрузки с одного CDN не открывают новое TCP/TLS-соединение.
+- Потоковая запись частями chunk_size_kib во временный файл <путь>.part и переименование по успеху.
+- Повторы - один уровень на каждый вид ошибки: ответы 429/5xx повторяет urllib3.Retry адаптера
+  (повторы соединения и чтения в адаптере выключены); ошибки соединения, таймауты и обрыв посреди
+  тела обрабатывает цикл download_to_file - докачка с Range: bytes=N- (если сервер ответил 206)
+  или загрузка заново. Итого не больше retries повторов каждого вида на URL.
+- download_many - параллельная загрузка списка (url, путь) в max_workers потоков.
+- Каждая загрузка пишется в журнал процесса (байты, время, докачки); в лог - скорость в МиБ/с.
+
+Настройки - секция DOWNLOADER в config.json:
+    pool_maxsize, max_workers, chunk_size_kib, retries, backoff_seconds, timeout_seconds.
+"""
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    from urllib3.util.retry import Retry
+except ImportError:
+    Retry = None
+
+try:
+    from .logger import get_logger
+    from .config_manager import ConfigManager
+    logger = get_logger("downloader")
+except ImportError:
+    from modules.logger import get_logger
+    from modules.config_manager import ConfigManager
+    logger = get_logger("downloader")
+
+DEFAULT_SETTINGS = {
+    "pool_maxsize": 8,
+    "max_workers": 4,
+    "chunk_size_kib": 256,
+    "retries": 3,
+    "backoff_seconds": 0.5,
+    "timeout_seconds": 30,
+}
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+# Ошибки посреди потока, после которых имеет смысл докачка
+STREAM_ERRORS = (requests.exceptions.ChunkedEncodingError, requests.exceptions.ConnectionError,
+                 requests.exceptions.ReadTimeout)
+
+_lock = threading.Lock()
+_session = None
+_settings = None
+_records = []
+_records_lock = threading.Lock()
+
+
+def get_downloader_settings(config=None) -> dict:
+    """Настройки DOWNLOADER из config.json поверх значений по умолчанию."""
+    global _settings
+    if _settings is not None and config is None:
+        return _settings
+    settings = dict(DEFAULT_SETTINGS)
+    try:
+        config = config or ConfigManager()
+        settings.update({k: v for k, v in (config.get("DOWNLOADER", {}) or {}).items() if v is not None})
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось прочитать DOWNLOADER из конфигурации: {e}. Используются значения по умолчанию.")
+    _settings = settings
+    return settings
+
+
+def create_session(settings: dict | None = None) -> requests.Session:
+    """
+    Новый requests.Session с пулом соединений (без регистрации как общего). Адаптер повторяет
+    только ответы 429/5xx; ошибки соединения и чтения повторяет с докачкой download_to_file.
+    """
+    settings = settings or get_downloader_settings()
+    retry = 0
+    if Retry is not None:
+        retry = Retry(total=int(settings["retries"]), connect=0, read=0, other=0,
+                      status=int(settings["retries"]), backoff_factor=float(settings["backoff_seconds"]),
+                      status_forcelist=RETRY_STATUS_CODES, allowed_methods=frozenset(["GET", "HEAD"]),
+                      raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=int(settings["pool_maxsize"]), pool_maxsize=int(settings["pool_maxsize"]),
+                          max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_download_session(config=None) -> requests.Session:
+    """Общий requests.Session процесса (создается при первом обращении)."""
+    global _session
+    with _lock:
+        if _session is None:
+            settings = get_downloader_settings(config)
+            _session = create_session(settings)
+            logger.info(f"✅ Сессия загрузчика создана (пул {settings['pool_maxsize']}, повторов {settings['retries']}).")
+        return _session
+
+
+def close_session():
+    global _session
+    with _lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+
+
+def get_download_records() -> list[dict]:
+    """Копия журнала загрузок текущего процесса."""
+    with _records_lock:
+        return list(_records)
+
+
+def reset_download_records():
+    with _records_lock:
+        _records.clear()
+
+
+def _record(url: str, local_path: str, size: int, elapsed: float, resumed: int, success: bool) -> dict:
+    record = {"url": url, "path": local_path, "bytes": size, "seconds": round(elapsed, 4),
+              "resumed": resumed, "success": success}
+    with _records_lock:
+        _records.append(record)
+    return record
+
+
+def _discard_part(part_path: str):
+    """Удаляет недокачанный <путь>.part после окончательной неудачи."""
+    try:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+    except OSError as e:
+        logger.warning(f"Не удалось удалить недокачанный файл {part_path}: {e}")
+
+
+def _throughput_mib_s(size: int, elapsed: float) -> float:
+    return size / (1024 * 1024) / elapsed if elapsed > 0 else 0.0
+
+
+def download_to_file(url: str, local_path: str, timeout: float | None = None, chunk_size_kib: int | None = None,
+                     retries: int | None = None, session: requests.Session | None = None) -> bool:
+    """
+    Скачивает url в local_path потоково, с докачкой после обрыва. Возвращает True/False.
+    timeout=None - DOWNLOADER.timeout_seconds. При неудаче <путь>.part удаляется.
+    """
+    settings = get_downloader_settings()
+    timeout = float(timeout if timeout is not None else settings["timeout_seconds"])
+    chunk_size = int(chunk_size_kib or settings["chunk_size_kib"]) * 1024
+    attempts_left = int(retries if retries is not None else settings["retries"])
+    session = session or get_download_session()
+    part_path = f"{local_path}.part"
+    directory = os.path.dirname(local_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    started = time.perf_counter()
+    received, resumed, expected_total = 0, 0, None
+    if os.path.exists(part_path):
+        os.remove(part_path)
+    while True:
+        headers = {"Range": f"bytes={received}-"} if received else {}
+        try:
+            with session.get(url, stream=True, timeout=timeout, headers=headers) as response:
+                if received and response.status_code != 206:
+                    # Сервер не поддерживает Range - начинаем заново
+                    logger.warning(f"⚠️ Сервер не поддержал докачку {url[:60]} (статус {response.status_code}), загрузка заново.")
+                    received = 0
+                response.raise_for_status()
+                if expected_total is None:
+                    length = response.headers.get("Content-Length")
+                    expected_total = int(length) if length and length.isdigit() and not received else None
+                with open(part_path, "ab" if received else "wb") as f:
+                    for chunk in response.iter_content(chunk_size=chunk_size):
+                        if chunk:
+                            f.write(chunk)
+                            received += len(chunk)
+            if expected_total is not None and received < expected_total:
+                raise requests.exceptions.ChunkedEncodingError(f"получено {received} из {expected_total} байт")
+            break
+        except STREAM_ERRORS as e:
+            if attempts_left <= 0:
+                logger.error(f"❌ Ошибка скачивания {url}: {e}")
+                _discard_part(part_path)
+                _record(url, local_path, received, time.perf_counter() - started, resumed, False)
+                return False
+            attempts_left -= 1
+            resumed += 1
+            logger.warning(f"⚠️ Обрыв загрузки {url[:60]} на {received} байт: {e}. Докачка (осталось попыток: {attempts_left}).")
+        except requests.exceptions.RequestException as e:
+            logger.error(f"❌ Ошибка скачивания {url}: {e}")
+            if e.response is not None:
+                logger.error(f"    Статус код: {e.response.status_code}, Ответ: {e.response.text[:200]}")
+            _discard_part(part_path)
+            _record(url, local_path, received, time.perf_counter() - started, resumed, False)
+            return False
+        except OSError as e:
+            logger.error(f"❌ Ошибка записи {part_path}: {e}")
+            _discard_part(part_path)
+            _record(url, local_path, received, time.perf_counter() - started, resumed, False)
+            return False
+
+    os.replace(part_path, local_path)
+    elapsed = time.perf_counter() - started
+    _record(url, local_path, received, elapsed, resumed, True)
+    logger.info(f"✅ Файл сохранен: {local_path} ({received / 1024:.0f} КиБ за {elapsed:.2f} c, "
+                f"{_throughput_mib_s(received, elapsed):.2f} МиБ/с{f', докачек: {resumed}' if resumed else ''})")
+    return True
+
+
+def download_many(items: list[tuple[str, str]], max_workers: int | None = None, **kwargs) -> dict:
+    """
+    Параллельно скачивает список (url, local_path). Возвращает {local_path: True/False}.
+    Пишет в лог суммарную скорость.
+    """
+    if not items:
+        return {}
+    max_workers = int(max_workers or get_downloader_settings()["max_workers"])
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items)), thread_name_prefix="download") as executor:
+        futures = {path: executor.submit(download_to_file, url, path, **kwargs) for url, path in items}
+        results = {path: future.result() for path, future in futures.items()}
+    elapsed = time.perf_counter() - started
+    total_bytes = sum(os.path.getsize(path) for path, ok in results.items() if ok and os.path.exists(path))
+    logger.info(f"📥 Загружено {sum(results.values())}/{len(items)} файлов, {total_bytes / 1024:.0f} КиБ за {elapsed:.2f} c "
+                f"({_throughput_mib_s(total_bytes, elapsed):.2f} МиБ/с).")
+    return results
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+# В файле modules/ffmpeg_tools.py
+"""
+Прямые вызовы ffmpeg (без покадровой обработки в Python).
+
+Бинарник ищется так: VIDEO.ffmpeg_path из config.json -> ffmpeg в PATH -> бинарник
+imageio-ffmpeg (ставится вместе с MoviePy). Если ffmpeg не найден, функции возвращают False/None,
+а вызывающий код переходит на MoviePy.
+
+encode_still_video - mock-видео из одной картинки: картинка подается один раз с -loop 1,
+кодируется libx264 с -tune stillimage, низкой частотой кадров и быстрым пресетом; GOP на весь
+ролик, поэтому почти все кадры - пустые P-кадры.
+
+prepare_delivery_video - нормализация видео перед загрузкой в 666/ (секция VIDEO_DELIVERY):
+целевой битрейт, +faststart для прогрессивного воспроизведения, опционально версия меньшего
+разрешения. Если перекодирование не уменьшает файл, исходник только перепаковывается (-c copy).
+"""
+import shutil
+import subprocess
+import time
+from pathlib import Path
+
+try:
+    from .logger import get_logger
+    from .config_manager import ConfigManager
+    logger = get_logger("ffmpeg_tools")
+except ImportError:
+    from modules.logger import get_logger
+    from modules.config_manager import ConfigManager
+    logger = get_logger("ffmpeg_tools")
+
+_ffmpeg_path = None
+_ffmpeg_searched = False
+
+
+def find_ffmpeg(config=None) -> str | None:
+    """Путь к ffmpeg или None (результат кэшируется на процесс)."""
+    global _ffmpeg_path, _ffmpeg_searched
+    if _ffmpeg_searched and config is None:
+        return _ffmpeg_path
+    candidate = None
+    try:
+        configured = (config or ConfigManager()).get("VIDEO.ffmpeg_path", None)
+        if configured and Path(configured).is_file():
+            candidate = str(configured)
+        elif configured:
+            logger.warning(f"⚠️ VIDEO.ffmpeg_path '{configured}' не найден, поиск ffmpeg в PATH.")
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось прочитать VIDEO.ffmpeg_path: {e}")
+    candidate = candidate or shutil.which("ffmpeg")
+    if candidate is None:
+        try:
+            import imageio_ffmpeg
+            candidate = imageio_ffmpeg.get_ffmpeg_exe()
+        except Exception:
+            candidate = None
+    if candidate is None:
+        logger.warning("⚠️ ffmpeg не найден (VIDEO.ffmpeg_path, PATH, imageio-ffmpeg).")
+    _ffmpeg_path, _ffmpeg_searched = candidate, True
+    return candidate
+
+
+def run_ffmpeg(args: list[str], timeout: float = 300, ffmpeg_path: str | None = None) -> bool:
+    """Запускает ffmpeg с аргументами args (без имени бинарника). Возвращает True при коде 0."""
+    ffmpeg_path = ffmpeg_path or find_ffmpeg()
+    if not ffmpeg_path:
+        return False
+    command = [ffmpeg_path, "-hide_banner", "-nostdin", "-y", "-loglevel", "error", *args]
+    started = time.perf_counter()
+    try:
+        result = subprocess.run(command, capture_output=True, text=True, timeout=timeout, check=False)
+    except subprocess.TimeoutExpired:
+        logger.error(f"❌ ffmpeg не завершился за {timeout} c: {' '.join(command[:12])}...")
+        return False
+    except OSError as e:
+        logger.error(f"❌ Не удалось запустить ffmpeg ({ffmpeg_path}): {e}")
+        return False
+    if result.returncode != 0:
+        logger.error(f"❌ ffmpeg завершился с кодом {result.returncode}: {result.stderr.strip()[-500:]}")
+        return False
+    logger.debug(f"ffmpeg выполнен за {time.perf_counter() - started:.2f} c.")
+    return True
+
+
+def encode_still_video(image_path: str, output_path: str, duration: float = 10, fps: int = 5,
+                       codec: str = "libx264", preset: str = "veryfast", crf: int = 28,
+                       timeout: float = 120) -> bool:
+    """Кодирует статичное видео длительностью duration из одной картинки. Возвращает True/False."""
+    if not Path(image_path).is_file():
+        logger.error(f"❌ Картинка для видео не найдена: {image_path}")
+        return False
+    fps = max(1, int(fps))
+    args = [
+        "-loop", "1", "-framerate", str(fps), "-i", str(image_path),
+        "-t", str(duration),
+        "-c:v", codec, *(["-tune", "stillimage"] if codec == "libx264" else []), "-preset", preset, "-crf", str(crf),
+        "-g", str(int(fps * duration)), "-pix_fmt", "yuv420p",
+        # libx264 + yuv420p требуют четных размеров
+        "-vf", "scale=trunc(iw/2)*2:trunc(ih/2)*2",
+        "-r", str(fps), "-an", "-movflags", "+faststart",
+        str(output_path),
+    ]
+    started = time.perf_counter()
+    if not run_ffmpeg(args, timeout=timeout):
+        return False
+    output = Path(output_path)
+    if not output.is_file() or output.stat().st_size == 0:
+        logger.error(f"❌ ffmpeg не создал {output_path}.")
+        return False
+    logger.info(f"🎬 Статичное видео (ffmpeg, {fps} к/с, {preset}) создано за {time.perf_counter() - started:.2f} c: "
+                f"{output.name} ({output.stat().st_size / 1024:.0f} КиБ)")
+    return True
+
+
+# --- Нормализация видео перед загрузкой в 666/ (VIDEO_DELIVERY) ---
+
+DELIVERY_DEFAULTS = {
+    "enabled": False,
+    "codec": "libx264",
+    "preset": "medium",
+    "video_bitrate_kbps": 2500,
+    "maxrate_factor": 1.5,
+    "max_height": 0,
+    "audio_bitrate_kbps": 128,
+    "rendition_height": 0,
+    "rendition_bitrate_kbps": 800,
+    "rendition_suffix": "_low",
+    "timeout_seconds": 300,
+}
+
+
+def get_delivery_settings(config=None) -> dict:
+    """Настройки VIDEO_DELIVERY из config.json поверх значений по умолчанию."""
+    settings = dict(DELIVERY_DEFAULTS)
+    try:
+        settings.update({k: v for k, v in ((config or ConfigManager()).get("VIDEO_DELIVERY", {}) or {}).items() if v is not None})
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось прочитать VIDEO_DELIVERY из конфигурации: {e}. Используются значения по умолчанию.")
+    return settings
+
+
+def transcode_for_delivery(input_path: str, output_path: str, bitrate_kbps: int, max_height: int = 0,
+                           codec: str = "libx264", preset: str = "medium", maxrate_factor: float = 1.5,
+                           audio_bitrate_kbps: int = 128, timeout: float = 300) -> bool:
+    """
+    Перекодирует видео с целевым битрейтом (ограничение пиков maxrate/bufsize), при max_height -
+    с уменьшением до этой высоты (только вниз), и +faststart (moov в начале файла).
+    """
+    bitrate_kbps = max(100, int(bitrate_kbps))
+    video_filter = "scale=trunc(iw/2)*2:trunc(ih/2)*2"
+    if max_height:
+        video_filter = f"scale=-2:'min({int(max_height)},trunc(ih/2)*2)'"
+    args = [
+        "-i", str(input_path), "-map", "0:v:0", "-map", "0:a?",
+        "-c:v", codec, "-preset", preset,
+        "-b:v", f"{bitrate_kbps}k", "-maxrate", f"{int(bitrate_kbps * float(maxrate_factor))}k", "-bufsize", f"{bitrate_kbps * 2}k",
+        "-vf", video_filter, "-pix_fmt", "yuv420p",
+        "-c:a", "aac", "-b:a", f"{int(audio_bitrate_kbps)}k",
+        "-movflags", "+faststart",
+        str(output_path),
+    ]
+    return run_ffmpeg(args, timeout=timeout)
+
+
+def remux_faststart(input_path: str, output_path: str, timeout: float = 120) -> bool:
+    """Перепаковывает MP4 без перекодирования, перенося moov в начало (+faststart)."""
+    return run_ffmpeg(["-i", str(input_path), "-map", "0", "-c", "copy", "-movflags", "+faststart", str(output_path)], timeout=timeout)
+
+
+def prepare_delivery_video(video_path: str, settings: dict | None = None) -> dict | None:
+    """
+    Готовит видео к загрузке: перекодирование с video_bitrate_kbps (+faststart); если результат
+    не меньше исходника - исходник только перепаковывается с +faststart. При rendition_height -
+    дополнительная версия меньшего разрешения (<имя><rendition_suffix>.mp4).
+    Возвращает {"path", "rendition_path", "original_bytes", "delivery_bytes", "rendition_bytes", "seconds"}
+    или None (ffmpeg недоступен/ошибка - загружается исходник).
+    """
+    settings = dict(DELIVERY_DEFAULTS, **(settings or {}))
+    source = Path(video_path)
+    if not source.is_file():
+        logger.error(f"❌ Видео для нормализации не найдено: {video_path}")
+        return None
+    if not find_ffmpeg():
+        return None
+    timeout = float(settings["timeout_seconds"])
+    original_bytes = source.stat().st_size
+    delivery_path = source.with_name(f"{source.stem}_delivery{source.suffix}")
+    started = time.perf_counter()
+    transcoded = transcode_for_delivery(str(source), str(delivery_path), settings["video_bitrate_kbps"],
+                                        max_height=int(settings["max_height"] or 0), codec=settings["codec"],
+                                        preset=settings["preset"], maxrate_factor=settings["maxrate_factor"],
+                                        audio_bitrate_kbps=settings["audio_bitrate_kbps"], timeout=timeout)
+    if transcoded and delivery_path.stat().st_size >= original_bytes:
+        logger.info(f"ℹ️ Перекодирование не уменьшило {source.name} ({delivery_path.stat().st_size / 1024:.0f} КиБ >= "
+                    f"{original_bytes / 1024:.0f} КиБ), исходник только перепаковывается с +faststart.")
+        transcoded = remux_faststart(str(source), str(delivery_path), timeout=timeout)
+    elif not transcoded:
+        logger.warning(f"⚠️ Перекодирование {source.name} не удалось, пробуем только +faststart.")
+        transcoded = remux_faststart(str(source), str(delivery_path), timeout=timeout)
+    if not transcoded or not delivery_path.is_file():
+        return None
+
+    rendition_path = None
+    if int(settings["rendition_height"] or 0) > 0:
+        rendition_path = source.with_name(f"{source.stem}{settings['rendition_suffix']}{source.suffix}")
+        if not transcode_for_delivery(str(source), str(rendition_path), settings["rendition_bitrate_kbps"],
+                                      max_height=int(settings["rendition_height"]), codec=settings["codec"],
+                                      preset=settings["preset"], maxrate_factor=settings["maxrate_factor"],
+                                      audio_bitrate_kbps=min(96, int(settings["audio_bitrate_kbps"])), timeout=timeout):
+            logger.warning(f"⚠️ Версия {settings['rendition_height']}p для {source.name} не создана.")
+            rendition_path = None
+
+    elapsed = time.perf_counter() - started
+    delivery_bytes = delivery_path.stat().st_size
+    rendition_bytes = rendition_path.stat().st_size if rendition_path else None
+    saved = 100 * (1 - delivery_bytes / original_bytes) if original_bytes else 0.0
+    rendition_note = f", версия {settings['rendition_height']}p {rendition_bytes / 1024:.0f} КиБ" if rendition_bytes else ""
+    logger.info(f"🎞️ Видео для загрузки {source.name}: {original_bytes / 1024:.0f} -> {delivery_bytes / 1024:.0f} КиБ "
+                f"({saved:.0f}% экономии) за {elapsed:.2f} c{rendition_note}.")
+    return {"path": str(delivery_path), "rendition_path": str(rendition_path) if rendition_path else None,
+            "original_bytes": original_bytes, "delivery_bytes": delivery_bytes, "rendition_bytes": rendition_bytes,
+            "seconds": elapsed}
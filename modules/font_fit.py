@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+# В файле modules/font_fit.py
+"""
+Подбор размера шрифта под ширину (заголовок utils.add_text_to_image и сарказм
+sarcasm_image_utils.add_text_to_image_sarcasm_openai_ready).
+
+Раньше размер уменьшался от стартового с шагом step, и на каждом шаге строился новый
+ImageFont.truetype и считался полный textbbox - десятки построений шрифта на одну отрисовку.
+
+Теперь поиск идет по той же сетке размеров (start, start - step, ..., >= min_size), поэтому
+результат совпадает с прежним (ширина текста монотонно растет с размером), но:
+    "binary" - двоичный поиск по сетке: не больше ~log2(N) + 1 построений;
+    "guess"  - сначала стартовый размер (если помещается - одно построение, как раньше),
+               затем первая догадка по линейной модели ширины (ширина ~ размер:
+               size * max_width / width), проверка соседнего шага и при промахе - двоичный
+               поиск в оставшемся интервале; обычно 2-3 построения;
+    "linear" - прежний пошаговый перебор (для сравнения в scripts/font_fit_benchmark.py).
+Каждый размер измеряется не больше одного раза. Если передан путь к шрифту, шрифты берутся
+из общего реестра modules/font_registry.py (повторные отрисовки не строят их заново);
+constructions - число реально построенных шрифтов (промахов реестра).
+Ширина и высота блока считаются арифметически по ширинам глифов (modules/text_layout.py), без textbbox.
+С wrap=True текст для каждого размера заново переносится под max_width, и размер подходит,
+если блок помещается и по ширине, и по высоте max_height.
+"""
+import io
+import math
+import time
+
+try:
+    from .logger import get_logger
+    from .font_registry import get_font_registry
+    from .text_layout import get_metrics
+    logger = get_logger("font_fit")
+except ImportError:
+    from modules.logger import get_logger
+    from modules.font_registry import get_font_registry
+    from modules.text_layout import get_metrics
+    logger = get_logger("font_fit")
+
+try:
+    from PIL import ImageFont
+except ImportError:
+    ImageFont = None
+
+FIT_STRATEGIES = ("guess", "binary", "linear")
+
+
+class _Measurer:
+    """Берет шрифт (реестр по пути или разбор байтов) и меряет блок текста для размера (каждый размер - один раз)."""
+
+    def __init__(self, font_source, text: str, wrap_width=None, spacing: int = 4):
+        self.font_source = font_source
+        self.text = text
+        self.wrap_width = wrap_width
+        self.spacing = spacing
+        self.cache = {}
+        self.constructions = 0
+
+    def measure(self, size: int):
+        if size not in self.cache:
+            if isinstance(self.font_source, (bytes, bytearray)):
+                font, cached = ImageFont.truetype(io.BytesIO(self.font_source), size), False
+            else:
+                font, cached = get_font_registry().lookup(self.font_source, size)
+            self.constructions += 0 if cached else 1
+            metrics = get_metrics(font)
+            lines = metrics.wrap(self.text, self.wrap_width) if self.wrap_width else self.text.split("\n")
+            width, height = metrics.block_size(lines, self.spacing)
+            self.cache[size] = (font, width, height, "\n".join(lines))
+        return self.cache[size]
+
+    def fits(self, size: int, max_width: float, max_height=None) -> bool:
+        _, width, height, _ = self.measure(size)
+        return width <= max_width and (max_height is None or height <= max_height)
+
+
+def fit_font_size(font_source, text: str, max_width: float, start_size: int, min_size: int,
+                  step: int = 2, strategy: str = "guess", max_height=None, wrap: bool = False,
+                  spacing: int = 4) -> dict:
+    """
+    Наибольший размер из сетки start_size, start_size - step, ... (>= min_size), при котором
+    ширина text не превышает max_width (и высота - max_height, если задана). font_source - путь
+    к шрифту (общий реестр) или байты файла. wrap=True - переносить text под max_width для каждого размера.
+    Возвращает {"fits", "size", "font", "width", "height", "text", "constructions", "seconds"}
+    (text - с переносами для выбранного размера); при fits=False size/font/width/height относятся
+    к наименьшему размеру сетки (вызывающий код решает, что делать; если start_size < min_size,
+    сетка пуста и font=None).
+    """
+    started = time.perf_counter()
+    step = max(1, int(step))
+    start_size, min_size = int(start_size), int(min_size)
+    measurer = _Measurer(font_source, text, wrap_width=max_width if wrap else None, spacing=spacing)
+    if start_size < min_size:
+        return {"fits": False, "size": min_size, "font": None, "width": 0, "height": 0, "text": text,
+                "constructions": 0, "seconds": time.perf_counter() - started}
+    count = max(1, (start_size - min_size) // step + 1) # Число размеров в сетке
+    size_at = lambda index: start_size - index * step
+    fits_at = lambda index: measurer.fits(size_at(index), max_width, max_height)
+
+    if strategy == "linear":
+        found = next((index for index in range(count) if fits_at(index)), None)
+    else:
+        # Инвариант: индексы < low не помещаются, индекс high помещается (high == count - ни один)
+        low, high = 0, count
+        if strategy == "guess":
+            if fits_at(0):
+                high = 0
+            else:
+                low = 1
+                width = measurer.measure(size_at(0))[1]
+                if width > max_width and count > 1:
+                    guess_size = start_size * max_width / width
+                    guess = min(count - 1, max(1, math.ceil((start_size - guess_size) / step)))
+                    if fits_at(guess):
+                        high = guess
+                        if guess - 1 >= low and not fits_at(guess - 1):
+                            low = guess
+                    else:
+                        low = guess + 1
+                        if guess + 1 < count and fits_at(guess + 1):
+                            high = guess + 1
+        while low < high:
+            middle = (low + high) // 2
+            if fits_at(middle):
+                high = middle
+            else:
+                low = middle + 1
+        found = high if high < count else None
+
+    fits = found is not None
+    size = size_at(found) if fits else size_at(count - 1)
+    font, width, height, laid_out = measurer.measure(size)
+    return {"fits": fits, "size": size, "font": font, "width": width, "height": height, "text": laid_out,
+            "constructions": measurer.constructions, "seconds": time.perf_counter() - started}
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+# В файле modules/font_registry.py
+"""
+Общий на процесс реестр шрифтов для отрисовки текста (заголовок, сарказм, плейсхолдер).
+
+Раньше каждая отрисовка заново читала файл шрифта с диска и разбирала его ImageFont.truetype
+для каждого пробуемого размера.
+
+Теперь:
+    - объекты FreeTypeFont кэшируются по (абсолютный путь, размер) с вытеснением LRU
+      (FONTS.cache_size записей);
+    - ImageFont.truetype получает путь к файлу: FreeType сам читает файл (на Linux - через mmap),
+      без копии всего файла в каждый объект шрифта, как было бы с io.BytesIO;
+    - шрифт строится при первой отрисовке (generate_media использует один шрифт заголовка и шрифт
+      сарказма за запуск); preload строит нужные размеры заранее - для процессов пакетной перерисовки
+      (modules/title_render.py);
+    - stats / log_stats - попадания, промахи, вытеснения.
+"""
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+try:
+    from .logger import get_logger
+    from .config_manager import ConfigManager
+    logger = get_logger("font_registry")
+except ImportError:
+    from modules.logger import get_logger
+    from modules.config_manager import ConfigManager
+    logger = get_logger("font_registry")
+
+try:
+    from PIL import ImageFont
+except ImportError:
+    ImageFont = None
+
+DEFAULT_CACHE_SIZE = 256
+
+
+class FontRegistry:
+    """Известные файлы шрифтов и LRU-кэш FreeTypeFont по (путь, размер)."""
+
+    def __init__(self, cache_size: int = DEFAULT_CACHE_SIZE):
+        self.cache_size = max(1, int(cache_size))
+        self._files = set()
+        self._fonts = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _key_path(font_path) -> str:
+        return str(Path(font_path).resolve())
+
+    def _check_file(self, path: str):
+        """Проверяет файл шрифта один раз на процесс (FileNotFoundError, если его нет)."""
+        if path not in self._files:
+            if not Path(path).is_file():
+                raise FileNotFoundError(f"Файл шрифта не найден: {path}")
+            self._files.add(path)
+
+    def lookup(self, font_path, size: int):
+        """(FreeTypeFont, было ли в кэше) для font_path и size."""
+        path, size = self._key_path(font_path), int(size)
+        key = (path, size)
+        with self._lock:
+            font = self._fonts.get(key)
+            if font is not None:
+                self._fonts.move_to_end(key)
+                self.hits += 1
+                return font, True
+            self.misses += 1
+            self._check_file(path)
+            font = ImageFont.truetype(path, size)
+            self._fonts[key] = font
+            if len(self._fonts) > self.cache_size:
+                self._fonts.popitem(last=False)
+                self.evictions += 1
+            return font, False
+
+    def get_font(self, font_path, size: int):
+        return self.lookup(font_path, size)[0]
+
+    def preload(self, font_paths, sizes=()) -> int:
+        """Проверяет файлы font_paths и строит их шрифты размеров sizes. Возвращает число доступных файлов."""
+        loaded = 0
+        for font_path in font_paths:
+            try:
+                path = self._key_path(font_path)
+                with self._lock:
+                    self._check_file(path)
+                for size in sizes:
+                    self.lookup(path, size)
+                loaded += 1
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось подготовить шрифт {font_path}: {e}")
+        return loaded
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "hit_rate": self.hits / lookups if lookups else 0.0,
+                    "fonts": len(self._fonts), "files": len(self._files)}
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_font_registry() -> FontRegistry:
+    """Реестр шрифтов процесса (размер кэша - FONTS.cache_size)."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            try:
+                cache_size = int(ConfigManager().get("FONTS.cache_size", DEFAULT_CACHE_SIZE))
+            except Exception:
+                cache_size = DEFAULT_CACHE_SIZE
+            _registry = FontRegistry(cache_size)
+        return _registry
+
+
+def get_font(font_path, size: int):
+    """FreeTypeFont из общего реестра."""
+    return get_font_registry().get_font(font_path, size)
+
+
+def log_stats():
+    """Пишет в лог статистику реестра шрифтов."""
+    stats = get_font_registry().stats()
+    logger.info(f"🔤 Кэш шрифтов: попаданий {stats['hits']}, промахов {stats['misses']} "
+                f"({stats['hit_rate'] * 100:.0f}% попаданий), вытеснено {stats['evictions']}, "
+                f"в кэше {stats['fonts']} шрифтов из {stats['files']} файлов.")
+    return stats
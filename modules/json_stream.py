@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+# В файле modules/json_stream.py
+"""
+Инкрементальная проверка JSON-ответа OpenAI при потоковой передаче (stream=True).
+
+JsonStreamGuard получает куски текста по мере генерации и прерывает поток (StreamAbort), если:
+- ответ не начинается с объекта '{';
+- значение ключа верхнего уровня не прошло валидатор сразу после завершения этого значения;
+- длина ответа превысила допустимую границу (kind="length" - отдельный вид прерывания, чтобы
+  слишком низкая граница была видна в логах и отчете по токенам).
+
+Обязательные ключи проверяются только при закрытии объекта верхнего уровня: порядок ключей
+в JSON произвольный, и до закрытия любой ключ еще может появиться. Это та же точка, где упал бы
+разбор без потока, - проверка дает понятную причину в логе, но не экономит токены.
+"""
+import json
+
+
+ABORT_LENGTH = "length"
+ABORT_STRUCTURE = "structure"
+
+
+class StreamAbort(Exception):
+    """Поток прерван досрочно: дальнейшая генерация не даст валидного ответа."""
+
+    def __init__(self, reason: str, received_chars: int = 0, kind: str = ABORT_STRUCTURE):
+        super().__init__(reason)
+        self.reason = reason
+        self.received_chars = received_chars
+        self.kind = kind
+
+
+def resolve_max_chars(max_chars_config: dict | None, prompt_config_key: str) -> int | None:
+    """
+    Граница длины для ключа промпта из OPENAI_SETTINGS.stream_max_output_chars: значение ключа
+    или "default" (None - без границы). Границы задаются по замерам архивных ответов
+    (scripts/json_stream_check.py), а не выводятся из max_tokens.
+    """
+    max_chars_config = max_chars_config or {}
+    max_chars = max_chars_config.get(prompt_config_key)
+    if max_chars is None:
+        max_chars = max_chars_config.get("default")
+    return int(max_chars) if max_chars else None
+
+
+class JsonStreamGuard:
+    """
+    Посимвольный разбор потокового JSON-объекта без построения дерева.
+
+    Args:
+        required_keys: ключи верхнего уровня, без которых ответ бесполезен.
+        value_validators: {ключ: функция(значение) -> bool} для значений верхнего уровня.
+        max_chars: граница длины ответа (None - без ограничения).
+    """
+
+    def __init__(self, required_keys=None, value_validators=None, max_chars: int | None = None):
+        self.required_keys = set(required_keys or [])
+        self.value_validators = dict(value_validators or {})
+        self.max_chars = int(max_chars) if max_chars else None
+        self.seen_keys = []
+        self.closed = False
+        self._parts = []
+        self._length = 0
+        self._buffer = ""          # текст от начала объекта (для среза значений)
+        self._started = False
+        self._in_fence_header = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._expect_key = False
+        self._key_start = None
+        self._current_key = None
+        self._value_start = None
+
+    @property
+    def text(self) -> str:
+        return "".join(self._parts)
+
+    def feed(self, chunk: str):
+        """Добавляет кусок ответа; выбрасывает StreamAbort при обнаружении безнадежного ответа."""
+        if not chunk:
+            return
+        self._parts.append(chunk)
+        self._length += len(chunk)
+        if self.max_chars and self._length > self.max_chars:
+            raise StreamAbort(f"превышена граница длины ответа ({self.max_chars} символов)", self._length,
+                              kind=ABORT_LENGTH)
+        for ch in chunk:
+            self._consume(ch)
+
+    def _abort(self, reason: str):
+        raise StreamAbort(reason, self._length)
+
+    def _consume(self, ch: str):
+        if self.closed:
+            return
+        if not self._started:
+            # Допускаем Markdown-обертку ```json ... (ее снимает call_openai)
+            if self._in_fence_header:
+                if ch == "\n":
+                    self._in_fence_header = False
+                return
+            if ch.isspace():
+                return
+            if ch == "`":
+                self._in_fence_header = True
+                return
+            if ch != "{":
+                self._abort(f"ответ не является JSON-объектом (начинается с '{ch}')")
+            self._started = True
+            self._depth = 1
+            self._expect_key = True
+            self._buffer = "{"
+            return
+
+        self._buffer += ch
+        pos = len(self._buffer) - 1
+
+        if self._in_string:
+            if self._escape:
+                self._escape = False
+            elif ch == "\\":
+                self._escape = True
+            elif ch == '"':
+                self._in_string = False
+                if self._key_start is not None:
+                    raw_key = self._buffer[self._key_start:pos + 1]
+                    try:
+                        self._current_key = json.loads(raw_key)
+                    except json.JSONDecodeError:
+                        self._current_key = raw_key.strip('"')
+                    self._key_start = None
+            return
+
+        if ch == '"':
+            self._in_string = True
+            if self._depth == 1 and self._expect_key:
+                self._key_start = pos
+                self._expect_key = False
+            return
+        if ch == ":" and self._depth == 1 and self._current_key is not None and self._value_start is None:
+            self._value_start = pos + 1
+            return
+        if ch in "{[":
+            self._depth += 1
+            return
+        if ch in "}]":
+            self._depth -= 1
+            if self._depth == 0:
+                self._complete_value(pos)
+                self._close_object()
+            return
+        if ch == "," and self._depth == 1:
+            self._complete_value(pos)
+            self._expect_key = True
+
+    def _complete_value(self, end_pos: int):
+        """Значение ключа верхнего уровня завершено: фиксируем ключ и запускаем валидатор."""
+        if self._current_key is None or self._value_start is None:
+            return
+        key = self._current_key
+        raw_value = self._buffer[self._value_start:end_pos].strip()
+        self._current_key = None
+        self._value_start = None
+        self.seen_keys.append(key)
+        validator = self.value_validators.get(key)
+        if validator is None:
+            return
+        try:
+            value = json.loads(raw_value)
+        except json.JSONDecodeError:
+            self._abort(f"значение ключа '{key}' не является корректным JSON")
+        try:
+            is_valid = validator(value)
+        except Exception as validator_err:
+            is_valid = False
+            raw_value = f"{raw_value[:80]} ({validator_err})"
+        if not is_valid:
+            self._abort(f"значение ключа '{key}' не прошло проверку: {raw_value[:80]}")
+
+    def _close_object(self):
+        self.closed = True
+        missing = [k for k in self.required_keys if k not in self.seen_keys]
+        if missing:
+            self._abort(f"объект закрыт без обязательных ключей: {sorted(missing)}")
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+# В файле modules/llm_client.py
+"""
+Общая фабрика клиентов OpenAI с единым пулом соединений на процесс.
+
+generate_content.call_openai, generate_media._initialize_openai_client и iid_local_tester
+получают один и тот же openai.OpenAI поверх одного httpx.Client, поэтому TCP/TLS-соединения
+с api.openai.com переиспользуются между шагами и модулями.
+
+Настройки - секция LLM_CLIENT в config.json:
+    timeout_seconds, connect_timeout_seconds  - таймауты запроса и установки соединения;
+    max_connections, max_keepalive_connections - размер пула;
+    keepalive_expiry_seconds - сколько держать простаивающее соединение (у httpx по умолчанию 5 c,
+                               что меньше пауз между вызовами в генерации);
+    http2 - использовать HTTP/2, если установлен пакет h2;
+    max_retries - повторы внутри SDK OpenAI.
+Прокси берутся из HTTP_PROXY / HTTPS_PROXY.
+"""
+import os
+import atexit
+import importlib.util
+import threading
+
+try:
+    from .logger import get_logger
+    from .config_manager import ConfigManager
+    logger = get_logger("llm_client")
+except ImportError:
+    from modules.logger import get_logger
+    from modules.config_manager import ConfigManager
+    logger = get_logger("llm_client")
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+try:
+    import openai
+except ImportError:
+    openai = None
+
+DEFAULT_SETTINGS = {
+    "timeout_seconds": 120.0,
+    "connect_timeout_seconds": 10.0,
+    "max_connections": 10,
+    "max_keepalive_connections": 5,
+    "keepalive_expiry_seconds": 120.0,
+    "http2": True,
+    "max_retries": 2,
+}
+
+_lock = threading.Lock()
+_http_client = None
+_async_http_client = None
+_openai_client = None
+_async_openai_client = None
+
+
+def get_client_settings(config=None) -> dict:
+    """Настройки LLM_CLIENT из config.json поверх значений по умолчанию."""
+    settings = dict(DEFAULT_SETTINGS)
+    try:
+        config = config or ConfigManager()
+        settings.update({k: v for k, v in (config.get("LLM_CLIENT", {}) or {}).items() if v is not None})
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось прочитать LLM_CLIENT из конфигурации: {e}. Используются значения по умолчанию.")
+    return settings
+
+
+def http2_available() -> bool:
+    """HTTP/2 в httpx требует пакет h2."""
+    return importlib.util.find_spec("h2") is not None
+
+
+def _get_proxies() -> dict:
+    proxies = {}
+    http_proxy = os.getenv("HTTP_PROXY") or os.getenv("http_proxy")
+    https_proxy = os.getenv("HTTPS_PROXY") or os.getenv("https_proxy")
+    if http_proxy: proxies["http://"] = http_proxy
+    if https_proxy: proxies["https://"] = https_proxy
+    return proxies
+
+
+def _client_kwargs(settings: dict, async_mode: bool) -> dict:
+    """Аргументы httpx.Client / httpx.AsyncClient: таймауты, пул, HTTP/2 и прокси через mounts."""
+    limits = httpx.Limits(max_connections=int(settings["max_connections"]),
+                          max_keepalive_connections=int(settings["max_keepalive_connections"]),
+                          keepalive_expiry=float(settings["keepalive_expiry_seconds"]))
+    timeout = httpx.Timeout(float(settings["timeout_seconds"]), connect=float(settings["connect_timeout_seconds"]))
+    use_http2 = bool(settings["http2"]) and http2_available()
+    if settings["http2"] and not use_http2:
+        logger.info("Пакет h2 не установлен, HTTP/2 отключен (pip install 'httpx[http2]').")
+    kwargs = {"limits": limits, "timeout": timeout, "http2": use_http2}
+    proxies = _get_proxies()
+    if proxies:
+        # httpx >= 0.28 не принимает proxies=..., прокси задаются транспортами по схемам
+        transport_cls = httpx.AsyncHTTPTransport if async_mode else httpx.HTTPTransport
+        logger.info(f"Обнаружены настройки прокси для OpenAI: {proxies}")
+        kwargs["mounts"] = {scheme: transport_cls(proxy=url, limits=limits, http2=use_http2)
+                            for scheme, url in proxies.items()}
+    return kwargs
+
+
+def create_http_client(settings: dict | None = None, async_mode: bool = False):
+    """Новый httpx.Client / AsyncClient с настройками LLM_CLIENT (без регистрации как общего)."""
+    if httpx is None:
+        logger.error("❌ Библиотека httpx не установлена.")
+        return None
+    settings = settings or get_client_settings()
+    client_cls = httpx.AsyncClient if async_mode else httpx.Client
+    return client_cls(**_client_kwargs(settings, async_mode=async_mode))
+
+
+def get_http_client(config=None):
+    """Общий httpx.Client процесса (создается при первом обращении)."""
+    global _http_client
+    if httpx is None:
+        logger.error("❌ Библиотека httpx не установлена.")
+        return None
+    with _lock:
+        if _http_client is None or _http_client.is_closed:
+            settings = get_client_settings(config)
+            _http_client = create_http_client(settings)
+            logger.info(f"✅ Общий HTTP-клиент создан (пул {settings['max_connections']}/"
+                        f"{settings['max_keepalive_connections']}, keep-alive {settings['keepalive_expiry_seconds']} c, "
+                        f"HTTP/2={'да' if settings['http2'] and http2_available() else 'нет'}).")
+        return _http_client
+
+
+def get_async_http_client(config=None):
+    """Общий httpx.AsyncClient процесса (для asyncio-кода)."""
+    global _async_http_client
+    if httpx is None:
+        logger.error("❌ Библиотека httpx не установлена.")
+        return None
+    with _lock:
+        if _async_http_client is None or _async_http_client.is_closed:
+            settings = get_client_settings(config)
+            _async_http_client = create_http_client(settings, async_mode=True)
+            logger.info("✅ Общий асинхронный HTTP-клиент создан.")
+        return _async_http_client
+
+
+def get_openai_client(api_key: str | None = None, config=None):
+    """
+    Общий openai.OpenAI поверх общего пула соединений.
+    Возвращает None, если нет ключа, SDK >= 1.0 или httpx.
+    """
+    global _openai_client
+    if _openai_client is not None:
+        return _openai_client
+    api_key = api_key or os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        logger.error("❌ Переменная окружения OPENAI_API_KEY не задана!")
+        return None
+    if openai is None or not hasattr(openai, 'OpenAI'):
+        logger.error("❌ Модуль/класс openai.OpenAI не найден. Убедитесь, что установлена версия >= 1.0.")
+        return None
+    http_client = get_http_client(config)
+    if http_client is None:
+        return None
+    settings = get_client_settings(config)
+    with _lock:
+        if _openai_client is None:
+            _openai_client = openai.OpenAI(api_key=api_key, http_client=http_client,
+                                           max_retries=int(settings["max_retries"]))
+            logger.info("✅ Общий клиент OpenAI (>1.0) инициализирован.")
+        return _openai_client
+
+
+def get_async_openai_client(api_key: str | None = None, config=None):
+    """Общий openai.AsyncOpenAI поверх общего асинхронного пула."""
+    global _async_openai_client
+    if _async_openai_client is not None:
+        return _async_openai_client
+    api_key = api_key or os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        logger.error("❌ Переменная окружения OPENAI_API_KEY не задана!")
+        return None
+    if openai is None or not hasattr(openai, 'AsyncOpenAI'):
+        logger.error("❌ Класс openai.AsyncOpenAI не найден. Убедитесь, что установлена версия >= 1.0.")
+        return None
+    http_client = get_async_http_client(config)
+    if http_client is None:
+        return None
+    settings = get_client_settings(config)
+    with _lock:
+        if _async_openai_client is None:
+            _async_openai_client = openai.AsyncOpenAI(api_key=api_key, http_client=http_client,
+                                                      max_retries=int(settings["max_retries"]))
+            logger.info("✅ Общий асинхронный клиент OpenAI инициализирован.")
+        return _async_openai_client
+
+
+def close_clients():
+    """Закрывает синхронный пул (вызывается при выходе процесса). Асинхронный закрывает владелец event loop."""
+    global _http_client, _openai_client
+    with _lock:
+        if _http_client is not None and not _http_client.is_closed:
+            _http_client.close()
+        _http_client = None
+        _openai_client = None
+
+
+atexit.register(close_clients)
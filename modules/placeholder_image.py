@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+# В файле modules/placeholder_image.py
+"""
+Локальная отрисовка плейсхолдера для пути --use-mock (таймаут MidJourney).
+
+Раньше плейсхолдер скачивался с placehold.co - лишний внешний запрос на пути, который должен
+работать при недоступности внешних сервисов. Теперь картинка рисуется Pillow: фон и цвет текста
+из VIDEO.placeholder_bg_color / placeholder_text_color, размер IMAGE_GENERATION.output_size,
+шрифт FILE_PATHS.placeholder_font (из общего реестра modules/font_registry.py).
+Текст переносится по словам и центрируется; размер шрифта подбирается под ~80% ширины кадра.
+"""
+from functools import lru_cache
+from pathlib import Path
+
+try:
+    from .logger import get_logger
+    from .utils import hex_to_rgba
+    from .font_registry import get_font
+    logger = get_logger("placeholder_image")
+except ImportError:
+    from modules.logger import get_logger
+    from modules.utils import hex_to_rgba
+    from modules.font_registry import get_font
+    logger = get_logger("placeholder_image")
+
+try:
+    from PIL import Image, ImageDraw, ImageFont
+except ImportError:
+    Image = None; ImageDraw = None; ImageFont = None
+
+MAX_TEXT_WIDTH_FRACTION = 0.8
+MAX_TEXT_HEIGHT_FRACTION = 0.6
+LINE_SPACING = 1.25
+
+
+def _load_font(font_path: str | None, size: int):
+    if font_path:
+        try:
+            return get_font(font_path, size)
+        except OSError as e:
+            logger.warning(f"⚠️ Не удалось загрузить шрифт плейсхолдера {font_path}: {e}")
+    return _default_font(size)
+
+
+@lru_cache(maxsize=16)
+def _default_font(size: int):
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError: # Pillow < 10.1 - размер встроенного шрифта не меняется
+        return ImageFont.load_default()
+
+
+def _layout(draw, text: str, font, max_width: int) -> list[str]:
+    """Переносит каждую строку text по словам так, чтобы она помещалась в max_width."""
+    lines = []
+    for paragraph in text.splitlines() or [""]:
+        words = paragraph.split()
+        current = ""
+        for word in words:
+            candidate = f"{current} {word}".strip()
+            if not current or draw.textlength(candidate, font=font) <= max_width:
+                current = candidate
+            else:
+                lines.append(current)
+                current = word
+        lines.append(current)
+    return lines
+
+
+def render_placeholder(text: str, output_path: str, width: int, height: int, bg_color_hex: str = "cccccc",
+                       text_color_hex: str = "333333", font_path: str | None = None) -> bool:
+    """Рисует плейсхолдер width x height с текстом по центру и сохраняет в output_path. Возвращает True/False."""
+    if Image is None:
+        logger.error("❌ Pillow недоступен, плейсхолдер не создан.")
+        return False
+    if font_path and not Path(font_path).is_file():
+        logger.warning(f"⚠️ Шрифт плейсхолдера не найден: {font_path}. Используется встроенный.")
+        font_path = None
+    try:
+        img = Image.new("RGB", (width, height), hex_to_rgba(bg_color_hex)[:3])
+        draw = ImageDraw.Draw(img)
+        max_width = int(width * MAX_TEXT_WIDTH_FRACTION)
+        max_height = int(height * MAX_TEXT_HEIGHT_FRACTION)
+        font_size = max(12, height // 8)
+        while True:
+            font = _load_font(font_path, font_size)
+            lines = _layout(draw, text, font, max_width)
+            line_height = int(font_size * LINE_SPACING)
+            widest = max((draw.textlength(line, font=font) for line in lines), default=0)
+            if (widest <= max_width and line_height * len(lines) <= max_height) or font_size <= 12:
+                break
+            font_size = max(12, int(font_size * 0.9))
+        y = (height - line_height * len(lines)) // 2
+        fill = hex_to_rgba(text_color_hex)[:3]
+        for line in lines:
+            line_width = draw.textlength(line, font=font)
+            draw.text(((width - line_width) / 2, y), line, font=font, fill=fill)
+            y += line_height
+        Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+        img.save(output_path)
+        logger.info(f"🖼️ Плейсхолдер {width}x{height} нарисован локально (шрифт {font_size}px): {output_path}")
+        return True
+    except Exception as e:
+        logger.error(f"❌ Ошибка отрисовки плейсхолдера: {e}", exc_info=True)
+        return False
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+# В файле modules/runway_input.py
+"""
+Подготовка входного кадра для Runway image-to-video.
+
+Раньше апскейл MJ (PNG 1792x1024, несколько МиБ) целиком кодировался в base64 (+33%) и уходил
+в теле запроса. Теперь кадр обрезается по центру до соотношения сторон задачи Runway,
+уменьшается до max_width и пережимается в JPEG/WebP заданного качества. Дальше два режима:
+    data_uri      - компактный кадр в base64 прямо в запросе;
+    presigned_url - кадр загружается в B2 (b2_prefix), в запрос уходит presigned URL на чтение,
+                    тело запроса - несколько сотен байт. Объект удаляется после завершения задачи.
+При ошибке подготовки или загрузки используется прежний путь (исходный файл в data URI).
+
+Настройки - секция RUNWAY_INPUT в config.json:
+    mode, format ("jpeg" | "webp"), quality, max_width, b2_prefix, presigned_expires_seconds.
+"""
+import base64
+import time
+from pathlib import Path
+
+try:
+    from .logger import get_logger
+    logger = get_logger("runway_input")
+except ImportError:
+    from modules.logger import get_logger
+    logger = get_logger("runway_input")
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+DEFAULT_SETTINGS = {
+    "mode": "data_uri",
+    "format": "jpeg",
+    "quality": 90,
+    "max_width": 1280,
+    "b2_prefix": "runway_inputs/",
+    "presigned_expires_seconds": 3600,
+}
+VALID_MODES = ("data_uri", "presigned_url")
+FORMATS = {"jpeg": ("JPEG", "image/jpeg", ".jpg"), "webp": ("WEBP", "image/webp", ".webp")}
+
+
+def get_runway_input_settings(config) -> dict:
+    """Настройки RUNWAY_INPUT из config.json поверх значений по умолчанию."""
+    settings = dict(DEFAULT_SETTINGS)
+    try:
+        settings.update({k: v for k, v in (config.get("RUNWAY_INPUT", {}) or {}).items() if v is not None})
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось прочитать RUNWAY_INPUT из конфигурации: {e}. Используются значения по умолчанию.")
+    if settings["mode"] not in VALID_MODES:
+        logger.warning(f"⚠️ Неизвестный RUNWAY_INPUT.mode '{settings['mode']}', используется 'data_uri'.")
+        settings["mode"] = "data_uri"
+    if settings["format"] not in FORMATS:
+        logger.warning(f"⚠️ Неизвестный RUNWAY_INPUT.format '{settings['format']}', используется 'jpeg'.")
+        settings["format"] = "jpeg"
+    return settings
+
+
+def parse_ratio(ratio: str) -> tuple[int, int] | None:
+    """'1280:768' -> (1280, 768)."""
+    try:
+        width, height = (int(part) for part in str(ratio).split(":"))
+        return (width, height) if width > 0 and height > 0 else None
+    except ValueError:
+        return None
+
+
+def _mime_for(path: Path) -> str:
+    ext = path.suffix.lower()
+    return f"image/{'png' if ext == '.png' else ('jpeg' if ext in ['.jpg', '.jpeg'] else ('webp' if ext == '.webp' else 'octet-stream'))}"
+
+
+def encode_data_uri(path, mime: str | None = None) -> str:
+    path = Path(path)
+    return f"data:{mime or _mime_for(path)};base64,{base64.b64encode(path.read_bytes()).decode('ascii')}"
+
+
+def prepare_runway_frame(image_path, ratio: str, settings: dict, output_dir=None) -> dict | None:
+    """
+    Обрезает кадр по центру до ratio, уменьшает до max_width и сохраняет в format/quality.
+    Возвращает {"path", "mime", "size", "bytes", "source_bytes", "seconds"} или None.
+    """
+    if Image is None:
+        logger.warning("⚠️ Pillow не установлен, кадр для Runway не пережимается.")
+        return None
+    image_path = Path(image_path)
+    target = parse_ratio(ratio)
+    pil_format, mime, suffix = FORMATS[settings["format"]]
+    output_path = Path(output_dir or image_path.parent) / f"{image_path.stem}_runway{suffix}"
+    started = time.perf_counter()
+    try:
+        with Image.open(image_path) as img:
+            img = img.convert("RGB")
+            if target:
+                target_ratio = target[0] / target[1]
+                width, height = img.size
+                if width / height > target_ratio:
+                    crop_width = round(height * target_ratio)
+                    left = (width - crop_width) // 2
+                    img = img.crop((left, 0, left + crop_width, height))
+                elif width / height < target_ratio:
+                    crop_height = round(width / target_ratio)
+                    top = (height - crop_height) // 2
+                    img = img.crop((0, top, width, top + crop_height))
+            max_width = int(settings["max_width"])
+            if max_width and img.width > max_width:
+                img = img.resize((max_width, round(img.height * max_width / img.width)), Image.LANCZOS)
+            img.save(output_path, format=pil_format, quality=int(settings["quality"]), optimize=True)
+            size = img.size
+    except Exception as e:
+        logger.error(f"❌ Ошибка подготовки кадра Runway из {image_path}: {e}", exc_info=True)
+        return None
+    return {"path": output_path, "mime": mime, "size": size, "bytes": output_path.stat().st_size,
+            "source_bytes": image_path.stat().st_size, "seconds": time.perf_counter() - started}
+
+
+def upload_presigned(s3_client, bucket_name: str, local_path, key: str, mime: str, expires_seconds: int) -> str | None:
+    """Загружает файл в B2 и возвращает presigned URL на чтение (или None)."""
+    try:
+        s3_client.upload_file(str(local_path), bucket_name, key, ExtraArgs={"ContentType": mime})
+        return s3_client.generate_presigned_url("get_object", Params={"Bucket": bucket_name, "Key": key},
+                                                ExpiresIn=int(expires_seconds))
+    except Exception as e:
+        logger.error(f"❌ Не удалось загрузить кадр Runway в B2 ({key}) или подписать URL: {e}")
+        return None
+
+
+def build_prompt_image(image_path, ratio: str, settings: dict, s3_client=None, bucket_name: str | None = None) -> dict | None:
+    """
+    Значение prompt_image для Runway и статистика подготовки:
+    {"prompt_image", "mode", "payload_bytes", "frame_bytes", "source_bytes", "prepare_s", "b2_key"}.
+    """
+    image_path = Path(image_path)
+    started = time.perf_counter()
+    frame = prepare_runway_frame(image_path, ratio, settings)
+    mode, b2_key, prompt_image = settings["mode"], None, None
+    if frame and mode == "presigned_url":
+        if s3_client is None or not bucket_name:
+            logger.warning("⚠️ Режим presigned_url без клиента B2, кадр будет передан как data URI.")
+        else:
+            b2_key = f"{settings['b2_prefix'].rstrip('/')}/{frame['path'].name}"
+            prompt_image = upload_presigned(s3_client, bucket_name, frame["path"], b2_key, frame["mime"],
+                                            settings["presigned_expires_seconds"])
+            if prompt_image is None:
+                b2_key = None
+    try:
+        if prompt_image is None:
+            mode = "data_uri" if frame else "data_uri_original"
+            prompt_image = encode_data_uri(frame["path"], frame["mime"]) if frame else encode_data_uri(image_path)
+    except OSError as e:
+        logger.error(f"❌ Ошибка кодирования изображения {image_path} в Base64: {e}", exc_info=True)
+        return None
+    result = {"prompt_image": prompt_image, "mode": mode, "payload_bytes": len(prompt_image),
+              "frame_bytes": frame["bytes"] if frame else image_path.stat().st_size,
+              "source_bytes": image_path.stat().st_size, "prepare_s": time.perf_counter() - started, "b2_key": b2_key}
+    size_note = f"кадр {frame['size'][0]}x{frame['size'][1]} {settings['format']} q{settings['quality']}, " if frame else ""
+    logger.info(f"🎞️ Вход Runway ({mode}): {size_note}исходник {result['source_bytes'] / 1024:.0f} КиБ -> "
+                f"в запросе {result['payload_bytes'] / 1024:.1f} КиБ, подготовка {result['prepare_s']:.2f} c.")
+    return result
+
+
+def delete_runway_input(s3_client, bucket_name: str, key: str | None) -> bool:
+    """Удаляет загруженный кадр из B2 (после завершения задачи Runway)."""
+    if not key or s3_client is None:
+        return False
+    try:
+        s3_client.delete_object(Bucket=bucket_name, Key=key)
+        logger.info(f"🗑️ Кадр Runway удален из B2: {key}")
+        return True
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось удалить кадр Runway {key} из B2: {e}")
+        return False
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+# В файле modules/runway_tasks.py
+"""
+Состояние асинхронной задачи Runway в config_midjourney.json (ключ "runway_task").
+
+generate_media отправляет задачу image-to-video и сразу завершается, сохранив ID задачи;
+следующие запуски b2_storage_manager проверяют статус один раз за запуск, когда наступил
+next_poll_at. Интервал между проверками растет (first_poll_delay * backoff^n, не больше
+max_poll_interval), так что долгие задачи не опрашиваются впустую, а процесс с блокировкой
+не простаивает в time.sleep.
+
+Структура runway_task:
+    task_id, generation_id, source_image_url (апскейл MJ - для mock при неудаче),
+    input_mode / input_key / payload_bytes / submit_s (входной кадр, см. modules/runway_input.py),
+    submitted_at_utc, next_poll_at_utc, poll_count, last_status.
+
+Настройки - секция WORKFLOW в config.json:
+    runway_async               - true: асинхронный режим; false (по умолчанию): прежний блокирующий
+                                 опрос в generate_media. Асинхронный режим включать, только если
+                                 b2_storage_manager запускается по расписанию (schedule в
+                                 .github/workflows/test.yml или cron): сам менеджер после отправки
+                                 завершается, и без следующих запусков видео не будет забрано;
+    runway_first_poll_delay    - первая проверка через N секунд после отправки;
+    runway_poll_backoff        - множитель интервала после каждой проверки;
+    runway_max_poll_interval   - верхняя граница интервала, сек;
+    runway_task_timeout        - после скольких секунд с отправки задача считается зависшей.
+"""
+from datetime import datetime, timedelta, timezone
+
+try:
+    from .logger import get_logger
+    logger = get_logger("runway_tasks")
+except ImportError:
+    from modules.logger import get_logger
+    logger = get_logger("runway_tasks")
+
+RUNWAY_TASK_KEY = "runway_task"
+RUNWAY_WAITING_STATUS = "waiting_for_runway"
+RUNWAY_IN_PROGRESS_STATUSES = ("PENDING", "PROCESSING", "QUEUED", "WAITING", "RUNNING", "THROTTLED")
+DEFAULT_SETTINGS = {
+    "runway_async": False,
+    "runway_first_poll_delay": 30,
+    "runway_poll_backoff": 1.5,
+    "runway_max_poll_interval": 300,
+    "runway_task_timeout": 1800,
+}
+
+
+def get_runway_task_settings(config) -> dict:
+    """Настройки асинхронного опроса Runway из WORKFLOW поверх значений по умолчанию."""
+    settings = dict(DEFAULT_SETTINGS)
+    for key, default in DEFAULT_SETTINGS.items():
+        try:
+            value = config.get(f"WORKFLOW.{key}", default)
+            settings[key] = type(default)(value) if value is not None else default
+        except (ValueError, TypeError):
+            logger.warning(f"⚠️ Некорректное значение WORKFLOW.{key}. Используется {default}.")
+    return settings
+
+
+def _now(now: datetime | None) -> datetime:
+    return now or datetime.now(timezone.utc)
+
+
+def _parse_utc(value) -> datetime | None:
+    if not isinstance(value, str) or not value:
+        return None
+    try:
+        if value.endswith('Z'):
+            value = value[:-1] + '+00:00'
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        logger.error(f"Ошибка парсинга метки времени '{value}' задачи Runway.")
+        return None
+    return parsed.replace(tzinfo=timezone.utc) if parsed.tzinfo is None else parsed.astimezone(timezone.utc)
+
+
+def get_runway_task(config_mj: dict) -> dict | None:
+    """Активная задача Runway из config_mj или None."""
+    task = config_mj.get(RUNWAY_TASK_KEY) if isinstance(config_mj, dict) else None
+    return task if isinstance(task, dict) and task.get("task_id") else None
+
+
+def new_runway_task(task_id: str, generation_id: str, source_image_url: str | None, settings: dict,
+                    now: datetime | None = None, input_info: dict | None = None) -> dict:
+    """
+    Состояние только что отправленной задачи; первая проверка - через runway_first_poll_delay.
+    input_info - результат submit_runway_task (режим входного кадра, ключ в B2 для удаления, размер запроса).
+    """
+    now = _now(now)
+    input_info = input_info or {}
+    return {
+        "task_id": str(task_id),
+        "generation_id": generation_id,
+        "source_image_url": source_image_url,
+        "input_mode": input_info.get("input_mode"),
+        "input_key": input_info.get("input_key"),
+        "payload_bytes": input_info.get("payload_bytes"),
+        "submit_s": input_info.get("submit_s"),
+        "submitted_at_utc": now.isoformat(),
+        "next_poll_at_utc": (now + timedelta(seconds=settings["runway_first_poll_delay"])).isoformat(),
+        "poll_count": 0,
+        "last_status": "SUBMITTED",
+    }
+
+
+def next_poll_interval(poll_count: int, settings: dict) -> float:
+    """Интервал до следующей проверки после poll_count проверок."""
+    interval = settings["runway_first_poll_delay"] * settings["runway_poll_backoff"] ** max(0, poll_count)
+    return min(float(settings["runway_max_poll_interval"]), interval)
+
+
+def schedule_next_poll(task: dict, status: str, settings: dict, now: datetime | None = None) -> dict:
+    """Отмечает проверку со статусом status и переносит next_poll_at_utc с нарастающим интервалом."""
+    now = _now(now)
+    task["poll_count"] = int(task.get("poll_count", 0)) + 1
+    task["last_status"] = status
+    task["last_polled_at_utc"] = now.isoformat()
+    task["next_poll_at_utc"] = (now + timedelta(seconds=next_poll_interval(task["poll_count"], settings))).isoformat()
+    return task
+
+
+def seconds_until_poll(task: dict, now: datetime | None = None) -> float:
+    """Сколько секунд осталось до следующей проверки (0 - пора проверять)."""
+    next_poll_at = _parse_utc(task.get("next_poll_at_utc"))
+    if next_poll_at is None:
+        return 0.0
+    return max(0.0, (next_poll_at - _now(now)).total_seconds())
+
+
+def task_age_seconds(task: dict, now: datetime | None = None) -> float | None:
+    submitted_at = _parse_utc(task.get("submitted_at_utc"))
+    return (_now(now) - submitted_at).total_seconds() if submitted_at else None
+
+
+def task_expired(task: dict, settings: dict, now: datetime | None = None) -> bool:
+    """True, если с отправки прошло больше runway_task_timeout секунд."""
+    age = task_age_seconds(task, now)
+    return age is not None and age > settings["runway_task_timeout"]
@@ -5,8 +5,6 @@
 """
 import logging
 from pathlib import Path
-import io
-import textwrap # Импортируем textwrap
 
 # --- Pillow ---
 try:
@@ -31,6 +29,18 @@ except ImportError:
     if logger.level > logging.DEBUG:
          logger.setLevel(logging.DEBUG)
 
+# --- Подбор размера шрифта (двоичный поиск по сетке размеров) и разметка по ширинам глифов ---
+try:
+    from modules.font_fit import fit_font_size
+except ImportError:
+    from .font_fit import fit_font_size
+
+# --- Кэш декодированной подложки (пиксели RGBA и области текста) ---
+try:
+    from modules.base_plate import get_base_plate
+except ImportError:
+    from .base_plate import get_base_plate
+
 # Вспомогательная функция
 #def hex_to_rgba(hex_color, alpha=255):
 #    """Конвертирует HEX цвет (#RRGGBB) в кортеж RGBA."""
@@ -60,16 +70,17 @@ def add_text_to_image_sarcasm(
     stroke_color_hex: str = "#404040", # Обводка для белого текста
     initial_font_size: int = 100, # Стартовый размер шрифта
     min_font_size: int = 24,      # Минимальный размер шрифта
-    logger_instance=None # Возможность передать логгер извне
+    logger_instance=None, # Возможность передать логгер извне
+    font_fit_strategy: str = "guess" # Подбор размера: "guess", "binary" или "linear" (modules/font_fit.py)
     ):
     """
     Наносит текст на ПРАВУЮ ПОЛОВИНУ изображения с автоподбором размера,
     выравниванием по правому краю и вертикальным центрированием.
-    Использует textwrap для корректной разбивки на строки.
+    Строки переносятся по измеренным ширинам глифов (modules/text_layout.py).
     """
     log = logger_instance if logger_instance else logger
     if log.level > logging.DEBUG: log.setLevel(logging.DEBUG)
-    log.info(">>> Запуск add_text_to_image_sarcasm (v3 - textwrap, fix position)")
+    log.info(">>> Запуск add_text_to_image_sarcasm (v4 - перенос по ширинам глифов)")
 
     if not PIL_AVAILABLE:
         log.error("Pillow недоступна. Невозможно добавить текст.")
@@ -83,117 +94,45 @@ def add_text_to_image_sarcasm(
         if not base_image_path.is_file(): log.error(f"Изображение не найдено: {base_image_path}"); return False
         if not font_path.is_file(): log.error(f"Шрифт не найден: {font_path}"); return False
 
-        log.info(f"Открытие базового изображения: {base_image_path.name}")
-        img = Image.open(base_image_path).convert("RGBA")
+        # Подложка из кэша (modules/base_plate.py): копия пикселей создается при первой записи
+        plate = get_base_plate(base_image_path)
+        img = plate.clone()
         img_width, img_height = img.size
         log.debug(f"Размеры изображения: {img_width}x{img_height}")
 
         draw = ImageDraw.Draw(img)
 
-        # 1. Определить область для текста (правая половина с отступами)
-        padding_x = int(img_width * padding_fraction)
-        padding_y = int(img_height * padding_fraction)
-        text_area_x_start = img_width // 2 + padding_x
-        text_area_y_start = padding_y
-        text_area_width = img_width // 2 - 2 * padding_x
-        text_area_height = img_height - 2 * padding_y
+        # 1. Область для текста (правая половина с отступами), посчитана подложкой один раз
+        region = plate.text_region(padding_fraction)
+        text_area_x_start, text_area_y_start = region["x_start"], region["y_start"]
+        text_area_width, text_area_height = region["width"], region["height"]
         log.info(f"Область текста: X={text_area_x_start}, Y={text_area_y_start}, W={text_area_width}, H={text_area_height}")
 
         if text_area_width <= 0 or text_area_height <= 0:
             log.error("Некорректная область текста (слишком маленькая или отрицательная)."); return False
 
-        # 2. Автоподбор размера шрифта с использованием textwrap
-        font = None
-        font_bytes = None
-        try:
-            with open(font_path, 'rb') as f_font: font_bytes = f_font.read()
-            log.debug(f"Шрифт '{font_path.name}' прочитан ({len(font_bytes)} байт).")
-        except Exception as read_font_err:
-             log.error(f"Ошибка чтения шрифта '{font_path}': {read_font_err}"); return False
-
-        current_font_size = initial_font_size
-        best_font_size = -1
-        best_wrapped_text = ""
-
+        # 2. Автоподбор размера шрифта: для каждого пробного размера текст переносится по реальным
+        # ширинам глифов, размер подходит, если блок помещается в область и по ширине, и по высоте
         log.info(f"Подбор размера шрифта (старт: {initial_font_size}, мин: {min_font_size}) для текста: '{text[:50]}...'")
-        # --- НАЧАЛО ЦИКЛА ПОДБОРА ---
-        while current_font_size >= min_font_size:
-            log.debug(f"--- Итерация цикла: Пробуем размер = {current_font_size} ---")
-            try:
-                font = ImageFont.truetype(io.BytesIO(font_bytes), current_font_size)
-
-                # Оценка максимальной ширины символа для textwrap
-                # Можно взять среднюю ширину или ширину самого широкого символа (например, 'W' или 'Ш')
-                avg_char_width = font.getlength("W") # Или другая широкая буква
-                if avg_char_width <= 0: avg_char_width = current_font_size * 0.6 # Примерный fallback
-                # Рассчитываем примерное количество символов в строке
-                approx_chars_per_line = max(1, int(text_area_width / avg_char_width))
-                log.debug(f"  Примерная ширина символа: {avg_char_width:.1f}, символов в строке: {approx_chars_per_line}")
-
-                # Используем textwrap для разбивки
-                wrapped_lines = textwrap.wrap(text, width=approx_chars_per_line, replace_whitespace=False)
-                wrapped_text = "\n".join(wrapped_lines)
-                log.debug(f"  Результат textwrap:\n{wrapped_text}")
-
-                # Получаем реальные размеры блока текста с переносами
-                try:
-                    # Используем textbbox для получения габаритов
-                    bbox = draw.textbbox((0, 0), wrapped_text, font=font, align=align)
-                    text_width = bbox[2] - bbox[0]
-                    text_height = bbox[3] - bbox[1]
-                    log.debug(f"  Размер {current_font_size}: Ширина={text_width:.0f}, Высота={text_height:.0f}")
-                except Exception as bbox_err:
-                    log.warning(f"  Ошибка расчета bbox для размера {current_font_size}: {bbox_err}. Пропускаем размер.")
-                    current_font_size -= 2
-                    continue
-
-                # Проверяем, помещается ли текст в область
-                if text_width <= text_area_width and text_height <= text_area_height:
-                    log.info(f"Найден ПОДХОДЯЩИЙ размер шрифта: {current_font_size}")
-                    best_font_size = current_font_size
-                    best_wrapped_text = wrapped_text
-                    break # Найден оптимальный размер
-                else:
-                    log.debug(f"  Размер {current_font_size} НЕ подходит (Ширина: {text_width > text_area_width}, Высота: {text_height > text_area_height}). Уменьшаем...")
-                    current_font_size -= 2
-
-            except Exception as size_err:
-                 log.error(f"Ошибка при расчете размера {current_font_size}: {size_err}", exc_info=True)
-                 current_font_size -= 2
-        # --- КОНЕЦ ЦИКЛА ПОДБОРА ---
-
-        if best_font_size == -1:
-            log.warning(f"Цикл завершен БЕЗ НАХОЖДЕНИЯ подходящего размера. Используем минимальный {min_font_size}.")
-            best_font_size = min_font_size
-            try:
-                font = ImageFont.truetype(io.BytesIO(font_bytes), best_font_size)
-                # Финальная разбивка с минимальным размером
-                avg_char_width = font.getlength("W")
-                if avg_char_width <= 0: avg_char_width = best_font_size * 0.6
-                approx_chars_per_line = max(1, int(text_area_width / avg_char_width))
-                wrapped_lines = textwrap.wrap(text, width=approx_chars_per_line, replace_whitespace=False)
-                best_wrapped_text = "\n".join(wrapped_lines)
-                log.debug(f"Разбивка на строки с минимальным шрифтом ({min_font_size}):\n" + best_wrapped_text)
-            except Exception as min_font_err:
-                 log.error(f"Критическая ошибка при работе с минимальным шрифтом: {min_font_err}"); return False
-
-        if not best_wrapped_text:
-            log.error("Не удалось подготовить текст для нанесения (best_wrapped_text пуст)."); return False
-
-        final_text_string = best_wrapped_text
-        font = ImageFont.truetype(io.BytesIO(font_bytes), best_font_size)
+        try:
+            fit = fit_font_size(str(font_path), text, text_area_width, initial_font_size, min_font_size, step=2,
+                                strategy=font_fit_strategy, max_height=text_area_height, wrap=True)
+        except Exception as size_err:
+            log.error(f"Ошибка при подборе размера шрифта: {size_err}", exc_info=True); return False
+        log.info(f"Подбор шрифта ({font_fit_strategy}): {fit['constructions']} построений за {fit['seconds'] * 1000:.1f} мс.")
+        if not fit["fits"]:
+            log.warning(f"Подходящий размер не найден. Используем минимальный {min_font_size}.")
+        if fit["font"] is None or not fit["text"].strip():
+            log.error("Не удалось подготовить текст для нанесения (пустая разметка)."); return False
+
+        final_text_string = fit["text"]
+        font = fit["font"]
+        best_font_size = fit["size"]
+        final_text_width, final_text_height = fit["width"], fit["height"]
         log.info(f"Финальный размер шрифта: {best_font_size}")
+        log.debug(f"Разбивка на строки:\n{final_text_string}")
 
         # 3. Расчет финальных координат X, Y
-        try:
-            # Получаем точные размеры финального текстового блока
-            bbox_final = draw.textbbox((0, 0), final_text_string, font=font, align=align)
-            final_text_width = bbox_final[2] - bbox_final[0]
-            final_text_height = bbox_final[3] - bbox_final[1]
-            log.debug(f"Финальные размеры блока текста: Ширина={final_text_width:.1f}, Высота={final_text_height:.1f}")
-        except Exception as final_bbox_err:
-             log.error(f"Ошибка финального расчета bbox: {final_bbox_err}"); return False
-
         # Расчет X для выравнивания по правому краю
         # Координата X - это правый край области минус ширина текста
         x = text_area_x_start + text_area_width - final_text_width
@@ -271,8 +210,9 @@ def add_text_to_image_sarcasm_openai_ready(
     stroke_width: int = 2,
     stroke_color_hex: str = "#404040", # Обводка для белого текста
     min_font_size_limit: int = 30, # Минимальный размер, до которого будем уменьшать
-    font_step_down: int = 2, # Шаг уменьшения шрифта
-    logger_instance=None # Возможность передать логгер извне
+    font_step_down: int = 2, # Шаг сетки размеров шрифта
+    logger_instance=None, # Возможность передать логгер извне
+    font_fit_strategy: str = "guess" # Подбор размера: "guess", "binary" или прежний "linear" (modules/font_fit.py)
     ):
     """
     Наносит ПРЕДВАРИТЕЛЬНО ОТФОРМАТИРОВАННЫЙ текст (с переносами \\n)
@@ -300,68 +240,40 @@ def add_text_to_image_sarcasm_openai_ready(
         if not base_image_path.is_file(): log.error(f"Изображение не найдено: {base_image_path}"); return False
         if not font_path.is_file(): log.error(f"Шрифт не найден: {font_path}"); return False
 
-        log.info(f"Открытие базового изображения: {base_image_path.name}")
-        img = Image.open(base_image_path).convert("RGBA")
+        # Подложка из кэша (modules/base_plate.py): копия пикселей создается при первой записи
+        plate = get_base_plate(base_image_path)
+        img = plate.clone()
         img_width, img_height = img.size
         log.debug(f"Размеры изображения: {img_width}x{img_height}")
 
         draw = ImageDraw.Draw(img)
 
-        # 1. Определить область для текста (правая половина с отступами)
-        padding_x = int(img_width * padding_fraction)
-        padding_y = int(img_height * padding_fraction)
-        # Левая граница текста - СТРОГО середина изображения + отступ
-        text_area_x_start = img_width // 2 + padding_x
-        text_area_y_start = padding_y
-        # Доступная ширина = Половина ширины - ДВА отступа (слева от границы и справа от края)
-        text_area_width = img_width // 2 - 2 * padding_x
-        text_area_height = img_height - 2 * padding_y
+        # 1. Область для текста (правая половина с отступами), посчитана подложкой один раз:
+        # левая граница - СТРОГО середина изображения + отступ, ширина - половина минус ДВА отступа
+        region = plate.text_region(padding_fraction)
+        text_area_x_start, text_area_y_start = region["x_start"], region["y_start"]
+        text_area_width, text_area_height = region["width"], region["height"]
         log.info(f"Целевая область текста: X_start={text_area_x_start}, Y_start={text_area_y_start}, W={text_area_width}, H={text_area_height}")
 
         if text_area_width <= 0 or text_area_height <= 0:
             log.error("Некорректная область текста (слишком маленькая или отрицательная)."); return False
 
-        # 2. Загрузка байтов шрифта
-        font_bytes = None
+        # 2. Шрифты берутся из общего реестра (modules/font_registry.py): файл читается один раз на процесс
+
+        # 3. Подбор размера шрифта: наибольший из suggested_font_size, -font_step_down, ... по ширине области
         try:
-            with open(font_path, 'rb') as f_font: font_bytes = f_font.read()
-            log.debug(f"Шрифт '{font_path.name}' прочитан ({len(font_bytes)} байт).")
-        except Exception as read_font_err:
-             log.error(f"Ошибка чтения шрифта '{font_path}': {read_font_err}"); return False
-
-        # 3. Цикл проверки и коррекции размера шрифта
-        current_font_size = suggested_font_size
-        final_font = None
-        final_text_width = 0
-        final_text_height = 0
-        fits = False
-
-        while current_font_size >= min_font_size_limit:
-            log.debug(f"--- Проверка размера шрифта: {current_font_size} ---")
-            try:
-                font = ImageFont.truetype(io.BytesIO(font_bytes), current_font_size)
-                # Получаем реальные размеры блока текста с текущим шрифтом
-                bbox = draw.textbbox((0, 0), formatted_text, font=font, align=align)
-                text_width = bbox[2] - bbox[0]
-                text_height = bbox[3] - bbox[1]
-                log.debug(f"  Размеры текста (шрифт {current_font_size}): W={text_width:.1f}, H={text_height:.1f}")
-
-                # Проверяем, помещается ли по ШИРИНЕ в доступную область
-                if text_width <= text_area_width:
-                    log.info(f"✅ Размер шрифта {current_font_size} подходит по ширине ({text_width:.1f} <= {text_area_width}).")
-                    final_font = font
-                    final_text_width = text_width
-                    final_text_height = text_height
-                    fits = True
-                    break # Найден подходящий размер
-                else:
-                    log.warning(f"  Размер шрифта {current_font_size} НЕ подходит по ширине ({text_width:.1f} > {text_area_width}). Уменьшаем...")
-                    current_font_size -= font_step_down
-
-            except Exception as size_err:
-                 log.error(f"Ошибка при расчете bbox для шрифта {current_font_size}: {size_err}", exc_info=True)
-                 # Пропускаем этот размер и пробуем следующий меньший
-                 current_font_size -= font_step_down
+            fit = fit_font_size(str(font_path), formatted_text, text_area_width, suggested_font_size, min_font_size_limit,
+                                step=font_step_down, strategy=font_fit_strategy)
+        except Exception as size_err:
+            log.error(f"Ошибка при подборе размера шрифта: {size_err}", exc_info=True); return False
+        log.info(f"Подбор шрифта ({font_fit_strategy}): {fit['constructions']} построений за {fit['seconds'] * 1000:.1f} мс.")
+        fits = fit["fits"]
+        current_font_size = fit["size"]
+        final_font = fit["font"]
+        final_text_width = fit["width"]
+        final_text_height = fit["height"]
+        if fits:
+            log.info(f"✅ Размер шрифта {current_font_size} подходит по ширине ({final_text_width:.1f} <= {text_area_width}).")
 
         # Если цикл завершился, а текст так и не поместился (даже с минимальным шрифтом)
         if not fits:
@@ -392,9 +304,9 @@ def add_text_to_image_sarcasm_openai_ready(
         text_position = (final_x, final_y)
         log.info(f"Финальная позиция текста (левый верх блока): {text_position}")
 
-        # Проверка, не заходит ли текст за ЛЕВУЮ границу (X < img_width // 2)
-        if final_x < img_width // 2:
-             log.error(f"КРИТИЧЕСКАЯ ОШИБКА РАСЧЕТА: Текст начинается ({final_x}) левее середины ({img_width // 2})!")
+        # Проверка, не заходит ли текст за ЛЕВУЮ границу (X < середины изображения)
+        if final_x < region["midline"]:
+             log.error(f"КРИТИЧЕСКАЯ ОШИБКА РАСЧЕТА: Текст начинается ({final_x}) левее середины ({region['midline']})!")
              # Можно попробовать сдвинуть вправо, но лучше прервать
              # final_x = img_width // 2 + padding_x # Попытка сдвинуть
              # text_position = (final_x, final_y)
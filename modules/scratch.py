@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+# В файле modules/scratch.py
+"""
+Рабочая область для временных файлов (картинки, видео, JSON перед отправкой в B2).
+
+Раньше временные папки temp_<ID>_<ts> и файлы вида config_mj_save_temp_*.json создавались
+в текущей директории: медленно на сетевых/overlay ФС, а упавшие запуски оставляли мусор.
+
+Корень выбирается один раз на процесс: первый из SCRATCH.base_dirs (по умолчанию /dev/shm - tmpfs
+в RAM), который существует, доступен на запись и имеет свободными не меньше SCRATCH.min_free_mib;
+иначе системный tempfile.gettempdir(); иначе текущая директория (как раньше).
+В корне создается подпапка b2_scratch/, внутри - папки запусков <метка>_<pid>_<ts>.
+
+Очистка:
+    - scratch_dir(...) - контекстный менеджер, папка удаляется на выходе;
+    - все созданные папки дополнительно удаляются atexit (в т.ч. при sys.exit);
+    - при выборе корня reclaim_stale удаляет папки завершившихся процессов (pid из имени не жив)
+      и записи без pid в имени старше SCRATCH.stale_after_hours (папки живых процессов - никогда);
+      с reclaim_legacy - также старый мусор
+      temp_* / *_temp_*.json в рабочей директории старше того же срока.
+
+scratch_path(name) - путь файла в общей папке процесса (для JSON перед load_b2_json/save_b2_json).
+is_cwd_fallback() - корнем оказалась текущая директория (долгоживущие файлы туда писать не стоит).
+"""
+import atexit
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+try:
+    from .logger import get_logger
+    from .config_manager import ConfigManager
+    logger = get_logger("scratch")
+except ImportError:
+    from modules.logger import get_logger
+    from modules.config_manager import ConfigManager
+    logger = get_logger("scratch")
+
+DEFAULT_SETTINGS = {
+    "enabled": True,
+    "base_dirs": ["/dev/shm"],
+    "min_free_mib": 512,
+    "stale_after_hours": 6,
+    "reclaim_legacy": True,
+}
+SCRATCH_SUBDIR = "b2_scratch"
+DIR_NAME_PATTERN = re.compile(r"^(?P<label>.+)_(?P<pid>\d+)_(?P<ts>\d{14,20})$")
+LEGACY_PATTERNS = ("temp_*_[0-9]*", "config_mj_save_temp_*.json", "config_*_local_*_*.json",
+                   "*_content_temp_*.json", "config_midjourney_*_temp_*.json", "temp_error_error_*.json",
+                   "token_usage_temp_*.json")
+
+_lock = threading.Lock()
+_root = None
+_root_is_cwd = False
+_process_dir = None
+_created_dirs = set()
+
+
+def get_scratch_settings(config=None) -> dict:
+    """Настройки SCRATCH из config.json поверх значений по умолчанию."""
+    settings = dict(DEFAULT_SETTINGS)
+    try:
+        settings.update({k: v for k, v in ((config or ConfigManager()).get("SCRATCH", {}) or {}).items() if v is not None})
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось прочитать SCRATCH из конфигурации: {e}. Используются значения по умолчанию.")
+    return settings
+
+
+def free_mib(path) -> float:
+    """Свободное место на ФС пути path, МиБ (0 при ошибке)."""
+    try:
+        return shutil.disk_usage(path).free / (1024 * 1024)
+    except OSError:
+        return 0.0
+
+
+def _usable(base: Path, required_mib: float) -> bool:
+    if not base.is_dir() or not os.access(base, os.W_OK | os.X_OK):
+        return False
+    available = free_mib(base)
+    if available < required_mib:
+        logger.info(f"ℹ️ {base}: свободно {available:.0f} МиБ < {required_mib:.0f} МиБ, пропуск.")
+        return False
+    return True
+
+
+def _pid_alive(pid: int) -> bool:
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True # Процесс есть, но чужой
+    except OSError:
+        return False
+    return True
+
+
+def _remove(path: Path):
+    if path.is_dir() and not path.is_symlink():
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        path.unlink(missing_ok=True)
+
+
+def reclaim_stale(root: Path, stale_after_hours: float) -> int:
+    """
+    Удаляет в root папки завершившихся процессов, а также записи старше stale_after_hours,
+    у которых pid владельца не читается из имени. Папки живых процессов не удаляются. Возвращает число удаленных.
+    """
+    removed = 0
+    now = time.time()
+    try:
+        entries = list(root.iterdir())
+    except OSError:
+        return 0
+    for entry in entries:
+        try:
+            age_hours = (now - entry.stat().st_mtime) / 3600
+            match = DIR_NAME_PATTERN.match(entry.name)
+            # Папку живого процесса не трогаем независимо от возраста (долгий пакетный rerender_titles)
+            owner_alive = match is not None and _pid_alive(int(match.group("pid")))
+            dead_owner = match is not None and not owner_alive
+            if dead_owner or (not owner_alive and age_hours > stale_after_hours):
+                _remove(entry)
+                removed += 1
+        except OSError as e:
+            logger.warning(f"⚠️ Не удалось удалить устаревшую временную запись {entry}: {e}")
+    if removed:
+        logger.info(f"🧹 Удалено устаревших временных записей в {root}: {removed}")
+    return removed
+
+
+def reclaim_legacy_debris(directory: Path, stale_after_hours: float) -> int:
+    """Удаляет старый мусор прежней схемы (temp_* и *_temp_*.json в рабочей директории) старше stale_after_hours."""
+    removed = 0
+    threshold = time.time() - stale_after_hours * 3600
+    for pattern in LEGACY_PATTERNS:
+        for entry in directory.glob(pattern):
+            try:
+                if entry.stat().st_mtime < threshold:
+                    _remove(entry)
+                    removed += 1
+            except OSError as e:
+                logger.warning(f"⚠️ Не удалось удалить старый временный файл {entry}: {e}")
+    if removed:
+        logger.info(f"🧹 Удалено старых временных файлов в {directory}: {removed}")
+    return removed
+
+
+def get_scratch_root(config=None) -> Path:
+    """Корень рабочей области (выбирается и очищается от устаревших папок один раз на процесс)."""
+    global _root, _root_is_cwd
+    with _lock:
+        if _root is not None:
+            return _root
+        settings = get_scratch_settings(config)
+        candidates = [Path(p) for p in settings["base_dirs"] if p] if settings["enabled"] else []
+        candidates.append(Path(tempfile.gettempdir()))
+        base = next((c for c in candidates if _usable(c, float(settings["min_free_mib"]))), None)
+        root = None
+        if base is not None:
+            root = base / SCRATCH_SUBDIR
+            try:
+                root.mkdir(mode=0o700, exist_ok=True)
+            except OSError as e:
+                logger.warning(f"⚠️ Не удалось создать {root}: {e}")
+                root = None
+        if root is None:
+            root = Path.cwd()
+            _root_is_cwd = True
+            logger.warning("⚠️ Нет подходящей временной ФС, временные файлы пишутся в текущую директорию.")
+        else:
+            reclaim_stale(root, float(settings["stale_after_hours"]))
+            logger.info(f"📂 Рабочая область временных файлов: {root} (свободно {free_mib(root):.0f} МиБ)")
+        if settings["reclaim_legacy"]:
+            reclaim_legacy_debris(Path.cwd(), float(settings["stale_after_hours"]))
+        _root = root
+        return _root
+
+
+def is_cwd_fallback(config=None) -> bool:
+    """True, если подходящей временной ФС нет и рабочая область - текущая директория."""
+    get_scratch_root(config)
+    return _root_is_cwd
+
+
+def create_scratch_dir(label: str, required_mib: float = 0, config=None) -> Path:
+    """
+    Создает папку <label>_<pid>_<ts> в рабочей области и возвращает путь.
+    Если на выбранной ФС свободно меньше required_mib, папка создается в системном tempfile.
+    Папка удаляется atexit, если вызывающий код не удалил ее раньше (remove_scratch_dir).
+    """
+    root = get_scratch_root(config)
+    if required_mib and free_mib(root) < required_mib:
+        fallback = Path(tempfile.gettempdir()) / SCRATCH_SUBDIR
+        logger.warning(f"⚠️ В {root} свободно {free_mib(root):.0f} МиБ < {required_mib:.0f} МиБ, папка '{label}' в {fallback}.")
+        fallback.mkdir(mode=0o700, exist_ok=True)
+        root = fallback
+    timestamp = datetime.now(timezone.utc).strftime("%Y%m%d%H%M%S%f")
+    path = root / f"{label}_{os.getpid()}_{timestamp}"
+    path.mkdir(parents=True, exist_ok=False)
+    with _lock:
+        _created_dirs.add(path)
+    return path
+
+
+def remove_scratch_dir(path) -> bool:
+    """Удаляет папку рабочей области. Возвращает True, если папки больше нет."""
+    if not path:
+        return True
+    path = Path(path)
+    shutil.rmtree(path, ignore_errors=True)
+    with _lock:
+        _created_dirs.discard(path)
+    if path.exists():
+        logger.warning(f"⚠️ Не удалось удалить временную папку {path}.")
+        return False
+    logger.debug(f"Удалена временная папка: {path}")
+    return True
+
+
+@contextmanager
+def scratch_dir(label: str, required_mib: float = 0, config=None):
+    """with scratch_dir("media_ID") as path: ... - папка удаляется на выходе в любом случае."""
+    path = create_scratch_dir(label, required_mib=required_mib, config=config)
+    try:
+        yield path
+    finally:
+        remove_scratch_dir(path)
+
+
+def scratch_path(name: str, config=None) -> Path:
+    """Путь файла name в общей временной папке процесса (удаляется при завершении процесса)."""
+    global _process_dir
+    if _process_dir is None or not _process_dir.is_dir():
+        _process_dir = create_scratch_dir("proc", config=config)
+    return _process_dir / name
+
+
+@atexit.register
+def _cleanup_at_exit():
+    for path in list(_created_dirs):
+        shutil.rmtree(path, ignore_errors=True)
+    _created_dirs.clear()
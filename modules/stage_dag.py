@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+# В файле modules/stage_dag.py
+"""
+Декларативный граф этапов (DAG) для generate_media.
+
+Каждый этап объявляется с явными входами и выходами:
+
+    dag = StageDAG("finalize", max_workers=3)
+    dag.stage("sarcasm.render", render_sarcasm, inputs=("sarcasm_text", "sarcasm_font_size"), output="sarcasm_image_path")
+    dag.stage("upload.sarcasm", upload_sarcasm, inputs=("sarcasm_image_path",), output="upload_success_sarcasm")
+    values = dag.run({"sarcasm_text": ..., "sarcasm_font_size": ...})
+
+Входы - имена значений: начальных (аргумент run) или выходов других этапов; функция этапа получает
+их именованными аргументами. output - имя значения (или кортеж имен, тогда функция возвращает кортеж).
+Этап запускается, как только готовы все его входы, поэтому независимые этапы выполняются параллельно
+на пуле max_workers потоков. Если этап упал (исключение), зависящие от него этапы пропускаются,
+остальные продолжают работу.
+
+retry(name) повторяет один этап на уже посчитанных входах, не перезапуская остальные
+(например, повтор загрузки в B2 без повторной отрисовки картинки). retries в stage - число
+автоматических повторов при ошибке.
+
+Для каждого этапа замеряются ожидание (от готовности входов до старта) и выполнение; summary пишет
+сводку: время графа по стене против суммы выполнений. max_workers=0 - последовательный режим.
+"""
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+try:
+    from .logger import get_logger
+    logger = get_logger("stage_dag")
+except ImportError:
+    from modules.logger import get_logger
+    logger = get_logger("stage_dag")
+
+PENDING = "pending"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+
+class StageDAG:
+    """Граф этапов с явными входами/выходами, параллельным выполнением и повтором отдельного этапа."""
+
+    def __init__(self, name: str, max_workers: int = 3, logger_instance=None):
+        self.name = name
+        self.max_workers = max_workers
+        self.log = logger_instance or logger
+        self.values = {}
+        self._stages = {}
+        self._producers = {}
+        self._status = {}
+        self._errors = {}
+        self._timings = {}
+        self._lock = threading.Lock()
+        self._started_at = None
+
+    def stage(self, name: str, fn, inputs=(), output=None, retries: int = 0):
+        """Объявляет этап name: fn(**входы) -> output (по умолчанию имя значения совпадает с name)."""
+        if name in self._stages:
+            raise ValueError(f"Этап '{name}' уже объявлен в графе '{self.name}'")
+        outputs = (output,) if isinstance(output, str) else tuple(output or (name,))
+        for key in outputs:
+            if key in self._producers:
+                raise ValueError(f"Значение '{key}' уже производит этап '{self._producers[key]}'")
+            self._producers[key] = name
+        self._stages[name] = {"fn": fn, "inputs": tuple(inputs), "outputs": outputs,
+                              "single": isinstance(output, str) or output is None, "retries": max(0, int(retries))}
+        self._status[name] = PENDING
+        return self
+
+    # --- Выполнение ---
+
+    def _execute(self, name: str, ready_at: float):
+        spec = self._stages[name]
+        kwargs = {key: self.values[key] for key in spec["inputs"]}
+        attempts = spec["retries"] + 1
+        started = time.perf_counter()
+        for attempt in range(1, attempts + 1):
+            try:
+                result = spec["fn"](**kwargs)
+                break
+            except Exception as e:
+                if attempt >= attempts:
+                    raise
+                self.log.warning(f"⚠️ [{self.name}:{name}] ошибка (попытка {attempt}/{attempts}): {e}. Повтор...")
+        finished = time.perf_counter()
+        with self._lock:
+            previous = self._timings.get(name, {})
+            self._timings[name] = {"wait_s": started - ready_at, "run_s": finished - started,
+                                   "finished_at_s": finished - (self._started_at or started),
+                                   "runs": previous.get("runs", 0) + 1}
+        self.log.info(f"⏱️ [{self.name}:{name}] выполнен за {finished - started:.2f} c (ожидание {started - ready_at:.2f} c).")
+        return result
+
+    def _store(self, name: str, result):
+        spec = self._stages[name]
+        if spec["single"]:
+            self.values[spec["outputs"][0]] = result
+        else:
+            if not isinstance(result, tuple) or len(result) != len(spec["outputs"]):
+                raise ValueError(f"Этап '{name}' должен вернуть кортеж {spec['outputs']}")
+            self.values.update(zip(spec["outputs"], result))
+
+    def _finish(self, name: str, future_or_result, is_future: bool = True):
+        try:
+            result = future_or_result.result() if is_future else future_or_result
+            self._store(name, result)
+            self._status[name] = SUCCEEDED
+            self._errors.pop(name, None)
+        except Exception as e:
+            self._status[name] = FAILED
+            self._errors[name] = e
+            self.log.error(f"❌ [{self.name}:{name}] завершился ошибкой: {e}", exc_info=True)
+
+    def _blocked(self, name: str) -> bool:
+        """Вход этапа уже не появится: производитель упал или пропущен."""
+        return any(self._status.get(self._producers.get(key)) in (FAILED, SKIPPED)
+                   for key in self._stages[name]["inputs"] if key not in self.values)
+
+    def _ready(self, name: str) -> bool:
+        return all(key in self.values for key in self._stages[name]["inputs"])
+
+    def run(self, values: dict | None = None) -> dict:
+        """Выполняет все этапы графа. Возвращает словарь значений (начальные + выходы успешных этапов)."""
+        self.values.update(values or {})
+        missing = {key for spec in self._stages.values() for key in spec["inputs"]
+                   if key not in self.values and key not in self._producers}
+        if missing:
+            raise ValueError(f"Граф '{self.name}': нет значений и этапов для входов {sorted(missing)}")
+        self._started_at = time.perf_counter()
+        executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=f"dag_{self.name}") if self.max_workers > 0 else None
+        running = {}
+        try:
+            while True:
+                progressed = True
+                while progressed:
+                    progressed = False
+                    for name, status in list(self._status.items()):
+                        if status != PENDING or name in running.values():
+                            continue
+                        if self._blocked(name):
+                            self._status[name] = SKIPPED
+                            self.log.warning(f"⚠️ [{self.name}:{name}] пропущен: не получены входы от упавших этапов.")
+                            progressed = True
+                        elif self._ready(name):
+                            ready_at = time.perf_counter()
+                            if executor is None:
+                                try:
+                                    result = self._execute(name, ready_at)
+                                except Exception as e:
+                                    self._finish(name, _Failed(e))
+                                else:
+                                    self._finish(name, result, is_future=False)
+                            else:
+                                running[executor.submit(self._execute, name, ready_at)] = name
+                            progressed = True
+                if not running:
+                    break
+                done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in done:
+                    self._finish(running.pop(future), future)
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True)
+        for name, status in self._status.items():
+            if status == PENDING:
+                # Входы не появились и производитель не упал - цикл в графе
+                self._status[name] = SKIPPED
+                self.log.error(f"❌ [{self.name}:{name}] не выполнен: входы {self._stages[name]['inputs']} не готовы (цикл?).")
+        return self.values
+
+    def retry(self, name: str) -> bool:
+        """Повторяет один этап на текущих значениях входов (остальные этапы не перезапускаются)."""
+        if name not in self._stages:
+            self.log.error(f"❌ [{self.name}] неизвестный этап '{name}'.")
+            return False
+        if not self._ready(name):
+            self.log.error(f"❌ [{self.name}:{name}] повтор невозможен: не готовы входы "
+                           f"{[key for key in self._stages[name]['inputs'] if key not in self.values]}.")
+            return False
+        self.log.info(f"🔁 [{self.name}:{name}] повтор этапа...")
+        try:
+            result = self._execute(name, time.perf_counter())
+        except Exception as e:
+            self._finish(name, _Failed(e))
+        else:
+            self._finish(name, result, is_future=False)
+        return self._status[name] == SUCCEEDED
+
+    # --- Состояние ---
+
+    def status(self, name: str) -> str | None:
+        return self._status.get(name)
+
+    def succeeded(self, name: str) -> bool:
+        return self._status.get(name) == SUCCEEDED
+
+    def failed(self) -> list[str]:
+        return [name for name, status in self._status.items() if status == FAILED]
+
+    def value(self, key: str, default=None):
+        return self.values.get(key, default)
+
+    def produces(self, key: str) -> bool:
+        """Есть ли в графе этап, производящий значение key."""
+        return key in self._producers
+
+    def summary(self) -> dict:
+        """Пишет в лог и возвращает сводку по этапам."""
+        with self._lock:
+            timings = dict(self._timings)
+        if not timings:
+            return {"stages": {}, "status": dict(self._status), "wall_s": 0.0, "sum_run_s": 0.0}
+        wall_s = max(t["finished_at_s"] for t in timings.values())
+        sum_run_s = sum(t["run_s"] for t in timings.values())
+        details = ", ".join(f"{name} {t['run_s']:.2f} c" for name, t in timings.items())
+        not_ok = {name: status for name, status in self._status.items() if status != SUCCEEDED}
+        self.log.info(f"⏱️ Граф '{self.name}': {wall_s:.2f} c по стене, сумма этапов {sum_run_s:.2f} c "
+                      f"(параллельно сэкономлено {max(0.0, sum_run_s - wall_s):.2f} c). {details}"
+                      f"{f'; не выполнены: {not_ok}' if not_ok else ''}")
+        return {"stages": timings, "status": dict(self._status), "wall_s": wall_s, "sum_run_s": sum_run_s}
+
+
+class _Failed:
+    """Результат-ошибка для последовательного режима и retry (интерфейс как у Future)."""
+
+    def __init__(self, error: Exception):
+        self.error = error
+
+    def result(self):
+        raise self.error
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+# В файле modules/stream_transfer.py
+"""
+Потоковая передача HTTP -> B2 без промежуточного файла (видео Runway).
+
+Тело ответа читается частями и собирается в части multipart-загрузки размером part_size_mib;
+каждая готовая часть сразу отправляется upload_part в фоновом потоке, поэтому загрузка в B2
+идет, пока скачивание еще продолжается. Одновременно в памяти не больше max_inflight_parts
+отправляемых частей плюс одна собираемая (ограниченная память).
+
+Проверки:
+    - каждая часть отправляется с Content-MD5 (B2 сверяет ее на своей стороне);
+    - число байт сверяется с Content-Length ответа и с ContentLength объекта после загрузки;
+    - по всему потоку считается SHA-256 (возвращается и пишется в лог).
+При ошибке multipart-загрузка отменяется (abort_multipart_upload), функция возвращает None.
+Файл меньше одной части загружается одним put_object.
+
+tee_path - дополнительно записать поток в локальный файл (кэш), без повторного чтения с диска.
+
+Настройки - секция STREAM_TRANSFER в config.json:
+    enabled, part_size_mib (>= 5 - минимум S3/B2), max_inflight_parts, tee_local, timeout_seconds.
+"""
+import base64
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+try:
+    from .logger import get_logger
+    from .downloader import get_download_session
+    logger = get_logger("stream_transfer")
+except ImportError:
+    from modules.logger import get_logger
+    from modules.downloader import get_download_session
+    logger = get_logger("stream_transfer")
+
+DEFAULT_SETTINGS = {
+    "enabled": True,
+    "part_size_mib": 8,
+    "max_inflight_parts": 2,
+    "tee_local": False,
+    "timeout_seconds": 60,
+}
+MIN_PART_SIZE = 5 * 1024 * 1024
+READ_CHUNK_SIZE = 256 * 1024
+
+
+def get_stream_transfer_settings(config) -> dict:
+    """Настройки STREAM_TRANSFER из config.json поверх значений по умолчанию."""
+    settings = dict(DEFAULT_SETTINGS)
+    try:
+        settings.update({k: v for k, v in (config.get("STREAM_TRANSFER", {}) or {}).items() if v is not None})
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось прочитать STREAM_TRANSFER из конфигурации: {e}. Используются значения по умолчанию.")
+    return settings
+
+
+def _content_md5(data: bytes) -> str:
+    return base64.b64encode(hashlib.md5(data).digest()).decode("ascii")
+
+
+class _MultipartWriter:
+    """Multipart-загрузка с отправкой частей в фоне и ограничением числа частей в полете."""
+
+    def __init__(self, s3_client, bucket_name: str, key: str, content_type: str, max_inflight: int):
+        self.s3 = s3_client
+        self.bucket = bucket_name
+        self.key = key
+        self.content_type = content_type
+        self.upload_id = None
+        self.parts = {}
+        self.first_part_started_at = None
+        self._slots = threading.BoundedSemaphore(max(1, max_inflight))
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_inflight), thread_name_prefix="b2_part")
+        self._futures = []
+
+    def _upload_part(self, number: int, data: bytes):
+        try:
+            if self.first_part_started_at is None:
+                self.first_part_started_at = time.perf_counter()
+            response = self.s3.upload_part(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, PartNumber=number,
+                                           Body=data, ContentMD5=_content_md5(data))
+            self.parts[number] = response["ETag"]
+        finally:
+            self._slots.release()
+
+    def submit(self, number: int, data: bytes):
+        if self.upload_id is None:
+            self.upload_id = self.s3.create_multipart_upload(Bucket=self.bucket, Key=self.key,
+                                                             ContentType=self.content_type)["UploadId"]
+        # Ждем свободный слот: скачивание притормаживает, если B2 не успевает (память ограничена)
+        self._slots.acquire()
+        failed = next((f for f in self._futures if f.done() and f.exception() is not None), None)
+        if failed is not None:
+            self._slots.release()
+            raise failed.exception()
+        self._futures.append(self._executor.submit(self._upload_part, number, data))
+
+    def complete(self):
+        for future in self._futures:
+            future.result()
+        self._executor.shutdown(wait=True)
+        parts = [{"PartNumber": number, "ETag": self.parts[number]} for number in sorted(self.parts)]
+        self.s3.complete_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                                          MultipartUpload={"Parts": parts})
+
+    def abort(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        if self.upload_id is not None:
+            try:
+                self.s3.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось отменить multipart-загрузку {self.key}: {e}")
+
+
+def stream_url_to_b2(url: str, s3_client, bucket_name: str, key: str, settings: dict | None = None,
+                     tee_path: str | None = None, content_type: str = "video/mp4",
+                     session: requests.Session | None = None) -> dict | None:
+    """
+    Передает тело ответа url в объект B2 key, не сохраняя его на диск (кроме tee_path).
+    Возвращает {"bytes", "sha256", "parts", "seconds", "upload_started_s"} или None при ошибке.
+    """
+    settings = dict(DEFAULT_SETTINGS, **(settings or {}))
+    part_size = max(MIN_PART_SIZE, int(float(settings["part_size_mib"]) * 1024 * 1024))
+    session = session or get_download_session()
+    writer = _MultipartWriter(s3_client, bucket_name, key, content_type, int(settings["max_inflight_parts"]))
+    sha256 = hashlib.sha256()
+    buffer = bytearray()
+    received, part_number = 0, 0
+    tee_file = None
+    started = time.perf_counter()
+    logger.info(f"📡 Потоковая передача {url[:60]}... -> {bucket_name}/{key} (части по {part_size // (1024 * 1024)} МиБ)")
+    try:
+        if tee_path:
+            os.makedirs(os.path.dirname(tee_path) or ".", exist_ok=True)
+            tee_file = open(f"{tee_path}.part", "wb")
+        with session.get(url, stream=True, timeout=float(settings["timeout_seconds"])) as response:
+            response.raise_for_status()
+            length = response.headers.get("Content-Length")
+            expected = int(length) if length and length.isdigit() else None
+            for chunk in response.iter_content(chunk_size=READ_CHUNK_SIZE):
+                if not chunk:
+                    continue
+                received += len(chunk)
+                sha256.update(chunk)
+                if tee_file:
+                    tee_file.write(chunk)
+                buffer.extend(chunk)
+                if len(buffer) >= part_size:
+                    part_number += 1
+                    writer.submit(part_number, bytes(buffer[:part_size]))
+                    del buffer[:part_size]
+        if expected is not None and received != expected:
+            raise IOError(f"получено {received} из {expected} байт")
+        if part_number == 0:
+            # Весь файл меньше одной части - обычный put_object
+            data = bytes(buffer)
+            s3_client.put_object(Bucket=bucket_name, Key=key, Body=data, ContentType=content_type, ContentMD5=_content_md5(data))
+        else:
+            if buffer:
+                part_number += 1
+                writer.submit(part_number, bytes(buffer))
+            buffer = bytearray()
+            writer.complete()
+        stored_size = s3_client.head_object(Bucket=bucket_name, Key=key).get("ContentLength")
+        if stored_size != received:
+            raise IOError(f"размер объекта в B2 {stored_size} не совпадает с переданным {received}")
+    except Exception as e:
+        logger.error(f"❌ Ошибка потоковой передачи {url[:60]} -> {key}: {e}")
+        writer.abort()
+        if tee_file:
+            tee_file.close()
+            os.remove(f"{tee_path}.part")
+        return None
+
+    if tee_file:
+        tee_file.close()
+        os.replace(f"{tee_path}.part", tee_path)
+    elapsed = time.perf_counter() - started
+    upload_started_s = (writer.first_part_started_at - started) if writer.first_part_started_at else None
+    result = {"bytes": received, "sha256": sha256.hexdigest(), "parts": max(part_number, 1),
+              "seconds": elapsed, "upload_started_s": upload_started_s}
+    logger.info(f"✅ Передано в B2 {key}: {received / (1024 * 1024):.1f} МиБ за {elapsed:.2f} c, частей {result['parts']}, "
+                f"sha256 {result['sha256'][:16]}...{f', загрузка начата через {upload_started_s:.2f} c' if upload_started_s is not None else ''}")
+    return result
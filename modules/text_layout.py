@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+# В файле modules/text_layout.py
+"""
+Разметка текста по измеренным ширинам глифов (заголовок utils.add_text_to_image, оба рендера
+сарказма в sarcasm_image_utils и подбор размера modules/font_fit.py).
+
+Раньше add_text_to_image_sarcasm оценивал число символов в строке по ширине одной буквы "W",
+переносил строки textwrap.wrap и для каждого пробного размера считал textbbox всего блока:
+с кириллицей строки получались рваными или вылезали за область.
+
+Теперь для каждого шрифта (FreeTypeFont из modules/font_registry.py - один объект на (путь, размер))
+кэшируются ширины (advance) символов и поправки кернинга пар; ширина строки считается
+арифметически как сумма ширин, перенос делается за один проход по словам с реальными ширинами.
+Высота блока - как у прежнего ImageDraw.multiline_textbbox: строки идут с шагом ImageDraw.multiline_text
+(высота "A" + spacing), верх и низ строки - крайние значения кэшированных вертикальных границ ее символов
+(font.getbbox(символ)), поэтому вертикальное центрирование текста не изменилось.
+"""
+import threading
+import weakref
+
+DEFAULT_SPACING = 4 # Как spacing по умолчанию у ImageDraw.text
+
+
+class TextMetrics:
+    """
+    Кэш ширин символов и кернинга пар для одного FreeTypeFont.
+    Шрифт хранится по слабой ссылке: метрики - значение WeakKeyDictionary с ключом-шрифтом, и сильная
+    ссылка на ключ не дала бы собрать ни шрифт, ни метрики после вытеснения шрифта из реестра.
+    """
+
+    def __init__(self, font):
+        self._font_ref = weakref.ref(font)
+        self._advances = {}
+        self._kerning = {}
+        self._extents = {}
+        self._glyph_a_bottom = font.getbbox("A")[3]
+
+    @property
+    def font(self):
+        font = self._font_ref()
+        if font is None:
+            raise ReferenceError("шрифт для TextMetrics уже освобожден")
+        return font
+
+    def advance(self, char: str) -> float:
+        width = self._advances.get(char)
+        if width is None:
+            width = self._advances[char] = self.font.getlength(char)
+        return width
+
+    def kerning(self, left: str, right: str) -> float:
+        """Поправка пары: ширина "ab" минус ширины "a" и "b" (0 для большинства пар)."""
+        pair = left + right
+        correction = self._kerning.get(pair)
+        if correction is None:
+            correction = self._kerning[pair] = self.font.getlength(pair) - self.advance(left) - self.advance(right)
+        return correction
+
+    def extent(self, char: str) -> tuple[int, int]:
+        """(верх, низ) bbox символа относительно верха строки, как у font.getbbox."""
+        bounds = self._extents.get(char)
+        if bounds is None:
+            bbox = self.font.getbbox(char)
+            bounds = self._extents[char] = (bbox[1], bbox[3])
+        return bounds
+
+    def line_extent(self, line: str) -> tuple[int, int]:
+        """(верх, низ) bbox строки: вертикальные границы глифов не зависят от их положения по горизонтали."""
+        if not line:
+            return self.extent("")
+        extents = [self.extent(char) for char in line]
+        return min(top for top, _ in extents), max(bottom for _, bottom in extents)
+
+    def line_width(self, line: str) -> float:
+        width, previous = 0.0, None
+        for char in line:
+            width += self.advance(char)
+            if previous is not None:
+                width += self.kerning(previous, char)
+            previous = char
+        return width
+
+    def joined_width(self, left: str, left_width: float, right: str, right_width: float, separator: str = " ") -> float:
+        """Ширина left + separator + right по уже известным ширинам частей."""
+        if not left:
+            return right_width
+        width = left_width + self.line_width(separator) + right_width
+        width += self.kerning(left[-1], separator[0]) + self.kerning(separator[-1], right[0])
+        return width
+
+    def line_pitch(self, spacing: int = DEFAULT_SPACING, stroke_width: int = 0) -> float:
+        """Расстояние между базовыми линиями строк, как в ImageDraw.multiline_text."""
+        return self._glyph_a_bottom + stroke_width + spacing
+
+    def block_size(self, lines, spacing: int = DEFAULT_SPACING) -> tuple[float, float]:
+        """
+        (ширина, высота) блока строк: ширина - самая длинная строка, высота - как у multiline_textbbox
+        (объединение bbox строк, сдвинутых на шаг строк).
+        """
+        if isinstance(lines, str):
+            lines = lines.split("\n")
+        if not lines:
+            return 0.0, 0.0
+        width = max(self.line_width(line) for line in lines)
+        pitch = self.line_pitch(spacing)
+        tops, bottoms = zip(*((index * pitch + top, index * pitch + bottom)
+                              for index, (top, bottom) in enumerate(map(self.line_extent, lines))))
+        height = max(bottoms) - min(tops)
+        return width, height
+
+    def _break_word(self, word: str, max_width: float) -> list[tuple[str, float]]:
+        """Слово шире max_width - на куски: сначала после дефисов, затем (если кусок все равно шире) по символам."""
+        pieces, piece, piece_width = [], "", 0.0
+        for part in filter(None, word.replace("-", "-\n").split("\n")):
+            part_width = self.line_width(part)
+            candidate_width = piece_width + part_width + (self.kerning(piece[-1], part[0]) if piece else 0.0)
+            if candidate_width <= max_width:
+                piece, piece_width = piece + part, candidate_width
+                continue
+            if piece:
+                pieces.append((piece, piece_width))
+            piece, piece_width = "", 0.0
+            if part_width <= max_width:
+                piece, piece_width = part, part_width
+                continue
+            for char in part:
+                char_width = self.advance(char) + (self.kerning(piece[-1], char) if piece else 0.0)
+                if piece and piece_width + char_width > max_width:
+                    pieces.append((piece, piece_width))
+                    piece, piece_width = char, self.advance(char)
+                else:
+                    piece, piece_width = piece + char, piece_width + char_width
+        if piece:
+            pieces.append((piece, piece_width))
+        return pieces
+
+    def wrap(self, text: str, max_width: float) -> list[str]:
+        """Жадный перенос по словам за один проход; существующие переносы строк сохраняются."""
+        lines = []
+        for paragraph in text.split("\n"):
+            line, line_width = "", 0.0
+            for word in paragraph.split():
+                word_width = self.line_width(word)
+                candidate_width = self.joined_width(line, line_width, word, word_width)
+                if candidate_width <= max_width:
+                    line = f"{line} {word}" if line else word
+                    line_width = candidate_width
+                    continue
+                if line:
+                    lines.append(line)
+                if word_width <= max_width:
+                    line, line_width = word, word_width
+                    continue
+                pieces = self._break_word(word, max_width)
+                lines.extend(piece for piece, _ in pieces[:-1])
+                line, line_width = pieces[-1]
+            lines.append(line)
+        return lines
+
+
+_metrics = weakref.WeakKeyDictionary()
+_metrics_lock = threading.Lock()
+
+
+def get_metrics(font) -> TextMetrics:
+    """TextMetrics для шрифта; живет, пока шрифт есть в реестре (или у вызывающего кода), и удаляется вместе с ним."""
+    with _metrics_lock:
+        metrics = _metrics.get(font)
+        if metrics is None:
+            metrics = _metrics[font] = TextMetrics(font)
+        return metrics
+
+
+def measure_text(font, text: str, spacing: int = DEFAULT_SPACING) -> tuple[float, float]:
+    """(ширина, высота) многострочного текста без растеризации bbox."""
+    return get_metrics(font).block_size(text, spacing)
+
+
+def wrap_text(font, text: str, max_width: float) -> str:
+    """Текст с переносами под max_width (строки через \\n)."""
+    return "\n".join(get_metrics(font).wrap(text, max_width))
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+# В файле modules/title_render.py
+"""
+Параметры и отрисовка изображения-заголовка для повторной (пакетной) перерисовки.
+
+generate_media рядом с 666/<ID>.png сохраняет в B2:
+    <ID>_title_base.png - выбранная картинка MJ без текста;
+    <ID>_title.json     - параметры отрисовки (текст после форматирования OpenAI, цвет, позиция,
+                          отступ, фокус и шрифт на момент генерации).
+По ним scripts/rerender_titles.py перерисовывает заголовки с новым шрифтом (FOCUS_FONT_MAPPING),
+дымкой или цветом без повторных запросов к Midjourney и OpenAI.
+
+render_title_job и init_render_worker - функции верхнего уровня, чтобы их можно было
+передать в ProcessPoolExecutor. init_render_worker строит в реестре процесса (modules/font_registry.py)
+шрифты всех размеров сетки подбора add_text_to_image (TITLE_FONT_SIZES), поэтому отрисовки
+в процессе не тратят время на ImageFont.truetype.
+"""
+import os
+import json
+import time
+from pathlib import Path
+
+try:
+    from .logger import get_logger
+    from .font_registry import get_font_registry
+    logger = get_logger("title_render")
+except ImportError:
+    from modules.logger import get_logger
+    from modules.font_registry import get_font_registry
+    logger = get_logger("title_render")
+
+TITLE_BASE_SUFFIX = "_title_base.png"
+TITLE_SPEC_SUFFIX = "_title.json"
+TITLE_SPEC_VERSION = 1
+DEFAULT_TEXT_COLOR = "#333333"
+# Сетка подбора размера add_text_to_image по умолчанию: initial_font_size 140 -> min_font_size 50, шаг 2
+TITLE_FONT_SIZES = tuple(range(140, 49, -2))
+
+
+def build_title_spec(text: str, text_color: str, position, padding: int, selected_focus,
+                     font_rel_path, haze_opacity: int, bg_blur_radius: float = 0, bg_opacity: int = 0) -> dict:
+    """Словарь параметров отрисовки заголовка (<ID>_title.json)."""
+    return {
+        "version": TITLE_SPEC_VERSION,
+        "text": text,
+        "text_color": text_color,
+        "position": list(position) if position else ["center", "center"],
+        "padding": int(padding),
+        "selected_focus": selected_focus,
+        "font_rel_path": font_rel_path,
+        "haze_opacity": int(haze_opacity),
+        "bg_blur_radius": bg_blur_radius,
+        "bg_opacity": int(bg_opacity),
+    }
+
+
+def save_title_spec(path, spec: dict) -> bool:
+    try:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(spec, f, ensure_ascii=False, indent=2)
+        return True
+    except (OSError, TypeError) as e:
+        logger.error(f"❌ Не удалось сохранить параметры заголовка {path}: {e}")
+        return False
+
+
+def default_title_spec(topic: str, selected_focus=None, haze_opacity: int = 128) -> dict:
+    """Параметры для группы без <ID>_title.json - как default_placement в generate_media."""
+    text = topic.split("\n")[0] if topic else "Текст отсутствует"
+    return build_title_spec(text, DEFAULT_TEXT_COLOR, ("center", "center"), 60, selected_focus, None, haze_opacity)
+
+
+def resolve_title_font(fonts_mapping: dict, selected_focus, base_dir) -> str | None:
+    """Абсолютный путь к шрифту фокуса из FOCUS_FONT_MAPPING (или "__default__"), если файл существует."""
+    for rel_path in (fonts_mapping.get(selected_focus) if isinstance(selected_focus, str) else None,
+                     fonts_mapping.get("__default__")):
+        if rel_path and (Path(base_dir) / rel_path).is_file():
+            return str(Path(base_dir) / rel_path)
+    return None
+
+
+def init_render_worker(font_paths=(), sizes=TITLE_FONT_SIZES):
+    """
+    Инициализатор процесса-обработчика: строит FreeTypeFont каждого шрифта font_paths для каждого
+    размера sizes. Кэш реестра процесса при необходимости увеличивается, чтобы прогретые шрифты
+    не вытеснялись друг другом.
+    """
+    registry = get_font_registry()
+    font_paths, sizes = list(font_paths), list(sizes)
+    registry.cache_size = max(registry.cache_size, len(font_paths) * len(sizes))
+    loaded = registry.preload(font_paths, sizes=sizes)
+    logger.info(f"🔤 Процесс {os.getpid()}: построено шрифтов {registry.stats()['fonts']} "
+                f"({loaded} файлов x {len(sizes)} размеров).")
+
+
+def render_title_job(job: dict) -> dict:
+    """
+    Отрисовывает один заголовок. job: generation_id, base_path, output_path, font_path, spec и
+    необязательные переопределения text_color / haze_opacity. Возвращает {"generation_id", "ok", "seconds", "error"}.
+    """
+    try:
+        from .utils import add_text_to_image
+    except ImportError:
+        from modules.utils import add_text_to_image
+    started = time.perf_counter()
+    spec = job["spec"]
+    result = {"generation_id": job["generation_id"], "ok": False, "seconds": 0.0, "error": None}
+    try:
+        result["ok"] = bool(add_text_to_image(
+            image_path_str=str(job["base_path"]), text=spec["text"], font_path_str=str(job["font_path"]),
+            output_path_str=str(job["output_path"]),
+            text_color_hex=job.get("text_color") or spec.get("text_color") or DEFAULT_TEXT_COLOR,
+            position=tuple(spec.get("position") or ("center", "center")), padding=int(spec.get("padding", 60)),
+            haze_opacity=int(job["haze_opacity"] if job.get("haze_opacity") is not None else spec.get("haze_opacity", 128)),
+            bg_blur_radius=spec.get("bg_blur_radius", 0), bg_opacity=int(spec.get("bg_opacity", 0)),
+            logger_instance=logger
+        ))
+        if not result["ok"]: result["error"] = "add_text_to_image вернула False"
+    except Exception as e:
+        result["error"] = str(e)
+    result["seconds"] = time.perf_counter() - started
+    return result
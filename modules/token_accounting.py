@@ -0,0 +1,440 @@
+# -*- coding: utf-8 -*-
+# В файле modules/token_accounting.py
+"""
+Учет токенов и задержек вызовов OpenAI по ключам промптов (prompt_config_key).
+
+- Оценка размера промпта до отправки (tiktoken, если установлен, иначе эвристика).
+- Фиксация фактических usage-полей ответа и времени вызова по каждому шагу. Вызовы без usage
+  (прерванный поток) учитываются отдельно: оценки не смешиваются с фактическими токенами.
+- Бюджеты промптов по шагам: обрезка списочных фрагментов ("* ...") при превышении.
+- Накопительный отчет по шагам между генерациями (хранится в B2).
+"""
+import re
+import time
+import logging
+import threading
+from datetime import datetime, timezone
+
+# --- Получение логгера ---
+try:
+    from .logger import get_logger
+    logger = get_logger("token_accounting")
+except ImportError:
+    try:
+        from modules.logger import get_logger
+        logger = get_logger("token_accounting")
+    except ImportError:
+        logger = logging.getLogger("token_accounting")
+        if not logger.hasHandlers():
+            logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+# --- Локальный токенизатор (опционально) ---
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    tiktoken = None
+    TIKTOKEN_AVAILABLE = False
+
+# Эвристика без tiktoken: латиница ~4 символа на токен, кириллица и прочее ~2.5
+ASCII_CHARS_PER_TOKEN = 4.0
+NON_ASCII_CHARS_PER_TOKEN = 2.5
+# Служебные токены на одно сообщение чата (роль, разделители)
+MESSAGE_OVERHEAD_TOKENS = 4
+# Оценка стоимости одной картинки для Vision (detail=auto/high для ~1024px; low = 85)
+VISION_IMAGE_TOKENS_ESTIMATE = {"low": 85, "high": 765, "auto": 765}
+# Минимум пунктов, которые оставляем в каждом списке при обрезке
+MIN_LIST_ITEMS_KEPT = 3
+DEFAULT_REPORT_PATH = "data/token_usage_report.json"
+DEFAULT_MAX_GENERATIONS_IN_REPORT = 50
+
+# Поля агрегатов по шагу, которые суммируются между запусками.
+# prompt_tokens/completion_tokens - только фактические usage; оценки - в estimated_* и calls_without_usage.
+SUMMED_STEP_FIELDS = ("calls", "failures", "prompt_tokens", "completion_tokens", "estimated_prompt_tokens",
+                      "estimated_completion_tokens", "calls_without_usage", "length_aborts")
+# Поля-максимумы: completion_chars_max - самый длинный успешный ответ шага (замер для границ длины потока)
+MAX_STEP_FIELDS = ("completion_chars_max",)
+
+_WEIGHT_RE = re.compile(r"\(Вес:\s*([0-9]+(?:\.[0-9]+)?)\)\s*$")
+
+_encoders = {}
+_records = []
+_records_lock = threading.Lock()
+
+
+def _get_encoder(model: str | None):
+    """Возвращает (и кэширует) кодировщик tiktoken для модели или None."""
+    if not TIKTOKEN_AVAILABLE:
+        return None
+    cache_key = model or "__default__"
+    if cache_key in _encoders:
+        return _encoders[cache_key]
+    encoder = None
+    try:
+        encoder = tiktoken.encoding_for_model(model) if model else None
+    except KeyError:
+        encoder = None
+    if encoder is None:
+        try:
+            encoding_name = "o200k_base" if model and ("4o" in model or model.startswith("o")) else "cl100k_base"
+            encoder = tiktoken.get_encoding(encoding_name)
+        except Exception as enc_err:
+            logger.warning(f"Не удалось загрузить кодировщик tiktoken для '{model}': {enc_err}. Используется эвристика.")
+            encoder = None
+    _encoders[cache_key] = encoder
+    return encoder
+
+
+def estimate_tokens(text: str, model: str | None = None) -> int:
+    """Оценивает количество токенов в строке (tiktoken или эвристика по символам)."""
+    if not text:
+        return 0
+    encoder = _get_encoder(model)
+    if encoder is not None:
+        try:
+            return len(encoder.encode(text, disallowed_special=()))
+        except Exception:
+            pass
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    other_chars = len(text) - ascii_chars
+    return int(ascii_chars / ASCII_CHARS_PER_TOKEN + other_chars / NON_ASCII_CHARS_PER_TOKEN) + 1
+
+
+def estimate_messages_tokens(messages: list, model: str | None = None) -> int:
+    """
+    Оценивает размер списка сообщений chat.completions до отправки.
+    Поддерживает content в виде строки и в виде списка частей (text / image_url).
+    """
+    total = 3  # затравка ответа ассистента
+    for message in messages or []:
+        total += MESSAGE_OVERHEAD_TOKENS
+        content = message.get("content") if isinstance(message, dict) else None
+        if isinstance(content, str):
+            total += estimate_tokens(content, model)
+        elif isinstance(content, list):
+            for part in content:
+                if not isinstance(part, dict):
+                    continue
+                if part.get("type") == "text":
+                    total += estimate_tokens(part.get("text", ""), model)
+                elif part.get("type") == "image_url":
+                    detail = (part.get("image_url") or {}).get("detail", "auto")
+                    total += VISION_IMAGE_TOKENS_ESTIMATE.get(detail, VISION_IMAGE_TOKENS_ESTIMATE["auto"])
+    return total
+
+
+def extract_usage(response) -> tuple[int | None, int | None]:
+    """Извлекает (prompt_tokens, completion_tokens) из ответа OpenAI (объект SDK или dict)."""
+    if response is None:
+        return None, None
+    usage = getattr(response, "usage", None)
+    if usage is None and isinstance(response, dict):
+        usage = response.get("usage")
+    if usage is None:
+        return None, None
+    if isinstance(usage, dict):
+        return usage.get("prompt_tokens"), usage.get("completion_tokens")
+    return getattr(usage, "prompt_tokens", None), getattr(usage, "completion_tokens", None)
+
+
+def _response_text(response) -> str | None:
+    """Текст первого варианта ответа chat.completions (объект SDK) или None."""
+    try:
+        return response.choices[0].message.content
+    except (AttributeError, IndexError, TypeError):
+        return None
+
+
+def record_openai_call(step_key: str, model: str, latency_s: float, estimated_prompt_tokens: int | None = None,
+                       response=None, success: bool | None = None, completion_text: str | None = None,
+                       abort_kind: str | None = None) -> dict:
+    """
+    Фиксирует один вызов OpenAI в журнале текущего процесса и пишет строку в лог.
+    Если success не передан, вызов считается успешным при наличии ответа.
+    completion_text: полученный текст (для потоковых вызовов без usage - оценка out-токенов).
+    abort_kind: вид досрочного прерывания потока (modules/json_stream.py), если он был.
+    """
+    prompt_tokens, completion_tokens = extract_usage(response)
+    if completion_text is None:
+        completion_text = _response_text(response)
+    completion_estimated = False
+    if completion_tokens is None and completion_text:
+        completion_tokens = estimate_tokens(completion_text, model)
+        completion_estimated = True
+    record = {
+        "step": step_key or "unknown",
+        "model": model,
+        "latency_s": round(float(latency_s), 3),
+        "estimated_prompt_tokens": estimated_prompt_tokens,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "completion_tokens_estimated": completion_estimated,
+        "completion_chars": len(completion_text) if completion_text else 0,
+        "abort": abort_kind,
+        "success": bool(response is not None) if success is None else bool(success),
+        "timestamp_utc": datetime.now(timezone.utc).isoformat(),
+    }
+    with _records_lock:
+        _records.append(record)
+    logger.info(f"📊 Токены [{record['step']}]: in={prompt_tokens if prompt_tokens is not None else '?'} "
+                f"(оценка {estimated_prompt_tokens if estimated_prompt_tokens is not None else '?'}), "
+                f"out={completion_tokens if completion_tokens is not None else '?'}{'~' if completion_estimated else ''}, "
+                f"время={record['latency_s']:.2f} c, успех={record['success']}")
+    return record
+
+
+def timed_openai_call(step_key: str, model: str, create_fn, request_params: dict):
+    """
+    Выполняет create_fn(**request_params) с замером времени и учетом токенов.
+    Исключения пробрасываются дальше; неудачный вызов тоже попадает в журнал.
+    """
+    estimated = estimate_messages_tokens(request_params.get("messages", []), model)
+    started = time.perf_counter()
+    response = None
+    try:
+        response = create_fn(**request_params)
+        return response
+    finally:
+        record_openai_call(step_key, model, time.perf_counter() - started,
+                           estimated_prompt_tokens=estimated, response=response)
+
+
+def get_session_records() -> list[dict]:
+    """Возвращает копию журнала вызовов текущего процесса."""
+    with _records_lock:
+        return list(_records)
+
+
+def reset_session_records():
+    """Очищает журнал вызовов текущего процесса."""
+    with _records_lock:
+        _records.clear()
+
+
+def _empty_step_summary() -> dict:
+    summary = {field: 0 for field in SUMMED_STEP_FIELDS + MAX_STEP_FIELDS}
+    summary.update({"latency_total_s": 0.0, "latency_max_s": 0.0})
+    return summary
+
+
+def summarize_records(records: list[dict]) -> dict:
+    """
+    Агрегирует записи по шагам: вызовы, ошибки, токены, задержки.
+    Оценка out-токенов (вызов без usage) идет в estimated_completion_tokens, а не в completion_tokens.
+    """
+    summary = {}
+    for rec in records:
+        step = summary.setdefault(rec.get("step", "unknown"), _empty_step_summary())
+        step["calls"] += 1
+        if not rec.get("success"):
+            step["failures"] += 1
+        if rec.get("prompt_tokens") is None:
+            step["calls_without_usage"] += 1
+        if rec.get("abort") == "length":
+            step["length_aborts"] += 1
+        elif rec.get("success"):
+            step["completion_chars_max"] = max(step["completion_chars_max"], rec.get("completion_chars") or 0)
+        step["prompt_tokens"] += rec.get("prompt_tokens") or 0
+        if rec.get("completion_tokens_estimated"):
+            step["estimated_completion_tokens"] += rec.get("completion_tokens") or 0
+        else:
+            step["completion_tokens"] += rec.get("completion_tokens") or 0
+        step["estimated_prompt_tokens"] += rec.get("estimated_prompt_tokens") or 0
+        latency = float(rec.get("latency_s") or 0.0)
+        step["latency_total_s"] = round(step["latency_total_s"] + latency, 3)
+        step["latency_max_s"] = round(max(step["latency_max_s"], latency), 3)
+    return summary
+
+
+def format_summary_table(steps_summary: dict) -> str:
+    """Форматирует агрегаты по шагам в текстовую таблицу для логов и консоли."""
+    if not steps_summary:
+        return "(нет данных о вызовах)"
+    header = (f"{'Шаг':<34} {'вызовы':>6} {'ошибки':>6} {'in':>8} {'out':>7} {'оценка':>8} {'без usage':>9} "
+              f"{'out~':>6} {'обрыв':>5} {'ср.время':>9} {'макс':>7}")
+    lines = [header, "-" * len(header)]
+    total_in = total_out = total_out_estimated = 0
+    for step_key in sorted(steps_summary):
+        s = steps_summary[step_key]
+        calls = s.get("calls", 0) or 0
+        avg_latency = (s.get("latency_total_s", 0.0) / calls) if calls else 0.0
+        total_in += s.get("prompt_tokens", 0) or 0
+        total_out += s.get("completion_tokens", 0) or 0
+        total_out_estimated += s.get("estimated_completion_tokens", 0) or 0
+        lines.append(f"{step_key:<34} {calls:>6} {s.get('failures', 0):>6} {s.get('prompt_tokens', 0):>8} "
+                     f"{s.get('completion_tokens', 0):>7} {s.get('estimated_prompt_tokens', 0):>8} "
+                     f"{s.get('calls_without_usage', 0):>9} {s.get('estimated_completion_tokens', 0):>6} "
+                     f"{s.get('length_aborts', 0):>5} "
+                     f"{avg_latency:>8.2f}c {s.get('latency_max_s', 0.0):>6.2f}c")
+    lines.append("-" * len(header))
+    lines.append(f"{'ИТОГО':<34} {'':>6} {'':>6} {total_in:>8} {total_out:>7} {'':>8} {'':>9} {total_out_estimated:>6}")
+    lines.append("in/out - фактические usage; без usage - вызовы без usage (их in не учтен), out~ - их оценка out; "
+                 "обрыв - прерывания потока по границе длины.")
+    return "\n".join(lines)
+
+
+def log_session_summary(logger_instance=None):
+    """Пишет в лог сводку по вызовам текущего процесса."""
+    log = logger_instance if logger_instance else logger
+    records = get_session_records()
+    if not records:
+        log.info("📊 Вызовов OpenAI в этом запуске не было.")
+        return
+    log.info("📊 Сводка токенов и задержек по шагам (текущий запуск):\n" + format_summary_table(summarize_records(records)))
+
+
+def merge_into_report(report: dict | None, records: list[dict], generation_id: str, script_name: str,
+                      max_generations: int = DEFAULT_MAX_GENERATIONS_IN_REPORT) -> dict:
+    """
+    Добавляет записи текущего запуска в накопительный отчет.
+    Отчет: {"updated_at", "steps": {ключ: агрегаты}, "generations": [последние N запусков]}.
+    """
+    report = report if isinstance(report, dict) else {}
+    steps_total = report.setdefault("steps", {})
+    generations = report.setdefault("generations", [])
+    run_summary = summarize_records(records)
+
+    for step_key, s in run_summary.items():
+        total = steps_total.setdefault(step_key, _empty_step_summary())
+        for field in SUMMED_STEP_FIELDS:
+            total[field] = (total.get(field) or 0) + (s.get(field) or 0)
+        for field in MAX_STEP_FIELDS:
+            total[field] = max(total.get(field) or 0, s.get(field) or 0)
+        total["latency_total_s"] = round((total.get("latency_total_s") or 0.0) + s["latency_total_s"], 3)
+        total["latency_max_s"] = round(max(total.get("latency_max_s") or 0.0, s["latency_max_s"]), 3)
+
+    generations.append({
+        "generation_id": generation_id,
+        "script": script_name,
+        "finished_at_utc": datetime.now(timezone.utc).isoformat(),
+        "steps": run_summary,
+    })
+    if max_generations and len(generations) > max_generations:
+        del generations[:len(generations) - max_generations]
+    report["updated_at"] = datetime.now(timezone.utc).isoformat()
+    return report
+
+
+def flush_usage_report(s3_client, bucket_name: str, generation_id: str, script_name: str, config=None,
+                       local_temp_path: str | None = None) -> bool:
+    """
+    Сливает журнал текущего процесса в накопительный отчет в B2 (TOKEN_ACCOUNTING.report_path)
+    и пишет сводку в лог. Возвращает True при успехе.
+    Запись - через TrackerStore.update (условный PUT по ETag): если отчет успел обновить другой
+    генератор, отчет перечитывается и записи сливаются заново, а не затирают чужой запуск.
+    """
+    log_session_summary()
+    records = get_session_records()
+    if not records:
+        return True
+    if config is not None and not config.get("TOKEN_ACCOUNTING.enabled", True):
+        return True
+    if not s3_client or not bucket_name:
+        logger.warning("B2 клиент или бакет недоступны, отчет по токенам не сохранен.")
+        return False
+    try:
+        from .tracker_store import TrackerStore
+        from .scratch import scratch_path
+    except ImportError:
+        from modules.tracker_store import TrackerStore
+        from modules.scratch import scratch_path
+
+    report_path = config.get("TOKEN_ACCOUNTING.report_path", DEFAULT_REPORT_PATH) if config else DEFAULT_REPORT_PATH
+    max_generations = int(config.get("TOKEN_ACCOUNTING.max_generations_in_report", DEFAULT_MAX_GENERATIONS_IN_REPORT)) \
+        if config else DEFAULT_MAX_GENERATIONS_IN_REPORT
+    if not local_temp_path:
+        local_temp_path = str(scratch_path(f"token_usage_temp_{datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S%f')}.json"))
+    try:
+        store = TrackerStore(s3_client, bucket_name, report_path, local_temp_path)
+        store.load()
+        if not isinstance(store.data, dict):
+            store.data = {}
+        report = store.update(lambda current: merge_into_report(current, records, generation_id, script_name,
+                                                                max_generations))
+        if report is None:
+            logger.error(f"❌ Не удалось сохранить отчет по токенам {report_path}.")
+            return False
+        reset_session_records()
+        logger.info(f"✅ Отчет по токенам обновлен: {report_path}")
+        return True
+    except Exception as e:
+        logger.error(f"❌ Ошибка обновления отчета по токенам: {e}", exc_info=True)
+        return False
+
+
+def get_prompt_budget(config, step_key: str) -> int | None:
+    """Возвращает бюджет (в токенах) для шага из TOKEN_ACCOUNTING.prompt_budgets или None."""
+    if config is None:
+        return None
+    budgets = config.get("TOKEN_ACCOUNTING.prompt_budgets", {}) or {}
+    budget = budgets.get(step_key, budgets.get("default"))
+    try:
+        return int(budget) if budget else None
+    except (TypeError, ValueError):
+        logger.warning(f"Некорректный бюджет промпта для '{step_key}': {budget}. Бюджет не применяется.")
+        return None
+
+
+def _pick_line_to_drop(lines: list[str]) -> int | None:
+    """Выбирает пункт списка для удаления: с минимальным весом, иначе последний."""
+    item_indexes = [i for i, line in enumerate(lines) if line.strip().startswith("*")]
+    if len(item_indexes) <= MIN_LIST_ITEMS_KEPT:
+        return None
+    weighted = []
+    for i in item_indexes:
+        match = _WEIGHT_RE.search(lines[i])
+        if match:
+            weighted.append((float(match.group(1)), -i))
+    if weighted:
+        return -min(weighted)[1]
+    return item_indexes[-1]
+
+
+def fit_prompt_to_budget(template: str, format_kwargs: dict, trimmable_keys: list[str], budget_tokens: int | None,
+                         model: str | None = None, step_key: str = "") -> str:
+    """
+    Собирает промпт template.format(**format_kwargs) и, если его оценка превышает budget_tokens,
+    по одному удаляет пункты из списочных фрагментов trimmable_keys (самый длинный список первым,
+    внутри списка - пункт с минимальным весом или последний), пока промпт не уложится в бюджет.
+    """
+    prompt = template.format(**format_kwargs)
+    if not budget_tokens:
+        return prompt
+    estimated = estimate_tokens(prompt, model)
+    if estimated <= budget_tokens:
+        return prompt
+
+    fragments = {k: str(format_kwargs[k]).split("\n") for k in trimmable_keys if k in format_kwargs}
+    dropped = 0
+    while estimated > budget_tokens:
+        candidates = sorted(fragments, key=lambda k: len(fragments[k]), reverse=True)
+        removed_line = None
+        removed_header = None
+        for key in candidates:
+            idx = _pick_line_to_drop(fragments[key])
+            if idx is None:
+                continue
+            removed_line = fragments[key].pop(idx)
+            # Убираем осиротевший заголовок категории, если под ним не осталось пунктов
+            if idx > 0 and idx - 1 < len(fragments[key]) and not fragments[key][idx - 1].strip().startswith("*") \
+                    and (idx >= len(fragments[key]) or not fragments[key][idx].strip().startswith("*")):
+                removed_header = fragments[key].pop(idx - 1)
+            break
+        if removed_line is None:
+            break
+        dropped += 1
+        estimated -= estimate_tokens(removed_line + "\n", model)
+        if removed_header is not None:
+            estimated -= estimate_tokens(removed_header + "\n", model)
+
+    trimmed_kwargs = dict(format_kwargs)
+    trimmed_kwargs.update({k: "\n".join(v) for k, v in fragments.items()})
+    prompt = template.format(**trimmed_kwargs)
+    estimated = estimate_tokens(prompt, model)
+    if estimated > budget_tokens:
+        logger.warning(f"⚠️ Промпт '{step_key}' превышает бюджет ({estimated} > {budget_tokens} токенов) "
+                       f"даже после удаления {dropped} пунктов списков.")
+    else:
+        logger.info(f"✂️ Промпт '{step_key}' уложен в бюджет {budget_tokens} токенов: удалено пунктов списков: {dropped}, "
+                    f"оценка {estimated}.")
+    return prompt
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+# В файле modules/topic_index.py
+"""
+Индекс всех исторических тем для отсева почти-повторов до запуска цепочки генерации.
+
+Трекер тем хранит только 5 последних ярлыков на фокус, поэтому generate_topic может повторить
+старую тему. Индекс хранит MinHash-сигнатуры (символьные шинглы) всех тем и LSH-корзины по полосам
+сигнатуры; проверка кандидата - хеширование шинглов + несколько словарных поисков + сравнение
+сигнатур кандидатов (доли миллисекунды).
+
+Хранение в B2 (data/topic_index.json): список тем + матрица сигнатур uint32 одной base64-строкой.
+Запись - через TrackerStore (условный PUT по ETag), поэтому параллельные генераторы не теряют темы.
+Корзины LSH не хранятся, а строятся при загрузке.
+"""
+import base64
+import re
+import random
+import zlib
+
+try:
+    from .logger import get_logger
+    from .tracker_store import TrackerStore
+    logger = get_logger("topic_index")
+except ImportError:
+    from modules.logger import get_logger
+    from modules.tracker_store import TrackerStore
+    logger = get_logger("topic_index")
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+INDEX_VERSION = 1
+MERSENNE_PRIME = (1 << 31) - 1
+DEFAULT_NUM_PERM = 96
+DEFAULT_BANDS = 24
+DEFAULT_SHINGLE_SIZE = 3
+DEFAULT_SIMILARITY_THRESHOLD = 0.6
+_NON_WORD_RE = re.compile(r"[^\w\s]+", re.UNICODE)
+_SPACES_RE = re.compile(r"\s+")
+
+
+def normalize_topic(text: str) -> str:
+    """Нижний регистр, ё -> е, без пунктуации и лишних пробелов."""
+    text = (text or "").lower().replace("ё", "е")
+    return _SPACES_RE.sub(" ", _NON_WORD_RE.sub(" ", text)).strip()
+
+
+class TopicIndex:
+    """
+    MinHash/LSH-индекс тем с хранением в B2.
+
+    Args:
+        s3_client, bucket_name, remote_key, local_path: как у TrackerStore.
+        num_perm: длина сигнатуры; bands: число LSH-полос (num_perm должен делиться на bands).
+        shingle_size: длина символьного шингла.
+        similarity_threshold: оценка Жаккара, начиная с которой тема считается повтором.
+    """
+
+    def __init__(self, s3_client, bucket_name: str, remote_key: str, local_path,
+                 num_perm: int = DEFAULT_NUM_PERM, bands: int = DEFAULT_BANDS,
+                 shingle_size: int = DEFAULT_SHINGLE_SIZE,
+                 similarity_threshold: float = DEFAULT_SIMILARITY_THRESHOLD, seed: int = 1):
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) должен делиться на bands ({bands}).")
+        self.store = TrackerStore(s3_client, bucket_name, remote_key, local_path)
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.similarity_threshold = similarity_threshold
+        self.seed = seed
+        self.enabled = np is not None
+        self._pending = [] # Добавленные, но еще не записанные в B2 темы (переживают перестроение индекса)
+        if not self.enabled:
+            logger.warning("⚠️ numpy не установлен, индекс повторов тем отключен.")
+            return
+        rng = random.Random(seed)
+        self._a = np.array([rng.randrange(1, MERSENNE_PRIME) for _ in range(num_perm)], dtype=np.uint64)
+        self._b = np.array([rng.randrange(0, MERSENNE_PRIME) for _ in range(num_perm)], dtype=np.uint64)
+        self._reset()
+
+    def _reset(self):
+        """Очищает структуры индекса; несохраненные темы (_pending) не трогает."""
+        self.topics = []
+        self.signatures = np.empty((0, self.num_perm), dtype=np.uint32)
+        self._buckets = {}
+        self._exact = {}
+
+    def __len__(self):
+        return len(self.topics) if self.enabled else 0
+
+    # --- MinHash ---
+    def _shingle_hashes(self, normalized: str):
+        k = self.shingle_size
+        if len(normalized) <= k:
+            shingles = {normalized}
+        else:
+            shingles = {normalized[i:i + k] for i in range(len(normalized) - k + 1)}
+        return np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+
+    def signature(self, text: str):
+        """MinHash-сигнатура темы (uint32[num_perm])."""
+        hashes = self._shingle_hashes(normalize_topic(text))
+        permuted = (np.outer(hashes, self._a) + self._b) % MERSENNE_PRIME
+        return permuted.min(axis=0).astype(np.uint32)
+
+    def _band_keys(self, signature):
+        rows = self.rows
+        return [(band, signature[band * rows:(band + 1) * rows].tobytes()) for band in range(self.bands)]
+
+    def _index_rows(self, start: int):
+        """Добавляет темы с номерами от start в словарь точных совпадений и LSH-корзины."""
+        for topic_id in range(start, len(self.topics)):
+            self._exact.setdefault(normalize_topic(self.topics[topic_id]), topic_id)
+            for key in self._band_keys(self.signatures[topic_id]):
+                self._buckets.setdefault(key, []).append(topic_id)
+
+    def _insert_many(self, topics: list[str], signatures: list):
+        if not topics:
+            return
+        start = len(self.topics)
+        self.topics.extend(topics)
+        self.signatures = np.vstack([self.signatures] + [s[None, :] for s in signatures])
+        self._index_rows(start)
+
+    # --- Загрузка/сериализация ---
+    def _serialize(self, data: dict):
+        data["version"] = INDEX_VERSION
+        data["num_perm"] = self.num_perm
+        data["shingle_size"] = self.shingle_size
+        data["seed"] = self.seed
+        data["topics"] = list(self.topics)
+        data["signatures"] = base64.b64encode(np.ascontiguousarray(self.signatures).tobytes()).decode("ascii")
+
+    def _build(self, data: dict | None):
+        self._reset()
+        if not data:
+            return
+        topics = [t for t in data.get("topics", []) if isinstance(t, str)]
+        same_params = (data.get("num_perm") == self.num_perm and data.get("shingle_size") == self.shingle_size
+                       and data.get("seed") == self.seed)
+        signatures = None
+        if same_params and data.get("signatures"):
+            raw = np.frombuffer(base64.b64decode(data["signatures"]), dtype=np.uint32)
+            if raw.size == len(topics) * self.num_perm:
+                signatures = raw.reshape(len(topics), self.num_perm)
+        if signatures is None and topics:
+            # Параметры MinHash изменились в конфиге - пересчитываем сигнатуры
+            logger.info(f"Пересчет сигнатур индекса тем ({len(topics)} тем).")
+            signatures = np.vstack([self.signature(t) for t in topics])
+        self.topics = topics
+        self.signatures = signatures if signatures is not None else self.signatures
+        self._index_rows(0)
+
+    def load(self) -> int:
+        """Загружает индекс из B2 (условно, как трекер). Возвращает число тем."""
+        if not self.enabled:
+            return 0
+        self._build(self.store.load())
+        self._insert_many([t for t, _ in self._pending], [s for _, s in self._pending])
+        logger.info(f"✅ Индекс тем загружен: {len(self.topics)} тем.")
+        return len(self.topics)
+
+    # --- Запросы ---
+    def find_duplicate(self, text: str):
+        """
+        Ищет почти-повтор темы. Возвращает (найденная тема, оценка сходства) или None.
+        """
+        if not self.enabled or not self.topics or not text:
+            return None
+        exact_id = self._exact.get(normalize_topic(text))
+        if exact_id is not None:
+            return self.topics[exact_id], 1.0
+        signature = self.signature(text)
+        candidates = set()
+        for key in self._band_keys(signature):
+            candidates.update(self._buckets.get(key, ()))
+        if not candidates:
+            return None
+        candidate_ids = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+        similarity = (self.signatures[candidate_ids] == signature).mean(axis=1)
+        best = int(similarity.argmax())
+        if similarity[best] >= self.similarity_threshold:
+            return self.topics[int(candidate_ids[best])], float(similarity[best])
+        return None
+
+    def add(self, topic: str) -> bool:
+        """Добавляет тему в индекс в памяти (запись в B2 - save). False, если такая тема уже есть."""
+        return self.add_many([topic]) == 1
+
+    def add_many(self, topics: list[str]) -> int:
+        """Добавляет темы пакетом (первичное наполнение индекса). Возвращает число новых тем."""
+        if not self.enabled:
+            return 0
+        new_topics, seen = [], set()
+        for topic in topics:
+            normalized = normalize_topic(topic) if isinstance(topic, str) else ""
+            if normalized and normalized not in self._exact and normalized not in seen:
+                seen.add(normalized)
+                new_topics.append(topic)
+        signatures = [self.signature(t) for t in new_topics]
+        self._insert_many(new_topics, signatures)
+        self._pending.extend(zip(new_topics, signatures))
+        return len(new_topics)
+
+    def save(self) -> bool:
+        """Записывает добавленные темы в B2; при конфликте темы добавляются к свежей версии индекса."""
+        if not self.enabled or not self._pending:
+            return True
+        pending = list(self._pending)
+
+        def merge_pending(data):
+            # data - текущая версия из B2 (после конфликта - перечитанная): добавляем к ней свои темы
+            self._build(data)
+            fresh = [(t, s) for t, s in pending if normalize_topic(t) not in self._exact]
+            self._insert_many([t for t, _ in fresh], [s for _, s in fresh])
+            self._serialize(data)
+
+        if self.store.data is None:
+            self.store.data = {}
+        saved = self.store.update(merge_pending) is not None
+        if saved:
+            self._pending = []
+            logger.info(f"✅ Индекс тем записан в B2: {len(self.topics)} тем (+{len(pending)}).")
+        return saved
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+# В файле modules/tracker_store.py
+"""
+Хранилище трекера тем (topics_tracker.json) в B2 с условными запросами.
+
+- Трекер держится в памяти; загрузка - get_object с If-None-Match по сохраненному ETag
+  (304 - локальная копия актуальна, тело не скачивается).
+- Запись - put_object с If-Match (или If-None-Match: * для нового объекта). Если трекер
+  успел изменить другой генератор (412), трекер перечитывается и изменение применяется заново,
+  поэтому параллельные генераторы не затирают историю фокусов друг друга. Если условная запись
+  не поддерживается (старый botocore или ответ B2 NotImplemented/InvalidArgument/501), трекер
+  пишется безусловно, как раньше.
+- Локальная копия и ее ETag (файл <путь>.etag) служат кэшем между запусками; ETag сохраняется
+  только вместе с успешной записью в B2. Без клиента B2 трекер пишется только локально и без
+  ETag, поэтому при следующей загрузке версия из B2 скачивается целиком.
+"""
+import json
+import os
+
+try:
+    from .logger import get_logger
+    logger = get_logger("tracker_store")
+except ImportError:
+    from modules.logger import get_logger
+    logger = get_logger("tracker_store")
+
+try:
+    from botocore.exceptions import ClientError, ParamValidationError
+except ImportError:
+    ClientError = Exception
+
+    class ParamValidationError(Exception):
+        """Заглушка имени при отсутствии botocore (исключение никогда не выбрасывается)."""
+
+NOT_MODIFIED_CODES = ('304', 'NotModified')
+NOT_FOUND_CODES = ('404', 'NoSuchKey', 'NotFound')
+CONFLICT_CODES = ('412', 'PreconditionFailed', '409', 'ConditionalRequestConflict')
+CONDITIONAL_UNSUPPORTED_CODES = ('501', 'NotImplemented', 'InvalidArgument')
+DEFAULT_MAX_UPDATE_ATTEMPTS = 3
+
+
+def _error_code(error) -> str | None:
+    response = getattr(error, 'response', None) or {}
+    code = response.get('Error', {}).get('Code')
+    if code is None:
+        status = response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+        code = str(status) if status else None
+    return code
+
+
+class TrackerConflict(Exception):
+    """Условная запись отклонена: объект в B2 изменен другим процессом."""
+
+
+class TrackerStore:
+    """
+    Трекер в памяти + условная синхронизация с B2.
+
+    Args:
+        s3_client: клиент boto3 (может быть None - тогда работа только с локальной копией).
+        bucket_name: бакет B2.
+        remote_key: ключ трекера в бакете (например, data/topics_tracker.json).
+        local_path: путь локальной копии (кэш между запусками).
+    """
+
+    def __init__(self, s3_client, bucket_name: str, remote_key: str, local_path):
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.remote_key = remote_key
+        self.local_path = str(local_path)
+        self.etag_path = f"{self.local_path}.etag"
+        self.data = None
+        self.etag = None
+        self.exists_remote = None
+
+    # --- Локальный кэш ---
+    def _load_local(self) -> bool:
+        if not os.path.isfile(self.local_path):
+            return False
+        try:
+            with open(self.local_path, 'r', encoding='utf-8') as f:
+                self.data = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"⚠️ Локальная копия трекера {self.local_path} не читается: {e}")
+            self.data = None
+            return False
+        self.etag = None
+        if os.path.isfile(self.etag_path):
+            try:
+                with open(self.etag_path, 'r', encoding='utf-8') as f:
+                    self.etag = f.read().strip() or None
+            except OSError:
+                self.etag = None
+        return True
+
+    def _save_local(self):
+        try:
+            os.makedirs(os.path.dirname(self.local_path) or '.', exist_ok=True)
+            with open(self.local_path, 'w', encoding='utf-8') as f:
+                json.dump(self.data, f, ensure_ascii=False, indent=4)
+            if self.etag:
+                with open(self.etag_path, 'w', encoding='utf-8') as f:
+                    f.write(self.etag)
+            elif os.path.exists(self.etag_path):
+                os.remove(self.etag_path)
+        except OSError as e:
+            logger.warning(f"⚠️ Не удалось сохранить локальную копию трекера {self.local_path}: {e}")
+
+    # --- B2 ---
+    def load(self):
+        """
+        Актуализирует трекер из B2 и возвращает его (None, если трекера нет ни в B2, ни локально).
+        Без изменений в B2 (304) тело не скачивается.
+        """
+        if self.data is None:
+            self._load_local()
+        if not self.s3_client:
+            logger.warning("⚠️ B2 клиент недоступен, используется локальная копия трекера.")
+            return self.data
+
+        request = {"Bucket": self.bucket_name, "Key": self.remote_key}
+        if self.data is not None and self.etag:
+            request["IfNoneMatch"] = self.etag
+        try:
+            response = self.s3_client.get_object(**request)
+        except ClientError as e:
+            code = _error_code(e)
+            if code in NOT_MODIFIED_CODES:
+                self.exists_remote = True
+                logger.info(f"✅ Трекер {self.remote_key} не изменился (ETag {self.etag}), загрузка пропущена.")
+                return self.data
+            if code in NOT_FOUND_CODES:
+                self.exists_remote = False
+                self.etag = None
+                logger.warning(f"⚠️ {self.remote_key} не найден в B2.")
+                return self.data
+            logger.error(f"⚠️ Ошибка B2 при загрузке трекера: {e}")
+            return self.data
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось загрузить трекер из B2: {e}")
+            return self.data
+
+        try:
+            body = response["Body"].read()
+            self.data = json.loads(body.decode('utf-8'))
+        except (ValueError, UnicodeDecodeError) as e:
+            logger.error(f"❌ Ошибка JSON в трекере {self.remote_key} из B2: {e}")
+            return self.data
+        self.etag = response.get("ETag")
+        self.exists_remote = True
+        self._save_local()
+        logger.info(f"✅ Загружен {self.remote_key} из B2 ({len(body)} байт, ETag {self.etag}).")
+        return self.data
+
+    def save(self, data=None) -> bool:
+        """
+        Условно записывает трекер в B2. Выбрасывает TrackerConflict, если объект изменен другим процессом.
+        Возвращает False при прочих ошибках записи.
+        """
+        if data is not None:
+            self.data = data
+        if not self.s3_client:
+            # Локальное содержимое больше не соответствует ни одной версии в B2 - ETag сбрасываем
+            self.etag = None
+            self._save_local()
+            logger.warning("B2 клиент недоступен, трекер сохранен только локально.")
+            return False
+
+        body = json.dumps(self.data, ensure_ascii=False, indent=4).encode('utf-8')
+        request = {"Bucket": self.bucket_name, "Key": self.remote_key, "Body": body,
+                   "ContentType": "application/json"}
+        if self.etag:
+            request["IfMatch"] = self.etag
+        elif self.exists_remote is False:
+            request["IfNoneMatch"] = "*"
+        try:
+            response = self.s3_client.put_object(**request)
+        except ParamValidationError as e:
+            # Старый botocore без условной записи - пишем безусловно, как раньше
+            response = self._put_unconditional(request, f"не поддерживается клиентом ({e})")
+        except ClientError as e:
+            code = _error_code(e)
+            if code in CONFLICT_CODES:
+                raise TrackerConflict(f"{self.remote_key} изменен другим процессом") from e
+            if code in CONDITIONAL_UNSUPPORTED_CODES and ("IfMatch" in request or "IfNoneMatch" in request):
+                response = self._put_unconditional(request, f"отклонена B2 ({code})")
+            else:
+                logger.error(f"⚠️ Не удалось загрузить трекер {self.remote_key} в B2: {e}")
+                return False
+        except Exception as e:
+            logger.error(f"⚠️ Не удалось загрузить трекер {self.remote_key} в B2: {e}")
+            return False
+        if response is None:
+            return False
+
+        self.etag = response.get("ETag") or None
+        self.exists_remote = True
+        self._save_local()
+        logger.info(f"✅ {self.remote_key} синхронизирован с B2 (ETag {self.etag}).")
+        return True
+
+    def _put_unconditional(self, request: dict, reason: str):
+        """Безусловная запись (без If-Match/If-None-Match). Возвращает ответ put_object или None."""
+        logger.warning(f"⚠️ Условная запись трекера {reason}, запись без проверки.")
+        request = {k: v for k, v in request.items() if k not in ("IfMatch", "IfNoneMatch")}
+        try:
+            return self.s3_client.put_object(**request)
+        except Exception as put_err:
+            logger.error(f"⚠️ Не удалось загрузить трекер {self.remote_key} в B2: {put_err}")
+            return None
+
+    def update(self, mutator, max_attempts: int = DEFAULT_MAX_UPDATE_ATTEMPTS):
+        """
+        Применяет mutator(tracker) и записывает результат. При конфликте трекер перечитывается
+        из B2 и mutator применяется к свежей версии (до max_attempts попыток).
+        Возвращает записанный трекер (после конфликта - другой объект, чем до вызова) или None.
+        """
+        for attempt in range(1, max_attempts + 1):
+            if self.data is None:
+                self.load()
+            if self.data is None:
+                logger.error("❌ Трекер не загружен, обновление невозможно.")
+                return None
+            mutator(self.data)
+            try:
+                return self.data if self.save() else None
+            except TrackerConflict as conflict:
+                logger.warning(f"⚠️ Конфликт записи трекера (попытка {attempt}/{max_attempts}): {conflict}. Перечитываем...")
+                self.data = None
+                self.etag = None
+                self.load()
+        logger.error(f"❌ Не удалось записать трекер после {max_attempts} попыток из-за конфликтов.")
+        return None
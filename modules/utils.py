@@ -1,12 +1,10 @@
 # -*- coding: utf-8 -*-
 # В файле modules/utils.py
-import io
 import os
 import json
 import logging
 import time
 from pathlib import Path
-import requests
 import shutil
 from datetime import datetime, timezone
 
@@ -27,6 +25,24 @@ except ImportError:
             logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
             logger.warning("Кастомный логгер не найден, используется стандартный logging.")
 
+# --- Загрузчик с общим пулом соединений ---
+try:
+    from .downloader import download_to_file
+except ImportError:
+    from modules.downloader import download_to_file
+
+# --- Подбор размера шрифта (двоичный поиск по сетке размеров) и общий реестр шрифтов ---
+try:
+    from .font_fit import fit_font_size
+    from .font_registry import get_font
+    from .text_layout import measure_text
+    from .compositing import apply_haze, apply_text_background
+except ImportError:
+    from modules.font_fit import fit_font_size
+    from modules.font_registry import get_font
+    from modules.text_layout import measure_text
+    from modules.compositing import apply_haze, apply_text_background
+
 # --- Исключения BotoCore ---
 try:
     from botocore.exceptions import ClientError, NoCredentialsError
@@ -167,40 +183,29 @@ def save_b2_json(s3_client, bucket_name, remote_path, local_temp_path, data):
              try: os.remove(local_temp_path); logger.debug(f"Удален временный файл: {local_temp_path}")
              except OSError as remove_err: logger.warning(f"Не удалось удалить временный файл {local_temp_path}: {remove_err}")
 
-def download_file(url, local_path_str, stream=False, timeout=30):
-    """Скачивает файл по URL."""
+def download_file(url, local_path_str, timeout=None):
+    """
+    Скачивает файл по URL через общий пул соединений (modules/downloader.py):
+    переиспользование соединений, потоковая запись, повторы и докачка по Range.
+    timeout=None - DOWNLOADER.timeout_seconds из config.json.
+    """
     logger.info(f"Загрузка файла с {url} в {local_path_str}...")
     try:
         ensure_directory_exists(local_path_str)
-        with requests.get(url, stream=stream, timeout=timeout) as r:
-            r.raise_for_status()
-            with open(local_path_str, 'wb') as f:
-                chunk_size = 8192 if stream else None
-                for chunk in r.iter_content(chunk_size=chunk_size):
-                    f.write(chunk)
-        logger.info(f"✅ Файл успешно сохранен: {local_path_str}")
-        return True
-    except requests.exceptions.Timeout:
-        logger.error(f"❌ Таймаут ({timeout} сек) при скачивании {url}")
-        return False
-    except requests.exceptions.RequestException as e:
-        logger.error(f"❌ Ошибка скачивания {url}: {e}")
-        if e.response is not None:
-             logger.error(f"    Статус код: {e.response.status_code}, Ответ: {e.response.text[:200]}")
-        return False
+        return download_to_file(url, local_path_str, timeout=timeout)
     except Exception as e:
         logger.error(f"❌ Неизвестная ошибка при скачивании {url}: {e}", exc_info=True)
         return False
 
-def download_image(url, local_path_str, timeout=30):
+def download_image(url, local_path_str, timeout=None):
     """Скачивает изображение."""
     logger.info(f"Загрузка изображения с {url} в {local_path_str}...")
-    return download_file(url, local_path_str, stream=True, timeout=timeout)
+    return download_file(url, local_path_str, timeout=timeout)
 
 def download_video(url, local_path_str, timeout=120):
     """Скачивает видео."""
     logger.info(f"Загрузка видео с {url} в {local_path_str}...")
-    return download_file(url, local_path_str, stream=True, timeout=timeout)
+    return download_file(url, local_path_str, timeout=timeout)
 
 def upload_to_b2(s3_client, bucket_name, target_folder, local_file_path_str, b2_filename_with_ext):
     """
@@ -446,12 +451,14 @@ def add_text_to_image(
     target_width_fraction: float = 0.92,
     initial_font_size: int = 140,
     min_font_size: int = 50,
-    min_font_size_multiline: int = 60
+    min_font_size_multiline: int = 60,
+    font_fit_strategy: str = "guess"
     ):
     """
     Наносит текст на изображение с автоподбором размера шрифта,
     добавляя белую "дымку" и обводку текста.
     Добавлено логирование получаемого цвета.
+    Размер подбирается modules/font_fit.py (font_fit_strategy: "guess", "binary" или прежний "linear").
     """
     # Получаем логгер
     log = logger_instance if logger_instance else logging.getLogger("utils_add_text") # Используем стандартный, если logger не передан
@@ -487,8 +494,8 @@ def add_text_to_image(
         # Добавление белой "дымки" (haze)
         if haze_opacity > 0:
             log.info(f"Добавление белой дымки (прозрачность: {haze_opacity})...")
-            haze_layer = Image.new('RGBA', img.size, (255, 255, 255, haze_opacity))
-            img = Image.alpha_composite(img, haze_layer)
+            # Без полнокадрового слоя: одна табличная операция (modules/compositing.py)
+            img = apply_haze(img, haze_opacity)
             log.debug("Белая дымка добавлена.")
         else:
             log.debug("Дымка отключена (haze_opacity=0).")
@@ -508,40 +515,21 @@ def add_text_to_image(
         max_text_width = img_width * target_width_fraction
         log.debug(f"Целевая ширина текста: {max_text_width:.0f}")
 
-        font_bytes = None
         try:
-            log.debug(f"Чтение файла шрифта в память: {font_path.name}")
-            with open(font_path, 'rb') as f_font: font_bytes = f_font.read()
-            log.debug(f"Файл шрифта прочитан, размер: {len(font_bytes)} байт.")
-        except Exception as read_font_err:
-             log.error(f"Ошибка чтения файла шрифта '{font_path}': {read_font_err}", exc_info=True); return False
-
-        while current_font_size >= current_min_font_size:
-            try:
-                log.debug(f"Пробуем размер шрифта: {current_font_size}")
-                font = ImageFont.truetype(io.BytesIO(font_bytes), current_font_size)
-                log.debug("Шрифт загружен для текущего размера.")
-                bbox_multiline = draw.textbbox((0, 0), text, font=font)
-                text_width = bbox_multiline[2] - bbox_multiline[0]
-                text_height = bbox_multiline[3] - bbox_multiline[1]
-                log.debug(f"Размер {current_font_size}: Ширина={text_width:.0f}, Высота={text_height:.0f}")
-                if text_width <= max_text_width:
-                    log.info(f"Найден подходящий размер шрифта: {current_font_size}")
-                    break
-                current_font_size -= 2
-            except Exception as size_calc_err:
-                log.error(f"Ошибка при расчете размера для шрифта {current_font_size}: {size_calc_err}", exc_info=True)
-                current_font_size -= 2
-                if current_font_size < current_min_font_size:
-                    log.error("Не удалось подобрать размер шрифта."); return False
-
+            fit = fit_font_size(str(font_path), text, max_text_width, current_font_size, current_min_font_size,
+                                step=2, strategy=font_fit_strategy)
+        except Exception as size_calc_err:
+            log.error(f"Ошибка при подборе размера шрифта: {size_calc_err}", exc_info=True); return False
+        log.info(f"Подбор шрифта ({font_fit_strategy}): {fit['constructions']} построений за {fit['seconds'] * 1000:.1f} мс.")
+        if fit["fits"]:
+            font, current_font_size = fit["font"], fit["size"]
+            text_width, text_height = fit["width"], fit["height"]
+            log.info(f"Найден подходящий размер шрифта: {current_font_size}")
         else:
             log.warning(f"Не удалось вместить текст в {target_width_fraction*100:.0f}% ширины. Используется минимальный размер {current_min_font_size}.")
             try:
-                font = ImageFont.truetype(io.BytesIO(font_bytes), current_min_font_size)
-                bbox_multiline = draw.textbbox((0, 0), text, font=font)
-                text_width = bbox_multiline[2] - bbox_multiline[0]
-                text_height = bbox_multiline[3] - bbox_multiline[1]
+                font = get_font(font_path, current_min_font_size)
+                text_width, text_height = measure_text(font, text)
                 current_font_size = current_min_font_size
             except Exception as min_font_err:
                 log.error(f"Ошибка при загрузке/расчете минимального шрифта {current_min_font_size}: {min_font_err}", exc_info=True); return False
@@ -549,12 +537,10 @@ def add_text_to_image(
         final_font_size = current_font_size
         log.debug(f"Финальный размер шрифта: {final_font_size}")
 
-        # Расчет финальных размеров и позиции
+        # Расчет финальных размеров и позиции (по ширинам глифов, modules/text_layout.py)
         log.debug("Расчет финальных размеров и позиции...")
         try:
-            bbox_multiline = draw.textbbox((0, 0), text, font=font)
-            text_width = bbox_multiline[2] - bbox_multiline[0]
-            text_height = bbox_multiline[3] - bbox_multiline[1]
+            text_width, text_height = measure_text(font, text)
             log.debug(f"Финальные размеры текста: Ширина={text_width:.0f}, Высота={text_height:.0f}")
         except Exception as final_size_err:
              log.error(f"Ошибка при расчете финального размера текста: {final_size_err}", exc_info=True); return False
@@ -572,50 +558,18 @@ def add_text_to_image(
 
         # Добавление подложки/размытия (если нужно)
         if bg_blur_radius > 0 or bg_opacity > 0:
-            # ... (код подложки остается прежним) ...
             log.info("Добавление эффектов фона под текстом...")
             log.debug(f"Параметры фона: blur={bg_blur_radius}, opacity={bg_opacity}")
-            background_layer = Image.new('RGBA', img.size, (0, 0, 0, 0))
-            draw_bg = ImageDraw.Draw(background_layer)
             bg_padding = 20
             bg_left = max(0, text_position[0] - bg_padding)
             bg_top = max(0, text_position[1] - bg_padding)
-            log.debug("Расчет bbox для фона под текстом...")
-            try:
-                bbox_multiline_at_pos = draw.textbbox(text_position, text, font=font)
-                log.debug(f"bbox_multiline_at_pos: {bbox_multiline_at_pos}")
-                bg_right = min(img_width, text_position[0] + (bbox_multiline_at_pos[2] - bbox_multiline_at_pos[0]) + bg_padding)
-                bg_bottom = min(img_height, text_position[1] + (bbox_multiline_at_pos[3] - bbox_multiline_at_pos[1]) + bg_padding)
-            except Exception as bbox_bg_err:
-                 log.error(f"Ошибка расчета bbox для фона: {bbox_bg_err}", exc_info=True)
-                 bg_right = min(img_width, text_position[0] + text_width + bg_padding)
-                 bg_bottom = min(img_height, text_position[1] + text_height + bg_padding)
-                 log.warning("Используются приблизительные размеры для фона.")
-            bg_rect_coords = [(int(bg_left), int(bg_top)), (int(bg_right), int(bg_bottom))]
-            bg_crop_box = (int(bg_left), int(bg_top), int(bg_right), int(bg_bottom))
-            log.debug(f"Координаты фона: rect={bg_rect_coords}, crop={bg_crop_box}")
-            if bg_blur_radius > 0:
-                log.info(f"Применение размытия фона под текстом (радиус: {bg_blur_radius}) в области {bg_crop_box}")
-                try:
-                    log.debug("Обрезка области для размытия...")
-                    crop = img.crop(bg_crop_box)
-                    log.debug("Применение фильтра GaussianBlur...")
-                    blurred_crop = crop.filter(ImageFilter.GaussianBlur(bg_blur_radius))
-                    log.debug("Вставка размытой области...")
-                    background_layer.paste(blurred_crop, bg_crop_box)
-                    log.debug("Размытие применено.")
-                except Exception as blur_err:
-                    log.warning(f"Не удалось применить размытие под текстом: {blur_err}")
-            if bg_opacity > 0:
-                 log.info(f"Создание полупрозрачной подложки под текстом (opacity: {bg_opacity}) в области {bg_rect_coords}")
-                 overlay_color = (0, 0, 0, bg_opacity) # Черный с заданной прозрачностью
-                 log.debug(f"Рисование прямоугольника подложки цветом {overlay_color}...")
-                 draw_bg.rectangle(bg_rect_coords, fill=overlay_color)
-                 log.debug("Подложка нарисована.")
-            log.debug("Наложение слоя фона на основное изображение...")
-            img = Image.alpha_composite(img, background_layer)
-            draw = ImageDraw.Draw(img) # Обновляем draw для финального изображения
-            log.debug("Слой фона наложен, ImageDraw обновлен.")
+            bg_right = min(img_width, text_position[0] + text_width + bg_padding)
+            bg_bottom = min(img_height, text_position[1] + text_height + bg_padding)
+            bg_box = (int(bg_left), int(bg_top), int(bg_right), int(bg_bottom))
+            log.info(f"Размытие (радиус: {bg_blur_radius}) и подложка (opacity: {bg_opacity}) под текстом в области {bg_box}")
+            # Слой размером с область текста накладывается на месте (modules/compositing.py)
+            apply_text_background(img, bg_box, blur_radius=bg_blur_radius, opacity=bg_opacity, log=log)
+            log.debug("Слой фона наложен.")
         else:
             log.debug("Эффекты фона под текстом отключены.")
 
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+# В файле modules/vision_images.py
+"""
+Локальная подготовка изображений для vision-вызовов OpenAI.
+
+Вместо полноразмерных временных URL MidJourney в select_best_image / get_text_placement_suggestions
+отправляются JPEG-миниатюры в виде data URI. Каждое изображение скачивается один раз (оригинал
+остается в кэше и переиспользуется, например, как основа заголовка), миниатюра строится один раз.
+
+Настройки - секция VISION_IMAGES в config.json:
+    enabled      - false: отправлять URL, как раньше;
+    max_side     - максимальная сторона миниатюры, px;
+    jpeg_quality - качество JPEG;
+    detail       - detail для image_url: "auto" (по умолчанию, как у API), "high" или "low"
+                   (85 токенов на картинку, но модель видит картинку в 512px - включать явно).
+При ошибке скачивания или без Pillow отправляется исходный URL.
+"""
+import base64
+import hashlib
+import io
+import math
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+try:
+    from .logger import get_logger
+    from .utils import download_image
+    logger = get_logger("vision_images")
+except ImportError:
+    from modules.logger import get_logger
+    from modules.utils import download_image
+    logger = get_logger("vision_images")
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+DEFAULT_MAX_SIDE = 768
+DEFAULT_JPEG_QUALITY = 80
+DEFAULT_DETAIL = "auto"
+VALID_DETAILS = ("low", "high", "auto")
+LOW_DETAIL_TOKENS = 85
+TILE_TOKENS = 170
+TILE_SIZE = 512
+
+
+def estimate_image_tokens(width: int, height: int, detail: str = "auto") -> int:
+    """Оценка токенов изображения по правилам OpenAI (gpt-4o): low - 85, иначе 85 + 170 за плитку 512px."""
+    if detail == "low" or not width or not height:
+        return LOW_DETAIL_TOKENS
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    tiles = math.ceil(width / TILE_SIZE) * math.ceil(height / TILE_SIZE)
+    return LOW_DETAIL_TOKENS + TILE_TOKENS * tiles
+
+
+class VisionImageCache:
+    """Кэш скачанных оригиналов и их миниатюр (data URI) на время одного запуска."""
+
+    def __init__(self, cache_dir, max_side: int = DEFAULT_MAX_SIDE, jpeg_quality: int = DEFAULT_JPEG_QUALITY,
+                 detail: str = DEFAULT_DETAIL):
+        self.cache_dir = Path(cache_dir)
+        self.max_side = int(max_side)
+        self.jpeg_quality = int(jpeg_quality)
+        if detail not in VALID_DETAILS:
+            logger.warning(f"⚠️ Неизвестный detail '{detail}', используется '{DEFAULT_DETAIL}'.")
+            detail = DEFAULT_DETAIL
+        self.detail = detail
+        self._thumbnails = {}
+        self._originals = {}
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        if Image is None:
+            logger.warning("⚠️ Pillow не установлен, миниатюры для vision-вызовов отключены (отправляются URL).")
+
+    def _lock_for(self, url: str) -> threading.Lock:
+        with self._locks_guard:
+            return self._locks.setdefault(url, threading.Lock())
+
+    def _original_path(self, url: str) -> Path:
+        suffix = Path(url.split("?", 1)[0]).suffix.lower()
+        if suffix not in (".png", ".jpg", ".jpeg", ".webp"):
+            suffix = ".img"
+        return self.cache_dir / f"src_{hashlib.sha1(url.encode('utf-8')).hexdigest()[:16]}{suffix}"
+
+    def fetch(self, url: str) -> Path | None:
+        """Скачивает оригинал один раз; повторные вызовы (в т.ч. из других потоков) берут файл из кэша."""
+        with self._lock_for(url):
+            if url in self._originals:
+                return self._originals[url]
+            path = self._original_path(url)
+            if not download_image(url, str(path)):
+                path = None
+            self._originals[url] = path
+            return path
+
+    def thumbnail(self, url: str) -> dict | None:
+        """Миниатюра: {"data_uri", "size", "bytes", "tokens"} или None (отправлять URL)."""
+        if Image is None:
+            return None
+        if url in self._thumbnails:
+            return self._thumbnails[url]
+        original = self.fetch(url)
+        thumb = None
+        if original is not None:
+            try:
+                with Image.open(original) as img:
+                    img = img.convert("RGB")
+                    img.thumbnail((self.max_side, self.max_side), Image.LANCZOS)
+                    buffer = io.BytesIO()
+                    img.save(buffer, format="JPEG", quality=self.jpeg_quality, optimize=True)
+                    size = img.size
+                payload = buffer.getvalue()
+                thumb = {"data_uri": "data:image/jpeg;base64," + base64.b64encode(payload).decode("ascii"),
+                         "size": size, "bytes": len(payload),
+                         "tokens": estimate_image_tokens(size[0], size[1], self.detail)}
+                logger.info(f"🖼️ Миниатюра {size[0]}x{size[1]} ({len(payload) // 1024} КиБ, ~{thumb['tokens']} ток.) для {url[:60]}...")
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось построить миниатюру для {url[:60]}: {e}. Будет отправлен URL.")
+        with self._lock_for(url):
+            self._thumbnails[url] = thumb
+        return thumb
+
+    def image_part(self, url: str) -> dict:
+        """Часть сообщения chat.completions для изображения: data URI миниатюры или исходный URL."""
+        thumb = self.thumbnail(url) if isinstance(url, str) and url.startswith("http") else None
+        image_url = {"url": thumb["data_uri"] if thumb else url, "detail": self.detail}
+        return {"type": "image_url", "image_url": image_url}
+
+    def prefetch(self, urls: list[str], max_workers: int = 4):
+        """Параллельно скачивает оригиналы и строит миниатюры."""
+        urls = [u for u in urls if isinstance(u, str) and u.startswith("http")]
+        if not urls:
+            return
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(urls)), thread_name_prefix="vision_fetch") as executor:
+            list(executor.map(self.thumbnail if Image is not None else self.fetch, urls))
+
+    def copy_original(self, url: str, destination: str) -> bool:
+        """Копирует скачанный оригинал в destination (скачивает, если его еще нет в кэше)."""
+        original = self.fetch(url)
+        if original is None:
+            return False
+        try:
+            Path(destination).parent.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(original, destination)
+            return True
+        except OSError as e:
+            logger.error(f"❌ Не удалось скопировать {original} в {destination}: {e}")
+            return False
+
+
+def create_vision_image_cache(config, cache_dir) -> VisionImageCache | None:
+    """VisionImageCache по настройкам VISION_IMAGES или None, если предобработка отключена."""
+    if not config.get("VISION_IMAGES.enabled", True):
+        logger.info("Предобработка изображений для vision отключена, отправляются URL.")
+        return None
+    return VisionImageCache(cache_dir,
+                            max_side=config.get("VISION_IMAGES.max_side", DEFAULT_MAX_SIDE),
+                            jpeg_quality=config.get("VISION_IMAGES.jpeg_quality", DEFAULT_JPEG_QUALITY),
+                            detail=config.get("VISION_IMAGES.detail", DEFAULT_DETAIL))
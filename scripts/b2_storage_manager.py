@@ -24,6 +24,13 @@ try:
     from modules.logger import get_logger
     from modules.error_handler import handle_error
     from modules.config_manager import ConfigManager
+    from modules.content_backlog import (
+        list_backlog, get_backlog_stats, format_backlog_stats,
+        promote_backlog_item, generation_id_is_free
+    )
+    from modules.runway_tasks import get_runway_task, seconds_until_poll, task_age_seconds
+    from modules.scratch import scratch_path
+    from modules.title_render import TITLE_BASE_SUFFIX, TITLE_SPEC_SUFFIX
 except ModuleNotFoundError as import_err:
     # Попытка относительного импорта, если запускается из папки scripts
     # или если абсолютный не сработал
@@ -42,6 +49,13 @@ except ModuleNotFoundError as import_err:
         from modules.logger import get_logger
         from modules.error_handler import handle_error
         from modules.config_manager import ConfigManager
+        from modules.content_backlog import (
+            list_backlog, get_backlog_stats, format_backlog_stats,
+            promote_backlog_item, generation_id_is_free
+        )
+        from modules.runway_tasks import get_runway_task, seconds_until_poll, task_age_seconds
+        from modules.scratch import scratch_path
+        from modules.title_render import TITLE_BASE_SUFFIX, TITLE_SPEC_SUFFIX
     except ModuleNotFoundError:
         print(f"Критическая Ошибка: Не найдены модули проекта: {import_err}", file=sys.stderr)
         sys.exit(1)
@@ -77,6 +91,9 @@ except Exception as init_err:
     sys.exit(1) # Выход с ошибкой
 
 
+# Начало запуска (для бюджета времени пополнения бэклога)
+RUN_STARTED_MONOTONIC = time.monotonic()
+
 # === Константы ===
 try:
     B2_BUCKET_NAME = config.get('API_KEYS.b2.bucket_name', os.getenv('B2_BUCKET_NAME'))
@@ -86,19 +103,24 @@ try:
     CONFIG_GEN_REMOTE_PATH = config.get('FILE_PATHS.config_gen', "config/config_gen.json")
     CONFIG_MJ_REMOTE_PATH = config.get('FILE_PATHS.config_midjourney', "config/config_midjourney.json")
 
-    # Локальные пути для временных файлов (сделаем их уникальными для параллелизма)
+    # Локальные пути для временных файлов (уникальные для параллелизма, в RAM-области modules/scratch.py)
     timestamp_suffix = datetime.now(timezone.utc).strftime("%Y%m%d%H%M%S%f")
-    CONFIG_PUBLIC_LOCAL_PATH = f"config_public_local_main_{timestamp_suffix}.json"
-    CONFIG_GEN_LOCAL_PATH = f"config_gen_local_main_{timestamp_suffix}.json"
-    CONFIG_MJ_LOCAL_PATH = f"config_mj_local_main_{timestamp_suffix}.json"
-    CONFIG_MJ_LOCAL_CHECK_PATH = f"config_mj_local_check_{timestamp_suffix}.json"
-    CONFIG_MJ_LOCAL_TIMEOUT_PATH = f"config_mj_local_timeout_{timestamp_suffix}.json"
-    CONFIG_MJ_LOCAL_RESET_PATH = f"config_mj_local_reset_{timestamp_suffix}.json"
-    CONFIG_MJ_LOCAL_MEDIA_CHECK_PATH = f"config_mj_local_media_check_{timestamp_suffix}.json" # Новый для проверки после media
+    CONFIG_PUBLIC_LOCAL_PATH = str(scratch_path(f"config_public_local_main_{timestamp_suffix}.json"))
+    CONFIG_GEN_LOCAL_PATH = str(scratch_path(f"config_gen_local_main_{timestamp_suffix}.json"))
+    CONFIG_MJ_LOCAL_PATH = str(scratch_path(f"config_mj_local_main_{timestamp_suffix}.json"))
+    CONFIG_MJ_LOCAL_CHECK_PATH = str(scratch_path(f"config_mj_local_check_{timestamp_suffix}.json"))
+    CONFIG_MJ_LOCAL_TIMEOUT_PATH = str(scratch_path(f"config_mj_local_timeout_{timestamp_suffix}.json"))
+    CONFIG_MJ_LOCAL_RESET_PATH = str(scratch_path(f"config_mj_local_reset_{timestamp_suffix}.json"))
+    CONFIG_MJ_LOCAL_MEDIA_CHECK_PATH = str(scratch_path(f"config_mj_local_media_check_{timestamp_suffix}.json")) # Новый для проверки после media
+    CONFIG_MJ_LOCAL_BACKLOG_PATH = str(scratch_path(f"config_mj_local_backlog_{timestamp_suffix}.json")) # Для флага generation после переноса из бэклога
 
     # *** ИЗМЕНЕНИЕ: Определяем требуемые СУФФИКСЫ файлов ***
     SARCASM_SUFFIX = config.get('FILE_PATHS.sarcasm_image_suffix', '_sarcasm.png')
     REQUIRED_SUFFIXES = ['.json', '.png', '.mp4', SARCASM_SUFFIX]
+    # Необязательные файлы группы (перемещаются и архивируются вместе с ней, если есть):
+    # версия видео меньшего разрешения из generate_media (VIDEO_DELIVERY.rendition_height),
+    # картинка заголовка без текста и параметры его отрисовки (scripts/rerender_titles.py)
+    OPTIONAL_SUFFIXES = [f"{config.get('VIDEO_DELIVERY.rendition_suffix', '_low')}.mp4", TITLE_BASE_SUFFIX, TITLE_SPEC_SUFFIX]
     # *** КОНЕЦ ИЗМЕНЕНИЯ ***
 
     FOLDERS = [
@@ -115,6 +137,16 @@ try:
     WORKSPACE_MEDIA_SCRIPT = os.path.join(SCRIPTS_FOLDER, "Workspace_media.py")
     GENERATE_MEDIA_SCRIPT = os.path.join(SCRIPTS_FOLDER, "generate_media.py")
 
+    # Бэклог заранее сгенерированного контента (modules/content_backlog.py)
+    CONTENT_BACKLOG_ENABLED = bool(config.get('CONTENT_BACKLOG.enabled', False))
+    CONTENT_BACKLOG_FOLDER = config.get('CONTENT_BACKLOG.folder', 'pending/')
+    CONTENT_BACKLOG_TARGET_DEPTH = int(config.get('CONTENT_BACKLOG.target_depth', 2))
+    CONTENT_BACKLOG_MAX_PRODUCE = int(config.get('CONTENT_BACKLOG.max_produce_per_run', 1))
+    CONTENT_BACKLOG_PRODUCE_TIMEOUT = int(config.get('CONTENT_BACKLOG.produce_timeout_seconds', 600))
+    # Бюджет времени запуска (задание в Actions ограничено timeout-minutes: 30) и минимум времени на одну генерацию
+    CONTENT_BACKLOG_JOB_BUDGET = int(config.get('CONTENT_BACKLOG.job_time_budget_seconds', 1500))
+    CONTENT_BACKLOG_MIN_PRODUCE = int(config.get('CONTENT_BACKLOG.min_produce_seconds', 180))
+
     # Таймаут MJ из конфига
     MJ_TIMEOUT_SECONDS = int(config.get('WORKFLOW.mj_timeout_seconds', 5 * 60 * 60)) # 5 часов по умолчанию
     if MJ_TIMEOUT_SECONDS <= 0:
@@ -214,8 +246,8 @@ def move_group(s3, src_folder, dst_folder, group_id):
     src_folder_norm = src_folder.rstrip('/') + '/'
     dst_folder_norm = dst_folder.rstrip('/') + '/'
 
-    # Итерируемся по ТРЕБУЕМЫМ СУФФИКСАМ
-    for suffix in REQUIRED_SUFFIXES:
+    # Итерируемся по ТРЕБУЕМЫМ и необязательным СУФФИКСАМ
+    for suffix in REQUIRED_SUFFIXES + OPTIONAL_SUFFIXES:
         src_key = f"{src_folder_norm}{group_id}{suffix}"
         dst_key = f"{dst_folder_norm}{group_id}{suffix}"
         try:
@@ -229,7 +261,8 @@ def move_group(s3, src_folder, dst_folder, group_id):
                 logger.info(f"✅ Успешно перемещен: {src_key} -> {dst_key}")
             except ClientError as head_err:
                 if head_err.response['Error']['Code'] == '404':
-                    logger.warning(f"Исходный файл {src_key} не найден для перемещения.")
+                    if suffix in OPTIONAL_SUFFIXES: logger.debug(f"Необязательный файл {src_key} отсутствует.")
+                    else: logger.warning(f"Исходный файл {src_key} не найден для перемещения.")
                     # Не считаем это ошибкой перемещения, если файла нет
                 else:
                     raise # Пробрасываем другие ошибки head_object
@@ -330,8 +363,8 @@ def handle_publish(s3, config_public):
         # Ищем файлы во всех рабочих папках (444, 555, 666)
         for folder in FOLDERS:
             folder_norm = folder.rstrip('/') + '/'
-            # Итерируемся по ТРЕБУЕМЫМ СУФФИКСАМ
-            for suffix in REQUIRED_SUFFIXES:
+            # Итерируемся по ТРЕБУЕМЫМ и необязательным СУФФИКСАМ
+            for suffix in REQUIRED_SUFFIXES + OPTIONAL_SUFFIXES:
                 src_key = f"{folder_norm}{clean_id}{suffix}"
                 dst_key = f"{ARCHIVE_FOLDER.rstrip('/')}/{clean_id}{suffix}"
                 try:
@@ -441,6 +474,58 @@ def run_script(script_path, args_list=[], timeout=600):
         return False
 
 
+def take_from_content_backlog(s3):
+    """
+    Переносит самый старый готовый JSON из бэклога в 666/.
+    Возвращает generation_id перенесенного контента или None, если бэклог пуст/выключен.
+    """
+    if not CONTENT_BACKLOG_ENABLED:
+        return None
+    items = list_backlog(s3, B2_BUCKET_NAME, CONTENT_BACKLOG_FOLDER)
+    if not items:
+        logger.info(f"📦 Бэклог контента ({CONTENT_BACKLOG_FOLDER}) пуст.")
+        return None
+    for item in items:
+        if promote_backlog_item(s3, B2_BUCKET_NAME, item, FOLDERS[-1]):
+            return item["generation_id"]
+        logger.error(f"Не удалось перенести {item['key']} из бэклога, пробуем следующий элемент.")
+    return None
+
+
+def refill_content_backlog(s3):
+    """
+    Пополняет бэклог до CONTENT_BACKLOG.target_depth, запуская generate_content.py --backlog
+    не более CONTENT_BACKLOG.max_produce_per_run раз. Вызывается после снятия блокировки.
+    Генерация запускается, только если глубина ниже цели, и с таймаутом не больше остатка
+    CONTENT_BACKLOG.job_time_budget_seconds; если остаток меньше min_produce_seconds -
+    пополнение откладывается до следующего запуска. Возвращает число созданных элементов.
+    """
+    if not CONTENT_BACKLOG_ENABLED:
+        return 0
+    produced = 0
+    while produced < CONTENT_BACKLOG_MAX_PRODUCE:
+        depth = len(list_backlog(s3, B2_BUCKET_NAME, CONTENT_BACKLOG_FOLDER))
+        if depth >= CONTENT_BACKLOG_TARGET_DEPTH:
+            logger.info(f"📦 Бэклог контента заполнен ({depth}/{CONTENT_BACKLOG_TARGET_DEPTH}).")
+            break
+        remaining_seconds = int(CONTENT_BACKLOG_JOB_BUDGET - (time.monotonic() - RUN_STARTED_MONOTONIC))
+        produce_timeout = min(CONTENT_BACKLOG_PRODUCE_TIMEOUT, remaining_seconds)
+        if produce_timeout < CONTENT_BACKLOG_MIN_PRODUCE:
+            logger.info(f"📦 Бэклог {depth}/{CONTENT_BACKLOG_TARGET_DEPTH}, но до конца бюджета запуска осталось {max(0, remaining_seconds)} c "
+                        f"(нужно не меньше {CONTENT_BACKLOG_MIN_PRODUCE} c). Пополнение отложено до следующего запуска.")
+            break
+        new_id = generate_file_id()
+        if not generation_id_is_free(s3, B2_BUCKET_NAME, new_id, [CONTENT_BACKLOG_FOLDER] + FOLDERS + [ARCHIVE_FOLDER]):
+            logger.info(f"ID {new_id} уже используется, пополнение бэклога отложено до следующего запуска.")
+            break
+        logger.info(f"📦 Пополнение бэклога ({depth}/{CONTENT_BACKLOG_TARGET_DEPTH}): генерация контента {new_id}...")
+        if not run_script(GENERATE_CONTENT_SCRIPT, ['--generation_id', new_id, '--backlog'], timeout=produce_timeout):
+            logger.error(f"Ошибка генерации контента для бэклога (ID {new_id}). Пополнение прервано.")
+            break
+        produced += 1
+    return produced
+
+
 # === Основная функция ===
 def main():
     parser = argparse.ArgumentParser(description='Manage B2 storage and content generation workflow.')
@@ -463,6 +548,7 @@ def main():
     config_mj = {}
     lock_acquired = False
     task_completed_successfully = False # Флаг для финальной очистки config_gen
+    backlog_refill_allowed = False # Пополнение бэклога - только после штатного прохода, вне блокировки
 
     # --- Блок try/finally для гарантированного снятия блокировки ---
     try:
@@ -558,6 +644,38 @@ def main():
                     logger.error(f"Ошибка генерации имитации для ID {current_generation_id}. Прерывание.")
                     break # Выходим из цикла while при ошибке
 
+            # Сценарий 5: Задача Runway отправлена -> одна проверка статуса, когда подошел срок
+            elif get_runway_task(config_mj):
+                action_taken_in_iteration = True
+                runway_task = get_runway_task(config_mj)
+                current_generation_id = config_gen.get("generation_id") or runway_task.get("generation_id")
+                if not current_generation_id:
+                    logger.error("❌ Задача Runway есть, но нет generation_id в config_gen! Прерывание.")
+                    break
+                wait_seconds = seconds_until_poll(runway_task)
+                if wait_seconds > 0:
+                    logger.info(f"Задача Runway {runway_task['task_id']} (ID {current_generation_id}): следующая проверка через {wait_seconds:.0f} c. "
+                                "Ожидание следующего запуска по расписанию.")
+                    break # Выходим из цикла while, процесс не ждет Runway
+                logger.info(f"Проверка задачи Runway {runway_task['task_id']} для ID {current_generation_id} "
+                            f"(с отправки {task_age_seconds(runway_task) or 0:.0f} c).")
+                script_args = ['--generation_id', current_generation_id]
+                if not run_script(GENERATE_MEDIA_SCRIPT, script_args, timeout=300):
+                    logger.error(f"Ошибка проверки задачи Runway (generate_media.py) для ID {current_generation_id}. Прерывание.")
+                    break
+                config_mj_after_media = load_b2_json(b2_client, B2_BUCKET_NAME, CONFIG_MJ_REMOTE_PATH, CONFIG_MJ_LOCAL_MEDIA_CHECK_PATH, default_value=None)
+                if config_mj_after_media is None:
+                    logger.error("Критическая ошибка: не удалось перезагрузить config_mj после проверки Runway. Прерывание.")
+                    break
+                config_mj = config_mj_after_media
+                if get_runway_task(config_mj):
+                    logger.info("Видео Runway еще не готово. Ожидание следующего запуска по расписанию.")
+                    break # Выходим из цикла while
+                logger.info("✅ Задача Runway завершена (видео или mock загружено). Считаем задачу ЗАВЕРШЕННОЙ.")
+                tasks_processed += 1
+                task_completed_successfully = True
+                break # Выходим из цикла while
+
             # Сценарий 3: Результаты MJ Готовы -> Генерация Видео / Запуск Upscale
             elif config_mj.get('midjourney_results') and isinstance(config_mj['midjourney_results'].get('task_result'), dict):
                 task_res = config_mj['midjourney_results']['task_result']
@@ -575,7 +693,7 @@ def main():
                         break
                     logger.info(f"Обнаружены результаты MJ для ID {current_generation_id}. Запуск обработки медиа.")
                     script_args = ['--generation_id', current_generation_id]
-                    if run_script(GENERATE_MEDIA_SCRIPT, script_args, timeout=600): # Увеличенный таймаут для Runway
+                    if run_script(GENERATE_MEDIA_SCRIPT, script_args, timeout=600): # Запас для блокирующего режима Runway (WORKFLOW.runway_async = false)
                         logger.info(f"Обработка медиа (generate_media.py) успешно запущена/выполнена для ID {current_generation_id}.")
 
                         # --- ИСПРАВЛЕНИЕ ЛОГИКИ ЗАВЕРШЕНИЯ ---
@@ -594,6 +712,9 @@ def main():
                         if config_mj.get('midjourney_task') and isinstance(config_mj['midjourney_task'], dict):
                             logger.info("Обнаружена НОВАЯ задача MJ (вероятно, upscale/variation). Задача НЕ завершена. Продолжаем цикл.")
                             continue # Переходим к следующей итерации для обработки новой задачи
+                        elif get_runway_task(config_mj):
+                            logger.info("Задача Runway отправлена. Задача НЕ завершена, видео заберут следующие запуски.")
+                            break # Выходим из цикла while, не дожидаясь Runway
                         else:
                             logger.info("Новая задача MJ не обнаружена. Считаем задачу ЗАВЕРШЕННОЙ.")
                             tasks_processed += 1
@@ -739,7 +860,28 @@ def main():
                 ready_groups_in_666 = get_ready_groups(files_in_666) # Теперь ищет 4 файла
 
                 if not ready_groups_in_666:
-                    # Если ГОТОВЫХ групп нет, запускаем генерацию нового контента
+                    # Сначала пробуем взять готовый контент из бэклога
+                    backlog_id = None
+                    try:
+                        backlog_id = take_from_content_backlog(b2_client)
+                    except Exception as backlog_err:
+                        logger.error(f"Ошибка при получении контента из бэклога: {backlog_err}", exc_info=True)
+                    if backlog_id:
+                        logger.info(f"📦 Контент {backlog_id} взят из бэклога, генерация текста не требуется.")
+                        config_gen["generation_id"] = backlog_id
+                        if not save_b2_json(b2_client, B2_BUCKET_NAME, CONFIG_GEN_REMOTE_PATH, CONFIG_GEN_LOCAL_PATH, config_gen):
+                            logger.error(f"Не удалось сохранить ID {backlog_id} в {CONFIG_GEN_REMOTE_PATH}. Прерывание.")
+                            break
+                        config_mj['generation'] = True
+                        config_mj['midjourney_task'] = None
+                        config_mj['midjourney_results'] = {}
+                        config_mj['status'] = None
+                        if not save_b2_json(b2_client, B2_BUCKET_NAME, CONFIG_MJ_REMOTE_PATH, CONFIG_MJ_LOCAL_BACKLOG_PATH, config_mj):
+                            logger.error("Не удалось установить флаг generation после переноса из бэклога. Прерывание.")
+                            break
+                        continue # Следующая итерация запустит /imagine (generation:true)
+
+                    # Если ГОТОВЫХ групп нет и бэклог пуст, запускаем генерацию нового контента
                     logger.info(f"В папке 666/ нет готовых групп. Запуск генерации нового контента...")
                     try:
                         new_id_base = generate_file_id() # Генерируем ID
@@ -805,6 +947,8 @@ def main():
         else:
              logger.info("Флаг task_completed_successfully не установлен, очистка config_gen не требуется.")
 
+        backlog_refill_allowed = CONTENT_BACKLOG_ENABLED
+
     # --- Обработка исключений основного блока ---
     except ConnectionError as conn_err:
         logger.error(f"❌ Ошибка соединения B2: {conn_err}")
@@ -840,11 +984,22 @@ def main():
         else:
             logger.info("Блокировка не была установлена или была потеряна, снятие не требуется.")
 
+        # --- Пополнение бэклога контента и сводка (после снятия блокировки: следующий запуск не ждет генерацию) ---
+        if backlog_refill_allowed and b2_client:
+            try:
+                produced_count = refill_content_backlog(b2_client)
+                backlog_stats = get_backlog_stats(list_backlog(b2_client, B2_BUCKET_NAME, CONTENT_BACKLOG_FOLDER))
+                logger.info(f"📦 Бэклог контента ({CONTENT_BACKLOG_FOLDER}): {format_backlog_stats(backlog_stats, CONTENT_BACKLOG_TARGET_DEPTH)}; "
+                            f"создано за запуск: {produced_count}")
+            except Exception as backlog_err:
+                logger.error(f"Ошибка обслуживания бэклога контента: {backlog_err}", exc_info=True)
+
         # Очистка временных локальных файлов
         temp_files = [
             CONFIG_PUBLIC_LOCAL_PATH, CONFIG_GEN_LOCAL_PATH, CONFIG_MJ_LOCAL_PATH,
             CONFIG_MJ_LOCAL_CHECK_PATH, CONFIG_MJ_LOCAL_TIMEOUT_PATH,
-            CONFIG_MJ_LOCAL_RESET_PATH, CONFIG_MJ_LOCAL_MEDIA_CHECK_PATH
+            CONFIG_MJ_LOCAL_RESET_PATH, CONFIG_MJ_LOCAL_MEDIA_CHECK_PATH,
+            CONFIG_MJ_LOCAL_BACKLOG_PATH
         ]
         for temp_file in temp_files:
             if os.path.exists(temp_file):
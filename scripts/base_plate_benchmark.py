@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+# В файле scripts/base_plate_benchmark.py
+"""
+Бенчмарк кэша подложки картинки сарказма (modules/base_plate.py).
+
+Подготовка подложки (до первой записи в пиксели) в пяти режимах:
+    "без кэша"           - как раньше: Image.open + convert("RGBA") + расчет области текста;
+    "холодный"           - пустой кэш процесса, настройки BASE_PLATE из config.json
+                           (по умолчанию persist_raw=false: только декодирование PNG);
+    "холодный + запись"  - persist_raw=True, сырого файла нет: декодирование PNG и запись сырого файла;
+    "сырой файл"         - persist_raw=True, сырой файл есть (новый процесс на той же машине): mmap;
+    "теплый"             - подложка уже в памяти процесса.
+Во всех режимах время включает clone() и ImageDraw.Draw (копию буфера при первой записи).
+Затем замеряется полная отрисовка add_text_to_image_sarcasm_openai_ready: холодная (первая
+в процессе) и теплая (повторная) - с сохранением PNG, которое от кэша не зависит.
+Сырой файл, созданный бенчмарком, в конце удаляется.
+
+Пример: python scripts/base_plate_benchmark.py --repeat 10
+"""
+import sys
+import time
+import argparse
+import tempfile
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+if str(BASE_DIR) not in sys.path:
+    sys.path.append(str(BASE_DIR))
+
+try:
+    from PIL import Image, ImageDraw
+    from modules.logger import get_logger
+    from modules.config_manager import ConfigManager
+    from modules.base_plate import get_base_plate, load_base_plate, clear_cache, raw_plate_path
+    from modules.sarcasm_image_utils import add_text_to_image_sarcasm_openai_ready
+except ModuleNotFoundError as e:
+    print(f"Критическая Ошибка: Не найдены модули в base_plate_benchmark: {e}", file=sys.stderr)
+    sys.exit(1)
+
+logger = get_logger("base_plate_benchmark")
+
+SARCASM_TEXT = "Конечно, ведь древние\nстроители просто\nзнали всё лучше\nнас с вами."
+SARCASM_FONT = "assets/fonts/Kurale-Regular.ttf"
+
+
+def prepare_legacy(plate_path: Path, padding_fraction: float):
+    img = Image.open(plate_path).convert("RGBA")
+    img_width, img_height = img.size
+    padding_x, padding_y = int(img_width * padding_fraction), int(img_height * padding_fraction)
+    region = (img_width // 2 + padding_x, padding_y, img_width // 2 - 2 * padding_x, img_height - 2 * padding_y)
+    return ImageDraw.Draw(img), region
+
+
+def prepare_cached(plate_path: Path, padding_fraction: float):
+    plate = get_base_plate(plate_path)
+    return ImageDraw.Draw(plate.clone()), plate.text_region(padding_fraction)
+
+
+def prepare_persisted(plate_path: Path, padding_fraction: float):
+    plate = load_base_plate(plate_path, persist_raw=True)
+    return ImageDraw.Draw(plate.clone()), plate.text_region(padding_fraction)
+
+
+def timed(fn, repeat: int, before=None) -> float:
+    """Лучшее время fn() из repeat запусков, мс (before() вызывается перед каждым запуском вне замера)."""
+    best = None
+    for _ in range(repeat):
+        if before: before()
+        started = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the sarcasm base-plate cache: cold vs warm preparation and render.')
+    parser.add_argument('--image', type=str, default=None, help='Base plate (default: FILE_PATHS.sarcasm_baron_image).')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    config = ConfigManager()
+    plate_path = Path(args.image or BASE_DIR / config.get("FILE_PATHS.sarcasm_baron_image", "assets/Барон.png"))
+    if not plate_path.is_file():
+        print(f"Подложка не найдена: {plate_path}", file=sys.stderr)
+        return 1
+    raw_file = raw_plate_path(plate_path)
+    padding_fraction = 0.05
+
+    def cold_state():
+        clear_cache(); raw_file.unlink(missing_ok=True)
+
+    legacy = timed(lambda: prepare_legacy(plate_path, padding_fraction), args.repeat)
+    cold = timed(lambda: prepare_cached(plate_path, padding_fraction), args.repeat, before=cold_state)
+    cold_persist = timed(lambda: prepare_persisted(plate_path, padding_fraction), args.repeat, before=cold_state)
+    raw = timed(lambda: prepare_persisted(plate_path, padding_fraction), args.repeat)
+    clear_cache()
+    warm = timed(lambda: prepare_cached(plate_path, padding_fraction), args.repeat)
+    print(f"Подложка {plate_path.name}, сырой файл: {raw_file}")
+    print(f"{'Подготовка подложки':<22} {'мс':>8}")
+    for label, value in (("без кэша", legacy), ("холодный", cold), ("холодный + запись", cold_persist),
+                         ("сырой файл (mmap)", raw), ("теплый", warm)):
+        print(f"{label:<22} {value:>8.1f}")
+
+    work_dir = Path(tempfile.mkdtemp(prefix="base_plate_bench_"))
+    quiet = get_logger("base_plate_benchmark_render")
+    render = lambda: add_text_to_image_sarcasm_openai_ready(
+        str(plate_path), SARCASM_TEXT, 90, str(BASE_DIR / SARCASM_FONT), str(work_dir / "sarcasm.png"), logger_instance=quiet)
+    cold_render = timed(render, args.repeat, before=cold_state)
+    warm_render = timed(render, args.repeat)
+    raw_file.unlink(missing_ok=True)
+    print(f"Полная отрисовка сарказма: холодная {cold_render:.0f} мс, теплая {warm_render:.0f} мс "
+          f"(экономия {cold_render - warm_render:.0f} мс; остальное - подбор шрифта и сохранение PNG).")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+# В файле scripts/brief_ab_harness.py
+"""
+A/B-сравнение режимов креативного брифа (шаги 6.1-6.3 generate_content.py):
+многошаговый (step1_core -> step2_driver -> step3_aesthetic) против объединенного (multi_step.fused_brief).
+
+Вызовы идут через настоящие ContentGenerator / call_openai, но вместо OpenAI используется
+локальный фейковый бэкенд: готовые ответы (встроенные или записанные в JSON-файл) и
+смоделированная задержка (накладные расходы + префилл + декодирование по токенам).
+Сравниваются задержка, токены и доля ответов, прошедших валидацию.
+
+Пример:
+    python scripts/brief_ab_harness.py --runs 20 --invalid-rate 0.1
+    python scripts/brief_ab_harness.py --recorded data/recorded_briefs.json --time-scale 1
+
+Формат --recorded: {"multi_step.step1_core": ["<json ответа>", ...], "multi_step.fused_brief": [...], ...};
+ответы для ключа выбираются по кругу.
+"""
+import sys
+import json
+import time
+import random
+import argparse
+import statistics
+from pathlib import Path
+from types import SimpleNamespace
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+if str(BASE_DIR) not in sys.path:
+    sys.path.append(str(BASE_DIR))
+
+try:
+    import scripts.generate_content as generate_content
+    from modules.logger import get_logger
+    from modules.token_accounting import (
+        estimate_tokens, estimate_messages_tokens, get_session_records, reset_session_records
+        )
+except ModuleNotFoundError as e:
+    print(f"Критическая Ошибка: Не найдены модули проекта в brief_ab_harness: {e}", file=sys.stderr)
+    sys.exit(1)
+
+logger = get_logger("brief_ab_harness")
+
+DEFAULT_TOPIC = "Падение Константинополя в 1453 году: последний день Византийской империи"
+MULTI_STEP_KEYS = ["multi_step.step1_core", "multi_step.step2_driver", "multi_step.step3_aesthetic"]
+FUSED_KEY = "multi_step.fused_brief"
+STREAM_CHUNK_CHARS = 16
+
+CANNED_CORE = {"chosen_type": "arc", "chosen_value": "От надежды к отчаянию",
+               "justification": "Последний день обороны - это крушение надежды на спасение города."}
+CANNED_DRIVER = {"chosen_driver_type": "metaphor", "chosen_driver_value": "Символический предмет",
+                 "justification": "Гаснущая лампада в соборе передаст угасание империи одним образом."}
+CANNED_AESTHETIC = {"style_needed": True, "chosen_style_type": "artist",
+                    "chosen_style_value": "Караваджо (Барокко / Кьяроскуро)",
+                    "style_keywords": ["dramatic chiaroscuro", "candlelit darkness", "intense realism"],
+                    "justification": "Контраст света и тьмы усилит драматизм последних часов."}
+CANNED_RESPONSES = {
+    "multi_step.step1_core": [json.dumps(CANNED_CORE, ensure_ascii=False)],
+    "multi_step.step2_driver": [json.dumps(CANNED_DRIVER, ensure_ascii=False)],
+    "multi_step.step3_aesthetic": [json.dumps(CANNED_AESTHETIC, ensure_ascii=False)],
+    FUSED_KEY: [json.dumps({"core": CANNED_CORE, "driver": CANNED_DRIVER, "aesthetic": CANNED_AESTHETIC},
+                           ensure_ascii=False)],
+}
+
+
+def corrupt_response(text: str, rng: random.Random) -> str:
+    """Удаляет один обязательный ключ (для объединенного ответа - внутри случайного раздела)."""
+    data = json.loads(text)
+    target = data
+    nested = [k for k, v in data.items() if isinstance(v, dict)]
+    if nested:
+        target = data[rng.choice(nested)]
+    target.pop(rng.choice(list(target.keys())), None)
+    return json.dumps(data, ensure_ascii=False)
+
+
+class FakeStream:
+    """Поток чанков в формате chat.completions (stream=True) с задержкой декодирования."""
+
+    def __init__(self, text: str, first_token_delay_s: float, per_chunk_delay_s: float, usage=None):
+        self.text = text
+        self.first_token_delay_s = first_token_delay_s
+        self.per_chunk_delay_s = per_chunk_delay_s
+        self.usage = usage # Последний чанк без choices, как при stream_options.include_usage
+        self.closed = False
+
+    def __iter__(self):
+        time.sleep(self.first_token_delay_s)
+        for start in range(0, len(self.text), STREAM_CHUNK_CHARS):
+            if self.closed:
+                return
+            time.sleep(self.per_chunk_delay_s)
+            delta = SimpleNamespace(content=self.text[start:start + STREAM_CHUNK_CHARS])
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta, finish_reason=None)])
+        if self.usage is not None and not self.closed:
+            yield SimpleNamespace(choices=[], usage=self.usage)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeOpenAIClient:
+    """
+    Минимальная замена openai.OpenAI для chat.completions.create.
+    Ответ выбирается по current_key (ключ промпта выставляет обертка call_openai в харнессе).
+    """
+
+    def __init__(self, responses: dict, invalid_rate: float, time_scale: float, overhead_s: float,
+                 prefill_s_per_token: float, decode_s_per_token: float, seed: int):
+        self.responses = responses
+        self.invalid_rate = invalid_rate
+        self.time_scale = time_scale
+        self.overhead_s = overhead_s
+        self.prefill_s_per_token = prefill_s_per_token
+        self.decode_s_per_token = decode_s_per_token
+        self.rng = random.Random(seed)
+        self.current_key = None
+        self._counters = {}
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def _next_text(self) -> str:
+        variants = self.responses.get(self.current_key)
+        if not variants:
+            raise KeyError(f"Нет записанных ответов для ключа '{self.current_key}'")
+        index = self._counters.get(self.current_key, 0)
+        self._counters[self.current_key] = index + 1
+        text = variants[index % len(variants)]
+        if self.invalid_rate and self.rng.random() < self.invalid_rate:
+            text = corrupt_response(text, self.rng)
+        return text
+
+    def create(self, model=None, messages=None, stream=False, **kwargs):
+        text = self._next_text()
+        prompt_tokens = estimate_messages_tokens(messages or [], model)
+        completion_tokens = estimate_tokens(text, model)
+        first_token_delay = (self.overhead_s + prompt_tokens * self.prefill_s_per_token) * self.time_scale
+        usage = SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+        if stream:
+            chunks = max(1, -(-len(text) // STREAM_CHUNK_CHARS))
+            per_chunk = completion_tokens * self.decode_s_per_token * self.time_scale / chunks
+            include_usage = bool((kwargs.get("stream_options") or {}).get("include_usage"))
+            return FakeStream(text, first_token_delay, per_chunk, usage=usage if include_usage else None)
+        time.sleep(first_token_delay + completion_tokens * self.decode_s_per_token * self.time_scale)
+        message = SimpleNamespace(content=text, role="assistant")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason="stop")], usage=usage)
+
+
+def install_fake_backend(fake_client: FakeOpenAIClient):
+    """Подключает фейковый клиент к generate_content и передает ему ключ текущего промпта."""
+    original_call_openai = generate_content.call_openai
+
+    def keyed_call_openai(prompt_text, prompt_config_key, *args, **kwargs):
+        fake_client.current_key = prompt_config_key
+        return original_call_openai(prompt_text, prompt_config_key, *args, **kwargs)
+
+    generate_content.openai_client_instance = fake_client
+    generate_content.call_openai = keyed_call_openai
+    # B2 для генерации брифа не нужен
+    generate_content.get_b2_client = lambda: None
+
+
+def run_mode(generator, mode: str, topic: str, runs: int, time_scale: float) -> list[dict]:
+    """Выполняет runs генераций брифа в режиме mode ('multi_step' | 'fused'), возвращает замеры по прогонам."""
+    results = []
+    list_strings = generator.build_brief_list_strings()
+    for _ in range(runs):
+        reset_session_records()
+        started = time.perf_counter()
+        if mode == "fused":
+            valid = generator.generate_creative_brief_fused(topic, list_strings) is not None
+        else:
+            try:
+                generator.generate_creative_brief_multi_step(topic, list_strings)
+                valid = True
+            except ValueError:
+                valid = False
+        wall_s = (time.perf_counter() - started) / time_scale
+        records = get_session_records()
+        results.append({
+            "valid": valid,
+            "latency_s": wall_s,
+            "calls": len(records),
+            "prompt_tokens": sum(r.get("prompt_tokens") or r.get("estimated_prompt_tokens") or 0 for r in records),
+            "completion_tokens": sum(r.get("completion_tokens") or 0 for r in records),
+        })
+    return results
+
+
+def summarize(mode: str, results: list[dict]) -> dict:
+    latencies = sorted(r["latency_s"] for r in results)
+    p95_index = max(0, int(round(0.95 * len(latencies))) - 1)
+    return {
+        "mode": mode,
+        "runs": len(results),
+        "pass_rate": sum(1 for r in results if r["valid"]) / len(results),
+        "latency_mean_s": statistics.mean(latencies),
+        "latency_p50_s": statistics.median(latencies),
+        "latency_p95_s": latencies[p95_index],
+        "calls_mean": statistics.mean(r["calls"] for r in results),
+        "prompt_tokens_mean": statistics.mean(r["prompt_tokens"] for r in results),
+        "completion_tokens_mean": statistics.mean(r["completion_tokens"] for r in results),
+    }
+
+
+def format_comparison(summaries: list[dict]) -> str:
+    header = f"{'Режим':<11} {'Прогонов':>8} {'Валидно':>8} {'Ср. c':>7} {'p50 c':>7} {'p95 c':>7} {'Вызовов':>8} {'In ток.':>8} {'Out ток.':>9}"
+    lines = [header, "-" * len(header)]
+    for s in summaries:
+        lines.append(f"{s['mode']:<11} {s['runs']:>8} {s['pass_rate']:>7.0%} {s['latency_mean_s']:>7.2f} "
+                     f"{s['latency_p50_s']:>7.2f} {s['latency_p95_s']:>7.2f} {s['calls_mean']:>8.1f} "
+                     f"{s['prompt_tokens_mean']:>8.0f} {s['completion_tokens_mean']:>9.0f}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='A/B harness: multi-step vs fused creative brief on a fake OpenAI backend.')
+    parser.add_argument('--runs', type=int, default=10, help='Brief generations per mode.')
+    parser.add_argument('--topic', type=str, default=DEFAULT_TOPIC, help='Topic text used as input_text.')
+    parser.add_argument('--recorded', type=str, default=None, help='JSON file with recorded responses per prompt key.')
+    parser.add_argument('--invalid-rate', type=float, default=0.0, help='Probability of a corrupted response per call.')
+    parser.add_argument('--time-scale', type=float, default=0.05, help='Sleep multiplier for simulated latency (results are rescaled).')
+    parser.add_argument('--overhead', type=float, default=0.6, help='Simulated per-call overhead, seconds.')
+    parser.add_argument('--prefill', type=float, default=0.0002, help='Simulated seconds per prompt token.')
+    parser.add_argument('--decode', type=float, default=0.02, help='Simulated seconds per completion token.')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--json-out', type=str, default=None, help='Write summaries to this JSON file.')
+    args = parser.parse_args()
+
+    responses = dict(CANNED_RESPONSES)
+    if args.recorded:
+        with open(args.recorded, 'r', encoding='utf-8') as f:
+            responses.update(json.load(f))
+        logger.info(f"Загружены записанные ответы из {args.recorded}: {list(responses.keys())}")
+
+    time_scale = args.time_scale if args.time_scale > 0 else 1.0
+    fake_client = FakeOpenAIClient(responses, args.invalid_rate, time_scale, args.overhead,
+                                   args.prefill, args.decode, args.seed)
+    install_fake_backend(fake_client)
+    generator = generate_content.ContentGenerator()
+    if not generator.creative_config_data or not generator.prompts_config_data:
+        print("Не удалось загрузить creative_config / prompts_config.", file=sys.stderr)
+        return 1
+
+    summaries = []
+    for mode in ("multi_step", "fused"):
+        logger.info(f"▶️ Режим {mode}: {args.runs} прогонов...")
+        summaries.append(summarize(mode, run_mode(generator, mode, args.topic, args.runs, time_scale)))
+
+    print(format_comparison(summaries))
+    if args.json_out:
+        with open(args.json_out, 'w', encoding='utf-8') as f:
+            json.dump(summaries, f, ensure_ascii=False, indent=4)
+        print(f"Результаты сохранены в {args.json_out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
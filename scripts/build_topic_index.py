@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+# В файле scripts/build_topic_index.py
+"""
+Первичное наполнение индекса тем (modules/topic_index.py) и замер скорости проверки.
+
+Темы берутся из поля "topic" документов контента в B2 (по умолчанию archive/, 444/, 555/, 666/)
+или из локальной папки с JSON. Затем индекс записывается в B2 (TOPIC_DEDUP.index_path) и
+измеряется время find_duplicate на почти-повторах (регистр/пунктуация/лишнее слово) и на новых темах.
+
+Без доступа к B2 можно прогнать только замер на синтетических темах:
+    python scripts/build_topic_index.py --synthetic 5000 --dry-run
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+if str(BASE_DIR) not in sys.path:
+    sys.path.append(str(BASE_DIR))
+
+try:
+    from modules.logger import get_logger
+    from modules.config_manager import ConfigManager
+    from modules.topic_index import TopicIndex
+except ModuleNotFoundError as e:
+    print(f"Критическая Ошибка: Не найдены модули проекта в build_topic_index: {e}", file=sys.stderr)
+    sys.exit(1)
+
+logger = get_logger("build_topic_index")
+
+DEFAULT_PREFIXES = ["archive/", "444/", "555/", "666/"]
+SYNTHETIC_WORDS = ("битва осада падение восстание реформа империя династия крепость флот поход "
+                   "договор заговор коронация чума голод экспедиция открытие изобретение раскол собор").split()
+SYNTHETIC_PLACES = ("Константинополя Рима Новгорода Византии Карфагена Киева Венеции Парижа "
+                    "Лондона Египта Персии Китая Японии Мексики Перу").split()
+
+
+def topics_from_b2(prefixes: list[str]) -> tuple:
+    from modules.api_clients import get_b2_client
+    from modules.utils import list_b2_folder_contents
+    s3 = get_b2_client()
+    bucket_name = ConfigManager().get("API_KEYS.b2.bucket_name")
+    topics = []
+    for prefix in prefixes:
+        for obj in list_b2_folder_contents(s3, bucket_name, prefix):
+            if not obj["Key"].endswith(".json"):
+                continue
+            try:
+                data = json.loads(s3.get_object(Bucket=bucket_name, Key=obj["Key"])["Body"].read().decode("utf-8"))
+            except Exception as e:
+                logger.warning(f"Пропуск {obj['Key']}: {e}")
+                continue
+            if isinstance(data, dict) and isinstance(data.get("topic"), str):
+                topics.append(data["topic"])
+    return topics, s3, bucket_name
+
+
+def topics_from_folder(folder: str) -> list[str]:
+    topics = []
+    for path in sorted(Path(folder).glob("*.json")):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            continue
+        if isinstance(data, dict) and isinstance(data.get("topic"), str):
+            topics.append(data["topic"])
+    return topics
+
+
+def synthetic_topics(count: int, rng: random.Random) -> list[str]:
+    return [f"{rng.choice(SYNTHETIC_WORDS).capitalize()} {rng.choice(SYNTHETIC_PLACES)}: "
+            f"{rng.choice(SYNTHETIC_WORDS)} и {rng.choice(SYNTHETIC_WORDS)} {rng.randint(100, 1999)} года"
+            for _ in range(count)]
+
+
+def near_duplicate(topic: str, rng: random.Random) -> str:
+    """Перефразировка, которую генератор выдает за новую тему: регистр, пунктуация, лишнее слово."""
+    variant = topic.upper() if rng.random() < 0.3 else topic
+    variant = variant.replace(":", " -")
+    return f"{variant} {rng.choice(['заново', 'вкратце', 'глазами очевидцев'])}"
+
+
+def measure(index: TopicIndex, queries: list[str]) -> tuple[list[float], int]:
+    timings, hits = [], 0
+    for query in queries:
+        started = time.perf_counter()
+        if index.find_duplicate(query):
+            hits += 1
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return timings, hits
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the historical topic dedup index and measure lookup time.')
+    parser.add_argument('--prefixes', nargs='*', default=DEFAULT_PREFIXES, help='B2 folders with content JSONs.')
+    parser.add_argument('--folder', type=str, default=None, help='Local folder with content JSONs instead of B2.')
+    parser.add_argument('--synthetic', type=int, default=0, help='Use N synthetic topics (no B2).')
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--dry-run', action='store_true', help='Do not write the index to B2.')
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    config = ConfigManager()
+    rng = random.Random(args.seed)
+    index_path_rel = config.get("TOPIC_DEDUP.index_path", "data/topic_index.json")
+    s3, bucket_name = None, None
+    if args.synthetic:
+        topics = synthetic_topics(args.synthetic, rng)
+    elif args.folder:
+        topics = topics_from_folder(args.folder)
+    else:
+        topics, s3, bucket_name = topics_from_b2(args.prefixes)
+    if not topics:
+        print("Темы не найдены.", file=sys.stderr)
+        return 1
+
+    local_path = BASE_DIR / index_path_rel
+    if args.dry_run or s3 is None:
+        local_path = Path(tempfile.mkdtemp()) / "topic_index.json"
+    index = TopicIndex(None if args.dry_run else s3, bucket_name, index_path_rel, local_path,
+                       num_perm=int(config.get("TOPIC_DEDUP.num_perm", 96)),
+                       bands=int(config.get("TOPIC_DEDUP.bands", 24)),
+                       shingle_size=int(config.get("TOPIC_DEDUP.shingle_size", 3)),
+                       similarity_threshold=float(config.get("TOPIC_DEDUP.similarity_threshold", 0.6)))
+    if not index.enabled:
+        return 1
+    index.load()
+    started = time.perf_counter()
+    added = index.add_many(topics)
+    build_s = time.perf_counter() - started
+    if not args.dry_run and s3 is not None:
+        if not index.save():
+            print("Не удалось записать индекс в B2.", file=sys.stderr)
+            return 1
+    index_bytes = len(index.topics) * index.num_perm * 4
+
+    sample = rng.sample(index.topics, min(args.queries, len(index.topics)))
+    dup_timings, dup_hits = measure(index, [near_duplicate(t, rng) for t in sample])
+    fresh_timings, fresh_hits = measure(index, [f"Неизвестная история #{rng.randint(0, 10**9)} острова {i}"
+                                                for i in range(len(sample))])
+
+    print(f"Тем в индексе: {len(index.topics)} (+{added}), построение {build_s:.2f} c, "
+          f"сигнатуры {index_bytes / 1024:.1f} КиБ")
+    for label, timings, hits in (("почти-повторы", dup_timings, dup_hits), ("новые темы", fresh_timings, fresh_hits)):
+        p50 = timings[len(timings) // 2] * 1e3
+        p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))] * 1e3
+        print(f"{label:<14} найдено {hits}/{len(timings)}, p50 {p50:.3f} мс, p99 {p99:.3f} мс")
+    if args.dry_run or s3 is None:
+        try:
+            os.remove(local_path)
+        except OSError:
+            pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+# В файле scripts/compositing_check.py
+"""
+Проверка и бенчмарк наложения дымки и подложки под текстом (modules/compositing.py).
+
+1. Попиксельное совпадение с прежним кодом add_text_to_image (полнокадровые слои + alpha_composite):
+   дымка с разной прозрачностью на непрозрачном изображении (путь через таблицу) и на изображении
+   с прозрачностью (прежний путь); размытие/затемнение под текстом, в т.ч. у краев кадра.
+   Любое расхождение - код выхода 1.
+2. Время и пик памяти процесса (VmHWM, Linux) для кадра 1792x1024: прежний способ против нового.
+
+Пример: python scripts/compositing_check.py --repeat 10
+"""
+import sys
+import time
+import random
+import argparse
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+if str(BASE_DIR) not in sys.path:
+    sys.path.append(str(BASE_DIR))
+
+try:
+    from PIL import Image, ImageDraw, ImageFilter, ImageChops
+    from modules.logger import get_logger
+    from modules.compositing import apply_haze, apply_text_background
+except ModuleNotFoundError as e:
+    print(f"Критическая Ошибка: Не найдены модули в compositing_check: {e}", file=sys.stderr)
+    sys.exit(1)
+
+logger = get_logger("compositing_check")
+
+FRAME_SIZE = (1792, 1024)
+HAZE_OPACITIES = [1, 37, 64, 100, 128, 200, 254, 255]
+BACKGROUNDS = [(0, 90), (6, 0), (6, 90), (2.5, 255)]
+
+
+def legacy_haze(img, opacity: int):
+    """Прежний код add_text_to_image: полнокадровый белый слой и alpha_composite."""
+    return Image.alpha_composite(img, Image.new('RGBA', img.size, (255, 255, 255, opacity)))
+
+
+def legacy_background(img, box, blur_radius, opacity):
+    """Прежний код add_text_to_image: полнокадровый прозрачный слой, вставка размытия, прямоугольник, alpha_composite."""
+    background_layer = Image.new('RGBA', img.size, (0, 0, 0, 0))
+    draw_bg = ImageDraw.Draw(background_layer)
+    if blur_radius > 0:
+        background_layer.paste(img.crop(box).filter(ImageFilter.GaussianBlur(blur_radius)), box)
+    if opacity > 0:
+        draw_bg.rectangle([(box[0], box[1]), (box[2], box[3])], fill=(0, 0, 0, opacity))
+    return Image.alpha_composite(img, background_layer)
+
+
+def test_frame(size, opaque: bool, seed: int):
+    """Шумный градиент (как фото MJ); при opaque=False - со случайной прозрачностью."""
+    rng = random.Random(seed)
+    base = Image.radial_gradient("L").resize(size)
+    noise = Image.effect_noise(size, 64)
+    img = Image.merge("RGBA", (base, noise, ImageChops.invert(base),
+                               Image.new("L", size, 255) if opaque else Image.effect_noise(size, 120)))
+    if not opaque:
+        img.putpixel((0, 0), (rng.randrange(256), 0, 0, 0))
+    return img
+
+
+def same(a, b) -> bool:
+    return a.size == b.size and a.mode == b.mode and ImageChops.difference(a, b).getbbox() is None
+
+
+def peak_kib():
+    """VmHWM процесса, КиБ (None вне Linux)."""
+    try:
+        with open("/proc/self/status") as f:
+            return next(int(line.split()[1]) for line in f if line.startswith("VmHWM"))
+    except (OSError, StopIteration, ValueError):
+        return None
+
+
+def reset_peak() -> bool:
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def measure(fn, repeat: int):
+    """(лучшее время, мс; прирост пика памяти, КиБ или None)."""
+    best, peak = None, None
+    for _ in range(repeat):
+        can_reset = reset_peak()
+        before = peak_kib()
+        started = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - started
+        after = peak_kib()
+        del result
+        best = elapsed if best is None else min(best, elapsed)
+        if can_reset and before is not None and after is not None:
+            peak = max(peak or 0, after - before)
+    return best * 1000, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pixel-identity check and benchmark for haze/background compositing.')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    failures = 0
+    small = (320, 200)
+    for opaque in (True, False):
+        frame = test_frame(small, opaque, seed=1)
+        for opacity in HAZE_OPACITIES:
+            ok = same(legacy_haze(frame, opacity), apply_haze(frame, opacity))
+            failures += not ok
+            print(f"дымка {opacity:>3}, {'непрозрачное' if opaque else 'с прозрачностью'}: {'OK' if ok else 'РАСХОЖДЕНИЕ'}")
+    frame = apply_haze(test_frame(small, True, seed=2), 128)
+    for box in [(40, 30, 260, 150), (0, 0, 120, 80), (200, 120, small[0], small[1]), (0, 0, small[0], small[1])]:
+        for blur_radius, opacity in BACKGROUNDS:
+            ok = same(legacy_background(frame, box, blur_radius, opacity),
+                      apply_text_background(frame.copy(), box, blur_radius=blur_radius, opacity=opacity))
+            failures += not ok
+            print(f"подложка {box}, размытие {blur_radius}, затемнение {opacity}: {'OK' if ok else 'РАСХОЖДЕНИЕ'}")
+
+    frame = test_frame(FRAME_SIZE, True, seed=3)
+    box = (300, 320, 1500, 700)
+    print(f"\nКадр {FRAME_SIZE[0]}x{FRAME_SIZE[1]}: {'операция':<34} {'прежний, мс':>12} {'новый, мс':>10} {'пик прежний, КиБ':>17} {'пик новый, КиБ':>15}")
+    for label, legacy_fn, new_fn in (
+        ("дымка 128", lambda: legacy_haze(frame, 128), lambda: apply_haze(frame, 128)),
+        ("размытие 6 + затемнение 90", lambda: legacy_background(frame, box, 6, 90),
+         lambda: apply_text_background(frame, box, blur_radius=6, opacity=90)),
+    ):
+        legacy_ms, legacy_peak = measure(legacy_fn, args.repeat)
+        new_ms, new_peak = measure(new_fn, args.repeat)
+        fmt = lambda value: "-" if value is None else f"{value}"
+        print(f"{'':<19} {label:<34} {legacy_ms:>12.1f} {new_ms:>10.1f} {fmt(legacy_peak):>17} {fmt(new_peak):>15}")
+    print(f"\nРасхождений: {failures}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
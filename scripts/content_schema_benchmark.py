@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+# В файле scripts/content_schema_benchmark.py
+"""
+Бенчмарк общей схемы контента (modules/content_schema.py) против прежних разрозненных проверок:
+- писатель: validate_output_json + проверка обязательных ключей в save_content_to_b2;
+- читатель: разбор sarcasm.comment в generate_media.main.
+Для каждого документа сравниваются также вердикты (валиден/нет) и извлеченный текст сарказма.
+
+Корпус:
+    --corpus DIR             - *.json архивных документов в локальной папке;
+    --b2-prefix archive/     - документы из B2 (первые --limit штук);
+    без параметров           - синтетический корпус (--synthetic N) с разными форматами sarcasm.comment.
+
+Пример: python scripts/content_schema_benchmark.py --b2-prefix archive/ --limit 200 --repeat 20
+"""
+import sys
+import json
+import time
+import random
+import argparse
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+if str(BASE_DIR) not in sys.path:
+    sys.path.append(str(BASE_DIR))
+
+try:
+    from modules.logger import get_logger
+    from modules.content_schema import CONTENT_SCHEMA, EXPECTED_KEYS
+except ModuleNotFoundError as e:
+    print(f"Критическая Ошибка: Не найдены модули проекта в content_schema_benchmark: {e}", file=sys.stderr)
+    sys.exit(1)
+
+logger = get_logger("content_schema_benchmark")
+
+
+# --- Прежние проверки (эталон для сравнения, логика перенесена без логирования) ---
+
+def legacy_validate_output_json(data: dict) -> bool:
+    content_val = data.get("content")
+    if not isinstance(content_val, str):
+        return False
+    try:
+        content_json = json.loads(content_val)
+    except json.JSONDecodeError:
+        return False
+    if not isinstance(content_json, dict) or list(content_json.keys()) != ["текст"]:
+        return False
+    main_text = content_json.get("текст")
+    if not isinstance(main_text, str) or not main_text.strip():
+        return False
+    if "\n\n" not in main_text and main_text.count('\n') > 0:
+        return False
+    sarcasm_data = data.get("sarcasm")
+    if isinstance(sarcasm_data, dict):
+        comment_val = sarcasm_data.get("comment")
+        if comment_val is not None and comment_val != "":
+            if not isinstance(comment_val, str):
+                return False
+            try:
+                comment_json = json.loads(comment_val)
+            except json.JSONDecodeError:
+                return False
+            if not isinstance(comment_json, dict) or list(comment_json.keys()) != ["комментарий"]:
+                return False
+            if not isinstance(comment_json.get("комментарий"), str):
+                return False
+    hashtags_val = data.get("hashtags")
+    if hashtags_val is not None:
+        if not isinstance(hashtags_val, list) or not all(isinstance(tag, str) for tag in hashtags_val):
+            return False
+    return True
+
+
+def legacy_required_keys(data: dict) -> tuple[list, list]:
+    missing_keys = [key for key in EXPECTED_KEYS if key not in data]
+    null_keys = [key for key in EXPECTED_KEYS if key in data and data[key] is None]
+    return missing_keys, null_keys
+
+
+def legacy_media_sarcasm_text(content_data: dict):
+    sarcasm_comment_text = None
+    sarcasm_data = content_data.get("sarcasm")
+    if isinstance(sarcasm_data, dict):
+        comment_value = sarcasm_data.get("comment")
+        if isinstance(comment_value, str):
+            try:
+                parsed_comment_value = json.loads(comment_value)
+                if isinstance(parsed_comment_value, dict):
+                    sarcasm_comment_text = parsed_comment_value.get("comment") or parsed_comment_value.get("комментарий")
+                elif isinstance(parsed_comment_value, str):
+                    sarcasm_comment_text = parsed_comment_value
+            except json.JSONDecodeError:
+                sarcasm_comment_text = comment_value.strip('"')
+    return sarcasm_comment_text or None
+
+
+# --- Корпус ---
+
+def synthetic_corpus(count: int, seed: int) -> list[dict]:
+    rng = random.Random(seed)
+    paragraphs = ["Осенью 1453 года стены Константинополя выдержали последний штурм." * 3,
+                  "Город пал, но память о нем пережила империю." * 2]
+    corpus = []
+    for index in range(count):
+        doc = {
+            "topic": f"Тема {index}",
+            "content": json.dumps({"текст": "\n\n".join(paragraphs)}, ensure_ascii=False),
+            "selected_focus": "История Византии",
+            "sarcasm": {"comment": json.dumps({"комментарий": f"Ирония №{index}"}, ensure_ascii=False),
+                        "poll": {"question": "Кто виноват?", "options": ["Я", "Ты", "Никто"]}},
+            "script": "Slow zoom on the city walls.", "first_frame_description": "Dawn over the Golden Horn.",
+            "creative_brief": {"core": {}, "driver": {}, "aesthetic": {}},
+            "final_mj_prompt": "ancient walls, dawn --ar 16:9", "final_runway_prompt": "slow zoom",
+            "hashtags": ["история", "византия"],
+        }
+        variant = rng.random()
+        if variant < 0.1:
+            doc["sarcasm"]["comment"] = f"Просто текст №{index}"          # старый формат: не JSON
+        elif variant < 0.15:
+            doc["content"] = json.dumps({"текст": "строка1\nстрока2"}, ensure_ascii=False)  # без абзацев
+        elif variant < 0.2:
+            doc.pop("hashtags")
+        corpus.append(doc)
+    return corpus
+
+
+def load_local_corpus(folder: str) -> list[dict]:
+    corpus = []
+    for path in sorted(Path(folder).glob("*.json")):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if isinstance(data, dict):
+                corpus.append(data)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"Пропуск {path}: {e}")
+    return corpus
+
+
+def load_b2_corpus(prefix: str, limit: int) -> list[dict]:
+    from modules.config_manager import ConfigManager
+    from modules.api_clients import get_b2_client
+    from modules.utils import list_b2_folder_contents
+    s3 = get_b2_client()
+    bucket_name = ConfigManager().get("API_KEYS.b2.bucket_name")
+    corpus = []
+    for obj in list_b2_folder_contents(s3, bucket_name, prefix):
+        if not obj["Key"].endswith(".json"):
+            continue
+        body = s3.get_object(Bucket=bucket_name, Key=obj["Key"])["Body"].read()
+        try:
+            data = json.loads(body.decode("utf-8"))
+        except (ValueError, UnicodeDecodeError):
+            continue
+        if isinstance(data, dict) and "content" in data:
+            corpus.append(data)
+        if len(corpus) >= limit:
+            break
+    return corpus
+
+
+def time_it(fn, corpus: list[dict], repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for doc in corpus:
+            fn(doc)
+    return (time.perf_counter() - started) / (repeat * len(corpus))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the shared content schema against the legacy ad-hoc checks.')
+    parser.add_argument('--corpus', type=str, default=None, help='Folder with archived content JSON files.')
+    parser.add_argument('--b2-prefix', type=str, default=None, help='Load the corpus from B2 under this prefix.')
+    parser.add_argument('--limit', type=int, default=200, help='Max documents from B2.')
+    parser.add_argument('--synthetic', type=int, default=500, help='Synthetic corpus size if no corpus is given.')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    if args.corpus:
+        corpus, source = load_local_corpus(args.corpus), args.corpus
+    elif args.b2_prefix:
+        corpus, source = load_b2_corpus(args.b2_prefix, args.limit), f"B2:{args.b2_prefix}"
+    else:
+        corpus, source = synthetic_corpus(args.synthetic, args.seed), "синтетический"
+    if not corpus:
+        print("Корпус пуст.", file=sys.stderr)
+        return 1
+
+    # Сверка вердиктов и извлеченного текста сарказма
+    verdict_mismatch = sum(1 for doc in corpus
+                           if legacy_validate_output_json(doc) != (CONTENT_SCHEMA.decode(doc, strict=True)[1] is None))
+    sarcasm_mismatch = sum(1 for doc in corpus
+                           if legacy_media_sarcasm_text(doc) != CONTENT_SCHEMA.decode(doc, strict=False)[0].sarcasm_comment)
+    valid_count = sum(1 for doc in corpus if CONTENT_SCHEMA.decode(doc, strict=True)[1] is None)
+
+    legacy_writer = time_it(lambda d: (legacy_validate_output_json(d), legacy_required_keys(d)), corpus, args.repeat)
+    schema_writer = time_it(lambda d: CONTENT_SCHEMA.decode(d, strict=True), corpus, args.repeat)
+    legacy_reader = time_it(legacy_media_sarcasm_text, corpus, args.repeat)
+    schema_reader = time_it(lambda d: CONTENT_SCHEMA.decode(d, strict=False), corpus, args.repeat)
+    # Полный путь документа: запись + чтение
+    legacy_total = legacy_writer + legacy_reader
+    schema_total = schema_writer + schema_reader
+
+    print(f"Корпус: {source}, документов: {len(corpus)}, валидных по схеме: {valid_count}")
+    print(f"Расхождения с прежней логикой: вердикт {verdict_mismatch}, текст сарказма {sarcasm_mismatch}")
+    print(f"{'Путь':<22} {'Прежний, мкс':>13} {'Схема, мкс':>11}")
+    print(f"{'писатель (валидация)':<22} {legacy_writer * 1e6:>13.1f} {schema_writer * 1e6:>11.1f}")
+    print(f"{'читатель (media)':<22} {legacy_reader * 1e6:>13.1f} {schema_reader * 1e6:>11.1f}")
+    print(f"{'итого на документ':<22} {legacy_total * 1e6:>13.1f} {schema_total * 1e6:>11.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+# В файле scripts/delivery_transcode_benchmark.py
+"""
+Бенчмарк нормализации видео перед загрузкой в 666/ (modules/ffmpeg_tools.prepare_delivery_video).
+
+Для каждого целевого битрейта из --bitrates: размер исходника и результата, экономия, время
+перекодирования, наличие +faststart (атом moov перед mdat) и размер версии меньшего разрешения
+(--rendition-height). Без --video исходник - синтетический ролик 1280x768, 5 c, с высоким
+битрейтом (как MP4 от Runway).
+
+Пример: python scripts/delivery_transcode_benchmark.py --video runway.mp4 --bitrates 1500,2500,4000 --rendition-height 480
+"""
+import sys
+import argparse
+import tempfile
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+if str(BASE_DIR) not in sys.path:
+    sys.path.append(str(BASE_DIR))
+
+try:
+    from modules.logger import get_logger
+    from modules.config_manager import ConfigManager
+    from modules.ffmpeg_tools import find_ffmpeg, run_ffmpeg, get_delivery_settings, prepare_delivery_video
+except ModuleNotFoundError as e:
+    print(f"Критическая Ошибка: Не найдены модули в delivery_transcode_benchmark: {e}", file=sys.stderr)
+    sys.exit(1)
+
+logger = get_logger("delivery_transcode_benchmark")
+
+
+def synthetic_source(path: Path) -> bool:
+    """Ролик 1280x768, 24 к/с, 5 c, почти без сжатия (crf 12) и без faststart - как исходник Runway."""
+    return run_ffmpeg(["-f", "lavfi", "-i", "testsrc2=size=1280x768:rate=24:duration=5",
+                       "-f", "lavfi", "-i", "sine=frequency=440:duration=5",
+                       "-c:v", "libx264", "-preset", "veryfast", "-crf", "12", "-pix_fmt", "yuv420p",
+                       "-c:a", "aac", "-shortest", str(path)])
+
+
+def moov_before_mdat(path: Path) -> bool:
+    """True, если атом moov расположен до mdat (файл воспроизводится до полной загрузки)."""
+    with open(path, "rb") as f:
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                return False
+            size = int.from_bytes(header[:4], "big")
+            kind = header[4:8]
+            if kind == b"moov":
+                return True
+            if kind == b"mdat":
+                return False
+            if size == 1:
+                size = int.from_bytes(f.read(8), "big") - 8
+            elif size == 0:
+                return False
+            f.seek(size - 8, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark delivery transcoding: size savings, transcode time, faststart.')
+    parser.add_argument('--video', type=str, default=None, help='Source MP4 (default: synthetic high-bitrate clip).')
+    parser.add_argument('--bitrates', type=str, default=None, help='Comma-separated target bitrates, kbit/s (default: VIDEO_DELIVERY.video_bitrate_kbps).')
+    parser.add_argument('--rendition-height', type=int, default=None)
+    args = parser.parse_args()
+
+    if not find_ffmpeg():
+        print("ffmpeg не найден.", file=sys.stderr)
+        return 1
+    settings = get_delivery_settings(ConfigManager())
+    if args.rendition_height is not None:
+        settings["rendition_height"] = args.rendition_height
+    bitrates = [int(b) for b in args.bitrates.split(",")] if args.bitrates else [int(settings["video_bitrate_kbps"])]
+
+    work_dir = Path(tempfile.mkdtemp(prefix="delivery_bench_"))
+    source = Path(args.video) if args.video else work_dir / "runway_source.mp4"
+    if not args.video and not synthetic_source(source):
+        print("Не удалось создать синтетический исходник.", file=sys.stderr)
+        return 1
+
+    print(f"Исходник: {source.name}, {source.stat().st_size / 1024:.0f} КиБ, faststart: {moov_before_mdat(source)}; "
+          f"пресет {settings['preset']}, версия меньшего разрешения: {settings['rendition_height'] or 'нет'}")
+    print(f"{'Битрейт':>8} {'Результат, КиБ':>15} {'Экономия':>9} {'Время, c':>9} {'faststart':>10} {'Версия, КиБ':>12}")
+    for bitrate in bitrates:
+        run_dir = work_dir / f"b{bitrate}"
+        run_dir.mkdir()
+        run_source = run_dir / source.name
+        run_source.write_bytes(source.read_bytes())
+        result = prepare_delivery_video(str(run_source), dict(settings, video_bitrate_kbps=bitrate))
+        if not result:
+            print(f"{bitrate:>8} ошибка")
+            continue
+        saved = 100 * (1 - result["delivery_bytes"] / result["original_bytes"])
+        rendition = f"{result['rendition_bytes'] / 1024:.0f}" if result["rendition_bytes"] else "-"
+        print(f"{bitrate:>8} {result['delivery_bytes'] / 1024:>15.0f} {saved:>8.0f}% {result['seconds']:>9.2f} "
+              f"{str(moov_before_mdat(Path(result['path']))):>10} {rendition:>12}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
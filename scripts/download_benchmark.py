@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+# В файле scripts/download_benchmark.py
+"""
+Бенчмарк загрузки медиа: прежний requests.get на каждый файл против общего пула modules/downloader.
+
+Локальный keep-alive сервер раздает файлы заданного размера, поддерживает Range, на каждое новое
+соединение ждет --connect-delay (имитация TCP+TLS до CDN) и ограничивает скорость одного
+соединения (--bandwidth-mib). С --drop-after каждый файл один раз обрывается после N КиБ,
+чтобы проверить докачку.
+
+Режимы:
+    legacy      - requests.get без Session, файлы по очереди (как utils.download_file раньше);
+    pooled      - общий Session, файлы по очереди;
+    concurrent  - общий Session, download_many (DOWNLOADER.max_workers потоков).
+
+Пример: python scripts/download_benchmark.py --files 4 --size-kib 2048 --drop-after 700
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import threading
+from pathlib import Path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+if str(BASE_DIR) not in sys.path:
+    sys.path.append(str(BASE_DIR))
+
+try:
+    from modules.logger import get_logger
+    from modules.downloader import (
+        create_session, get_downloader_settings, download_to_file, download_many,
+        get_download_records, reset_download_records
+        )
+except ModuleNotFoundError as e:
+    print(f"Критическая Ошибка: Не найдены модули проекта в download_benchmark: {e}", file=sys.stderr)
+    sys.exit(1)
+
+logger = get_logger("download_benchmark")
+
+
+class MediaHandler(BaseHTTPRequestHandler):
+    """Отдает /<имя> телом file_size байт; поддерживает Range и разовый обрыв."""
+    protocol_version = "HTTP/1.1"
+    connect_delay = 0.0
+    bytes_per_second = 0
+    file_size = 0
+    drop_after = 0
+    payload = b""
+    state = None
+
+    def setup(self):
+        super().setup()
+        with self.state["lock"]:
+            self.state["connections"] += 1
+        time.sleep(self.connect_delay)
+
+    def do_GET(self):
+        start = 0
+        range_header = self.headers.get("Range")
+        if range_header and range_header.startswith("bytes="):
+            start = int(range_header[6:].split("-", 1)[0] or 0)
+        body = self.payload[start:]
+        self.send_response(206 if start else 200)
+        if start:
+            self.send_header("Content-Range", f"bytes {start}-{self.file_size - 1}/{self.file_size}")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Content-Type", "application/octet-stream")
+        self.end_headers()
+        with self.state["lock"]:
+            drop = self.drop_after and not start and self.path not in self.state["dropped"]
+            if drop:
+                self.state["dropped"].add(self.path)
+        chunk = 64 * 1024
+        sent = 0
+        while sent < len(body):
+            if drop and sent >= self.drop_after:
+                self.close_connection = True
+                self.connection.shutdown(2)
+                return
+            piece = body[sent:sent + chunk]
+            self.wfile.write(piece)
+            sent += len(piece)
+            if self.bytes_per_second:
+                time.sleep(len(piece) / self.bytes_per_second)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(args):
+    state = {"connections": 0, "dropped": set(), "lock": threading.Lock()}
+    handler = type("BenchMediaHandler", (MediaHandler,), {
+        "connect_delay": args.connect_delay, "bytes_per_second": int(args.bandwidth_mib * 1024 * 1024),
+        "file_size": args.size_kib * 1024, "drop_after": args.drop_after * 1024,
+        "payload": os.urandom(args.size_kib * 1024), "state": state})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def legacy_download(url: str, path: str) -> bool:
+    try:
+        with requests.get(url, stream=True, timeout=30) as r:
+            r.raise_for_status()
+            with open(path, 'wb') as f:
+                for chunk in r.iter_content(chunk_size=8192):
+                    f.write(chunk)
+        return True
+    except requests.exceptions.RequestException:
+        return False
+
+
+def run_mode(mode: str, items: list, settings: dict) -> dict:
+    reset_download_records()
+    started = time.perf_counter()
+    if mode == "legacy":
+        results = [legacy_download(url, path) for url, path in items]
+    else:
+        session = create_session(settings)
+        try:
+            if mode == "pooled":
+                results = [download_to_file(url, path, session=session) for url, path in items]
+            else:
+                results = list(download_many(items, session=session).values())
+        finally:
+            session.close()
+    elapsed = time.perf_counter() - started
+    total_bytes = sum(os.path.getsize(path) for _, path in items if os.path.exists(path))
+    return {"ok": sum(1 for r in results if r), "seconds": elapsed, "bytes": total_bytes,
+            "resumed": sum(r["resumed"] for r in get_download_records())}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark legacy per-file requests.get vs pooled/concurrent downloader.')
+    parser.add_argument('--files', type=int, default=4)
+    parser.add_argument('--size-kib', type=int, default=2048)
+    parser.add_argument('--connect-delay', type=float, default=0.15, help='Seconds per new connection (handshake).')
+    parser.add_argument('--bandwidth-mib', type=float, default=8.0, help='Per-connection speed limit, MiB/s (0 - no limit).')
+    parser.add_argument('--drop-after', type=int, default=0, help='Drop each file once after N KiB (resume test).')
+    args = parser.parse_args()
+
+    settings = get_downloader_settings()
+    print(f"Файлов: {args.files} x {args.size_kib} КиБ, рукопожатие {args.connect_delay} c, "
+          f"скорость соединения {args.bandwidth_mib} МиБ/с, обрыв после {args.drop_after or '-'} КиБ")
+    print(f"{'Режим':<11} {'Успешно':>8} {'Время, c':>9} {'МиБ/с':>7} {'Соединений':>11} {'Докачек':>8}")
+    for mode in ("legacy", "pooled", "concurrent"):
+        server, state, base_url = start_server(args)
+        work_dir = Path(tempfile.mkdtemp(prefix=f"download_bench_{mode}_"))
+        items = [(f"{base_url}/media_{i}.bin", str(work_dir / f"media_{i}.bin")) for i in range(args.files)]
+        try:
+            result = run_mode(mode, items, settings)
+        finally:
+            server.shutdown()
+        throughput = result["bytes"] / (1024 * 1024) / result["seconds"] if result["seconds"] else 0.0
+        print(f"{mode:<11} {result['ok']:>5}/{args.files:<2} {result['seconds']:>9.2f} {throughput:>7.2f} "
+              f"{state['connections']:>11} {result['resumed']:>8}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
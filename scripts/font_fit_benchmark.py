@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+# В файле scripts/font_fit_benchmark.py
+"""
+Бенчмарк подбора размера шрифта (modules/font_fit.py): прежний пошаговый перебор ("linear")
+против двоичного поиска ("binary") и двоичного поиска с первой догадкой по линейной модели
+ширины ("guess").
+
+Для каждого случая (заголовок: старт 140, шаг 2, ширина 92% кадра; сарказм: размер от OpenAI,
+шаг 2, правая половина кадра) и каждого шрифта печатается число построений ImageFont.truetype,
+время подбора и выбранный размер (должен совпадать у всех стратегий). Высота блока по
+modules/text_layout.py сверяется с прежней ImageDraw.multiline_textbbox (от нее зависит вертикальное
+центрирование); расхождение размера или высоты - код выхода 1. С --render дополнительно
+замеряется полная отрисовка add_text_to_image / add_text_to_image_sarcasm_openai_ready.
+
+Пример: python scripts/font_fit_benchmark.py --repeat 5 --render
+"""
+import sys
+import time
+import argparse
+import tempfile
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+if str(BASE_DIR) not in sys.path:
+    sys.path.append(str(BASE_DIR))
+
+try:
+    from PIL import Image, ImageDraw
+    from modules.logger import get_logger
+    from modules.font_fit import fit_font_size, FIT_STRATEGIES
+    from modules.text_layout import measure_text
+    from modules.utils import add_text_to_image
+    from modules.sarcasm_image_utils import add_text_to_image_sarcasm_openai_ready
+except ModuleNotFoundError as e:
+    print(f"Критическая Ошибка: Не найдены модули в font_fit_benchmark: {e}", file=sys.stderr)
+    sys.exit(1)
+
+logger = get_logger("font_fit_benchmark")
+
+TITLE_FONTS = ["fonts/Roboto-Regular.ttf", "fonts/Oswald-Regular.ttf", "fonts/PlayfairDisplay-Regular.ttf",
+               "fonts/YesevaOne-Regular.ttf"]
+SARCASM_FONT = "assets/fonts/Kurale-Regular.ttf"
+TITLES = [
+    "Тайна исчезнувшей\nэкспедиции Дятлова",
+    "Почему пирамиды\nпостроены так точно,\nчто инженеры до сих пор спорят",
+    "Кот Шрёдингера",
+]
+SARCASMS = [
+    ("Конечно, ведь древние\nстроители просто\nзнали всё лучше\nнас с вами.", 90),
+    ("Гениально.\nОсобенно та часть,\nгде никто ничего\nне проверил.", 120),
+]
+
+
+def case_list(image_size):
+    width, height = image_size
+    cases = []
+    for font in TITLE_FONTS:
+        for text in TITLES:
+            min_size = 60 if text.count("\n") + 1 >= 3 else 50
+            cases.append(("title", font, text, width * 0.92, 140, min_size))
+    sarcasm_width = width // 2 - 2 * int(width * 0.05)
+    for text, suggested in SARCASMS:
+        cases.append(("sarcasm", SARCASM_FONT, text, sarcasm_width, suggested, 30))
+    return cases
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark font fitting: step-down loop vs binary search vs linear-model guess.')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--render', action='store_true', help='Also time full title/sarcasm renders.')
+    args = parser.parse_args()
+
+    image_size = (1792, 1024)
+    font_cache = {}
+    totals = {strategy: {"constructions": 0, "seconds": 0.0} for strategy in FIT_STRATEGIES}
+    mismatches, height_mismatches = 0, []
+    draw = ImageDraw.Draw(Image.new("RGB", (1, 1)))
+    print(f"{'Случай':<8} {'Шрифт':<28} {'Текст':<22} " + " ".join(f"{s:>16}" for s in FIT_STRATEGIES) + "  Размер")
+    for kind, font_rel, text, max_width, start, min_size in case_list(image_size):
+        font_bytes = font_cache.setdefault(font_rel, (BASE_DIR / font_rel).read_bytes())
+        cells, sizes = [], set()
+        for strategy in FIT_STRATEGIES:
+            best = None
+            for _ in range(args.repeat):
+                result = fit_font_size(font_bytes, text, max_width, start, min_size, step=2, strategy=strategy)
+                best = result if best is None or result["seconds"] < best["seconds"] else best
+            totals[strategy]["constructions"] += best["constructions"]
+            totals[strategy]["seconds"] += best["seconds"]
+            sizes.add((best["fits"], best["size"]))
+            cells.append(f"{best['constructions']:>3} / {best['seconds'] * 1000:>6.1f} мс")
+        mismatches += len(sizes) > 1
+        if best["font"] is not None:
+            bbox = draw.multiline_textbbox((0, 0), best["text"], font=best["font"])
+            layout_height = measure_text(best["font"], best["text"])[1]
+            if layout_height != bbox[3] - bbox[1]:
+                height_mismatches.append(f"{Path(font_rel).name} {best['size']}: {layout_height} вместо {bbox[3] - bbox[1]}")
+        size_note = " ≠ ".join(f"{size}{'' if fits else '*'}" for fits, size in sorted(sizes))
+        preview = text.split("\n")[0][:20]
+        print(f"{kind:<8} {Path(font_rel).name:<28} {preview:<22} " + " ".join(f"{c:>16}" for c in cells) + f"  {size_note}")
+    print("Итого (построений / мс): " + ", ".join(
+        f"{s}: {t['constructions']} / {t['seconds'] * 1000:.1f}" for s, t in totals.items()))
+    print(f"Расхождений выбранного размера: {mismatches} (* - не поместился, используется минимум)")
+    print(f"Расхождений высоты блока с multiline_textbbox: {len(height_mismatches)}")
+    for note in height_mismatches:
+        print(f"    {note}")
+
+    if args.render:
+        work_dir = Path(tempfile.mkdtemp(prefix="font_fit_bench_"))
+        base_path = work_dir / "base.png"
+        Image.radial_gradient("L").resize(image_size).convert("RGB").save(base_path)
+        sarcasm_base = BASE_DIR / "assets" / "Барон.png"
+        quiet = get_logger("font_fit_benchmark_render")
+        quiet.setLevel("WARNING")
+        print(f"{'Отрисовка':<10} " + " ".join(f"{s:>12}" for s in FIT_STRATEGIES))
+        for label, render in (
+            ("title", lambda strategy: add_text_to_image(str(base_path), TITLES[1], str(BASE_DIR / TITLE_FONTS[0]),
+                                                         str(work_dir / f"title_{strategy}.png"), logger_instance=quiet,
+                                                         font_fit_strategy=strategy)),
+            ("sarcasm", lambda strategy: add_text_to_image_sarcasm_openai_ready(
+                str(sarcasm_base), SARCASMS[0][0], SARCASMS[0][1], str(BASE_DIR / SARCASM_FONT),
+                str(work_dir / f"sarcasm_{strategy}.png"), logger_instance=quiet, font_fit_strategy=strategy)),
+        ):
+            cells = []
+            for strategy in FIT_STRATEGIES:
+                timings = []
+                for _ in range(args.repeat):
+                    started = time.perf_counter()
+                    ok = render(strategy)
+                    timings.append(time.perf_counter() - started)
+                cells.append(f"{min(timings) * 1000:>9.0f} мс" if ok else f"{'ошибка':>12}")
+            print(f"{label:<10} " + " ".join(cells))
+    return 1 if mismatches or height_mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -9,12 +9,11 @@ import re
 import boto3
 import io
 import random
+import time
 import argparse
 from datetime import datetime, timezone
-import shutil
 from pathlib import Path
 import logging # Добавляем logging
-import httpx # <-- Добавляем импорт httpx
 
 # Импортируем ClientError из botocore
 try:
@@ -39,6 +38,20 @@ try:
         load_json_config, save_error_to_b2, generate_file_id
         )
     from modules.api_clients import get_b2_client
+    from modules.token_accounting import (
+        timed_openai_call, record_openai_call, estimate_messages_tokens,
+        fit_prompt_to_budget, get_prompt_budget, flush_usage_report
+        )
+    from modules.json_stream import JsonStreamGuard, StreamAbort, resolve_max_chars, ABORT_LENGTH
+    from modules.content_schema import decode_content_document
+    from modules.llm_client import get_openai_client
+    from modules.tracker_store import TrackerStore, TrackerConflict
+    from modules.topic_index import TopicIndex
+    from modules.scratch import scratch_path
+    from modules.creative_brief import (
+        CORE_KEYS, DRIVER_KEYS, AESTHETIC_KEYS, FUSED_SECTIONS,
+        validate_core_brief, validate_driver_brief, validate_aesthetic_brief, split_fused_brief
+        )
 except ModuleNotFoundError as e:
      print(f"Критическая Ошибка: Не найдены модули проекта в generate_content: {e}", file=sys.stderr)
      sys.exit(1)
@@ -60,52 +73,94 @@ logger = get_logger("generate_content")
 # --- Глобальная переменная для клиента OpenAI ---
 openai_client_instance = None
 
+# --- Валидаторы значений для потокового JSON (modules/json_stream.py) ---
+def _is_non_empty_str(value) -> bool:
+    return isinstance(value, str) and bool(value.strip())
+
+
+def _is_list_of_str(value) -> bool:
+    return isinstance(value, list) and all(isinstance(item, str) for item in value)
+
+
 # --- Функция вызова OpenAI API (без изменений) ---
-def call_openai(prompt_text: str, prompt_config_key: str, use_json_mode=False, temperature_override=None, max_tokens_override=None, config_manager_instance=None, prompts_config_data_instance=None):
+def _stream_json_completion(request_params: dict, prompt_config_key: str, openai_model: str, guard: JsonStreamGuard):
+    """
+    Потоковый вызов chat.completions для JSON-режима с проверкой структуры по мере генерации.
+    Возвращает полный текст ответа или None, если поток прерван JsonStreamGuard.
+    usage запрашивается через stream_options.include_usage и приходит последним чанком (без choices);
+    у прерванного потока его нет - тогда out-токены в журнале оцениваются по полученному тексту.
+    """
+    estimated = estimate_messages_tokens(request_params.get("messages", []), openai_model)
+    started = time.perf_counter()
+    success = False
+    stream = None
+    usage_chunk = None
+    abort_kind = None
+    try:
+        stream = openai_client_instance.chat.completions.create(**request_params, stream=True,
+                                                               stream_options={"include_usage": True})
+        for chunk in stream:
+            if getattr(chunk, "usage", None) is not None:
+                usage_chunk = chunk
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+            if delta is not None and delta.content:
+                guard.feed(delta.content)
+        success = True
+        return guard.text
+    except StreamAbort as abort:
+        abort_kind = abort.kind
+        if abort.kind == ABORT_LENGTH:
+            # Отдельно от структурных прерываний: если ответ был бы валидным, граница занижена
+            logger.warning(f"📏 Поток OpenAI прерван по границе длины (Ключ: {prompt_config_key}): {abort.reason}. "
+                           f"Получено символов: {abort.received_chars}. Проверьте OPENAI_SETTINGS.stream_max_output_chars "
+                           f"по замерам (scripts/json_stream_check.py).")
+        else:
+            logger.warning(f"⛔ Поток OpenAI прерван досрочно (Ключ: {prompt_config_key}): {abort.reason}. "
+                           f"Получено символов: {abort.received_chars}.")
+        logger.debug(f"Частичный ответ: {guard.text[:500]}")
+        return None
+    finally:
+        if stream is not None and not success:
+            # Закрываем соединение, чтобы сервер перестал генерировать ненужные токены
+            try:
+                close_fn = getattr(stream, "close", None)
+                if callable(close_fn):
+                    close_fn()
+                elif getattr(stream, "response", None) is not None:
+                    stream.response.close()
+            except Exception as close_err:
+                logger.debug(f"Ошибка закрытия потока OpenAI: {close_err}")
+        record_openai_call(prompt_config_key, openai_model, time.perf_counter() - started,
+                           estimated_prompt_tokens=estimated, response=usage_chunk, success=success,
+                           completion_text=guard.text, abort_kind=abort_kind)
+
+
+def call_openai(prompt_text: str, prompt_config_key: str, use_json_mode=False, temperature_override=None, max_tokens_override=None, config_manager_instance=None, prompts_config_data_instance=None,
+                required_keys=None, value_validators=None):
     """
     Выполняет вызов OpenAI API (версии >=1.0), инициализируя клиент при необходимости,
     и возвращает распарсенный JSON или строку.
     Использует настройки из prompts_config.json.
+    В JSON-режиме при OPENAI_SETTINGS.stream_json ответ читается потоком и прерывается досрочно,
+    если он не может стать валидным (value_validators, не объект, граница длины). Ключи JSON-объекта
+    идут в любом порядке, поэтому required_keys проверяются при закрытии объекта.
     """
     global openai_client_instance # Используем глобальную переменную для клиента
 
-    # --- Инициализация клиента при первом вызове ---
+    # --- Инициализация клиента при первом вызове (общий пул соединений, modules/llm_client.py) ---
     if not openai_client_instance:
-        api_key_local = os.getenv("OPENAI_API_KEY")
-        if not api_key_local:
+        if not os.getenv("OPENAI_API_KEY"):
             logger.error("❌ Переменная окружения OPENAI_API_KEY не задана!")
             raise RuntimeError("OpenAI API key not found.") # Прерываем выполнение
-
         try:
-            if openai and hasattr(openai, 'OpenAI'):
-                # Проверяем наличие прокси в переменных окружения
-                http_proxy = os.getenv("HTTP_PROXY")
-                https_proxy = os.getenv("HTTPS_PROXY")
-                proxies_dict = {}
-                if http_proxy: proxies_dict["http://"] = http_proxy
-                if https_proxy: proxies_dict["https://"] = https_proxy
-
-                # Создаем httpx_client ВСЕГДА, но передаем proxies только если они есть
-                if proxies_dict:
-                    logger.info(f"Обнаружены настройки прокси для OpenAI: {proxies_dict}")
-                    http_client = httpx.Client(proxies=proxies_dict)
-                else:
-                    logger.info("Прокси не обнаружены, создаем httpx.Client без аргумента proxies.")
-                    http_client = httpx.Client() # Инициализируем без proxies
-
-                # Передаем созданный http_client в OpenAI
-                openai_client_instance = openai.OpenAI(api_key=api_key_local, http_client=http_client)
-                logger.info("✅ Клиент OpenAI (>1.0) инициализирован.")
-
-            else:
-                logger.error("❌ Модуль/класс openai.OpenAI не найден. Убедитесь, что установлена версия >= 1.0.")
-                raise ImportError("openai.OpenAI class not found.")
+            openai_client_instance = get_openai_client(config=config_manager_instance)
         except Exception as init_err:
             logger.error(f"❌ Ошибка инициализации клиента OpenAI: {init_err}", exc_info=True)
-            # Проверяем, не связана ли ошибка с 'proxies' снова
-            if "got an unexpected keyword argument 'proxies'" in str(init_err):
-                logger.error("!!! Повторная ошибка 'unexpected keyword argument proxies'. Проблема глубже, возможно, в httpx или окружении.")
             raise RuntimeError(f"Failed to initialize OpenAI client: {init_err}") from init_err
+        if not openai_client_instance:
+            raise RuntimeError("Failed to initialize OpenAI client (см. лог llm_client).")
     # --- Конец инициализации клиента ---
 
     if not config_manager_instance:
@@ -137,10 +192,24 @@ def call_openai(prompt_text: str, prompt_config_key: str, use_json_mode=False, t
         request_params = { "model": openai_model, "messages": messages, "max_tokens": max_tokens, "temperature": temp }
         if use_json_mode: request_params["response_format"] = {"type": "json_object"}
 
-        response = openai_client_instance.chat.completions.create(**request_params)
+        response_content = None
+        if use_json_mode and config_manager_instance.get("OPENAI_SETTINGS.stream_json", False):
+            # Граница длины - только по замерам архивных ответов ключа (без замеров границы нет)
+            max_chars = resolve_max_chars(config_manager_instance.get("OPENAI_SETTINGS.stream_max_output_chars", {}),
+                                          prompt_config_key)
+            guard = JsonStreamGuard(required_keys=required_keys, value_validators=value_validators, max_chars=max_chars)
+            streamed_text = _stream_json_completion(request_params, prompt_config_key, openai_model, guard)
+            if streamed_text is None:
+                return None
+            response_content = streamed_text.strip()
+        else:
+            # Учет токенов и времени по ключу промпта (modules/token_accounting.py)
+            response = timed_openai_call(prompt_config_key, openai_model,
+                                         openai_client_instance.chat.completions.create, request_params)
+            if response.choices and response.choices[0].message and response.choices[0].message.content:
+                response_content = response.choices[0].message.content.strip()
 
-        if response.choices and response.choices[0].message and response.choices[0].message.content:
-            response_content = response.choices[0].message.content.strip()
+        if response_content:
             logger.debug(f"Сырой ответ OpenAI: {response_content[:500]}...")
             # --- НАЧАЛО ИСПРАВЛЕНИЯ ---
             # Всегда проверяем и удаляем возможную Markdown обертку JSON
@@ -202,19 +271,11 @@ def save_content_to_b2(folder, content_dict, generation_id, config_manager_insta
     clean_base_id = generation_id.replace(".json", "")
     s3_key = f"{folder.rstrip('/')}/{clean_base_id}.json"
     timestamp_suffix = datetime.utcnow().strftime("%Y%m%d%H%M%S%f")
-    local_temp_path = f"{clean_base_id}_content_temp_{timestamp_suffix}.json"
+    local_temp_path = str(scratch_path(f"{clean_base_id}_content_temp_{timestamp_suffix}.json"))
     logger.info(f"Сохранение {clean_base_id} в B2 как {s3_key} через {local_temp_path}...")
 
     try:
-        # Проверка ключей (оставляем как было)
-        # ИЗМЕНЕНО: Добавляем 'hashtags' в список обязательных ключей
-        required_keys = ["topic", "content", "sarcasm", "script", "first_frame_description",
-                         "creative_brief", "final_mj_prompt", "final_runway_prompt", "hashtags"]
-        missing_keys = [key for key in required_keys if key not in content_dict]
-        null_keys = [key for key in required_keys if key in content_dict and content_dict[key] is None]
-        if missing_keys: logger.warning(f"⚠️ Отсутствуют ключи: {missing_keys}.")
-        if null_keys: logger.warning(f"⚠️ Ключи с null: {null_keys}.")
-
+        # Ожидаемые ключи проверяет схема контента при валидации (validate_output_json)
         ensure_directory_exists(local_temp_path) # Создаем папку перед записью
         with open(local_temp_path, 'w', encoding='utf-8') as f:
             # <<< ИЗМЕНЕНИЕ: Сохраняем без ensure_ascii=False и indent=4, т.к. поля content и sarcasm.comment уже строки JSON >>>
@@ -239,6 +300,8 @@ def save_content_to_b2(folder, content_dict, generation_id, config_manager_insta
 def validate_output_json(data: dict, logger_instance=None) -> tuple[bool, str]:
     """
     Проверяет соответствие словаря `data` требованиям ТЗ к формату полей 'content', 'sarcasm.comment' и 'hashtags'.
+    Правила - в общей схеме modules/content_schema.py (ее же используют читатели контента);
+    отсутствующие/null ожидаемые ключи логируются как предупреждения.
 
     Args:
         data: Словарь с данными для сохранения.
@@ -249,123 +312,9 @@ def validate_output_json(data: dict, logger_instance=None) -> tuple[bool, str]:
     """
     log = logger_instance if logger_instance else logger
     log.info("Запуск валидации выходного JSON...")
-
-    # --- Проверка поля 'content' (без изменений) ---
-    content_val = data.get("content")
-    if not isinstance(content_val, str):
-        msg = "Ошибка валидации: Поле 'content' не является строкой."
-        log.error(msg)
-        return False, msg
-
-    try:
-        content_json = json.loads(content_val)
-        if not isinstance(content_json, dict):
-            msg = "Ошибка валидации: Поле 'content' не содержит валидный JSON-объект."
-            log.error(msg)
-            return False, msg
-        if list(content_json.keys()) != ["текст"]:
-            msg = f"Ошибка валидации: JSON в поле 'content' должен содержать ровно один ключ 'текст'. Найдено: {list(content_json.keys())}"
-            log.error(msg)
-            return False, msg
-
-        main_text = content_json.get("текст")
-        if not isinstance(main_text, str):
-            msg = "Ошибка валидации: Значение по ключу 'текст' в поле 'content' не является строкой."
-            log.error(msg)
-            return False, msg
-        if not main_text.strip():
-            msg = "Ошибка валидации: Значение по ключу 'текст' в поле 'content' пустое."
-            log.error(msg)
-            return False, msg
-        # Проверка наличия двойных переносов (абзацев)
-        if "\n\n" not in main_text:
-            # Допускаем одну строку без двойного переноса
-            if main_text.count('\n') > 0:
-                 msg = "Ошибка валидации: Текст в поле 'content'['текст'] не разбит на абзацы с помощью '\\n\\n'."
-                 log.error(msg)
-                 return False, msg
-            else:
-                 log.debug("Текст в 'content'['текст'] состоит из одной строки, проверка '\\n\\n' пропущена.")
-
-    except json.JSONDecodeError:
-        msg = "Ошибка валидации: Не удалось распарсить JSON-строку в поле 'content'."
-        log.error(msg)
-        return False, msg
-    except Exception as e:
-        msg = f"Неожиданная ошибка при валидации 'content': {e}"
-        log.error(msg, exc_info=True)
-        return False, msg
-
-    log.debug("Валидация поля 'content' пройдена.")
-
-    # --- Проверка поля 'sarcasm.comment' (без изменений) ---
-    sarcasm_data = data.get("sarcasm")
-    # Допускаем отсутствие 'sarcasm' или 'sarcasm.comment'
-    if not isinstance(sarcasm_data, dict):
-        log.debug("Поле 'sarcasm' отсутствует или не словарь, проверка 'comment' пропущена.")
-    else:
-        comment_val = sarcasm_data.get("comment")
-        # Допускаем None или пустую строку, если комментарий не генерировался
-        if comment_val is None or comment_val == "":
-            log.debug("Поле 'sarcasm.comment' отсутствует или пустое, валидация пропущена.")
-        elif not isinstance(comment_val, str):
-            msg = "Ошибка валидации: Поле 'sarcasm.comment' не является строкой (и не None/пустое)."
-            log.error(msg)
-            return False, msg
-        else:
-            # Если строка не пустая, она должна быть валидным JSON
-            try:
-                comment_json = json.loads(comment_val)
-                if not isinstance(comment_json, dict):
-                    msg = "Ошибка валидации: Поле 'sarcasm.comment' не содержит валидный JSON-объект."
-                    log.error(msg)
-                    return False, msg
-                if list(comment_json.keys()) != ["комментарий"]:
-                    msg = f"Ошибка валидации: JSON в поле 'sarcasm.comment' должен содержать ровно один ключ 'комментарий'. Найдено: {list(comment_json.keys())}"
-                    log.error(msg)
-                    return False, msg
-
-                comment_text = comment_json.get("комментарий")
-                if not isinstance(comment_text, str):
-                    msg = "Ошибка валидации: Значение по ключу 'комментарий' в поле 'sarcasm.comment' не является строкой."
-                    log.error(msg)
-                    return False, msg
-                # Проверка на пустоту комментария не требуется по ТЗ
-
-            except json.JSONDecodeError:
-                msg = "Ошибка валидации: Не удалось распарсить JSON-строку в поле 'sarcasm.comment'."
-                log.error(msg)
-                return False, msg
-            except Exception as e:
-                msg = f"Неожиданная ошибка при валидации 'sarcasm.comment': {e}"
-                log.error(msg, exc_info=True)
-                return False, msg
-
-            log.debug("Валидация поля 'sarcasm.comment' пройдена.")
-
-    # --- НОВОЕ: Проверка поля 'hashtags' ---
-    hashtags_val = data.get("hashtags")
-    if hashtags_val is None:
-        # Допускаем отсутствие хештегов
-        log.debug("Поле 'hashtags' отсутствует, валидация пропущена.")
-    elif not isinstance(hashtags_val, list):
-        msg = "Ошибка валидации: Поле 'hashtags' не является списком (и не None)."
-        log.error(msg)
-        return False, msg
-    elif not all(isinstance(tag, str) for tag in hashtags_val):
-        msg = "Ошибка валидации: Не все элементы в списке 'hashtags' являются строками."
-        log.error(msg)
-        return False, msg
-    # Можно добавить проверку на количество хештегов, если нужно
-    # elif not (5 <= len(hashtags_val) <= 8):
-    #     msg = f"Ошибка валидации: Количество хештегов ({len(hashtags_val)}) не в диапазоне 5-8."
-    #     log.error(msg)
-    #     return False, msg
-    else:
-        log.debug("Валидация поля 'hashtags' пройдена.")
-    # --- КОНЕЦ ПРОВЕРКИ 'hashtags' ---
-
-    # --- Все проверки пройдены ---
+    document, error = decode_content_document(data, strict=True, logger_instance=log)
+    if error:
+        return False, error
     log.info("✅ Валидация выходного JSON успешно пройдена.")
     return True, "OK"
 # +++ КОНЕЦ НОВОЙ ФУНКЦИИ +++
@@ -403,6 +352,16 @@ class ContentGenerator:
         self.b2_bucket_name = self.config.get("API_KEYS.b2.bucket_name", "default-bucket")
         if not self.b2_bucket_name or self.b2_bucket_name == "default-bucket":
             logger.warning("Имя бакета B2 не задано или используется значение по умолчанию!")
+        self.tracker_store = TrackerStore(self.b2_client, self.b2_bucket_name, self.tracker_path_rel, self.tracker_path_abs)
+        self.topic_index = None
+        if self.config.get("TOPIC_DEDUP.enabled", True):
+            topic_index_path_rel = self.config.get("TOPIC_DEDUP.index_path", "data/topic_index.json")
+            self.topic_index = TopicIndex(self.b2_client, self.b2_bucket_name, topic_index_path_rel,
+                                          BASE_DIR / topic_index_path_rel,
+                                          num_perm=int(self.config.get("TOPIC_DEDUP.num_perm", 96)),
+                                          bands=int(self.config.get("TOPIC_DEDUP.bands", 24)),
+                                          shingle_size=int(self.config.get("TOPIC_DEDUP.shingle_size", 3)),
+                                          similarity_threshold=float(self.config.get("TOPIC_DEDUP.similarity_threshold", 0.6)))
 
     def _load_additional_config(self, config_key, config_name):
         """Вспомогательный метод для загрузки доп. конфигов."""
@@ -433,48 +392,35 @@ class ContentGenerator:
 
 
     def load_tracker(self):
-        """Загружает трекер тем из B2 или локального файла."""
-        tracker_path_abs = self.tracker_path_abs; tracker_path_rel = self.tracker_path_rel
-        failsafe_path_abs = self.failsafe_path_abs; bucket_name = self.b2_bucket_name
-        os.makedirs(tracker_path_abs.parent, exist_ok=True); tracker_updated_locally = False
-        if self.b2_client:
-            try:
-                self.logger.info(f"Загрузка {tracker_path_rel} из B2...")
-                timestamp_suffix = datetime.utcnow().strftime("%Y%m%d%H%M%S%f"); local_temp_tracker = f"tracker_temp_{timestamp_suffix}.json"
-                ensure_directory_exists(local_temp_tracker) # Убедимся, что папка для temp есть
-                self.b2_client.download_file(bucket_name, tracker_path_rel, local_temp_tracker)
-                shutil.copyfile(local_temp_tracker, str(tracker_path_abs)); os.remove(local_temp_tracker)
-                self.logger.info(f"✅ Загружен {tracker_path_rel} из B2.")
-            except ClientError as e:
-                 error_code = e.response.get('Error', {}).get('Code')
-                 if error_code == 'NoSuchKey' or '404' in str(e): self.logger.warning(f"⚠️ {tracker_path_rel} не найден в B2.")
-                 else: self.logger.error(f"⚠️ Ошибка B2 при загрузке трекера: {e}")
-            except Exception as e: self.logger.warning(f"⚠️ Не удалось загрузить трекер из B2: {e}")
-        else: self.logger.warning("⚠️ B2 клиент недоступен.")
-        if not tracker_path_abs.exists():
-            self.logger.warning(f"{tracker_path_abs} не найден. Создание из {failsafe_path_abs}.")
-            try:
-                ensure_directory_exists(str(failsafe_path_abs.parent)) # Проверка папки для failsafe
+        """Загружает трекер тем через TrackerStore (условный GET из B2, локальная копия как кэш)."""
+        failsafe_path_abs = self.failsafe_path_abs
+        empty_tracker = {"all_focuses": [], "used_focuses": [], "focus_data": {}}
+        tracker = self.tracker_store.load()
+        tracker_updated_locally = False
+        try:
+            if tracker is None:
+                self.logger.warning(f"Трекер не найден ни в B2, ни локально. Создание из {failsafe_path_abs}.")
                 if not failsafe_path_abs.is_file(): raise FileNotFoundError(f"Failsafe файл не найден: {failsafe_path_abs}")
                 with open(failsafe_path_abs, 'r', encoding='utf-8') as f_failsafe: failsafe_data = json.load(f_failsafe)
                 tracker = {"all_focuses": failsafe_data.get("focuses", []), "used_focuses": [], "focus_data": {}}
-                with open(tracker_path_abs, 'w', encoding='utf-8') as f_tracker: json.dump(tracker, f_tracker, ensure_ascii=False, indent=4)
-                self.logger.info(f"✅ Создан новый {tracker_path_abs}."); tracker_updated_locally = True
-            except FileNotFoundError: self.logger.error(f"❌ {failsafe_path_abs} не найден!"); return {"all_focuses": [], "used_focuses": [], "focus_data": {}}
-            except Exception as e: self.logger.error(f"❌ Ошибка создания трекера: {e}"); return {"all_focuses": [], "used_focuses": [], "focus_data": {}}
-        try:
-            with open(tracker_path_abs, 'r', encoding='utf-8') as f: tracker = json.load(f)
-            if "all_focuses" not in tracker: # Обновление структуры старого трекера
+                self.logger.info("✅ Создан новый трекер."); tracker_updated_locally = True
+            elif "all_focuses" not in tracker: # Обновление структуры старого трекера
                 self.logger.info("Обновляем структуру трекера."); failsafe_data = {}
                 if failsafe_path_abs.exists():
                      with open(failsafe_path_abs, 'r', encoding='utf-8') as f_failsafe: failsafe_data = json.load(f_failsafe)
                 tracker["all_focuses"] = failsafe_data.get("focuses", []); tracker.setdefault("used_focuses", []); tracker.setdefault("focus_data", {})
-                with open(tracker_path_abs, 'w', encoding='utf-8') as f_tracker: json.dump(tracker, f_tracker, ensure_ascii=False, indent=4)
                 tracker_updated_locally = True
-            if tracker_updated_locally: self.sync_tracker_to_b2(tracker_path_abs=tracker_path_abs, tracker_path_rel=tracker_path_rel)
-            return tracker
-        except json.JSONDecodeError: self.logger.error(f"❌ Ошибка JSON в трекере: {tracker_path_abs}."); return {"all_focuses": [], "used_focuses": [], "focus_data": {}}
-        except Exception as e: self.logger.error(f"❌ Ошибка чтения трекера {tracker_path_abs}: {e}"); return {"all_focuses": [], "used_focuses": [], "focus_data": {}}
+        except FileNotFoundError: self.logger.error(f"❌ {failsafe_path_abs} не найден!"); return empty_tracker
+        except json.JSONDecodeError: self.logger.error(f"❌ Ошибка JSON в {failsafe_path_abs}."); return empty_tracker
+        except Exception as e: self.logger.error(f"❌ Ошибка подготовки трекера: {e}"); return empty_tracker
+        if tracker_updated_locally:
+            try: self.tracker_store.save(tracker)
+            except TrackerConflict:
+                # Трекер только что создал/обновил другой генератор - берем его версию
+                self.logger.warning("⚠️ Трекер изменен другим процессом во время инициализации, перечитываем.")
+                self.tracker_store.data = None
+                tracker = self.tracker_store.load() or tracker
+        return tracker
 
     def get_valid_focus_areas(self, tracker):
         """Возвращает список доступных фокусов."""
@@ -490,26 +436,51 @@ class ContentGenerator:
         selected_focus = random.choice(valid_focuses)
         self.logger.info(f"Выбран фокус: {selected_focus}")
         used_labels = tracker.get("focus_data", {}).get(selected_focus, [])
-        exclusions_str = ", ".join(used_labels) if used_labels else "нет"
 
         prompt_config_key = "content.topic"
         prompt_template = self._get_prompt_template(prompt_config_key)
         if not prompt_template: raise ValueError(f"Промпт {prompt_config_key} не найден.")
-        prompt = prompt_template.format(focus_areas=selected_focus, exclusions=exclusions_str)
-
-        try:
-            topic_data = call_openai(prompt,
-                                     prompt_config_key=prompt_config_key,
-                                     use_json_mode=True,
-                                     config_manager_instance=self.config,
-                                     prompts_config_data_instance=self.prompts_config_data)
 
-            if not topic_data: raise ValueError("call_openai не вернул ответ для темы.")
+        # Индекс всех прошлых тем: повтор отсеивается до оплаты текста, сарказма, брифа и промптов
+        max_regenerations = 0
+        if self.topic_index is not None:
+            self.topic_index.load()
+            max_regenerations = int(self.config.get("TOPIC_DEDUP.max_regenerations", 3))
+        rejected_labels = []
 
-            full_topic = topic_data.get("full_topic"); short_topic = topic_data.get("short_topic")
-            if not full_topic or not short_topic: raise ValueError(f"Ответ для темы не содержит ключи: {topic_data}")
+        try:
+            for attempt in range(max_regenerations + 1):
+                exclusions = used_labels + rejected_labels
+                exclusions_str = ", ".join(exclusions) if exclusions else "нет"
+                prompt = prompt_template.format(focus_areas=selected_focus, exclusions=exclusions_str)
+                topic_data = call_openai(prompt,
+                                         prompt_config_key=prompt_config_key,
+                                         use_json_mode=True,
+                                         config_manager_instance=self.config,
+                                         prompts_config_data_instance=self.prompts_config_data,
+                                         required_keys=["full_topic", "short_topic"],
+                                         value_validators={"full_topic": _is_non_empty_str, "short_topic": _is_non_empty_str})
+
+                if not topic_data: raise ValueError("call_openai не вернул ответ для темы.")
+
+                full_topic = topic_data.get("full_topic"); short_topic = topic_data.get("short_topic")
+                if not full_topic or not short_topic: raise ValueError(f"Ответ для темы не содержит ключи: {topic_data}")
+                duplicate = self.topic_index.find_duplicate(full_topic) if self.topic_index is not None else None
+                if not duplicate:
+                    break
+                matched_topic, similarity = duplicate
+                if attempt < max_regenerations:
+                    self.logger.warning(f"🔁 Тема '{full_topic}' повторяет '{matched_topic}' (сходство {similarity:.2f}). "
+                                        f"Повторная генерация ({attempt + 1}/{max_regenerations}).")
+                    rejected_labels.append(short_topic)
+                else:
+                    self.logger.warning(f"⚠️ Тема '{full_topic}' похожа на '{matched_topic}' (сходство {similarity:.2f}), "
+                                        f"но лимит повторных генераций исчерпан. Принимаем.")
             self.logger.info(f"Сгенерирована тема: '{full_topic}' (Ярлык: '{short_topic}')")
-            self.update_tracker(selected_focus, short_topic, tracker)
+            tracker = self.update_tracker(selected_focus, short_topic, tracker)
+            if self.topic_index is not None and self.topic_index.add(full_topic):
+                if not self.topic_index.save():
+                    self.logger.error("⚠️ Индекс тем не записан в B2 (см. ошибки выше).")
             self.save_to_generated_content("topic", {"full_topic": full_topic, "short_topic": short_topic})
             content_metadata = {"theme": "tragic" if "(т)" in selected_focus else "normal"}
             return full_topic, content_metadata, selected_focus
@@ -519,34 +490,28 @@ class ContentGenerator:
         except Exception as e: self.logger.error(f"Ошибка генерации темы: {e}", exc_info=True); raise
 
     def update_tracker(self, focus, short_topic, tracker):
-        """Обновляет данные трекера в памяти и сохраняет его."""
-        used_focuses = tracker.get("used_focuses", []); focus_data = tracker.get("focus_data", {})
-        if focus in used_focuses: used_focuses.remove(focus)
-        used_focuses.insert(0, focus); tracker["used_focuses"] = used_focuses[:15]
-        focus_labels = focus_data.setdefault(focus, [])
-        if short_topic in focus_labels: focus_labels.remove(short_topic)
-        focus_labels.insert(0, short_topic); focus_data[focus] = focus_labels[:5]
-        tracker["focus_data"] = focus_data
-        self.save_topics_tracker(tracker)
-        self.sync_tracker_to_b2(tracker_path_abs=self.tracker_path_abs, tracker_path_rel=self.tracker_path_rel)
-
-    def save_topics_tracker(self, tracker):
-        """Сохраняет трекер в локальный файл."""
-        try:
-            ensure_directory_exists(str(self.tracker_path_abs.parent)) # Используем parent
-            with open(self.tracker_path_abs, "w", encoding="utf-8") as file: json.dump(tracker, file, ensure_ascii=False, indent=4)
-            self.logger.info(f"Трекер тем сохранен: {self.tracker_path_abs}")
-        except Exception as e: self.logger.error(f"Ошибка сохранения трекера: {e}")
-
-    def sync_tracker_to_b2(self, tracker_path_abs, tracker_path_rel):
-        """Синхронизирует локальный трекер с B2."""
-        if not self.b2_client: self.logger.warning("B2 клиент недоступен."); return
-        if not tracker_path_abs.is_file(): self.logger.warning(f"Локальный трекер {tracker_path_abs} не найден."); return # Проверка is_file
-        try:
-            self.logger.info(f"Синхронизация {tracker_path_abs} с B2 как {tracker_path_rel}...")
-            self.b2_client.upload_file(str(tracker_path_abs), self.b2_bucket_name, tracker_path_rel)
-            self.logger.info(f"✅ {tracker_path_rel} синхронизирован с B2.")
-        except Exception as e: self.logger.error(f"⚠️ Не удалось загрузить трекер {tracker_path_rel} в B2: {e}")
+        """
+        Обновляет трекер и записывает его в B2 условно (If-Match).
+        При конфликте изменение применяется к свежей версии, чтобы не затереть историю других генераторов.
+        Возвращает актуальный трекер (после конфликта - перечитанный из B2 с примененным изменением).
+        """
+        def apply_focus(current_tracker):
+            used_focuses = current_tracker.get("used_focuses", []); focus_data = current_tracker.get("focus_data", {})
+            if focus in used_focuses: used_focuses.remove(focus)
+            used_focuses.insert(0, focus); current_tracker["used_focuses"] = used_focuses[:15]
+            focus_labels = focus_data.setdefault(focus, [])
+            if short_topic in focus_labels: focus_labels.remove(short_topic)
+            focus_labels.insert(0, short_topic); focus_data[focus] = focus_labels[:5]
+            current_tracker["focus_data"] = focus_data
+
+        if self.tracker_store.data is not tracker:
+            self.tracker_store.data = tracker
+        updated_tracker = self.tracker_store.update(apply_focus)
+        if updated_tracker is not None:
+            self.logger.info(f"Трекер тем обновлен: фокус '{focus}', ярлык '{short_topic}'.")
+            return updated_tracker
+        self.logger.error("⚠️ Трекер тем не записан в B2 (см. ошибки выше).")
+        return self.tracker_store.data if self.tracker_store.data is not None else tracker
 
     def _get_prompt_template(self, prompt_config_key: str) -> str | None:
         """Вспомогательный метод для получения шаблона промпта."""
@@ -618,7 +583,9 @@ class ContentGenerator:
                                     prompt_config_key=prompt_config_key,
                                     use_json_mode=True, # Опрос - JSON
                                     config_manager_instance=self.config,
-                                    prompts_config_data_instance=self.prompts_config_data)
+                                    prompts_config_data_instance=self.prompts_config_data,
+                                    required_keys=["question", "options"],
+                                    value_validators={"options": lambda v: isinstance(v, list) and len(v) == 3})
 
             if not poll_data: self.logger.error(f"❌ Ошибка генерации опроса ({prompt_config_key})."); return {}
 
@@ -652,7 +619,9 @@ class ContentGenerator:
                                         prompt_config_key=prompt_config_key,
                                         use_json_mode=True, # Ожидаем JSON
                                         config_manager_instance=self.config,
-                                        prompts_config_data_instance=self.prompts_config_data)
+                                        prompts_config_data_instance=self.prompts_config_data,
+                                        required_keys=["hashtags"],
+                                        value_validators={"hashtags": _is_list_of_str})
 
             if not hashtags_data:
                 self.logger.error(f"❌ Ошибка генерации хештегов ({prompt_config_key}).")
@@ -740,9 +709,125 @@ class ContentGenerator:
         else: return "- (Неверный формат данных)"
         return "\n".join(lines).strip()
 
-    def run(self, generation_id):
-        """Основной процесс генерации контента для заданного ID."""
-        self.logger.info(f"--- Запуск ContentGenerator.run для ID: {generation_id} ---")
+    def format_prompt_with_budget(self, prompt_config_key: str, template: str, trimmable_keys: list[str], **format_kwargs) -> str:
+        """
+        Форматирует шаблон и применяет бюджет TOKEN_ACCOUNTING.prompt_budgets для шага:
+        при превышении обрезает списочные фрагменты из trimmable_keys.
+        """
+        budget = get_prompt_budget(self.config, prompt_config_key)
+        model = self.config.get("OPENAI_SETTINGS.model", "gpt-4o")
+        return fit_prompt_to_budget(template, format_kwargs, trimmable_keys, budget, model=model, step_key=prompt_config_key)
+
+    def build_brief_list_strings(self) -> dict:
+        """Готовит списки creative_config для промптов креативного брифа (шаги 6.1-6.3)."""
+        main_prompts_list = self.creative_config_data.get("creative_prompts", {}).get("main", [])
+        return {
+            "moods_list_str": self.format_list_for_prompt(self.creative_config_data.get("moods", []), use_weights=True),
+            "arcs_list_str": self.format_list_for_prompt(self.creative_config_data.get("emotional_arcs", [])),
+            "prompts_list_str": self.format_list_for_prompt(main_prompts_list, use_weights=True),
+            "perspectives_list_str": self.format_list_for_prompt(self.creative_config_data.get("perspective_types", [])),
+            "metaphors_list_str": self.format_list_for_prompt(self.creative_config_data.get("visual_metaphor_types", [])),
+            "directors_list_str": self.format_list_for_prompt(self.creative_config_data.get("director_styles", [])),
+            "artists_list_str": self.format_list_for_prompt(self.creative_config_data.get("artist_styles", [])),
+        }
+
+    def generate_creative_brief(self, topic: str) -> dict:
+        """
+        Креативный бриф {"core", "driver", "aesthetic"}.
+        При WORKFLOW.fused_creative_brief сначала пробует один объединенный вызов,
+        при его неудаче - обычные три шага. Выбрасывает ValueError, если бриф получить не удалось.
+        """
+        list_strings = self.build_brief_list_strings()
+        if self.config.get("WORKFLOW.fused_creative_brief", False):
+            creative_brief = self.generate_creative_brief_fused(topic, list_strings)
+            if creative_brief:
+                return creative_brief
+            self.logger.warning("⚠️ Объединенный бриф не получен, переход к многошаговому режиму (6.1-6.3).")
+        return self.generate_creative_brief_multi_step(topic, list_strings)
+
+    def generate_creative_brief_fused(self, topic: str, list_strings: dict) -> dict | None:
+        """Шаги 6.1-6.3 одним вызовом (multi_step.fused_brief). Возвращает бриф или None."""
+        self.logger.info("--- Шаги 6.1-6.3: Объединенный бриф ---")
+        prompt_key = "multi_step.fused_brief"
+        template = self._get_prompt_template(prompt_key)
+        if not template:
+            self.logger.error(f"{prompt_key} не найден.")
+            return None
+        prompt = self.format_prompt_with_budget(prompt_key, template, list(list_strings.keys()),
+                                                input_text=topic, **list_strings)
+        fused_brief = call_openai(prompt, prompt_config_key=prompt_key, use_json_mode=True,
+                                  config_manager_instance=self.config,
+                                  prompts_config_data_instance=self.prompts_config_data,
+                                  required_keys=FUSED_SECTIONS,
+                                  value_validators={"core": validate_core_brief,
+                                                    "driver": validate_driver_brief,
+                                                    "aesthetic": validate_aesthetic_brief})
+        if not fused_brief:
+            return None
+        return split_fused_brief(fused_brief)
+
+    def generate_creative_brief_multi_step(self, topic: str, list_strings: dict) -> dict:
+        """Шаги 6.1-6.3 тремя последовательными вызовами. Выбрасывает ValueError при неверном ответе."""
+        # Шаг 6.1: Ядро
+        self.logger.info("--- Шаг 6.1: Ядро ---");
+        prompt_key1 = "multi_step.step1_core";
+        tmpl1 = self._get_prompt_template(prompt_key1);
+        if not tmpl1: raise ValueError(f"{prompt_key1} не найден.")
+        prompt1 = self.format_prompt_with_budget(prompt_key1, tmpl1, ["moods_list_str", "arcs_list_str"],
+                                                 input_text=topic, moods_list_str=list_strings["moods_list_str"],
+                                                 arcs_list_str=list_strings["arcs_list_str"])
+        core_brief = call_openai(prompt1, prompt_config_key=prompt_key1, use_json_mode=True,
+                                 config_manager_instance=self.config,
+                                 prompts_config_data_instance=self.prompts_config_data,
+                                 required_keys=CORE_KEYS)
+        if not validate_core_brief(core_brief): raise ValueError(f"Шаг 6.1: неверный JSON {core_brief}.")
+
+        # Шаг 6.2: Драйвер
+        self.logger.info("--- Шаг 6.2: Драйвер ---");
+        prompt_key2 = "multi_step.step2_driver";
+        tmpl2 = self._get_prompt_template(prompt_key2);
+        if not tmpl2: raise ValueError(f"{prompt_key2} не найден.")
+        prompt2 = self.format_prompt_with_budget(prompt_key2, tmpl2,
+                                                 ["prompts_list_str", "perspectives_list_str", "metaphors_list_str"],
+                                                 input_text=topic,
+                                                 chosen_emotional_core_json=json.dumps(core_brief, ensure_ascii=False, indent=2),
+                                                 prompts_list_str=list_strings["prompts_list_str"],
+                                                 perspectives_list_str=list_strings["perspectives_list_str"],
+                                                 metaphors_list_str=list_strings["metaphors_list_str"])
+        driver_brief = call_openai(prompt2, prompt_config_key=prompt_key2, use_json_mode=True,
+                                   config_manager_instance=self.config,
+                                   prompts_config_data_instance=self.prompts_config_data,
+                                   required_keys=DRIVER_KEYS)
+        if not validate_driver_brief(driver_brief): raise ValueError(f"Шаг 6.2: неверный JSON {driver_brief}.")
+
+        # Шаг 6.3: Эстетика
+        self.logger.info("--- Шаг 6.3: Эстетика ---");
+        prompt_key3 = "multi_step.step3_aesthetic";
+        tmpl3 = self._get_prompt_template(prompt_key3);
+        if not tmpl3: raise ValueError(f"{prompt_key3} не найден.")
+        prompt3 = self.format_prompt_with_budget(prompt_key3, tmpl3, ["directors_list_str", "artists_list_str"],
+                                                 input_text=topic,
+                                                 chosen_emotional_core_json=json.dumps(core_brief, ensure_ascii=False, indent=2),
+                                                 chosen_driver_json=json.dumps(driver_brief, ensure_ascii=False, indent=2),
+                                                 directors_list_str=list_strings["directors_list_str"],
+                                                 artists_list_str=list_strings["artists_list_str"])
+        aesthetic_brief = call_openai(prompt3, prompt_config_key=prompt_key3, use_json_mode=True,
+                                      config_manager_instance=self.config,
+                                      prompts_config_data_instance=self.prompts_config_data,
+                                      required_keys=AESTHETIC_KEYS,
+                                      value_validators={"style_needed": lambda v: isinstance(v, bool),
+                                                        "style_keywords": lambda v: v is None or _is_list_of_str(v)})
+        if not validate_aesthetic_brief(aesthetic_brief): raise ValueError("Шаг 6.3: неверный JSON.")
+
+        return {"core": core_brief, "driver": driver_brief, "aesthetic": aesthetic_brief}
+
+    def run(self, generation_id, target_folder="666/", set_generation_flag=True):
+        """
+        Основной процесс генерации контента для заданного ID.
+        target_folder: папка B2 для итогового JSON (666/ или папка бэклога).
+        set_generation_flag: выставлять ли generation=true в config_midjourney.json (для бэклога - нет).
+        """
+        self.logger.info(f"--- Запуск ContentGenerator.run для ID: {generation_id} (папка: {target_folder}) ---")
         if not generation_id: raise ValueError("generation_id не может быть пустым.")
         if not self.creative_config_data or not self.prompts_config_data: raise RuntimeError("Конфиги не загружены.")
 
@@ -821,92 +906,8 @@ class ContentGenerator:
             enable_russian_translation = self.config.get("WORKFLOW.enable_russian_translation", False)
             self.logger.info(f"Перевод {'ВКЛЮЧЕН' if enable_russian_translation else 'ОТКЛЮЧЕН'}.")
             try:
-                # Подготовка списков для промптов шага 6
-                moods_list_str = self.format_list_for_prompt(self.creative_config_data.get("moods", []),
-                                                             use_weights=True)
-                arcs_list_str = self.format_list_for_prompt(self.creative_config_data.get("emotional_arcs", []))
-                main_prompts_list = self.creative_config_data.get("creative_prompts", {}).get("main", [])
-                prompts_list_str = self.format_list_for_prompt(main_prompts_list, use_weights=True)
-                perspectives_list_str = self.format_list_for_prompt(
-                    self.creative_config_data.get("perspective_types", []))
-                metaphors_list_str = self.format_list_for_prompt(
-                    self.creative_config_data.get("visual_metaphor_types", []))
-                directors_list_str = self.format_list_for_prompt(self.creative_config_data.get("director_styles", []))
-                artists_list_str = self.format_list_for_prompt(self.creative_config_data.get("artist_styles", []))
-
-                # Шаг 6.1: Ядро
-                self.logger.info("--- Шаг 6.1: Ядро ---");
-                prompt_key1 = "multi_step.step1_core";
-                tmpl1 = self._get_prompt_template(prompt_key1);
-                if not tmpl1: raise ValueError(f"{prompt_key1} не найден.")
-                prompt1 = tmpl1.format(input_text=topic, moods_list_str=moods_list_str, arcs_list_str=arcs_list_str)
-                core_brief = call_openai(prompt1, prompt_config_key=prompt_key1, use_json_mode=True,
-                                         config_manager_instance=self.config,
-                                         prompts_config_data_instance=self.prompts_config_data)
-                if not core_brief or not all(
-                    k in core_brief for k in ["chosen_type", "chosen_value", "justification"]): raise ValueError(
-                    f"Шаг 6.1: неверный JSON {core_brief}.")
-
-                # Шаг 6.2: Драйвер
-                self.logger.info("--- Шаг 6.2: Драйвер ---");
-                prompt_key2 = "multi_step.step2_driver";
-                tmpl2 = self._get_prompt_template(prompt_key2);
-                if not tmpl2: raise ValueError(f"{prompt_key2} не найден.")
-                prompt2 = tmpl2.format(input_text=topic,
-                                       chosen_emotional_core_json=json.dumps(core_brief, ensure_ascii=False, indent=2),
-                                       prompts_list_str=prompts_list_str, perspectives_list_str=perspectives_list_str,
-                                       metaphors_list_str=metaphors_list_str)
-                driver_brief = call_openai(prompt2, prompt_config_key=prompt_key2, use_json_mode=True,
-                                           config_manager_instance=self.config,
-                                           prompts_config_data_instance=self.prompts_config_data)
-                if not driver_brief or not all(k in driver_brief for k in ["chosen_driver_type", "chosen_driver_value",
-                                                                           "justification"]): raise ValueError(
-                    f"Шаг 6.2: неверный JSON {driver_brief}.")
-
-                # Шаг 6.3: Эстетика
-                self.logger.info("--- Шаг 6.3: Эстетика ---");
-                prompt_key3 = "multi_step.step3_aesthetic";
-                tmpl3 = self._get_prompt_template(prompt_key3);
-                if not tmpl3: raise ValueError(f"{prompt_key3} не найден.")
-                prompt3 = tmpl3.format(input_text=topic,
-                                       chosen_emotional_core_json=json.dumps(core_brief, ensure_ascii=False, indent=2),
-                                       chosen_driver_json=json.dumps(driver_brief, ensure_ascii=False, indent=2),
-                                       directors_list_str=directors_list_str, artists_list_str=artists_list_str)
-                aesthetic_brief = call_openai(prompt3, prompt_config_key=prompt_key3, use_json_mode=True,
-                                              config_manager_instance=self.config,
-                                              prompts_config_data_instance=self.prompts_config_data)
-                # Валидация aesthetic_brief (остается без изменений)
-                valid_step3 = False
-                if isinstance(aesthetic_brief, dict):
-                    style_needed = aesthetic_brief.get("style_needed", False);
-                    base_keys_exist = all(k in aesthetic_brief for k in
-                                          ["style_needed", "chosen_style_type", "chosen_style_value", "style_keywords",
-                                           "justification"])
-                    if base_keys_exist:
-                        if not style_needed:
-                            if all(aesthetic_brief.get(k) is None for k in
-                                   ["chosen_style_type", "chosen_style_value", "style_keywords", "justification"]):
-                                valid_step3 = True
-                            else:
-                                self.logger.warning(
-                                    f"Шаг 6.3: style_needed=false, но ключи не null. Исправляем."); aesthetic_brief.update(
-                                    {k: None for k in ["chosen_style_type", "chosen_style_value", "style_keywords",
-                                                       "justification"]}); valid_step3 = True
-                        else:
-                            if all([aesthetic_brief.get("chosen_style_type"), aesthetic_brief.get("chosen_style_value"),
-                                    isinstance(aesthetic_brief.get("style_keywords"), list),
-                                    aesthetic_brief.get("justification")]):
-                                valid_step3 = True
-                            else:
-                                logger.error(f"Шаг 6.3: style_needed=true, но значения некорректны.")
-                    else:
-                        logger.error(f"Шаг 6.3: Отсутствуют базовые ключи.")
-                else:
-                    logger.error(f"Шаг 6.3: Ответ не словарь.")
-                if not valid_step3: raise ValueError("Шаг 6.3: неверный JSON.")
-
-                # Сборка Брифа
-                creative_brief = {"core": core_brief, "driver": driver_brief, "aesthetic": aesthetic_brief};
+                # Шаги 6.1-6.3: Креативный бриф (три вызова или один объединенный)
+                creative_brief = self.generate_creative_brief(topic)
                 self.logger.info("--- Шаг 6.4: Бриф Собран ---");
                 self.logger.debug(f"Бриф: {json.dumps(creative_brief, ensure_ascii=False, indent=2)}");
                 self.save_to_generated_content("creative_brief", creative_brief)
@@ -920,7 +921,8 @@ class ContentGenerator:
                                        creative_brief_json=json.dumps(creative_brief, ensure_ascii=False, indent=2))
                 script_frame_data = call_openai(prompt5, prompt_config_key=prompt_key5, use_json_mode=True,
                                                 config_manager_instance=self.config,
-                                                prompts_config_data_instance=self.prompts_config_data)
+                                                prompts_config_data_instance=self.prompts_config_data,
+                                                required_keys=["script", "first_frame_description"])
                 if not script_frame_data or not all(
                     k in script_frame_data for k in ["script", "first_frame_description"]): raise ValueError(
                     f"Шаг 6.5: неверный JSON {script_frame_data}.")
@@ -951,7 +953,9 @@ class ContentGenerator:
                                          style_parameter_str=style_parameter_str_for_prompt)
                 mj_prompt_data = call_openai(prompt6a, prompt_config_key=prompt_key6a, use_json_mode=True,
                                              config_manager_instance=self.config,
-                                             prompts_config_data_instance=self.prompts_config_data)
+                                             prompts_config_data_instance=self.prompts_config_data,
+                                             required_keys=["final_mj_prompt"],
+                                             value_validators={"final_mj_prompt": _is_non_empty_str})
                 if not mj_prompt_data or "final_mj_prompt" not in mj_prompt_data: raise ValueError(
                     f"Шаг 6.6a: неверный JSON {mj_prompt_data}.")
                 final_mj_prompt_en = mj_prompt_data["final_mj_prompt"];
@@ -968,7 +972,9 @@ class ContentGenerator:
                                          input_text=topic)
                 runway_prompt_data = call_openai(prompt6b, prompt_config_key=prompt_key6b, use_json_mode=True,
                                                  config_manager_instance=self.config,
-                                                 prompts_config_data_instance=self.prompts_config_data)
+                                                 prompts_config_data_instance=self.prompts_config_data,
+                                                 required_keys=["final_runway_prompt"],
+                                                 value_validators={"final_runway_prompt": _is_non_empty_str})
                 if not runway_prompt_data or "final_runway_prompt" not in runway_prompt_data: raise ValueError(
                     f"Шаг 6.6b: неверный JSON {runway_prompt_data}.")
                 final_runway_prompt_en = runway_prompt_data["final_runway_prompt"];
@@ -1068,7 +1074,7 @@ class ContentGenerator:
             if not is_valid:
                 self.logger.error(f"❌ ВАЛИДАЦИЯ НЕ ПРОЙДЕНА для ID {generation_id}: {validation_message}")
                 error_filename = f"error_{generation_id}_{datetime.utcnow().strftime('%Y%m%d%H%M%S')}.json"
-                local_error_path = f"temp_error_{error_filename}"
+                local_error_path = str(scratch_path(f"temp_error_{error_filename}"))
                 error_data_to_save = {"validation_error": validation_message, "generation_id": generation_id,
                                       "timestamp_utc": datetime.utcnow().isoformat(),
                                       "invalid_data": complete_content_dict}
@@ -1081,11 +1087,16 @@ class ContentGenerator:
             else:
                 self.logger.info(f"✅ Валидация успешно пройдена для ID {generation_id}.")
 
-            # Шаг 8: Сохранение в B2 (папка 666/)
-            self.logger.info(f"Сохранение валидного контента в B2 для ID {generation_id}...")
-            if not save_content_to_b2("666/", complete_content_dict, generation_id, self.config):
+            # Шаг 8: Сохранение в B2 (папка 666/ или бэклог)
+            self.logger.info(f"Сохранение валидного контента в B2 ({target_folder}) для ID {generation_id}...")
+            if not save_content_to_b2(target_folder, complete_content_dict, generation_id, self.config):
                 raise Exception(f"Не удалось сохранить итоговый контент в B2 для ID {generation_id}")
 
+            # Контент для бэклога: флаг generation выставит b2_storage_manager при переносе в 666/
+            if not set_generation_flag:
+                self.logger.info(f"✅ ContentGenerator.run завершен для ID {generation_id} (бэклог, config_midjourney не изменен).")
+                return
+
             # Шаг 9: Обновление config_midjourney.json
             self.logger.info(f"Обновление config_midjourney.json для ID: {generation_id}...")
             try:
@@ -1093,7 +1104,7 @@ class ContentGenerator:
                 if not s3_client_mj: raise ConnectionError("B2 клиент недоступен.")
                 config_mj_remote_path = self.config.get('FILE_PATHS.config_midjourney', 'config/config_midjourney.json')
                 timestamp_suffix = datetime.utcnow().strftime("%Y%m%d%H%M%S%f")
-                config_mj_local_path = f"config_midjourney_{generation_id}_temp_{timestamp_suffix}.json"
+                config_mj_local_path = str(scratch_path(f"config_midjourney_{generation_id}_temp_{timestamp_suffix}.json"))
                 bucket_name = self.b2_bucket_name
                 ensure_directory_exists(config_mj_local_path)
                 config_mj = load_b2_json(s3_client_mj, bucket_name, config_mj_remote_path, config_mj_local_path,
@@ -1122,13 +1133,21 @@ class ContentGenerator:
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Generate content for a specific ID.')
     parser.add_argument('--generation_id', type=str, required=True, help='The generation ID.')
+    parser.add_argument('--backlog', action='store_true', default=False,
+                        help='Save content to the backlog folder (CONTENT_BACKLOG.folder) without setting generation flag.')
     args = parser.parse_args()
     generation_id_main = args.generation_id
     if not generation_id_main: logger.critical("generation_id не передан!"); sys.exit(1)
-    logger.info(f"--- Запуск generate_content.py для ID: {generation_id_main} ---")
+    logger.info(f"--- Запуск generate_content.py для ID: {generation_id_main} (бэклог: {args.backlog}) ---")
     exit_code = 1
+    generator = None
     try:
-        generator = ContentGenerator(); generator.run(generation_id_main)
+        generator = ContentGenerator()
+        if args.backlog:
+            backlog_folder = generator.config.get("CONTENT_BACKLOG.folder", "pending/")
+            generator.run(generation_id_main, target_folder=backlog_folder, set_generation_flag=False)
+        else:
+            generator.run(generation_id_main)
         logger.info(f"--- Скрипт generate_content.py успешно завершен для ID: {generation_id_main} ---")
         exit_code = 0
     except ValueError as val_err: # Ловим ошибку валидации
@@ -1139,4 +1158,9 @@ if __name__ == "__main__":
         logger.error(f"!!! КРИТИЧЕСКАЯ ОШИБКА generate_content.py для ID {generation_id_main} !!!")
         logger.exception(main_err)
         exit_code = 1 # Устанавливаем код ошибки
-    finally: logger.info(f"--- Завершение generate_content.py с кодом выхода: {exit_code} ---"); sys.exit(exit_code)
+    finally:
+        # Отчет по токенам/задержкам шагов (накопительный, в B2)
+        if generator is not None:
+            flush_usage_report(generator.b2_client, generator.b2_bucket_name, generation_id_main,
+                               "generate_content", config=generator.config)
+        logger.info(f"--- Завершение generate_content.py с кодом выхода: {exit_code} ---"); sys.exit(exit_code)
@@ -7,7 +7,7 @@ print("--- SCRIPT START (generate_media.py v4 - sarcasm integrated - FULL) ---",
 # В файле scripts/generate_media.py
 
 # --- Убедитесь, что все необходимые импорты присутствуют в начале файла ---
-import os, json, sys, time, argparse, requests, shutil, base64, re, urllib.parse, logging, httpx
+import os, json, sys, time, argparse, requests, re, urllib.parse, logging
 from datetime import datetime, timezone
 from pathlib import Path
 # --- Импорт кастомных модулей ---
@@ -29,6 +29,22 @@ try:
     from modules.sarcasm_image_utils import add_text_to_image_sarcasm
     # ++++++++++++++++++++
     from modules.api_clients import get_b2_client
+    from modules.token_accounting import timed_openai_call, flush_usage_report
+    from modules.llm_client import get_openai_client
+    from modules.content_schema import decode_content_document
+    from modules.stage_dag import StageDAG
+    from modules.scratch import create_scratch_dir, remove_scratch_dir, scratch_path
+    from modules.vision_images import create_vision_image_cache
+    from modules.stream_transfer import get_stream_transfer_settings, stream_url_to_b2
+    from modules.placeholder_image import render_placeholder
+    from modules.font_registry import log_stats as log_font_stats
+    from modules.title_render import build_title_spec, save_title_spec, TITLE_BASE_SUFFIX, TITLE_SPEC_SUFFIX
+    from modules.ffmpeg_tools import find_ffmpeg, encode_still_video, get_delivery_settings, prepare_delivery_video
+    from modules.runway_input import get_runway_input_settings, build_prompt_image, delete_runway_input
+    from modules.runway_tasks import (
+        get_runway_task_settings, get_runway_task, new_runway_task, schedule_next_poll,
+        task_expired, task_age_seconds, RUNWAY_TASK_KEY, RUNWAY_WAITING_STATUS, RUNWAY_IN_PROGRESS_STATUSES
+    )
     # from modules.error_handler import handle_error # Если используется
 except ModuleNotFoundError as import_err:
     # Попытка относительного импорта
@@ -48,6 +64,22 @@ except ModuleNotFoundError as import_err:
         from modules.sarcasm_image_utils import add_text_to_image_sarcasm
         # ++++++++++++++++++++
         from modules.api_clients import get_b2_client
+        from modules.token_accounting import timed_openai_call, flush_usage_report
+        from modules.llm_client import get_openai_client
+        from modules.content_schema import decode_content_document
+        from modules.stage_dag import StageDAG
+        from modules.scratch import create_scratch_dir, remove_scratch_dir, scratch_path
+        from modules.vision_images import create_vision_image_cache
+        from modules.stream_transfer import get_stream_transfer_settings, stream_url_to_b2
+        from modules.placeholder_image import render_placeholder
+        from modules.font_registry import log_stats as log_font_stats
+        from modules.title_render import build_title_spec, save_title_spec, TITLE_BASE_SUFFIX, TITLE_SPEC_SUFFIX
+        from modules.ffmpeg_tools import find_ffmpeg, encode_still_video, get_delivery_settings, prepare_delivery_video
+        from modules.runway_input import get_runway_input_settings, build_prompt_image, delete_runway_input
+        from modules.runway_tasks import (
+            get_runway_task_settings, get_runway_task, new_runway_task, schedule_next_poll,
+            task_expired, task_age_seconds, RUNWAY_TASK_KEY, RUNWAY_WAITING_STATUS, RUNWAY_IN_PROGRESS_STATUSES
+        )
         # from modules.error_handler import handle_error # Если используется
         del _BASE_DIR_FOR_IMPORT
     except ModuleNotFoundError as import_err_rel:
@@ -159,12 +191,21 @@ except Exception as _cfg_err:
 # --- Проверка доступности сторонних библиотек (после инициализации logger) ---
 if not RUNWAY_SDK_AVAILABLE: logger.warning("RunwayML SDK недоступен.")
 if not PIL_AVAILABLE: logger.warning("Библиотека Pillow (PIL) недоступна. Функции обработки изображений будут отключены.") # Добавили проверку
-if ImageClip is None: logger.warning("Библиотека MoviePy недоступна.")
+if ImageClip is None: logger.warning("Библиотека MoviePy недоступна (mock-видео - только через ffmpeg).")
 if openai is None: logger.warning("Библиотека OpenAI недоступна.")
 # ---------------------------------------------------------------------------
 
 # === Глобальная переменная для клиента OpenAI ===
 openai_client_instance = None
+# Кэш миниатюр для vision-вызовов (создается в main, None - отправлять URL как есть)
+vision_image_cache = None
+
+
+def vision_image_part(url: str) -> dict:
+    """Часть сообщения для изображения: миниатюра data URI из кэша или исходный URL."""
+    if vision_image_cache is not None:
+        return vision_image_cache.image_part(url)
+    return {"type": "image_url", "image_url": {"url": url}}
 
 # === Вспомогательные Функции (оставляем как есть, кроме добавления Pillow) ===
 
@@ -184,35 +225,17 @@ def _initialize_openai_client():
         logger.error("❌ Переменная окружения OPENAI_API_KEY не задана для generate_media!")
         return False # Не можем инициализировать
 
+    # Общий клиент и пул соединений процесса (modules/llm_client.py)
     try:
-        if hasattr(openai, 'OpenAI'):
-            # Проверяем наличие прокси
-            http_proxy = os.getenv("HTTP_PROXY")
-            https_proxy = os.getenv("HTTPS_PROXY")
-            proxies_dict = {}
-            if http_proxy: proxies_dict["http://"] = http_proxy
-            if https_proxy: proxies_dict["https://"] = https_proxy
-
-            # Создаем httpx_client
-            if proxies_dict:
-                logger.info(f"Обнаружены настройки прокси для OpenAI (generate_media): {proxies_dict}")
-                http_client = httpx.Client(proxies=proxies_dict)
-            else:
-                logger.info("Прокси не обнаружены (generate_media), создаем httpx.Client без аргумента proxies.")
-                http_client = httpx.Client()
-
-            # Передаем http_client в OpenAI
-            openai_client_instance = openai.OpenAI(api_key=OPENAI_API_KEY, http_client=http_client)
-            logger.info("✅ Клиент OpenAI (>1.0) инициализирован (generate_media).")
-            return True
-        else:
-            logger.error("❌ Класс openai.OpenAI не найден в generate_media.")
-            return False
+        openai_client_instance = get_openai_client(api_key=OPENAI_API_KEY, config=config)
     except Exception as init_err:
         logger.error(f"❌ Ошибка инициализации клиента OpenAI (generate_media): {init_err}", exc_info=True)
-        if "got an unexpected keyword argument 'proxies'" in str(init_err):
-             logger.error("!!! Повторная ошибка 'unexpected keyword argument proxies' в generate_media.")
         return False
+    if not openai_client_instance:
+        logger.error("❌ Не удалось получить клиент OpenAI (generate_media).")
+        return False
+    logger.info("✅ Клиент OpenAI (>1.0) получен из общего пула (generate_media).")
+    return True
 
 
 def get_text_placement_suggestions(image_url: str, text: str, image_width: int, image_height: int) -> dict:
@@ -310,7 +333,7 @@ def get_text_placement_suggestions(image_url: str, text: str, image_width: int,
     prompt = prompt_template.format(image_width=image_width, image_height=image_height, text=text)
     messages_content = [
         {"type": "text", "text": prompt},
-        {"type": "image_url", "image_url": {"url": image_url}}
+        vision_image_part(image_url)
     ]
 
     try:
@@ -328,15 +351,16 @@ def get_text_placement_suggestions(image_url: str, text: str, image_width: int,
 
 
         logger.info(f"Запрос к OpenAI Vision ({OPENAI_VISION_MODEL}) для рекомендаций по тексту (t={temperature}, max_tokens={max_tokens})...")
-        response = openai_client_instance.chat.completions.create(
+        response = timed_openai_call("text_placement.suggestions", OPENAI_VISION_MODEL,
+                                     openai_client_instance.chat.completions.create, {
             # --- ИСПРАВЛЕНИЕ: Используем OPENAI_VISION_MODEL ---
-            model=OPENAI_VISION_MODEL,
+            "model": OPENAI_VISION_MODEL,
             # ---------------------------------------------
-            messages=[{"role": "user", "content": messages_content}],
-            max_tokens=max_tokens,
-            temperature=temperature,
-            response_format={"type": "json_object"}
-        )
+            "messages": [{"role": "user", "content": messages_content}],
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "response_format": {"type": "json_object"}
+        })
 
         if response.choices and response.choices[0].message and response.choices[0].message.content:
             response_text = response.choices[0].message.content.strip()
@@ -448,7 +472,7 @@ Evaluation Criteria: {criteria}
     for i, url in enumerate(image_urls):
         if isinstance(url, str) and re.match(r"^(https?|data:image)", url):
             messages_content.append({"type": "text", "text": f"Image {i+1}:"})
-            messages_content.append({"type": "image_url", "image_url": {"url": url}})
+            messages_content.append(vision_image_part(url))
             valid_image_urls.append(url)
         else: logger.warning(f"Некорректный URL #{i+1}: {url}. Пропуск.")
 
@@ -458,12 +482,13 @@ Evaluation Criteria: {criteria}
     for attempt in range(MAX_ATTEMPTS):
         try:
             logger.info(f"Попытка {attempt + 1}/{MAX_ATTEMPTS} выбора индекса лучшего изображения (max_tokens={max_tokens})...")
-            gpt_response = openai_client_instance.chat.completions.create( # Используем глобальный клиент
-                model=OPENAI_VISION_MODEL, # Используем Vision модель
-                messages=[{"role": "user", "content": messages_content}],
-                max_tokens=max_tokens,
-                temperature=0.2 # Низкая температура для более детерминированного ответа
-            )
+            gpt_response = timed_openai_call("visual_analysis.image_selection", OPENAI_VISION_MODEL,
+                                             openai_client_instance.chat.completions.create, { # Используем глобальный клиент
+                "model": OPENAI_VISION_MODEL, # Используем Vision модель
+                "messages": [{"role": "user", "content": messages_content}],
+                "max_tokens": max_tokens,
+                "temperature": 0.2 # Низкая температура для более детерминированного ответа
+            })
             if gpt_response.choices and gpt_response.choices[0].message:
                 answer = gpt_response.choices[0].message.content.strip()
                 if not answer:
@@ -541,9 +566,14 @@ def clean_script_text(script_text_param):
     logger.info("Очистка текста скрипта...");
     return ' '.join(script_text_param.replace('\n', ' ').replace('\r', ' ').split()) if script_text_param else ""
 
-def generate_runway_video(image_path: str, script: str, config: ConfigManager, api_key: str) -> str | None:
-    """Генерирует видео с помощью Runway ML SDK."""
-    logger.info(f"Запуск генерации видео Runway для: {image_path}")
+def submit_runway_task(image_path: str, script: str, config: ConfigManager, api_key: str,
+                       b2_client=None, bucket_name: str | None = None) -> dict | None:
+    """
+    Отправляет задачу Runway ML Image-to-Video без ожидания результата.
+    Кадр готовит modules/runway_input.py (компактный JPEG/WebP в data URI или presigned URL из B2).
+    Возвращает {"task_id", "input_mode", "input_key", "payload_bytes", "submit_s"} или None.
+    """
+    logger.info(f"Отправка задачи Runway для: {image_path}")
 
     if RunwayML is None:
         logger.error("❌ Класс RunwayML не доступен (ошибка импорта в начале файла?).")
@@ -565,27 +595,17 @@ def generate_runway_video(image_path: str, script: str, config: ConfigManager, a
         # Используем размеры из констант для ratio
         ratio_str = f"{PLACEHOLDER_WIDTH}:{PLACEHOLDER_HEIGHT}"
         logger.info(f"Используется ratio: {ratio_str}")
-        poll_timeout = int(config.get('WORKFLOW.runway_polling_timeout', 300))
-        poll_interval = int(config.get('WORKFLOW.runway_polling_interval', 15))
         logger.info(f"Параметры Runway: model='{model_name}', duration={duration}, ratio='{ratio_str}'")
     except Exception as cfg_err:
         logger.error(f"Ошибка чтения параметров Runway из конфига: {cfg_err}. Используются значения по умолчанию.")
-        model_name="gen-2"; duration=10; ratio_str=f"{PLACEHOLDER_WIDTH}:{PLACEHOLDER_HEIGHT}"; poll_timeout=300; poll_interval=15
+        model_name="gen-2"; duration=10; ratio_str=f"{PLACEHOLDER_WIDTH}:{PLACEHOLDER_HEIGHT}"
 
-    # Кодирование изображения в Base64
-    try:
-        with open(image_path, "rb") as f:
-            base64_image = base64.b64encode(f.read()).decode("utf-8")
-        ext = Path(image_path).suffix.lower()
-        mime_type = f"image/{'png' if ext == '.png' else ('jpeg' if ext in ['.jpg', '.jpeg'] else 'octet-stream')}" # Улучшенный вариант
-        image_data_uri = f"data:{mime_type};base64,{base64_image}"
-        logger.info(f"Изображение {image_path} успешно кодировано в Base64 (MIME: {mime_type}).")
-    except Exception as e:
-        logger.error(f"❌ Ошибка кодирования изображения в Base64: {e}", exc_info=True)
+    # Подготовка кадра: пережатие под ratio и, при mode=presigned_url, загрузка в B2
+    runway_input = build_prompt_image(image_path, ratio_str, get_runway_input_settings(config),
+                                      s3_client=b2_client, bucket_name=bucket_name)
+    if runway_input is None:
         return None
 
-    client = None
-    task_id = 'N/A' # Инициализируем task_id
     try:
         logger.info("Инициализация клиента RunwayML SDK...")
         client = RunwayML(api_key=api_key)
@@ -593,7 +613,7 @@ def generate_runway_video(image_path: str, script: str, config: ConfigManager, a
 
         generation_params = {
             "model": model_name,
-            "prompt_image": image_data_uri,
+            "prompt_image": runway_input["prompt_image"],
             "prompt_text": script,
             "duration": duration,
             "ratio": ratio_str
@@ -603,80 +623,130 @@ def generate_runway_video(image_path: str, script: str, config: ConfigManager, a
         log_params = {k: (v[:50] + '...' if isinstance(v, str) and len(v) > 50 else v) for k, v in generation_params.items()}
         logger.debug(f"Параметры Runway: {json.dumps(log_params, indent=2)}")
 
+        submit_started = time.perf_counter()
         task = client.image_to_video.create(**generation_params)
-        task_id = getattr(task, 'id', 'N/A') # Получаем ID задачи
-        logger.info(f"✅ Задача Runway создана! ID: {task_id}")
-
-        logger.info(f"⏳ Начало опроса статуса задачи Runway {task_id}...")
-        start_time = time.time()
-        final_output_url = None
-
-        while time.time() - start_time < poll_timeout:
-            try:
-                task_status = client.tasks.retrieve(task_id)
-                current_status = getattr(task_status, 'status', 'UNKNOWN').upper()
-                logger.info(f"Статус Runway {task_id}: {current_status}")
-
-                if current_status == "SUCCEEDED":
-                    logger.info(f"✅ Задача Runway {task_id} успешно завершена!")
-                    task_output = getattr(task_status, 'output', None)
-                    # Пытаемся извлечь URL из разных возможных структур ответа
-                    if isinstance(task_output, list) and len(task_output) > 0 and isinstance(task_output[0], str):
-                        final_output_url = task_output[0]
-                    elif isinstance(task_output, dict) and task_output.get('url'):
-                        final_output_url = task_output['url']
-                    elif isinstance(task_output, str) and task_output.startswith('http'):
-                         final_output_url = task_output
-
-                    if final_output_url:
-                        logger.info(f"Получен URL видео: {final_output_url}")
-                        return final_output_url
-                    else:
-                        logger.warning(f"Статус SUCCEEDED, но URL видео не найден в ответе: {task_output}")
-                    break # Выходим из цикла опроса
-
-                elif current_status == "FAILED":
-                    logger.error(f"❌ Задача Runway {task_id} завершилась с ошибкой (FAILED)!")
-                    error_details = getattr(task_status, 'error_message', 'Детали ошибки отсутствуют в ответе API.')
-                    logger.error(f"Детали ошибки Runway: {error_details}")
-                    break # Выходим из цикла опроса
-
-                elif current_status in ["PENDING", "PROCESSING", "QUEUED", "WAITING", "RUNNING"]:
-                    # Статус промежуточный, продолжаем опрос
-                    time.sleep(poll_interval)
-                else:
-                    logger.warning(f"Неизвестный или неожиданный статус Runway: {current_status}. Прерывание опроса.")
-                    break # Выходим при неизвестном статусе
-
-            except requests.HTTPError as http_err: # Ловим HTTP ошибки от requests (которые использует SDK)
-                 logger.error(f"❌ Ошибка HTTP при опросе задачи Runway {task_id}: {http_err.response.status_code} - {http_err.response.text}", exc_info=False) # Не выводим полный traceback для HTTP ошибок
-                 break
-            except Exception as poll_err: # Ловим остальные ошибки (включая возможные ошибки SDK, если RunwayError не определен)
-                if RunwayError and isinstance(poll_err, RunwayError):
-                     logger.error(f"❌ Ошибка SDK Runway при опросе задачи {task_id}: {poll_err}", exc_info=True)
-                else:
-                     logger.error(f"❌ Общая ошибка при опросе статуса Runway {task_id}: {poll_err}", exc_info=True)
-                break # Прерываем опрос при других ошибках
-        else:
-            # Цикл завершился по таймауту
-            logger.warning(f"⏰ Таймаут ({poll_timeout} сек) ожидания завершения задачи Runway {task_id}.")
-
-        return None # Возвращаем None, если видео не было получено
+        submit_s = time.perf_counter() - submit_started
+        task_id = getattr(task, 'id', None) # Получаем ID задачи
+        if not task_id:
+            logger.error(f"❌ Runway не вернул ID задачи: {task}")
+            delete_runway_input(b2_client, bucket_name, runway_input["b2_key"])
+            return None
+        logger.info(f"✅ Задача Runway создана! ID: {task_id} (режим входа {runway_input['mode']}, "
+                    f"в запросе {runway_input['payload_bytes'] / 1024:.1f} КиБ, создание задачи {submit_s:.2f} c)")
+        return {"task_id": str(task_id), "input_mode": runway_input["mode"], "input_key": runway_input["b2_key"],
+                "payload_bytes": runway_input["payload_bytes"], "submit_s": round(submit_s, 3)}
 
     except requests.HTTPError as http_err: # Ловим HTTP ошибки от requests при создании задачи
         logger.error(f"❌ Ошибка HTTP при создании задачи Runway: {http_err.response.status_code} - {http_err.response.text}", exc_info=False)
+        delete_runway_input(b2_client, bucket_name, runway_input["b2_key"])
         return None
     except Exception as e: # Ловим остальные ошибки (включая возможные ошибки SDK)
          if RunwayError and isinstance(e, RunwayError):
               logger.error(f"❌ Ошибка SDK Runway при создании задачи: {e}", exc_info=True)
          else:
               logger.error(f"❌ Общая ошибка при взаимодействии с Runway: {e}", exc_info=True)
+         delete_runway_input(b2_client, bucket_name, runway_input["b2_key"])
          return None
 
 
+def check_runway_task(task_id: str, api_key: str, client=None) -> tuple[str, str | None]:
+    """
+    Однократная проверка статуса задачи Runway (без ожидания).
+    Возвращает (статус, URL видео или детали ошибки):
+        SUCCEEDED / FAILED / один из RUNWAY_IN_PROGRESS_STATUSES - ответ API;
+        ERROR - запрос не удался (сеть, SDK), задачу стоит проверить позже;
+        UNKNOWN - неожиданный статус или SUCCEEDED без URL.
+    """
+    if RunwayML is None:
+        return "ERROR", "RunwayML SDK недоступен"
+    try:
+        client = client or RunwayML(api_key=api_key)
+        task_status = client.tasks.retrieve(task_id)
+        current_status = str(getattr(task_status, 'status', 'UNKNOWN') or 'UNKNOWN').upper()
+        logger.info(f"Статус Runway {task_id}: {current_status}")
+
+        if current_status == "SUCCEEDED":
+            task_output = getattr(task_status, 'output', None)
+            # Пытаемся извлечь URL из разных возможных структур ответа
+            final_output_url = None
+            if isinstance(task_output, list) and len(task_output) > 0 and isinstance(task_output[0], str):
+                final_output_url = task_output[0]
+            elif isinstance(task_output, dict) and task_output.get('url'):
+                final_output_url = task_output['url']
+            elif isinstance(task_output, str) and task_output.startswith('http'):
+                 final_output_url = task_output
+            if final_output_url:
+                logger.info(f"✅ Задача Runway {task_id} успешно завершена! URL видео: {final_output_url}")
+                return "SUCCEEDED", final_output_url
+            logger.warning(f"Статус SUCCEEDED, но URL видео не найден в ответе: {task_output}")
+            return "UNKNOWN", f"нет URL в ответе: {task_output}"
+
+        if current_status == "FAILED":
+            error_details = getattr(task_status, 'error_message', None) or getattr(task_status, 'failure', None) or 'Детали ошибки отсутствуют в ответе API.'
+            logger.error(f"❌ Задача Runway {task_id} завершилась с ошибкой (FAILED)! Детали: {error_details}")
+            return "FAILED", str(error_details)
+
+        if current_status in RUNWAY_IN_PROGRESS_STATUSES:
+            return current_status, None
+
+        logger.warning(f"Неизвестный или неожиданный статус Runway: {current_status}.")
+        return "UNKNOWN", current_status
+
+    except requests.HTTPError as http_err: # Ловим HTTP ошибки от requests (которые использует SDK)
+         logger.error(f"❌ Ошибка HTTP при опросе задачи Runway {task_id}: {http_err.response.status_code} - {http_err.response.text}", exc_info=False)
+         return "ERROR", str(http_err)
+    except Exception as poll_err: # Ловим остальные ошибки (включая возможные ошибки SDK, если RunwayError не определен)
+        if RunwayError and isinstance(poll_err, RunwayError):
+             logger.error(f"❌ Ошибка SDK Runway при опросе задачи {task_id}: {poll_err}", exc_info=True)
+        else:
+             logger.error(f"❌ Общая ошибка при опросе статуса Runway {task_id}: {poll_err}", exc_info=True)
+        return "ERROR", str(poll_err)
+
+
+def generate_runway_video(image_path: str, script: str, config: ConfigManager, api_key: str,
+                          b2_client=None, bucket_name: str | None = None) -> str | None:
+    """Генерирует видео Runway с блокирующим опросом (режим WORKFLOW.runway_async = false)."""
+    logger.info(f"Запуск генерации видео Runway для: {image_path}")
+    try:
+        poll_timeout = int(config.get('WORKFLOW.runway_polling_timeout', 300))
+        poll_interval = int(config.get('WORKFLOW.runway_polling_interval', 15))
+    except (ValueError, TypeError) as cfg_err:
+        logger.error(f"Ошибка чтения параметров опроса Runway из конфига: {cfg_err}. Используются значения по умолчанию.")
+        poll_timeout = 300; poll_interval = 15
+
+    submitted = submit_runway_task(image_path, script, config, api_key, b2_client=b2_client, bucket_name=bucket_name)
+    if not submitted:
+        return None
+    task_id = submitted["task_id"]
+
+    logger.info(f"⏳ Начало опроса статуса задачи Runway {task_id}...")
+    client = RunwayML(api_key=api_key)
+    start_time = time.time()
+    try:
+        while time.time() - start_time < poll_timeout:
+            status, detail = check_runway_task(task_id, api_key, client=client)
+            if status == "SUCCEEDED":
+                return detail
+            if status not in RUNWAY_IN_PROGRESS_STATUSES:
+                return None # FAILED, ошибка запроса или неизвестный статус - прерываем опрос
+            time.sleep(poll_interval)
+        # Цикл завершился по таймауту
+        logger.warning(f"⏰ Таймаут ({poll_timeout} сек) ожидания завершения задачи Runway {task_id}.")
+        return None
+    finally:
+        delete_runway_input(b2_client, bucket_name, submitted["input_key"])
+
+
+def mock_video_available() -> bool:
+    """Можно ли создать mock-видео: есть ffmpeg (быстрый путь) или MoviePy."""
+    return ImageClip is not None or find_ffmpeg() is not None
+
 def create_mock_video(image_path_str: str) -> str | None:
-    """Создает mock-видео из изображения."""
-    if ImageClip is None: logger.error("MoviePy не импортирован."); return None
+    """
+    Создает mock-видео из изображения.
+    VIDEO.mock_encoder = "ffmpeg": ffmpeg напрямую (-loop 1, -tune stillimage, VIDEO.mock_fast_fps к/с);
+    при ошибке или без ffmpeg - прежний путь через MoviePy ImageClip.
+    """
     logger.info(f"Создание mock видео для {image_path_str}...")
     image_path_obj = Path(image_path_str)
     if not image_path_obj.is_file(): logger.error(f"{image_path_obj} не найден или не файл."); return None
@@ -688,6 +758,13 @@ def create_mock_video(image_path_str: str) -> str | None:
     for suffix in suffixes_to_remove:
         if base_name.endswith(suffix): base_name = base_name[:-len(suffix)]; break
     output_path = str(image_path_obj.parent / f"{base_name}.{VIDEO_FORMAT}")
+    if config.get("VIDEO.mock_encoder", "ffmpeg") == "ffmpeg" and find_ffmpeg():
+        if encode_still_video(str(image_path_obj), output_path, duration=int(config.get("VIDEO.mock_duration", 10)),
+                              fps=int(config.get("VIDEO.mock_fast_fps", 5)), codec=config.get("VIDEO.mock_codec", "libx264"),
+                              preset=config.get("VIDEO.mock_preset", "veryfast"), crf=int(config.get("VIDEO.mock_crf", 28))):
+            logger.info(f"✅ Mock видео создано: {output_path}"); return output_path
+        logger.warning("⚠️ Быстрое кодирование mock через ffmpeg не удалось, используется MoviePy.")
+    if ImageClip is None: logger.error("MoviePy не импортирован."); return None
     try:
         duration = int(config.get("VIDEO.mock_duration", 10)); fps = int(config.get("VIDEO.mock_fps", 24)); codec = config.get("VIDEO.mock_codec", "libx264")
         logger.debug(f"Параметры mock: output={output_path}, duration={duration}, fps={fps}, codec={codec}")
@@ -703,6 +780,43 @@ def create_mock_video(image_path_str: str) -> str | None:
             except Exception as close_err:
                  logger.warning(f"Ошибка закрытия clip: {close_err}")
 
+def transfer_runway_video(video_url: str, b2_client, bucket_name: str, generation_id: str, temp_dir_path: Path) -> tuple[bool, Path | None]:
+    """
+    Видео Runway -> 666/<ID>.mp4. При STREAM_TRANSFER.enabled тело ответа передается в B2 потоково
+    (загрузка идет параллельно со скачиванием, без временного файла); при ошибке - прежний путь:
+    скачивание во временную папку, загрузка общим блоком upload_to_b2.
+    Возвращает (видео уже в B2, локальный путь для загрузки или None).
+    """
+    stream_settings = get_stream_transfer_settings(config)
+    # С VIDEO_DELIVERY.enabled видео перекодируется перед загрузкой - нужен локальный файл
+    if stream_settings["enabled"] and not get_delivery_settings(config)["enabled"] and b2_client and bucket_name:
+        tee_path = None
+        if stream_settings["tee_local"]:
+            tee_path = str(BASE_DIR / stream_settings.get("cache_dir", "cache/runway_videos") / f"{generation_id}.{VIDEO_FORMAT}")
+        if stream_url_to_b2(video_url, b2_client, bucket_name, f"666/{generation_id}.{VIDEO_FORMAT}",
+                            settings=stream_settings, tee_path=tee_path):
+            return True, None
+        logger.warning("⚠️ Потоковая передача видео Runway не удалась, скачивание во временную папку.")
+    video_path_temp = temp_dir_path / f"{generation_id}_runway_final.{VIDEO_FORMAT}"
+    if download_video(video_url, str(video_path_temp)):
+        logger.info(f"Видео Runway скачано: {video_path_temp}")
+        return False, video_path_temp
+    logger.error(f"Не удалось скачать видео Runway {video_url}.")
+    return False, None
+
+def create_mock_video_from_url(image_url: str | None, temp_dir_path: Path, generation_id: str, image_format: str) -> str | None:
+    """Скачивает изображение (апскейл MJ) и создает из него mock-видео - запасной путь для задачи Runway."""
+    if not image_url:
+        logger.error("Нет URL изображения для mock видео."); return None
+    if not mock_video_available():
+        logger.warning("Нет ни ffmpeg, ни MoviePy, mock видео не создано."); return None
+    base_image_path = temp_dir_path / f"{generation_id}_upscaled_for_runway.{image_format}"
+    if not download_image(image_url, str(base_image_path)):
+        logger.error(f"Не удалось скачать изображение для mock: {image_url}"); return None
+    if PIL_AVAILABLE and not resize_existing_image(str(base_image_path)):
+        logger.warning(f"Не удалось выполнить ресайз для {base_image_path}, но продолжаем.")
+    return create_mock_video(str(base_image_path))
+
 def initiate_midjourney_task(prompt: str, config: ConfigManager, api_key: str, endpoint: str, ref_id: str = "") -> dict | None:
     """Инициирует задачу Midjourney /imagine."""
     if not api_key: logger.error("Нет MIDJOURNEY_API_KEY."); return None
@@ -784,6 +898,480 @@ def trigger_piapi_action(original_task_id: str, action: str, api_key: str, endpo
     except Exception as e: logger.exception(f"❌ Неизвестная ошибка при запуске '{action}' PiAPI: {e}"); return None
 
 
+def format_sarcasm_for_image(sarcasm_comment_text: str, formatting_prompt_settings: dict, model: str) -> tuple[str | None, int | None]:
+    """
+    Запрашивает у OpenAI форматирование текста сарказма для картинки.
+    Возвращает (formatted_text, font_size); None на месте значения, которое не удалось получить.
+    """
+    formatted_sarcasm_text = None
+    suggested_sarcasm_font_size = None
+    formatting_prompt_template = formatting_prompt_settings.get("template")
+    formatting_max_tokens = int(formatting_prompt_settings.get("max_tokens", 300))
+    formatting_temperature = float(formatting_prompt_settings.get("temperature", 0.5))
+    if not formatting_prompt_template:
+        logger.error("Промпт 'sarcasm.image_formatting.template' не найден в prompts_config.json.")
+        return None, None
+    if not openai_client_instance:
+        logger.error("Клиент OpenAI не инициализирован, форматирование невозможно.")
+        return None, None
+
+    prompt_text_for_formatting = formatting_prompt_template.format(sarcasm_text_input=sarcasm_comment_text)
+    try:
+        logger.info(f"Вызов OpenAI для форматирования сарказма (модель: {model})...")
+        response = timed_openai_call("sarcasm.image_formatting", model,
+                                     openai_client_instance.chat.completions.create, {
+            "model": model,
+            "messages": [{"role": "user", "content": prompt_text_for_formatting}],
+            "max_tokens": formatting_max_tokens,
+            "temperature": formatting_temperature,
+            "response_format": {"type": "json_object"}
+        })
+
+        if response.choices and response.choices[0].message and response.choices[0].message.content:
+            response_json_str = response.choices[0].message.content.strip()
+            logger.debug(f"Ответ OpenAI (форматирование сарказма): {response_json_str}")
+            try:
+                formatting_result = json.loads(response_json_str)
+                fmt_text = formatting_result.get("formatted_text")
+                fnt_size = formatting_result.get("font_size")
+                if isinstance(fmt_text, str) and fmt_text.strip(): formatted_sarcasm_text = fmt_text
+                else: logger.warning("OpenAI вернул некорректный 'formatted_text'.")
+                if isinstance(fnt_size, int) and 10 < fnt_size < 200: suggested_sarcasm_font_size = fnt_size
+                else: logger.warning(f"OpenAI вернул некорректный 'font_size': {fnt_size}.")
+                if formatted_sarcasm_text and suggested_sarcasm_font_size:
+                     log_text_preview = formatted_sarcasm_text[:50].replace('\n', '\\n')
+                     logger.info(f"Получены рекомендации от OpenAI: Размер={suggested_sarcasm_font_size}, Текст='{log_text_preview}...'")
+                else: logger.warning("Не удалось получить валидные данные форматирования от OpenAI.")
+            except json.JSONDecodeError: logger.error(f"Ошибка декодирования JSON ответа OpenAI: {response_json_str}")
+            except Exception as parse_err: logger.error(f"Ошибка парсинга ответа OpenAI: {parse_err}", exc_info=True)
+        else: logger.error("OpenAI вернул пустой ответ на запрос форматирования.")
+    # Обработка ошибок OpenAI (как в оригинале)
+    except openai.AuthenticationError as e: logger.exception(f"Ошибка аутентификации OpenAI: {e}")
+    except openai.RateLimitError as e: logger.exception(f"Превышен лимит запросов OpenAI: {e}")
+    except openai.APIConnectionError as e: logger.exception(f"Ошибка соединения с API OpenAI: {e}")
+    except openai.APIStatusError as e: logger.exception(f"Ошибка статуса API OpenAI: {e.status_code} - {e.response}")
+    except openai.BadRequestError as e: logger.exception(f"Ошибка неверного запроса OpenAI: {e}")
+    except openai.OpenAIError as e: logger.exception(f"Произошла ошибка API OpenAI: {e}")
+    except Exception as e: logger.error(f"Неизвестная ошибка при запросе форматирования к OpenAI: {e}", exc_info=True)
+    return formatted_sarcasm_text, suggested_sarcasm_font_size
+
+
+def normalize_best_index(best_index) -> int:
+    """Индекс выбранной картинки сетки 2x2; 0, если выбор не удался."""
+    if best_index is None or not isinstance(best_index, int) or not (0 <= best_index <= 3):
+        logger.warning(f"Не удалось выбрать индекс для Runway (результат: {best_index}). Используем индекс 0.")
+        return 0
+    return best_index
+
+
+# === Этапы generate_media (modules/stage_dag.py) ===
+# Выбранная ветка (mock, проверка Runway, результат /upscale, результат /imagine, запуск /imagine) объявляет
+# свои шаги этапами общего графа "media" с явными входами и выходами; финальные этапы (сарказм, нормализация
+# видео, загрузки в B2) получают ее выходы напрямую. Ветка не меняет config_mj сама: изменения возвращаются
+# выходом config_mj_patch и применяются в main после выполнения графа.
+
+# Значения для финальных этапов, если выбранная ветка их не производит
+MEDIA_VALUE_DEFAULTS = {"local_image_path": None, "video_path": None, "video_streamed": False,
+                        "title_base_path": None, "title_spec_path": None, "config_mj_patch": {}}
+TITLE_PADDING = 60
+TITLE_BG_BLUR_RADIUS = 0
+TITLE_BG_OPACITY = 0
+DEFAULT_SARCASM_FONT_SIZE = 60
+
+
+def mj_reset_patch(changes: dict | None = None) -> dict:
+    """Изменения config_mj: сброс задачи и результатов MJ, поверх - поля из changes."""
+    patch = {"midjourney_task": None, "midjourney_results": {}, "generation": False, "status": None}
+    patch.update(changes or {})
+    return patch
+
+
+def mock_video_for(image_path) -> Path | None:
+    """Mock-видео из картинки; None, если создать не удалось."""
+    if not mock_video_available(): logger.warning("Нет ни ffmpeg, ни MoviePy, mock видео не создано."); return None
+    if not image_path or not Path(image_path).is_file(): logger.warning("Базовое изображение для mock не найдено, mock видео не создано."); return None
+    video_path_str = create_mock_video(str(image_path))
+    if not video_path_str: logger.warning("Не удалось создать mock видео."); return None
+    return Path(video_path_str)
+
+
+def resolve_title_font(selected_focus) -> tuple[str, str]:
+    """Шрифт заголовка по фокусу (creative_config, FOCUS_FONT_MAPPING): (относительный путь, абсолютный путь)."""
+    logger.info("Определение шрифта для заголовка...")
+    creative_config_path_str = config.get('FILE_PATHS.creative_config')
+    creative_config_data = {}
+    if creative_config_path_str:
+        creative_config_path = Path(creative_config_path_str)
+        if not creative_config_path.is_absolute(): creative_config_path = BASE_DIR / creative_config_path
+        creative_config_data = load_json_config(str(creative_config_path)) or {}
+    else: logger.error("Путь к creative_config не найден!")
+    fonts_mapping = creative_config_data.get("FOCUS_FONT_MAPPING", {})
+    default_font_rel_path = fonts_mapping.get("__default__")
+    if not default_font_rel_path: logger.error("Критическая ошибка: Шрифт по умолчанию '__default__' не задан!"); raise ValueError("Шрифт по умолчанию не настроен")
+    font_rel_path = None
+    if selected_focus and isinstance(selected_focus, str):
+        font_rel_path = fonts_mapping.get(selected_focus)
+        if font_rel_path: logger.info(f"Найден шрифт для фокуса '{selected_focus}': {font_rel_path}")
+        else: logger.warning(f"Шрифт для фокуса '{selected_focus}' не найден. Используется дефолтный.")
+    else: logger.warning(f"Ключ 'selected_focus' отсутствует/некорректен. Используется дефолтный.")
+    for rel_path in dict.fromkeys(filter(None, (font_rel_path, default_font_rel_path))):
+        font_path_abs = BASE_DIR / rel_path
+        if font_path_abs.is_file():
+            logger.info(f"Финальный путь к шрифту: {font_path_abs}")
+            return rel_path, str(font_path_abs)
+        logger.error(f"Файл шрифта не найден: {font_path_abs}")
+    logger.critical(f"КРИТИЧЕСКАЯ ОШИБКА: Не найден файл шрифта по умолчанию: {BASE_DIR / default_font_rel_path}")
+    raise FileNotFoundError(f"Не найден файл шрифта по умолчанию: {BASE_DIR / default_font_rel_path}")
+
+
+def add_mock_stages(dag: StageDAG, ctx: dict):
+    """Сценарий 0: принудительный mock - плейсхолдер, mock-видео из него, сброс состояния MJ/Runway."""
+    generation_id = ctx["generation_id"]
+
+    def render_mock_placeholder():
+        logger.warning(f"⚠️ Принудительный mock для ID: {generation_id}")
+        placeholder_text = f"MJ Timeout\n{ctx['topic'][:60]}"
+        local_image_path = ctx["temp_dir_path"] / f"{generation_id}.{ctx['image_format']}"
+        width, height = ctx["placeholder_size"]
+        bg_color, text_color = ctx["placeholder_colors"]
+        # Плейсхолдер рисуется локально: путь таймаута не зависит от внешних сервисов
+        if not render_placeholder(placeholder_text, str(local_image_path), width, height, bg_color, text_color, str(ctx["placeholder_font_path"])):
+            placeholder_url = f"https://placehold.co/{width}x{height}/{bg_color}/{text_color}?text={urllib.parse.quote(placeholder_text)}"
+            logger.warning(f"Локальная отрисовка не удалась, скачивание плейсхолдера: {placeholder_url}")
+            if not download_image(placeholder_url, str(local_image_path)):
+                logger.error("Не удалось скачать плейсхолдер."); return None
+        logger.info(f"Плейсхолдер сохранен как финальный PNG: {local_image_path}")
+        return local_image_path
+
+    def reset_state(video_path):
+        logger.info("Сброс состояния MJ...")
+        return mj_reset_patch({RUNWAY_TASK_KEY: None})
+
+    dag.stage("mock.placeholder", render_mock_placeholder, output="local_image_path")
+    dag.stage("mock.video", lambda local_image_path: mock_video_for(local_image_path), inputs=("local_image_path",), output="video_path")
+    dag.stage("mj.state", reset_state, inputs=("video_path",), output="config_mj_patch")
+
+
+def add_runway_poll_stages(dag: StageDAG, ctx: dict, runway_task_state: dict):
+    """Сценарий 4: задача Runway отправлена ранее - одна проверка статуса без ожидания и скачивание готового видео."""
+    generation_id = ctx["generation_id"]
+    runway_settings = get_runway_task_settings(config)
+    runway_task_id = runway_task_state["task_id"]
+
+    def poll_runway():
+        logger.info(f"Проверка задачи Runway {runway_task_id} для ID {generation_id} "
+                    f"(проверка #{int(runway_task_state.get('poll_count', 0)) + 1}, с отправки {task_age_seconds(runway_task_state) or 0:.0f} c)...")
+        return check_runway_task(runway_task_id, ctx["runway_api_key"])
+
+    def download_runway(runway_status, runway_detail):
+        if runway_status != "SUCCEEDED": return False, None, runway_status
+        video_streamed, video_path = transfer_runway_video(runway_detail, ctx["b2_client"], ctx["bucket_name"], generation_id, ctx["temp_dir_path"])
+        if video_streamed or video_path: return video_streamed, video_path, runway_status
+        # URL результата Runway живет долго - повторим скачивание при следующей проверке
+        logger.error(f"Не удалось скачать видео Runway {runway_detail}. Повтор при следующей проверке.")
+        return False, None, "DOWNLOAD_FAILED"
+
+    def finish_runway(video_streamed, runway_video_path, runway_result_status):
+        runway_finished = bool(video_streamed or runway_video_path) or runway_result_status in ("FAILED", "UNKNOWN")
+        if not runway_finished and task_expired(runway_task_state, runway_settings):
+            logger.warning(f"⏰ Превышен таймаут задачи Runway {runway_task_id} ({runway_settings['runway_task_timeout']} c, последний статус {runway_result_status}).")
+            runway_finished = True
+        if not runway_finished:
+            schedule_next_poll(runway_task_state, runway_result_status, runway_settings)
+            logger.info(f"Задача Runway {runway_task_id} еще не готова ({runway_result_status}). Следующая проверка не раньше {runway_task_state['next_poll_at_utc']}.")
+            return None, {RUNWAY_TASK_KEY: runway_task_state, "status": RUNWAY_WAITING_STATUS}
+        video_path = runway_video_path
+        if not video_path and not video_streamed:
+            logger.error(f"Видео Runway для ID {generation_id} не получено (статус {runway_result_status}). Создание mock.")
+            video_path_str = create_mock_video_from_url(runway_task_state.get("source_image_url"), ctx["temp_dir_path"], generation_id, ctx["image_format"])
+            if video_path_str: video_path = Path(video_path_str)
+            else: logger.warning("Не удалось получить финальное видео (Runway или mock).")
+        delete_runway_input(ctx["b2_client"], ctx["bucket_name"], runway_task_state.get("input_key"))
+        logger.info("Очистка состояния Runway...")
+        return video_path, mj_reset_patch({RUNWAY_TASK_KEY: None})
+
+    dag.stage("runway.poll", poll_runway, output=("runway_status", "runway_detail"))
+    dag.stage("runway.download", download_runway, inputs=("runway_status", "runway_detail"),
+              output=("video_streamed", "runway_video_path", "runway_result_status"))
+    dag.stage("runway.finish", finish_runway, inputs=("video_streamed", "runway_video_path", "runway_result_status"),
+              output=("video_path", "config_mj_patch"))
+
+
+def add_upscale_stages(dag: StageDAG, ctx: dict, final_upscaled_image_url: str):
+    """Сценарий 3: есть результат /upscale - скачивание апскейла, отправка в Runway, получение видео (или mock)."""
+    generation_id = ctx["generation_id"]
+    runway_api_key = ctx["runway_api_key"]
+    final_runway_prompt = ctx["final_runway_prompt"]
+
+    def download_upscale():
+        logger.info(f"Обработка результата /upscale для ID {generation_id}. Генерация видео Runway...")
+        runway_base_image_path = ctx["temp_dir_path"] / f"{generation_id}_upscaled_for_runway.{ctx['image_format']}"
+        if not download_image(final_upscaled_image_url, str(runway_base_image_path)):
+            raise IOError(f"Не скачать апскейл {final_upscaled_image_url}")
+        logger.info(f"Апскейл для Runway сохранен: {runway_base_image_path}")
+        if not PIL_AVAILABLE: logger.warning("Pillow не найден, ресайз не выполнен.")
+        elif not resize_existing_image(str(runway_base_image_path)): logger.warning(f"Не удалось выполнить ресайз для {runway_base_image_path}, но продолжаем.")
+        return runway_base_image_path
+
+    def submit_runway(runway_base_image_path):
+        # (состояние асинхронной задачи, URL или путь готового видео); (None, None) - видео заменяется mock
+        if not final_runway_prompt: logger.error("❌ Промпт Runway отсутствует! Создание mock видео."); return None, None
+        if not RUNWAY_SDK_AVAILABLE: logger.error("SDK RunwayML недоступен. Создание mock видео."); return None, None
+        if not runway_api_key: logger.error("RUNWAY_API_KEY не найден. Создание mock видео."); return None, None
+        runway_settings = get_runway_task_settings(config)
+        if runway_settings["runway_async"]:
+            # Задача отправляется без ожидания; результат заберут следующие запуски (Сценарий 4)
+            runway_submitted = submit_runway_task(str(runway_base_image_path), final_runway_prompt, config, runway_api_key,
+                                                  b2_client=ctx["b2_client"], bucket_name=ctx["bucket_name"])
+            if not runway_submitted: logger.error("Не удалось отправить задачу Runway. Создание mock."); return None, None
+            runway_task_state = new_runway_task(runway_submitted["task_id"], generation_id, final_upscaled_image_url, runway_settings,
+                                                input_info=runway_submitted)
+            logger.info(f"⏳ Задача Runway {runway_submitted['task_id']} сохранена в состоянии, первая проверка не раньше {runway_task_state['next_poll_at_utc']}.")
+            return runway_task_state, None
+        video_url_or_path = generate_runway_video(image_path=str(runway_base_image_path), script=final_runway_prompt, config=config,
+                                                  api_key=runway_api_key, b2_client=ctx["b2_client"], bucket_name=ctx["bucket_name"])
+        if not video_url_or_path: logger.error("Генерация видео Runway не удалась. Создание mock.")
+        return None, video_url_or_path
+
+    def download_runway(runway_base_image_path, runway_task_state, runway_video):
+        if runway_task_state: return False, None
+        video_streamed, video_path = False, None
+        if runway_video and runway_video.startswith("http"):
+            video_streamed, video_path = transfer_runway_video(runway_video, ctx["b2_client"], ctx["bucket_name"], generation_id, ctx["temp_dir_path"])
+            if not video_streamed and not video_path: logger.error(f"Не удалось скачать видео Runway {runway_video}. Создание mock.")
+        elif runway_video:
+            video_path = Path(runway_video)
+            logger.info(f"Получен локальный путь к видео Runway: {video_path}")
+        if not video_streamed and not video_path:
+            video_path = mock_video_for(runway_base_image_path)
+            if not video_path: logger.warning("Не удалось получить финальное видео (Runway или mock).")
+        return video_streamed, video_path
+
+    def runway_state(runway_task_state):
+        logger.info("Очистка состояния MJ (после Runway)...")
+        if runway_task_state: return mj_reset_patch({RUNWAY_TASK_KEY: runway_task_state, "status": RUNWAY_WAITING_STATUS})
+        return mj_reset_patch()
+
+    dag.stage("upscale.download", download_upscale, output="runway_base_image_path", retries=ctx["download_retries"])
+    dag.stage("runway.submit", submit_runway, inputs=("runway_base_image_path",), output=("runway_task_state", "runway_video"))
+    dag.stage("runway.download", download_runway, inputs=("runway_base_image_path", "runway_task_state", "runway_video"),
+              output=("video_streamed", "video_path"))
+    dag.stage("mj.state", runway_state, inputs=("runway_task_state",), output="config_mj_patch")
+
+
+def add_imagine_stages(dag: StageDAG, ctx: dict, mj_results: dict, imagine_urls: list):
+    """Сценарий 2: есть результат /imagine - выбор картинок, заголовок с архивом исходников, запуск /upscale."""
+    generation_id = ctx["generation_id"]
+    task_result_data = mj_results.get("task_result") or {}
+    task_meta_data = mj_results.get("meta")
+    logger.info(f"Обработка результата /imagine для ID {generation_id}.")
+    imagine_task_id = mj_results.get("task_id")
+    if not imagine_task_id and isinstance(task_meta_data, dict): imagine_task_id = task_meta_data.get("task_id")
+    if not imagine_urls or len(imagine_urls) != 4: logger.error("Не найдены URL сетки /imagine (4 шт.)."); raise ValueError("Некорректные результаты /imagine")
+    if not imagine_task_id: logger.error(f"Не найден task_id исходной задачи /imagine в результатах: {mj_results}."); raise ValueError("Отсутствует ID исходной задачи /imagine")
+
+    text_for_title = ctx["topic"]
+    title_source_path = ctx["temp_dir_path"] / f"{generation_id}_title_base.{ctx['image_format']}"
+    final_title_image_path = ctx["temp_dir_path"] / f"{generation_id}.{ctx['image_format']}"
+    default_placement = {"position": ('center', 'center'), "font_size": 70, "formatted_text": text_for_title.split('\n')[0] if text_for_title else "Текст отсутствует", "text_color": "#333333"}
+
+    def title_url_for(best_index):
+        return imagine_urls[(best_index + 1) % 4]
+
+    def select_runway_index():
+        logger.info("Выбор лучшего изображения для Runway...")
+        if not openai_client_instance:
+            if openai is None: logger.warning("Модуль OpenAI недоступен. Используется индекс 0 для Runway.")
+            else: logger.warning("Клиент OpenAI не инициализирован. Используется индекс 0 для Runway.")
+            best_index = 0
+        else:
+            # Четыре картинки сетки скачиваются и сжимаются параллельно до вызова
+            if vision_image_cache is not None: vision_image_cache.prefetch(imagine_urls)
+            visual_analysis_settings = ctx["prompts_config"].get("visual_analysis", {}).get("image_selection", {})
+            best_index = normalize_best_index(select_best_image(imagine_urls, ctx["first_frame_description"] or " ", visual_analysis_settings))
+        logger.info(f"Индекс для Runway: {best_index}, URL: {imagine_urls[best_index][:60]}...")
+        logger.info(f"Индекс для заголовка: {(best_index + 1) % 4}, URL: {title_url_for(best_index)[:60]}...")
+        return best_index
+
+    def suggest_title_placement(best_index):
+        logger.info(f"Запрос рекомендаций по размещению для текста (тема): '{text_for_title[:100]}...'")
+        width, height = ctx["placeholder_size"]
+        return get_text_placement_suggestions(image_url=title_url_for(best_index), text=text_for_title,
+                                              image_width=width, image_height=height) or default_placement
+
+    def fetch_title_source(best_index):
+        # Оригинал уже скачан для vision-миниатюры - копируем его вместо повторной загрузки
+        if vision_image_cache is not None: fetched = vision_image_cache.copy_original(title_url_for(best_index), str(title_source_path))
+        else: fetched = download_image(title_url_for(best_index), str(title_source_path))
+        if not fetched: raise IOError(f"Не удалось скачать базовое изображение для заголовка: {title_url_for(best_index)}")
+        logger.info(f"Базовое изображение для заголовка скачано: {title_source_path.name}")
+        return title_source_path
+
+    def render_title(title_source_path, title_placement, title_font_path):
+        logger.info("Создание изображения-заголовка...")
+        if not PIL_AVAILABLE: logger.warning("Pillow недоступен, текст на заголовок не добавлен."); return title_source_path
+        log_text_preview = title_placement['formatted_text'].replace('\n', '\\n')
+        logger.info(f"Параметры для add_text_to_image: text='{log_text_preview}', color={title_placement['text_color']}, pos={title_placement['position']}")
+        if add_text_to_image(
+            image_path_str=str(title_source_path), text=title_placement["formatted_text"],
+            font_path_str=title_font_path, output_path_str=str(final_title_image_path),
+            text_color_hex=title_placement["text_color"], position=title_placement["position"],
+            padding=TITLE_PADDING, haze_opacity=ctx["haze_opacity"],
+            bg_blur_radius=TITLE_BG_BLUR_RADIUS, bg_opacity=TITLE_BG_OPACITY, logger_instance=logger
+        ):
+            logger.info(f"✅ Изображение-заголовок с текстом создано: {final_title_image_path.name}")
+            return final_title_image_path
+        logger.error("Не удалось создать изображение-заголовок.")
+        logger.warning("В качестве финального PNG будет использовано базовое изображение без текста.")
+        return title_source_path
+
+    def archive_title(title_source_path, title_placement, title_font_rel_path):
+        # Исходники для scripts/rerender_titles.py: <ID>_title_base.png и <ID>_title.json
+        title_spec_path = ctx["temp_dir_path"] / f"{generation_id}{TITLE_SPEC_SUFFIX}"
+        title_spec = build_title_spec(
+            title_placement["formatted_text"], title_placement["text_color"], title_placement["position"], TITLE_PADDING,
+            ctx["selected_focus"], title_font_rel_path, ctx["haze_opacity"], TITLE_BG_BLUR_RADIUS, TITLE_BG_OPACITY)
+        return title_source_path, (title_spec_path if save_title_spec(title_spec_path, title_spec) else None)
+
+    def trigger_upscale(best_index):
+        action_to_trigger = f"upscale{best_index + 1}"
+        available_actions = task_result_data.get("actions", [])
+        logger.info(f"Запуск Upscale для картинки Runway (индекс {best_index}). Действие: {action_to_trigger}.")
+        if action_to_trigger not in available_actions:
+            logger.warning(f"Действие {action_to_trigger} недоступно! Поиск другого upscale...")
+            action_to_trigger = next((a for a in available_actions if a.startswith("upscale")), None)
+            if action_to_trigger: logger.info(f"Используем первое доступное upscale: {action_to_trigger}")
+            else: logger.error("Не найдено доступных upscale действий!")
+        upscale_task_info = None
+        if not action_to_trigger: logger.warning("Нет действия upscale для запуска.")
+        elif not ctx["midjourney_api_key"]: logger.error("MIDJOURNEY_API_KEY не найден для trigger_piapi_action.")
+        elif not ctx["mj_endpoint"]: logger.error("MJ_IMAGINE_ENDPOINT не найден для trigger_piapi_action.")
+        else: upscale_task_info = trigger_piapi_action(original_task_id=imagine_task_id, action=action_to_trigger,
+                                                       api_key=ctx["midjourney_api_key"], endpoint=ctx["mj_endpoint"])
+        if upscale_task_info and upscale_task_info.get("task_id"):
+            logger.info(f"Задача Upscale ({action_to_trigger}) запущена. ID: {upscale_task_info['task_id']}. Состояние - ожидание /upscale.")
+            return mj_reset_patch({"midjourney_task": upscale_task_info, "status": "waiting_for_upscale"})
+        logger.error(f"Не удалось запустить задачу Upscale ({action_to_trigger}).")
+        return {"status": "upscale_trigger_failed", "midjourney_task": None, "midjourney_results": {}}
+
+    dag.stage("visual_analysis.image_selection", select_runway_index, output="best_index")
+    dag.stage("text_placement.suggestions", suggest_title_placement, inputs=("best_index",), output="title_placement")
+    dag.stage("title_base.download", fetch_title_source, inputs=("best_index",), output="title_source_path", retries=ctx["download_retries"])
+    dag.stage("title.font", lambda: resolve_title_font(ctx["selected_focus"]), output=("title_font_rel_path", "title_font_path"))
+    dag.stage("title.render", render_title, inputs=("title_source_path", "title_placement", "title_font_path"), output="local_image_path")
+    if PIL_AVAILABLE and config.get("TITLE_RERENDER.archive_title_sources", True):
+        dag.stage("title.archive", archive_title, inputs=("title_source_path", "title_placement", "title_font_rel_path"),
+                  output=("title_base_path", "title_spec_path"))
+    dag.stage("mj.upscale", trigger_upscale, inputs=("best_index",), output="config_mj_patch")
+
+
+def add_imagine_launch_stages(dag: StageDAG, ctx: dict):
+    """Сценарий 1: результатов MJ нет, флаг generation=true - запуск /imagine."""
+    def launch_imagine():
+        logger.info(f"Нет результатов MJ, флаг generation=true. Запуск /imagine для ID {ctx['generation_id']}...")
+        if not ctx["final_mj_prompt"]: logger.error("❌ Промпт MJ отсутствует!"); return {"generation": False}
+        if not ctx["midjourney_api_key"]: logger.error("MIDJOURNEY_API_KEY не найден для initiate_midjourney_task."); return {}
+        if not ctx["mj_endpoint"]: logger.error("MJ_IMAGINE_ENDPOINT не найден для initiate_midjourney_task."); return {}
+        imagine_task_info = initiate_midjourney_task(prompt=ctx["final_mj_prompt"], config=config, api_key=ctx["midjourney_api_key"],
+                                                     endpoint=ctx["mj_endpoint"], ref_id=ctx["generation_id"])
+        if imagine_task_info and imagine_task_info.get("task_id"):
+            logger.info(f"Задача /imagine запущена. ID: {imagine_task_info['task_id']}")
+            return mj_reset_patch({"midjourney_task": imagine_task_info, "status": "waiting_for_imagine"})
+        logger.warning("Не удалось получить task_id для /imagine.")
+        return {"midjourney_task": None, "generation": False}
+
+    dag.stage("mj.imagine", launch_imagine, output="config_mj_patch")
+
+
+def add_finalize_stages(dag: StageDAG, ctx: dict):
+    """
+    Финал: форматирование и отрисовка сарказма, нормализация видео, загрузки в B2.
+    Загрузки не ждут отрисовки сарказма; упавшая загрузка повторяется отдельно (retry),
+    без повторной отрисовки и без повторной загрузки остальных файлов.
+    """
+    generation_id = ctx["generation_id"]
+    sarcasm_image_suffix = ctx["sarcasm_image_suffix"]
+    target_folder_b2 = "666/"
+    delivery_settings = get_delivery_settings(config)
+
+    def format_sarcasm():
+        # Форматирование не зависит от ветки - идет параллельно с ее этапами
+        sarcasm_comment_text = ctx["sarcasm_comment_text"]
+        formatted_sarcasm_text, sarcasm_font_size = None, None
+        if not sarcasm_comment_text: logger.info("Текст сарказма отсутствует, форматирование не требуется.")
+        elif not openai_client_instance: logger.error("Клиент OpenAI не инициализирован, форматирование невозможно.")
+        else:
+            logger.info("Запрос форматирования текста сарказма у OpenAI...")
+            formatted_sarcasm_text, sarcasm_font_size = format_sarcasm_for_image(
+                sarcasm_comment_text, ctx["prompts_config"].get("sarcasm", {}).get("image_formatting", {}), ctx["openai_model"])
+        if not formatted_sarcasm_text:
+            if sarcasm_comment_text: logger.warning("Используется исходный текст сарказма для отрисовки (без форматирования OpenAI).")
+            formatted_sarcasm_text = sarcasm_comment_text.replace('\n', ' ') if sarcasm_comment_text else None
+        if not sarcasm_font_size:
+            logger.warning(f"Используется размер шрифта по умолчанию: {DEFAULT_SARCASM_FONT_SIZE}")
+            sarcasm_font_size = DEFAULT_SARCASM_FONT_SIZE
+        return formatted_sarcasm_text, sarcasm_font_size
+
+    def render_sarcasm(sarcasm_text, sarcasm_font_size):
+        if not sarcasm_text: logger.info("Пропуск генерации картинки с сарказмом (нет форматированного текста)."); return None
+        if not PIL_AVAILABLE: logger.warning("Pillow недоступен, пропуск генерации картинки с сарказмом."); return None
+        logger.info("Генерация изображения с сарказмом (с форматированием OpenAI)...")
+        if not ctx["sarcasm_base_image_rel_path"] or not ctx["sarcasm_font_rel_path"] or not sarcasm_image_suffix:
+            logger.error("Пути для картинки с сарказмом не заданы в конфиге!"); return None
+        sarcasm_base_image_path_abs = BASE_DIR / ctx["sarcasm_base_image_rel_path"]
+        sarcasm_font_path_abs = BASE_DIR / ctx["sarcasm_font_rel_path"]
+        sarcasm_output_path_temp = ctx["temp_dir_path"] / f"{generation_id}{sarcasm_image_suffix}"
+        if not sarcasm_base_image_path_abs.is_file(): logger.error(f"Базовое изображение Барона не найдено: {sarcasm_base_image_path_abs}"); return None
+        if not sarcasm_font_path_abs.is_file(): logger.error(f"Шрифт для сарказма не найден: {sarcasm_font_path_abs}"); return None
+        sarcasm_success = add_text_to_image_sarcasm_openai_ready(
+            image_path_str=str(sarcasm_base_image_path_abs), formatted_text=sarcasm_text,
+            suggested_font_size=sarcasm_font_size, font_path_str=str(sarcasm_font_path_abs),
+            output_path_str=str(sarcasm_output_path_temp), text_color_hex="#FFFFFF", align='right',
+            padding_fraction=0.05, stroke_width=2, stroke_color_hex="#404040", logger_instance=logger
+        )
+        if not sarcasm_success: logger.error("Не удалось создать изображение с сарказмом (OpenAI формат)."); return None
+        logger.info(f"✅ Изображение с сарказмом создано (OpenAI формат): {sarcasm_output_path_temp.name}")
+        return sarcasm_output_path_temp
+
+    def transcode_video(video_path):
+        # Нормализация перед загрузкой (modules/ffmpeg_tools.py); при любой ошибке - исходный файл
+        if not video_path or not delivery_settings["enabled"]: return video_path, None
+        try:
+            delivery = prepare_delivery_video(str(video_path), delivery_settings)
+        except Exception as e:
+            logger.error(f"❌ Ошибка нормализации видео {video_path}: {e}", exc_info=True); delivery = None
+        if not delivery: logger.warning(f"⚠️ Видео {video_path} загружается без нормализации."); return video_path, None
+        return Path(delivery["path"]), (Path(delivery["rendition_path"]) if delivery["rendition_path"] else None)
+
+    def upload_stage(label: str, b2_filename: str):
+        def upload(**inputs):
+            # Единственный вход - путь к файлу; имя входа у каждой загрузки свое
+            (path,) = inputs.values()
+            if not path: return False
+            if not (isinstance(path, Path) and path.is_file()):
+                logger.warning(f"{label} {path} не найден(о) для загрузки."); return False
+            if not upload_to_b2(ctx["b2_client"], ctx["bucket_name"], target_folder_b2, str(path), b2_filename):
+                raise IOError(f"!!! ОШИБКА ЗАГРУЗКИ: {label} {b2_filename} !!!")
+            return True
+        return upload
+
+    dag.stage("sarcasm.image_formatting", format_sarcasm, output=("sarcasm_text", "sarcasm_font_size"))
+    dag.stage("sarcasm.render", render_sarcasm, inputs=("sarcasm_text", "sarcasm_font_size"), output="sarcasm_image_path")
+    dag.stage("video.transcode", transcode_video, inputs=("video_path",), output=("delivery_video_path", "rendition_path"))
+    dag.stage("upload.image", upload_stage("Изображение", f"{generation_id}.png"),
+              inputs=("local_image_path",), output="upload_success_img")
+    dag.stage("upload.video", upload_stage("Видео", f"{generation_id}.mp4"),
+              inputs=("delivery_video_path",), output="upload_success_vid")
+    dag.stage("upload.video_rendition", upload_stage("Видео (версия меньшего разрешения)", f"{generation_id}{delivery_settings['rendition_suffix']}.mp4"),
+              inputs=("rendition_path",), output="upload_success_rendition")
+    dag.stage("upload.sarcasm", upload_stage("Картинка с сарказмом", f"{generation_id}{sarcasm_image_suffix}"),
+              inputs=("sarcasm_image_path",), output="upload_success_sarcasm")
+    dag.stage("upload.title_base", upload_stage("Картинка заголовка без текста", f"{generation_id}{TITLE_BASE_SUFFIX}"),
+              inputs=("title_base_path",), output="upload_success_title_base")
+    dag.stage("upload.title_spec", upload_stage("Параметры заголовка", f"{generation_id}{TITLE_SPEC_SUFFIX}"),
+              inputs=("title_spec_path",), output="upload_success_title_spec")
+
+
 # === Основная Функция ===
 def main():
     """
@@ -796,7 +1384,7 @@ def main():
     Сохраняет оригинальную структуру и логику пользователя.
     """
     # --- Инициализация переменных перед try блоком ---
-    global config, logger, BASE_DIR, openai_client_instance, OPENAI_VISION_MODEL # Используем глобальные
+    global config, logger, BASE_DIR, openai_client_instance, OPENAI_VISION_MODEL, vision_image_cache # Используем глобальные
     b2_client = None
     generation_id = None
     timestamp_suffix = None
@@ -835,15 +1423,18 @@ def main():
     config_mj = None
     local_image_path = None
     video_path = None
+    video_streamed = False # Видео уже передано в B2 потоково (modules/stream_transfer.py)
     prompts_config_data = {} # Инициализируем здесь
 
     # --- Определяем timestamp_suffix и пути здесь ---
     timestamp_suffix = datetime.now(timezone.utc).strftime("%Y%m%d%H%M%S%f")
-    temp_dir_path = Path(f"temp_{generation_id}_{timestamp_suffix}")
+    # Временная папка - в RAM-области (/dev/shm при наличии места), см. modules/scratch.py
+    temp_dir_path = create_scratch_dir(f"temp_{generation_id}", required_mib=float(config.get("SCRATCH.media_required_mib", 300)))
     # Генерируем уникальные имена для временных файлов конфигов внутри временной папки
     config_mj_local_path = temp_dir_path / f"config_midjourney_{generation_id}_temp.json"
     content_local_temp_path = temp_dir_path / f"{generation_id}_content_temp.json"
-    ensure_directory_exists(str(temp_dir_path)) # Создаем временную папку сразу
+    # Изображения для vision-вызовов скачиваются один раз и отправляются миниатюрами
+    vision_image_cache = create_vision_image_cache(config, temp_dir_path / "vision")
     # ----------------------------------------------------------------------------------------
 
     # +++ Получение констант из конфига ВНУТРИ main +++
@@ -930,126 +1521,27 @@ def main():
                 except OSError as e: logger.warning(f"Не удалить {content_local_temp_path}: {e}")
         # -----------------------------
 
-        # --- Извлечение полей из content_data ---
-        topic = content_data.get("topic", "Нет темы")
+        # --- Извлечение полей из content_data (общая схема modules/content_schema.py) ---
+        content_document, content_error = decode_content_document(content_data, strict=False, logger_instance=logger)
+        if content_document is None:
+            logger.error(f"❌ Некорректный документ контента {content_remote_path}: {content_error}"); sys.exit(1)
+        topic = content_document.topic or "Нет темы"
         text_for_title = topic
-        selected_focus = content_data.get("selected_focus")
-        first_frame_description = content_data.get("first_frame_description", "")
-        final_mj_prompt = content_data.get("final_mj_prompt", "")
-        final_runway_prompt = content_data.get("final_runway_prompt", "")
+        selected_focus = content_document.selected_focus
+        first_frame_description = content_document.first_frame_description
+        final_mj_prompt = content_document.final_mj_prompt
+        final_runway_prompt = content_document.final_runway_prompt
         logger.info(f"Тема: '{topic[:100]}...'")
         if selected_focus: logger.info(f"Выбранный фокус: {selected_focus}")
         else: logger.warning("⚠️ Ключ 'selected_focus' отсутствует в данных контента.")
         # ------------------------------------
 
-        # +++ ИЗВЛЕЧЕНИЕ ТЕКСТА САРКАЗМА (Логика из оригинала) +++
-        sarcasm_comment_text = None
-        sarcasm_data = content_data.get("sarcasm")
-        if isinstance(sarcasm_data, dict):
-            comment_value = sarcasm_data.get("comment")
-            if isinstance(comment_value, str):
-                parsed_comment_value = None
-                try:
-                    parsed_comment_value = json.loads(comment_value)
-                    if isinstance(parsed_comment_value, dict):
-                        sarcasm_comment_text = parsed_comment_value.get("comment") or parsed_comment_value.get("комментарий")
-                        if sarcasm_comment_text: logger.info("Текст сарказма извлечен из JSON-строки.")
-                        else: logger.warning("В JSON-строке 'sarcasm.comment' не найден ключ 'comment'/'комментарий'."); sarcasm_comment_text = None
-                    else:
-                        if isinstance(parsed_comment_value, str): logger.info("JSON-строка 'sarcasm.comment' содержит простую строку, используем ее."); sarcasm_comment_text = parsed_comment_value
-                        else: logger.warning(f"JSON-строка 'sarcasm.comment' содержит не строку и не словарь: {type(parsed_comment_value)}. Игнорируем."); sarcasm_comment_text = None
-                except json.JSONDecodeError:
-                    logger.info("Значение 'sarcasm.comment' не JSON, используется как простая строка.")
-                    sarcasm_comment_text = comment_value.strip('"')
-            elif comment_value is not None:
-                 logger.warning(f"Значение 'sarcasm.comment' не строка: {type(comment_value)}")
+        # Текст сарказма уже декодирован схемой (JSON-строка, словарь или простой текст)
+        sarcasm_comment_text = content_document.sarcasm_comment
         if sarcasm_comment_text: logger.info(f"Текст для картинки сарказма: '{sarcasm_comment_text[:60]}...'")
         else: logger.info("Текст сарказма не найден в данных контента.")
         # +++++++++++++++++++++++++++++++++++++
 
-        # +++ БЛОК: Получение форматирования от OpenAI (с исправлением) +++
-        formatted_sarcasm_text = None
-        suggested_sarcasm_font_size = None
-        default_sarcasm_font_size = 60
-
-        if sarcasm_comment_text:
-            logger.info("Запрос форматирования текста сарказма у OpenAI...")
-            if not openai_client_instance:
-                if '_initialize_openai_client' in globals() and callable(globals()['_initialize_openai_client']):
-                    if not _initialize_openai_client(): logger.error("Клиент OpenAI недоступен для форматирования сарказма.")
-                else: logger.error("Функция _initialize_openai_client не найдена!")
-
-            if openai_client_instance:
-                if not prompts_config_data: # Загрузка, если пуст
-                     prompts_config_path_str = config.get('FILE_PATHS.prompts_config')
-                     if prompts_config_path_str:
-                         prompts_config_path = Path(prompts_config_path_str)
-                         if not prompts_config_path.is_absolute():
-                             if 'BASE_DIR' not in globals() or BASE_DIR is None: logger.error("Глобальная переменная BASE_DIR не найдена!")
-                             else: prompts_config_path = BASE_DIR / prompts_config_path
-                         if 'load_json_config' in globals() and callable(globals()['load_json_config']): prompts_config_data = load_json_config(str(prompts_config_path)) or {}
-                         else: logger.error("Функция load_json_config не найдена!"); prompts_config_data = {}
-                     else: logger.error("Путь к prompts_config не найден!"); prompts_config_data = {}
-
-                formatting_prompt_settings = prompts_config_data.get("sarcasm", {}).get("image_formatting", {})
-                formatting_prompt_template = formatting_prompt_settings.get("template")
-                formatting_max_tokens = int(formatting_prompt_settings.get("max_tokens", 300))
-                formatting_temperature = float(formatting_prompt_settings.get("temperature", 0.5))
-
-                if formatting_prompt_template:
-                    prompt_text_for_formatting = formatting_prompt_template.format(sarcasm_text_input=sarcasm_comment_text)
-                    try:
-                        # --- Используем OPENAI_MODEL_MAIN ---
-                        logger.info(f"Вызов OpenAI для форматирования сарказма (модель: {OPENAI_MODEL_MAIN})...")
-                        response = openai_client_instance.chat.completions.create(
-                            model=OPENAI_MODEL_MAIN, # Используем модель, полученную внутри main
-                            messages=[{"role": "user", "content": prompt_text_for_formatting}],
-                            max_tokens=formatting_max_tokens,
-                            temperature=formatting_temperature,
-                            response_format={"type": "json_object"}
-                        )
-                        # ------------------------------------
-
-                        if response.choices and response.choices[0].message and response.choices[0].message.content:
-                            response_json_str = response.choices[0].message.content.strip()
-                            logger.debug(f"Ответ OpenAI (форматирование сарказма): {response_json_str}")
-                            try:
-                                formatting_result = json.loads(response_json_str)
-                                fmt_text = formatting_result.get("formatted_text")
-                                fnt_size = formatting_result.get("font_size")
-                                if isinstance(fmt_text, str) and fmt_text.strip(): formatted_sarcasm_text = fmt_text
-                                else: logger.warning("OpenAI вернул некорректный 'formatted_text'.")
-                                if isinstance(fnt_size, int) and 10 < fnt_size < 200: suggested_sarcasm_font_size = fnt_size
-                                else: logger.warning(f"OpenAI вернул некорректный 'font_size': {fnt_size}.")
-                                if formatted_sarcasm_text and suggested_sarcasm_font_size:
-                                     log_text_preview = formatted_sarcasm_text[:50].replace('\n', '\\n')
-                                     logger.info(f"Получены рекомендации от OpenAI: Размер={suggested_sarcasm_font_size}, Текст='{log_text_preview}...'")
-                                else: logger.warning("Не удалось получить валидные данные форматирования от OpenAI.")
-                            except json.JSONDecodeError: logger.error(f"Ошибка декодирования JSON ответа OpenAI: {response_json_str}")
-                            except Exception as parse_err: logger.error(f"Ошибка парсинга ответа OpenAI: {parse_err}", exc_info=True)
-                        else: logger.error("OpenAI вернул пустой ответ на запрос форматирования.")
-                    # Обработка ошибок OpenAI (как в оригинале)
-                    except openai.AuthenticationError as e: logger.exception(f"Ошибка аутентификации OpenAI: {e}")
-                    except openai.RateLimitError as e: logger.exception(f"Превышен лимит запросов OpenAI: {e}")
-                    except openai.APIConnectionError as e: logger.exception(f"Ошибка соединения с API OpenAI: {e}")
-                    except openai.APIStatusError as e: logger.exception(f"Ошибка статуса API OpenAI: {e.status_code} - {e.response}")
-                    except openai.BadRequestError as e: logger.exception(f"Ошибка неверного запроса OpenAI: {e}")
-                    except openai.OpenAIError as e: logger.exception(f"Произошла ошибка API OpenAI: {e}")
-                    except Exception as e: logger.error(f"Неизвестная ошибка при запросе форматирования к OpenAI: {e}", exc_info=True)
-                else: logger.error("Промпт 'sarcasm.image_formatting.template' не найден в prompts_config.json.")
-            else: logger.error("Клиент OpenAI не инициализирован, форматирование невозможно.")
-        else: logger.info("Текст сарказма отсутствует, форматирование не требуется.")
-
-        # Fallback (как в оригинале)
-        if not formatted_sarcasm_text:
-            logger.warning("Используется исходный текст сарказма для отрисовки (без форматирования OpenAI).")
-            formatted_sarcasm_text = sarcasm_comment_text
-            if formatted_sarcasm_text: formatted_sarcasm_text = formatted_sarcasm_text.replace('\n', ' ')
-        if not suggested_sarcasm_font_size:
-            logger.warning(f"Используется размер шрифта по умолчанию: {default_sarcasm_font_size}")
-            suggested_sarcasm_font_size = default_sarcasm_font_size
-        # +++ КОНЕЦ БЛОКА +++
-
         # --- Загрузка config_mj ---
         logger.info(f"Загрузка состояния: {CONFIG_MJ_REMOTE_PATH}...")
         config_mj = load_b2_json(b2_client, B2_BUCKET_NAME, CONFIG_MJ_REMOTE_PATH, str(config_mj_local_path), default_value=None)
@@ -1063,6 +1555,22 @@ def main():
             config_mj.setdefault("status", None)
         logger.info("✅ Конфиг MJ загружен.")
         # --------------------------
+        # Задача Runway отправлена одним из прошлых запусков: этот запуск только проверяет ее статус,
+        # картинка с сарказмом уже загружена запуском, отправившим задачу.
+        runway_task_state = get_runway_task(config_mj) if not use_mock_flag else None
+        if runway_task_state and sarcasm_comment_text:
+            logger.info("Запуск проверки задачи Runway: картинка с сарказмом не перегенерируется.")
+            sarcasm_comment_text = None
+
+        # --- Промпты и клиент OpenAI для этапов анализа (выбор картинки, размещение заголовка, сарказм) ---
+        if not prompts_config_data:
+            prompts_config_path_str = config.get('FILE_PATHS.prompts_config')
+            if prompts_config_path_str:
+                prompts_config_path = Path(prompts_config_path_str)
+                if not prompts_config_path.is_absolute(): prompts_config_path = BASE_DIR / prompts_config_path
+                prompts_config_data = load_json_config(str(prompts_config_path)) or {}
+            else: logger.error("Путь к prompts_config не найден!")
+        if not openai_client_instance: _initialize_openai_client()
 
         # --- Определение типа результата MJ (как в оригинале) ---
         mj_results = config_mj.get("midjourney_results", {})
@@ -1099,319 +1607,52 @@ def main():
             # temp_dir_path уже создан
             logger.info(f"Временная папка: {temp_dir_path}")
 
-            # ==================================================================
-            # ||   БЛОК ОБРАБОТКИ СЦЕНАРИЕВ (use-mock, upscale, imagine)      ||
-            # ||   Полностью скопирован из вашего оригинального файла         ||
-            # ||   для сохранения всей логики.                              ||
-            # ==================================================================
-            if use_mock_flag:
-                # --- Сценарий 0: Принудительный Mock ---
-                logger.warning(f"⚠️ Принудительный mock для ID: {generation_id}")
-                placeholder_text = f"MJ Timeout\n{topic[:60]}"
-                encoded_text = urllib.parse.quote(placeholder_text)
-                placeholder_url = f"https://placehold.co/{PLACEHOLDER_WIDTH_LOCAL}x{PLACEHOLDER_HEIGHT_LOCAL}/{PLACEHOLDER_BG_COLOR}/{PLACEHOLDER_TEXT_COLOR}?text={encoded_text}"
-                local_image_path = temp_dir_path / f"{generation_id}.{IMAGE_FORMAT}"
-                logger.info(f"Создание плейсхолдера: {placeholder_url}")
-                if not download_image(placeholder_url, str(local_image_path)):
-                    logger.error("Не удалось скачать плейсхолдер.")
-                    local_image_path = None
-                else:
-                     logger.info(f"Плейсхолдер сохранен как финальный PNG: {local_image_path}")
-
-                video_path_str = None
-                if 'create_mock_video' in globals() and callable(globals()['create_mock_video']):
-                    if ImageClip and local_image_path and local_image_path.is_file():
-                         video_path_str = create_mock_video(str(local_image_path))
-                         if not video_path_str: logger.warning("Не удалось создать mock видео.")
-                         else: video_path = Path(video_path_str)
-                    elif not ImageClip: logger.warning("MoviePy не найден, mock видео не создано.")
-                    elif not local_image_path or not local_image_path.is_file(): logger.warning("Базовое изображение для mock не найдено, mock видео не создано.")
-                else: logger.error("Функция create_mock_video не найдена!")
-
-                logger.info("Сброс состояния MJ...");
-                config_mj['midjourney_task'] = None; config_mj['midjourney_results'] = {}
-                config_mj['generation'] = False; config_mj['status'] = None
-
-            elif is_upscale_result and final_upscaled_image_url:
-                # --- Сценарий 3: Есть результат апскейла -> Генерируем Runway ---
-                logger.info(f"Обработка результата /upscale для ID {generation_id}. Генерация видео Runway...")
-                runway_base_image_path = temp_dir_path / f"{generation_id}_upscaled_for_runway.{IMAGE_FORMAT}"
-                if not download_image(final_upscaled_image_url, str(runway_base_image_path)):
-                    raise Exception(f"Не скачать апскейл {final_upscaled_image_url}")
-                logger.info(f"Апскейл для Runway сохранен: {runway_base_image_path}")
-
-                if 'resize_existing_image' in globals() and callable(globals()['resize_existing_image']):
-                    if PIL_AVAILABLE:
-                        if not resize_existing_image(str(runway_base_image_path)): logger.warning(f"Не удалось выполнить ресайз для {runway_base_image_path}, но продолжаем.")
-                    else: logger.warning("Pillow не найден, ресайз не выполнен.")
-                else: logger.error("Функция resize_existing_image не найдена!")
-
-                video_path_str = None
-                if not final_runway_prompt:
-                    logger.error("❌ Промпт Runway отсутствует! Создание mock видео.")
-                    if 'create_mock_video' in globals() and callable(globals()['create_mock_video']):
-                        if ImageClip: video_path_str = create_mock_video(str(runway_base_image_path))
-                        else: logger.warning("MoviePy не найден, mock видео не создано.")
-                    else: logger.error("Функция create_mock_video не найдена!")
-                else:
-                     if not RUNWAY_SDK_AVAILABLE:
-                         logger.error("SDK RunwayML недоступен. Создание mock видео.")
-                         if 'create_mock_video' in globals() and callable(globals()['create_mock_video']):
-                             if ImageClip: video_path_str = create_mock_video(str(runway_base_image_path))
-                             else: logger.warning("MoviePy не найден, mock видео не создано.")
-                         else: logger.error("Функция create_mock_video не найдена!")
-                     elif not RUNWAY_API_KEY:
-                          logger.error("RUNWAY_API_KEY не найден. Создание mock видео.")
-                          if 'create_mock_video' in globals() and callable(globals()['create_mock_video']):
-                              if ImageClip: video_path_str = create_mock_video(str(runway_base_image_path))
-                              else: logger.warning("MoviePy не найден, mock видео не создано.")
-                          else: logger.error("Функция create_mock_video не найдена!")
-                     else:
-                         if 'generate_runway_video' in globals() and callable(globals()['generate_runway_video']):
-                             video_url_or_path = generate_runway_video(
-                                 image_path=str(runway_base_image_path), script=final_runway_prompt,
-                                 config=config, api_key=RUNWAY_API_KEY
-                             )
-                             if video_url_or_path:
-                                 if video_url_or_path.startswith("http"):
-                                     video_path_temp = temp_dir_path / f"{generation_id}_runway_final.{VIDEO_FORMAT}"
-                                     if download_video(video_url_or_path, str(video_path_temp)):
-                                         video_path = video_path_temp
-                                         logger.info(f"Видео Runway скачано: {video_path}")
-                                     else:
-                                         logger.error(f"Не удалось скачать видео Runway {video_url_or_path}. Создание mock.")
-                                         if 'create_mock_video' in globals() and callable(globals()['create_mock_video']):
-                                             if ImageClip: video_path_str = create_mock_video(str(runway_base_image_path))
-                                             else: logger.warning("MoviePy не найден, mock видео не создано.")
-                                         else: logger.error("Функция create_mock_video не найдена!")
-                                 else:
-                                     video_path = Path(video_url_or_path)
-                                     logger.info(f"Получен локальный путь к видео Runway: {video_path}")
-                             else:
-                                 logger.error("Генерация видео Runway не удалась. Создание mock.")
-                                 if 'create_mock_video' in globals() and callable(globals()['create_mock_video']):
-                                     if ImageClip: video_path_str = create_mock_video(str(runway_base_image_path))
-                                     else: logger.warning("MoviePy не найден, mock видео не создано.")
-                                 else: logger.error("Функция create_mock_video не найдена!")
-                         else:
-                              logger.error("Функция generate_runway_video не найдена! Создание mock видео.")
-                              if 'create_mock_video' in globals() and callable(globals()['create_mock_video']):
-                                  if ImageClip: video_path_str = create_mock_video(str(runway_base_image_path))
-                                  else: logger.warning("MoviePy не найден, mock видео не создано.")
-                              else: logger.error("Функция create_mock_video не найдена!")
-
-                     if not video_path and video_path_str: video_path = Path(video_path_str)
-
-                if not video_path or not video_path.is_file(): logger.warning("Не удалось получить финальное видео (Runway или mock).")
-                local_image_path = None # Изображение не нужно сохранять
-                logger.info("Очистка состояния MJ (после Runway)...");
-                config_mj['midjourney_results'] = {}; config_mj['generation'] = False
-                config_mj['midjourney_task'] = None; config_mj['status'] = None
-
-            elif is_imagine_result:
-                # --- Сценарий 2: Есть результат imagine -> Выбираем картинки, создаем заголовок, запускаем upscale ---
-                logger.info(f"Обработка результата /imagine для ID {generation_id}.")
-                imagine_task_id = mj_results.get("task_id")
-                if not imagine_task_id and isinstance(task_meta_data, dict): imagine_task_id = task_meta_data.get("task_id")
-                if not imagine_urls or len(imagine_urls) != 4: logger.error("Не найдены URL сетки /imagine (4 шт.)."); raise ValueError("Некорректные результаты /imagine")
-                if not imagine_task_id: logger.error(f"Не найден task_id исходной задачи /imagine в результатах: {mj_results}."); raise ValueError("Отсутствует ID исходной задачи /imagine")
-
-                logger.info("Выбор лучшего изображения для Runway...")
-                if not prompts_config_data: # Загрузка, если пуст
-                     prompts_config_path_str = config.get('FILE_PATHS.prompts_config')
-                     if prompts_config_path_str:
-                         prompts_config_path = Path(prompts_config_path_str)
-                         if not prompts_config_path.is_absolute(): prompts_config_path = BASE_DIR / prompts_config_path
-                         if 'load_json_config' in globals() and callable(globals()['load_json_config']): prompts_config_data = load_json_config(str(prompts_config_path)) or {}
-                         else: logger.error("Функция load_json_config не найдена!")
-                     else: logger.error("Путь к prompts_config не найден!")
-                visual_analysis_settings = prompts_config_data.get("visual_analysis", {}).get("image_selection", {})
-                best_index_runway = 0
-                if 'select_best_image' in globals() and callable(globals()['select_best_image']):
-                    if not openai_client_instance: _initialize_openai_client()
-                    if openai_client_instance:
-                        # --- Используем глобальную OPENAI_VISION_MODEL, установленную в начале main ---
-                        best_index_runway = select_best_image(imagine_urls, first_frame_description or " ", visual_analysis_settings)
-                    elif openai is None: logger.warning("Модуль OpenAI недоступен. Используется индекс 0 для Runway.")
-                    else: logger.warning("Клиент OpenAI не инициализирован. Используется индекс 0 для Runway.")
-                else: logger.error("Функция select_best_image не найдена! Используется индекс 0 для Runway.")
-                if best_index_runway is None or not (0 <= best_index_runway <= 3): logger.warning(f"Не удалось выбрать индекс для Runway (результат: {best_index_runway}). Используем индекс 0."); best_index_runway = 0
-                image_for_runway_url = imagine_urls[best_index_runway]
-                logger.info(f"Индекс для Runway: {best_index_runway}, URL: {image_for_runway_url[:60]}...")
-
-                title_index = (best_index_runway + 1) % 4
-                image_for_title_url = imagine_urls[title_index]
-                logger.info(f"Индекс для заголовка: {title_index}, URL: {image_for_title_url[:60]}...")
-
-                final_font_path = None
-                logger.info("Определение шрифта для заголовка...")
-                creative_config_path_str = config.get('FILE_PATHS.creative_config')
-                creative_config_data = {}
-                if creative_config_path_str:
-                    creative_config_path = Path(creative_config_path_str)
-                    if not creative_config_path.is_absolute(): creative_config_path = BASE_DIR / creative_config_path
-                    if 'load_json_config' in globals() and callable(globals()['load_json_config']): creative_config_data = load_json_config(str(creative_config_path)) or {}
-                    else: logger.error("Функция load_json_config не найдена!")
-                else: logger.error("Путь к creative_config не найден!")
-                fonts_mapping = creative_config_data.get("FOCUS_FONT_MAPPING", {})
-                default_font_rel_path = fonts_mapping.get("__default__")
-                if not default_font_rel_path: logger.error("Критическая ошибка: Шрифт по умолчанию '__default__' не задан!"); raise ValueError("Шрифт по умолчанию не настроен")
-                font_rel_path = None
-                if selected_focus and isinstance(selected_focus, str):
-                    font_rel_path = fonts_mapping.get(selected_focus)
-                    if font_rel_path: logger.info(f"Найден шрифт для фокуса '{selected_focus}': {font_rel_path}")
-                    else: logger.warning(f"Шрифт для фокуса '{selected_focus}' не найден. Используется дефолтный.")
-                else: logger.warning(f"Ключ 'selected_focus' отсутствует/некорректен. Используется дефолтный.")
-                final_rel_path = font_rel_path if font_rel_path else default_font_rel_path
-                logger.info(f"Используемый относительный путь к шрифту: {final_rel_path}")
-                font_path_abs = BASE_DIR / final_rel_path
-                if font_path_abs.is_file(): final_font_path = str(font_path_abs); logger.info(f"Финальный абсолютный путь к шрифту: {final_font_path}")
-                else:
-                    logger.error(f"Файл шрифта не найден: {font_path_abs}")
-                    if final_rel_path == default_font_rel_path: logger.critical(f"КРИТИЧЕСКАЯ ОШИБКА: Не найден файл шрифта по умолчанию: {font_path_abs}"); raise FileNotFoundError(f"Не найден файл шрифта по умолчанию: {font_path_abs}")
-                    else:
-                         logger.warning(f"Попытка использовать шрифт по умолчанию: {default_font_rel_path}")
-                         font_path_abs_default = BASE_DIR / default_font_rel_path
-                         if font_path_abs_default.is_file(): final_font_path = str(font_path_abs_default); logger.info(f"Успешно использован шрифт по умолчанию: {final_font_path}")
-                         else: logger.critical(f"КРИТИЧЕСКАЯ ОШИБКА: Файл шрифта по умолчанию также не найден: {font_path_abs_default}"); raise FileNotFoundError(f"Не найден файл шрифта по умолчанию: {font_path_abs_default}")
-                if not final_font_path: raise RuntimeError("Не удалось определить финальный путь к шрифту")
-
-                logger.info("Создание изображения-заголовка...")
-                title_base_path = temp_dir_path / f"{generation_id}_title_base.{IMAGE_FORMAT}"
-                final_title_image_path = temp_dir_path / f"{generation_id}.{IMAGE_FORMAT}"
-                if download_image(image_for_title_url, str(title_base_path)):
-                    logger.info(f"Базовое изображение для заголовка скачано: {title_base_path.name}")
-                    logger.info(f"Запрос рекомендаций по размещению для текста (тема): '{text_for_title[:100]}...'")
-                    if not openai_client_instance: _initialize_openai_client()
-                    if 'get_text_placement_suggestions' in globals() and callable(globals()['get_text_placement_suggestions']):
-                        # --- Используем глобальную OPENAI_VISION_MODEL, установленную в начале main ---
-                        placement_suggestions = get_text_placement_suggestions(
-                            image_url=image_for_title_url, text=text_for_title,
-                            image_width=PLACEHOLDER_WIDTH_LOCAL, image_height=PLACEHOLDER_HEIGHT_LOCAL
-                        )
-                    else:
-                        logger.error("Функция get_text_placement_suggestions не найдена!")
-                        placement_suggestions = {"position": ('center', 'center'), "font_size": 70, "formatted_text": text_for_title.split('\n')[0] if text_for_title else "Текст отсутствует", "text_color": "#333333"}
-                    title_padding = 60; title_bg_blur_radius = 0; title_bg_opacity = 0
-                    if 'add_text_to_image' in globals() and callable(globals()['add_text_to_image']):
-                        if PIL_AVAILABLE:
-                            log_text_preview = placement_suggestions['formatted_text'].replace('\n', '\\n')
-                            logger.info(f"Параметры для add_text_to_image: text='{log_text_preview}', color={placement_suggestions['text_color']}, pos={placement_suggestions['position']}")
-                            if add_text_to_image(
-                                image_path_str=str(title_base_path), text=placement_suggestions["formatted_text"],
-                                font_path_str=final_font_path, output_path_str=str(final_title_image_path),
-                                text_color_hex=placement_suggestions["text_color"], position=placement_suggestions["position"],
-                                padding=title_padding, haze_opacity=HAZE_OPACITY_DEFAULT,
-                                bg_blur_radius=title_bg_blur_radius, bg_opacity=title_bg_opacity, logger_instance=logger
-                            ): logger.info(f"✅ Изображение-заголовок с текстом создано: {final_title_image_path.name}"); local_image_path = final_title_image_path
-                            else: logger.error("Не удалось создать изображение-заголовок."); local_image_path = title_base_path; logger.warning("В качестве финального PNG будет использовано базовое изображение без текста.")
-                        else: logger.warning("Pillow недоступен, текст на заголовок не добавлен."); local_image_path = title_base_path
-                    else: logger.error("Функция add_text_to_image не найдена/импортирована!"); local_image_path = title_base_path; logger.warning("В качестве финального PNG будет использовано базовое изображение без текста.")
-                else: logger.error(f"Не удалось скачать базовое изображение для заголовка: {image_for_title_url}"); local_image_path = None
-
-                action_to_trigger = f"upscale{best_index_runway + 1}"
-                available_actions = task_result_data.get("actions", [])
-                logger.info(f"Запуск Upscale для картинки Runway (индекс {best_index_runway}). Действие: {action_to_trigger}.")
-                if action_to_trigger not in available_actions:
-                    logger.warning(f"Действие {action_to_trigger} недоступно! Поиск другого upscale...")
-                    action_to_trigger = next((a for a in available_actions if a.startswith("upscale")), None)
-                    if action_to_trigger: logger.info(f"Используем первое доступное upscale: {action_to_trigger}")
-                    else: logger.error("Не найдено доступных upscale действий!")
-                upscale_task_info = None
-                if 'trigger_piapi_action' in globals() and callable(globals()['trigger_piapi_action']):
-                    if action_to_trigger:
-                        if not MIDJOURNEY_API_KEY: logger.error("MIDJOURNEY_API_KEY не найден для trigger_piapi_action.")
-                        elif not MJ_IMAGINE_ENDPOINT: logger.error("MJ_IMAGINE_ENDPOINT не найден для trigger_piapi_action.")
-                        else: upscale_task_info = trigger_piapi_action(original_task_id=imagine_task_id, action=action_to_trigger, api_key=MIDJOURNEY_API_KEY, endpoint=MJ_IMAGINE_ENDPOINT)
-                    else: logger.warning("Нет действия upscale для запуска.")
-                else: logger.error("Функция trigger_piapi_action не найдена!")
-                if upscale_task_info and upscale_task_info.get("task_id"):
-                    logger.info(f"Задача Upscale ({action_to_trigger}) запущена. ID: {upscale_task_info['task_id']}")
-                    config_mj['midjourney_task'] = upscale_task_info; config_mj['midjourney_results'] = {}
-                    config_mj['generation'] = False; config_mj['status'] = "waiting_for_upscale"
-                    logger.info("Состояние обновлено для ожидания /upscale.")
-                else:
-                    logger.error(f"Не удалось запустить задачу Upscale ({action_to_trigger}).")
-                    config_mj['status'] = "upscale_trigger_failed"; config_mj['midjourney_task'] = None
-                    config_mj['midjourney_results'] = {}
-                video_path = None
-
-            elif config_mj.get("generation") is True:
-                # --- Сценарий 1: Запускаем imagine ---
-                logger.info(f"Нет результатов MJ, флаг generation=true. Запуск /imagine для ID {generation_id}...")
-                if not final_mj_prompt: logger.error("❌ Промпт MJ отсутствует!"); config_mj['generation'] = False
-                else:
-                    if 'initiate_midjourney_task' in globals() and callable(globals()['initiate_midjourney_task']):
-                        if not MIDJOURNEY_API_KEY: logger.error("MIDJOURNEY_API_KEY не найден для initiate_midjourney_task.")
-                        elif not MJ_IMAGINE_ENDPOINT: logger.error("MJ_IMAGINE_ENDPOINT не найден для initiate_midjourney_task.")
-                        else:
-                            imagine_task_info = initiate_midjourney_task(prompt=final_mj_prompt, config=config, api_key=MIDJOURNEY_API_KEY, endpoint=MJ_IMAGINE_ENDPOINT, ref_id=generation_id)
-                            if imagine_task_info and imagine_task_info.get("task_id"):
-                                logger.info(f"Задача /imagine запущена. ID: {imagine_task_info['task_id']}")
-                                config_mj['midjourney_task'] = imagine_task_info; config_mj['generation'] = False
-                                config_mj['midjourney_results'] = {}; config_mj['status'] = "waiting_for_imagine"
-                            else: logger.warning("Не удалось получить task_id для /imagine."); config_mj['midjourney_task'] = None; config_mj['generation'] = False
-                    else: logger.error("Функция initiate_midjourney_task не найдена!"); config_mj['midjourney_task'] = None; config_mj['generation'] = False
-                local_image_path = None; video_path = None
-
-            else:
-                logger.warning("Нет активной задачи MJ, результатов или флага 'generation'. Пропуск.")
-                local_image_path = None; video_path = None
-
-            # +++ Генерация картинки с сарказмом (используя данные OpenAI) +++
-            sarcasm_image_path = None
-            if 'add_text_to_image_sarcasm_openai_ready' in globals() and callable(globals()['add_text_to_image_sarcasm_openai_ready']):
-                if formatted_sarcasm_text and suggested_sarcasm_font_size and PIL_AVAILABLE:
-                    logger.info("Генерация изображения с сарказмом (с форматированием OpenAI)...")
-                    if not SARCASM_BASE_IMAGE_REL_PATH or not SARCASM_FONT_REL_PATH or not SARCASM_IMAGE_SUFFIX: logger.error("Константы для сарказма не определены в области видимости main!")
-                    else:
-                        sarcasm_base_image_path_abs = BASE_DIR / SARCASM_BASE_IMAGE_REL_PATH
-                        sarcasm_font_path_abs = BASE_DIR / SARCASM_FONT_REL_PATH
-                        sarcasm_output_path_temp = temp_dir_path / f"{generation_id}{SARCASM_IMAGE_SUFFIX}"
-                        if not sarcasm_base_image_path_abs.is_file(): logger.error(f"Базовое изображение Барона не найдено: {sarcasm_base_image_path_abs}")
-                        elif not sarcasm_font_path_abs.is_file(): logger.error(f"Шрифт для сарказма не найден: {sarcasm_font_path_abs}")
-                        else:
-                            sarcasm_success = add_text_to_image_sarcasm_openai_ready(
-                                image_path_str=str(sarcasm_base_image_path_abs), formatted_text=formatted_sarcasm_text,
-                                suggested_font_size=suggested_sarcasm_font_size, font_path_str=str(sarcasm_font_path_abs),
-                                output_path_str=str(sarcasm_output_path_temp), text_color_hex="#FFFFFF", align='right',
-                                padding_fraction=0.05, stroke_width=2, stroke_color_hex="#404040", logger_instance=logger
-                            )
-                            if sarcasm_success: sarcasm_image_path = sarcasm_output_path_temp; logger.info(f"✅ Изображение с сарказмом создано (OpenAI формат): {sarcasm_image_path.name}")
-                            else: logger.error("Не удалось создать изображение с сарказмом (OpenAI формат).")
-                elif not formatted_sarcasm_text: logger.info("Пропуск генерации картинки с сарказмом (нет форматированного текста).")
-                elif not suggested_sarcasm_font_size: logger.info("Пропуск генерации картинки с сарказмом (нет предложенного размера шрифта).")
-                elif not PIL_AVAILABLE: logger.warning("Pillow недоступен, пропуск генерации картинки с сарказмом.")
-            else: logger.error("Функция add_text_to_image_sarcasm_openai_ready не найдена!")
-            # +++ КОНЕЦ БЛОКА +++
-
-            # --- Загрузка файлов в B2 ---
-            target_folder_b2 = "666/"
-            upload_success_img = False
-            upload_success_vid = False
-            upload_success_sarcasm = False
-
-            if 'upload_to_b2' in globals() and callable(globals()['upload_to_b2']):
-                if local_image_path and isinstance(local_image_path, Path) and local_image_path.is_file():
-                     b2_image_filename = f"{generation_id}.png"
-                     upload_success_img = upload_to_b2(b2_client, B2_BUCKET_NAME, target_folder_b2, str(local_image_path), b2_image_filename)
-                     if not upload_success_img: logger.error(f"!!! ОШИБКА ЗАГРУЗКИ ИЗОБРАЖЕНИЯ {b2_image_filename} !!!")
-                elif local_image_path: logger.warning(f"Финальное изображение {local_image_path} не найдено для загрузки.")
-
-                if video_path and isinstance(video_path, Path) and video_path.is_file():
-                     b2_video_filename = f"{generation_id}.mp4"
-                     upload_success_vid = upload_to_b2(b2_client, B2_BUCKET_NAME, target_folder_b2, str(video_path), b2_video_filename)
-                     if not upload_success_vid: logger.error(f"!!! ОШИБКА ЗАГРУЗКИ ВИДЕО {b2_video_filename} !!!")
-                elif video_path: logger.error(f"Видео {video_path} не найдено для загрузки!")
-
-                if sarcasm_image_path and isinstance(sarcasm_image_path, Path) and sarcasm_image_path.is_file():
-                     if 'SARCASM_IMAGE_SUFFIX' not in locals(): logger.error("Переменная SARCASM_IMAGE_SUFFIX не определена в области видимости main!")
-                     else:
-                         b2_sarcasm_filename = f"{generation_id}{SARCASM_IMAGE_SUFFIX}"
-                         upload_success_sarcasm = upload_to_b2(b2_client, B2_BUCKET_NAME, target_folder_b2, str(sarcasm_image_path), b2_sarcasm_filename)
-                         if not upload_success_sarcasm: logger.error(f"!!! ОШИБКА ЗАГРУЗКИ КАРТИНКИ С САРКАЗМОМ {b2_sarcasm_filename} !!!")
-                elif sarcasm_image_path: logger.warning(f"Картинка с сарказмом {sarcasm_image_path} не найдена для загрузки.")
-            else: logger.error("Функция upload_to_b2 не найдена! Загрузка в B2 невозможна.")
+            # --- Граф этапов "media": шаги выбранной ветки + финал (см. "Этапы generate_media" выше) ---
+            media_ctx = {
+                "generation_id": generation_id, "temp_dir_path": temp_dir_path, "image_format": IMAGE_FORMAT,
+                "b2_client": b2_client, "bucket_name": B2_BUCKET_NAME,
+                "midjourney_api_key": MIDJOURNEY_API_KEY, "mj_endpoint": MJ_IMAGINE_ENDPOINT, "runway_api_key": RUNWAY_API_KEY,
+                "openai_model": OPENAI_MODEL_MAIN, "prompts_config": prompts_config_data,
+                "topic": topic, "selected_focus": selected_focus, "first_frame_description": first_frame_description,
+                "final_mj_prompt": final_mj_prompt, "final_runway_prompt": final_runway_prompt,
+                "sarcasm_comment_text": sarcasm_comment_text,
+                "placeholder_size": (PLACEHOLDER_WIDTH_LOCAL, PLACEHOLDER_HEIGHT_LOCAL),
+                "placeholder_colors": (PLACEHOLDER_BG_COLOR, PLACEHOLDER_TEXT_COLOR),
+                "placeholder_font_path": BASE_DIR / config.get("FILE_PATHS.placeholder_font", SARCASM_FONT_REL_PATH),
+                "sarcasm_base_image_rel_path": SARCASM_BASE_IMAGE_REL_PATH, "sarcasm_font_rel_path": SARCASM_FONT_REL_PATH,
+                "sarcasm_image_suffix": SARCASM_IMAGE_SUFFIX, "haze_opacity": HAZE_OPACITY_DEFAULT,
+                "download_retries": int(config.get("WORKFLOW.stage_download_retries", 1)),
+            }
+            stage_workers = int(config.get("WORKFLOW.stage_max_workers", 3)) if config.get("WORKFLOW.parallel_analysis", True) else 0
+            media_dag = StageDAG("media", max_workers=stage_workers, logger_instance=logger)
+            if use_mock_flag: add_mock_stages(media_dag, media_ctx)
+            elif runway_task_state: add_runway_poll_stages(media_dag, media_ctx, runway_task_state)
+            elif is_upscale_result and final_upscaled_image_url: add_upscale_stages(media_dag, media_ctx, final_upscaled_image_url)
+            elif is_imagine_result: add_imagine_stages(media_dag, media_ctx, mj_results, imagine_urls)
+            elif config_mj.get("generation") is True: add_imagine_launch_stages(media_dag, media_ctx)
+            else: logger.warning("Нет активной задачи MJ, результатов или флага 'generation'. Пропуск.")
+            add_finalize_stages(media_dag, media_ctx)
+
+            media_dag.run({key: value for key, value in MEDIA_VALUE_DEFAULTS.items() if not media_dag.produces(key)})
+            for failed_stage in media_dag.failed():
+                if not failed_stage.startswith("upload."): continue
+                for _ in range(int(config.get("WORKFLOW.stage_upload_retries", 1))):
+                    if media_dag.retry(failed_stage): break
+            media_dag.summary()
+
+            # Изменения состояния ветки применяются только если ее этапы дошли до конца
+            config_mj_patch = media_dag.value("config_mj_patch")
+            if config_mj_patch is None:
+                raise RuntimeError(f"Этапы ветки не завершены (ошибки: {media_dag.failed()}), config_midjourney.json не обновлен.")
+            config_mj.update(config_mj_patch)
+
+            local_image_path = media_dag.value("local_image_path")
+            video_path = media_dag.value("video_path")
+            video_streamed = bool(media_dag.value("video_streamed", False))
+            sarcasm_image_path = media_dag.value("sarcasm_image_path")
+            upload_success_img = bool(media_dag.value("upload_success_img", False))
+            upload_success_vid = video_streamed or bool(media_dag.value("upload_success_vid", False))
+            upload_success_sarcasm = bool(media_dag.value("upload_success_sarcasm", False))
 
             uploaded_items = []
             if upload_success_img: uploaded_items.append("Изображение")
@@ -1433,18 +1674,14 @@ def main():
         # --- finally для очистки temp_dir_path ---
         finally:
              if temp_dir_path and temp_dir_path.exists(): # Проверяем, что temp_dir_path не None
-                 try:
-                     shutil.rmtree(temp_dir_path)
-                     logger.debug(f"Удалена временная папка: {temp_dir_path}")
-                 except Exception as e:
-                     logger.warning(f"Не удалить {temp_dir_path}: {e}")
+                 remove_scratch_dir(temp_dir_path)
         # --- Конец вложенного finally ---
 
 
         # --- Сохранение финального состояния config_mj ---
         logger.info(f"Сохранение config_midjourney.json в B2...")
         # Используем новый уникальный путь для временного файла сохранения вне удаляемой папки
-        config_mj_save_local_path = Path(f"config_mj_save_temp_{timestamp_suffix}.json")
+        config_mj_save_local_path = scratch_path(f"config_mj_save_temp_{timestamp_suffix}.json")
         ensure_directory_exists(str(config_mj_save_local_path)) # Убедимся, что папка есть
 
         if 'save_b2_json' in globals() and callable(globals()['save_b2_json']):
@@ -1482,10 +1719,14 @@ def main():
         sys.exit(1)
     # --- Внешний finally для очистки временных файлов ---
     finally:
+        log_font_stats()
+        # Отчет по токенам/задержкам Vision-вызовов (накопительный, в B2)
+        if b2_client and generation_id:
+            flush_usage_report(b2_client, B2_BUCKET_NAME, generation_id, "generate_media", config=config)
+
         # Очистка временной папки (если она еще существует)
         if 'temp_dir_path' in locals() and temp_dir_path and temp_dir_path.exists():
-            try: shutil.rmtree(temp_dir_path); logger.debug(f"Окончательная очистка temp папки: {temp_dir_path}")
-            except Exception as final_clean_err: logger.warning(f"Ошибка окончательной очистки {temp_dir_path}: {final_clean_err}")
+            remove_scratch_dir(temp_dir_path)
 
         # Очистка временных файлов конфигов, если они вне temp_dir_path
         if 'content_local_temp_path' in locals() and content_local_temp_path and content_local_temp_path.exists():
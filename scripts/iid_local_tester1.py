@@ -44,6 +44,7 @@ try:
     # Импортируем утилиты
     from modules.utils import ensure_directory_exists, download_image, download_video
     from modules.config_manager import ConfigManager
+    from modules.llm_client import get_openai_client
 
 except ImportError as e:
      logging.exception(f"Критическая ошибка импорта модулей/функций проекта: {e}. Проверьте структуру папок и наличие файлов.")
@@ -377,7 +378,8 @@ def call_openai(prompt_text: str, model: str = "gpt-4o", temperature: float = 0.
          api_key_local = os.getenv("OPENAI_API_KEY")
          if api_key_local and hasattr(openai, 'OpenAI'):
              try:
-                 openai_client = openai.OpenAI(api_key=api_key_local)
+                 openai_client = get_openai_client(api_key=api_key_local)
+                 if not openai_client: raise RuntimeError("общий клиент OpenAI недоступен (см. лог llm_client)")
                  logger.info("Клиент OpenAI (>1.0) был инициализирован внутри call_openai.")
              except Exception as init_err:
                  logger.error(f"Ошибка инициализации клиента OpenAI внутри call_openai: {init_err}")
@@ -539,7 +541,8 @@ def run_iid_pipeline(input_json_path: Path, config_dir: Path):
     if not openai_client:
         try:
             if hasattr(openai, 'OpenAI'):
-                 openai_client = openai.OpenAI(api_key=api_key)
+                 openai_client = get_openai_client(api_key=api_key)
+                 if not openai_client: raise RuntimeError("общий клиент OpenAI недоступен (см. лог llm_client)")
                  logger.info("Клиент OpenAI (>1.0) успешно инициализирован.")
             else:
                  logger.error("Используется старая версия библиотеки OpenAI (<1.0). Обновите: pip install --upgrade openai")
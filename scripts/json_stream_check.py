@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+# В файле scripts/json_stream_check.py
+"""
+Подбор и проверка границ длины потокового JSON-ответа (OPENAI_SETTINGS.stream_max_output_chars).
+
+Граница задается только по замерам реальных ответов ключа промпта:
+- архивные ответы из tests/stream_responses.json (их же воспроизводит tests/test_json_stream.py);
+- completion_chars_max из отчета по токенам (TOKEN_ACCOUNTING.report_path, локальная копия через --report):
+  длина самого длинного успешного ответа шага по всем генерациям.
+Предлагаемая граница - наибольший замер * CAP_MARGIN с округлением вверх до 100 символов.
+
+Для каждого ключа печатаются замеры, предложенная и заданная граница. Код выхода 1, если заданная
+граница ниже замера, задана без замеров или архивный ответ прерывается при воспроизведении.
+
+Пример: python scripts/json_stream_check.py --report token_usage_report.json
+"""
+import sys
+import json
+import math
+import argparse
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+if str(BASE_DIR) not in sys.path:
+    sys.path.append(str(BASE_DIR))
+
+try:
+    from modules.json_stream import JsonStreamGuard, StreamAbort, resolve_max_chars
+except ModuleNotFoundError as e:
+    print(f"Критическая Ошибка: Не найдены модули в json_stream_check: {e}", file=sys.stderr)
+    sys.exit(1)
+
+CONFIG_PATH = BASE_DIR / "config" / "config.json"
+ARCHIVE_PATH = BASE_DIR / "tests" / "stream_responses.json"
+# Запас над самым длинным замеренным ответом
+CAP_MARGIN = 2.0
+
+
+def load_json(path: Path) -> dict:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def suggested_cap(measured_max: int) -> int:
+    return int(math.ceil(measured_max * CAP_MARGIN / 100.0)) * 100
+
+
+def replay(text: str, max_chars: int | None, chunk: int = 8):
+    """Подает ответ в JsonStreamGuard кусками, как при потоке. Возвращает StreamAbort или None."""
+    guard = JsonStreamGuard(max_chars=max_chars)
+    try:
+        for start in range(0, len(text), chunk):
+            guard.feed(text[start:start + chunk])
+    except StreamAbort as abort:
+        return abort
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Size and check streamed JSON length caps from measured responses.')
+    parser.add_argument('--archive', default=str(ARCHIVE_PATH), help='Archived responses per prompt key.')
+    parser.add_argument('--report', default=None, help='Local copy of the token usage report (completion_chars_max).')
+    args = parser.parse_args()
+
+    caps_config = load_json(CONFIG_PATH).get("OPENAI_SETTINGS", {}).get("stream_max_output_chars") or {}
+    archive = load_json(Path(args.archive)).get("responses", {})
+    report_steps = load_json(Path(args.report)).get("steps", {}) if args.report else {}
+
+    measured = {}
+    for key, responses in archive.items():
+        measured.setdefault(key, []).extend(len(text) for text in responses)
+    for key, step in report_steps.items():
+        if step.get("completion_chars_max"):
+            measured.setdefault(key, []).append(int(step["completion_chars_max"]))
+
+    failures = 0
+    keys = sorted(set(measured) | {k for k in caps_config if k != "default"})
+    print(f"{'ключ':<32} {'замеров':>7} {'макс':>6} {'предложено':>10} {'задано':>7}")
+    for key in keys:
+        lengths = measured.get(key, [])
+        cap = resolve_max_chars(caps_config, key)
+        measured_max = max(lengths) if lengths else None
+        notes = []
+        if measured_max is None:
+            if cap:
+                notes.append("граница задана без замеров")
+        elif not cap:
+            notes.append(f"граница не задана, предлагается {suggested_cap(measured_max)}")
+        elif cap < measured_max:
+            notes.append("граница ниже замеренного ответа")
+        elif cap < suggested_cap(measured_max):
+            notes.append(f"запас меньше x{CAP_MARGIN:g}")
+        for text in archive.get(key, []):
+            abort = replay(text, cap)
+            if abort is not None:
+                notes.append(f"архивный ответ прерван: {abort.reason}")
+        failed = any(note.startswith(("граница задана", "граница ниже", "архивный")) for note in notes)
+        failures += failed
+        print(f"{key:<32} {len(lengths):>7} {'-' if measured_max is None else measured_max:>6} "
+              f"{'-' if measured_max is None else suggested_cap(measured_max):>10} {str(cap or '-'):>7}  "
+              f"{'; '.join(notes) if notes else 'OK'}")
+
+    print(f"\nНарушений: {failures}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
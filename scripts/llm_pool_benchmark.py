@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+# В файле scripts/llm_pool_benchmark.py
+"""
+Бенчмарк установки соединений с OpenAI за полную генерацию:
+"per_module" - как раньше: свой httpx.Client с настройками httpx по умолчанию (keep-alive 5 c);
+"shared"     - пул modules/llm_client (настройки LLM_CLIENT из config.json).
+
+generate_content, generate_media и iid_local_tester в работе - отдельные процессы
+(b2_storage_manager.run_script), поэтому в обоих режимах клиент один на процесс (PROCESS_OF_SCRIPT)
+и соединения переиспользуются только между вызовами одного скрипта. Разница режимов - настройки
+пула (прежде всего keep-alive между паузами), а не общий пул на всю генерацию.
+
+По умолчанию запросы идут на локальный keep-alive сервер, который на каждое новое соединение
+ждет --connect-delay секунд (имитация TCP+TLS рукопожатия с api.openai.com). С --url запросы идут
+на реальный адрес (например, https://api.openai.com/v1/models; ответ 401 без ключа тоже годится).
+Новые соединения считаются через trace-расширение httpcore.
+
+Паузы между вызовами соответствуют одной генерации (GENERATION_PLAN) и умножаются на --time-scale
+вместе со временем keep-alive, чтобы бенчмарк шел быстрее, не меняя картины переиспользования.
+
+Пример: python scripts/llm_pool_benchmark.py --time-scale 0.05 --connect-delay 0.25
+"""
+import sys
+import json
+import time
+import argparse
+import threading
+from pathlib import Path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+if str(BASE_DIR) not in sys.path:
+    sys.path.append(str(BASE_DIR))
+
+try:
+    import httpx
+    from modules.logger import get_logger
+    from modules.llm_client import create_http_client, get_client_settings
+except ModuleNotFoundError as e:
+    print(f"Критическая Ошибка: Не найдены модули в llm_pool_benchmark: {e}", file=sys.stderr)
+    sys.exit(1)
+
+logger = get_logger("llm_pool_benchmark")
+
+HTTPX_DEFAULT_KEEPALIVE_EXPIRY = 5.0
+# (модуль, шаг, пауза перед вызовом в секундах) - вызовы OpenAI одной генерации
+GENERATION_PLAN = [
+    ("generate_content", "content.topic", 0.0),
+    ("generate_content", "content.text", 1.0),
+    ("generate_content", "sarcasm.comment", 1.0),
+    ("generate_content", "sarcasm.poll", 0.5),
+    ("generate_content", "content.hashtags", 0.5),
+    ("generate_content", "multi_step.step1_core", 0.5),
+    ("generate_content", "multi_step.step2_driver", 0.5),
+    ("generate_content", "multi_step.step3_aesthetic", 0.5),
+    ("generate_content", "multi_step.step5_script_frame", 0.5),
+    ("generate_content", "multi_step.step6a_mj_adapt", 0.5),
+    ("generate_content", "multi_step.step6b_runway_adapt", 0.5),
+    ("generate_content", "multi_step.step6c_translate", 0.5),
+    ("generate_media", "sarcasm.image_formatting", 8.0),
+    ("generate_media", "visual_analysis.image_selection", 12.0),
+    ("generate_media", "text_placement.suggestions", 6.0),
+    ("iid_local_tester", "visual_analysis.image_selection", 4.0),
+]
+# Скрипт -> процесс, в котором он работает (клиент и пул соединений общие только внутри процесса)
+PROCESS_OF_SCRIPT = {
+    "generate_content": "generate_content",
+    "generate_media": "generate_media",
+    "iid_local_tester": "iid_local_tester",
+}
+CHAT_RESPONSE = json.dumps({"id": "bench", "object": "chat.completion", "choices": [
+    {"index": 0, "message": {"role": "assistant", "content": "{}"}, "finish_reason": "stop"}],
+    "usage": {"prompt_tokens": 1, "completion_tokens": 1}}).encode("utf-8")
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    """Отвечает готовым chat.completion; новое соединение стоит connect_delay секунд."""
+    protocol_version = "HTTP/1.1"
+    connect_delay = 0.0
+    response_delay = 0.0
+
+    def setup(self):
+        super().setup()
+        time.sleep(self.connect_delay)
+
+    def _respond(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+        time.sleep(self.response_delay)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(CHAT_RESPONSE)))
+        self.end_headers()
+        self.wfile.write(CHAT_RESPONSE)
+
+    do_POST = _respond
+    do_GET = _respond
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_local_server(connect_delay: float, response_delay: float):
+    handler = type("BenchHandler", (KeepAliveHandler,), {"connect_delay": connect_delay,
+                                                         "response_delay": response_delay})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1/chat/completions"
+
+
+class ConnectCounter:
+    """trace-колбэк httpcore: считает начатые TCP-подключения."""
+
+    def __init__(self):
+        self.connections = 0
+
+    def __call__(self, event_name, info):
+        if event_name == "connection.connect_tcp.started":
+            self.connections += 1
+
+
+def run_plan(clients: dict, url: str, time_scale: float, use_post: bool) -> dict:
+    """Проходит GENERATION_PLAN; clients: {модуль: httpx.Client}."""
+    counter = ConnectCounter()
+    request_times = []
+    started = time.perf_counter()
+    for module_name, step, gap_s in GENERATION_PLAN:
+        time.sleep(gap_s * time_scale)
+        client = clients[module_name]
+        call_started = time.perf_counter()
+        if use_post:
+            response = client.post(url, json={"model": "gpt-4o", "messages": [{"role": "user", "content": step}]},
+                                   extensions={"trace": counter})
+        else:
+            response = client.get(url, extensions={"trace": counter})
+        response.read()
+        request_times.append(time.perf_counter() - call_started)
+    return {"calls": len(request_times), "connections": counter.connections,
+            "request_time_s": sum(request_times), "wall_s": time.perf_counter() - started}
+
+
+def build_clients(mode: str, time_scale: float) -> dict:
+    """{скрипт: httpx.Client}: один клиент на процесс (PROCESS_OF_SCRIPT) в обоих режимах."""
+    modules = sorted({module_name for module_name, _, _ in GENERATION_PLAN})
+    per_process = {}
+    for process in sorted({PROCESS_OF_SCRIPT.get(name, name) for name in modules}):
+        if mode == "shared":
+            settings = get_client_settings()
+            settings["keepalive_expiry_seconds"] = float(settings["keepalive_expiry_seconds"]) * time_scale
+            per_process[process] = create_http_client(settings)
+        else:
+            limits = httpx.Limits(keepalive_expiry=HTTPX_DEFAULT_KEEPALIVE_EXPIRY * time_scale)
+            per_process[process] = httpx.Client(limits=limits)
+    return {name: per_process[PROCESS_OF_SCRIPT.get(name, name)] for name in modules}
+
+
+def close_clients(clients: dict):
+    for client in {id(c): c for c in clients.values()}.values():
+        client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark connection setup: per-module httpx clients vs shared llm_client pool.')
+    parser.add_argument('--url', type=str, default=None, help='Real endpoint (GET). Default: local keep-alive server (POST).')
+    parser.add_argument('--connect-delay', type=float, default=0.25, help='Local server: seconds per new connection (handshake).')
+    parser.add_argument('--response-delay', type=float, default=0.0, help='Local server: seconds per response.')
+    parser.add_argument('--time-scale', type=float, default=0.1, help='Multiplier for pauses and keep-alive expiry.')
+    parser.add_argument('--repeat', type=int, default=3, help='Generations per mode.')
+    args = parser.parse_args()
+
+    server = None
+    if args.url:
+        url, use_post = args.url, False
+    else:
+        server, url = start_local_server(args.connect_delay, args.response_delay)
+        use_post = True
+    processes = sorted(set(PROCESS_OF_SCRIPT.get(name, name) for name, _, _ in GENERATION_PLAN))
+    print(f"Цель: {url}; вызовов за генерацию: {len(GENERATION_PLAN)}; масштаб пауз: {args.time_scale}; "
+          f"процессов (клиентов в каждом режиме): {len(processes)}")
+
+    results = {}
+    try:
+        for mode in ("per_module", "shared"):
+            runs = []
+            for _ in range(args.repeat):
+                clients = build_clients(mode, args.time_scale)
+                try:
+                    runs.append(run_plan(clients, url, args.time_scale, use_post))
+                finally:
+                    close_clients(clients)
+            results[mode] = {
+                "connections": sum(r["connections"] for r in runs) / len(runs),
+                "request_time_s": sum(r["request_time_s"] for r in runs) / len(runs),
+                "wall_s": sum(r["wall_s"] for r in runs) / len(runs),
+            }
+    finally:
+        if server:
+            server.shutdown()
+
+    print(f"{'Режим':<11} {'Соединений':>11} {'Время запросов, c':>18} {'Всего, c':>9}")
+    for mode, r in results.items():
+        print(f"{mode:<11} {r['connections']:>11.1f} {r['request_time_s']:>18.3f} {r['wall_s']:>9.3f}")
+    saved_conn = results["per_module"]["connections"] - results["shared"]["connections"]
+    saved_time = results["per_module"]["request_time_s"] - results["shared"]["request_time_s"]
+    print(f"Экономия за генерацию (пул общий только внутри процесса): соединений {saved_conn:.1f}, "
+          f"время запросов {saved_time:.3f} c")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
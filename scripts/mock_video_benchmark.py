@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+# В файле scripts/mock_video_benchmark.py
+"""
+Бенчмарк кодирования mock-видео из статичной картинки: MoviePy ImageClip (прежний путь,
+VIDEO.mock_fps кадров в секунду, каждый кадр проходит через Python) против прямого вызова ffmpeg
+(modules/ffmpeg_tools.encode_still_video: -loop 1, -tune stillimage, низкая частота кадров).
+
+Режимы:
+    moviepy       - ImageClip.write_videofile, как create_mock_video раньше (если MoviePy установлен);
+    ffmpeg_same   - ffmpeg с той же частотой кадров, что MoviePy (вклад -tune stillimage и пресета);
+    ffmpeg_fast   - ffmpeg с VIDEO.mock_fast_fps (путь по умолчанию в create_mock_video).
+
+Пример: python scripts/mock_video_benchmark.py --image placeholder.png --repeat 3
+"""
+import sys
+import time
+import argparse
+import tempfile
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+if str(BASE_DIR) not in sys.path:
+    sys.path.append(str(BASE_DIR))
+
+try:
+    from PIL import Image, ImageDraw
+    from modules.logger import get_logger
+    from modules.config_manager import ConfigManager
+    from modules.ffmpeg_tools import find_ffmpeg, encode_still_video
+except ModuleNotFoundError as e:
+    print(f"Критическая Ошибка: Не найдены модули в mock_video_benchmark: {e}", file=sys.stderr)
+    sys.exit(1)
+
+try:
+    from moviepy.editor import ImageClip
+except ImportError:
+    ImageClip = None
+
+logger = get_logger("mock_video_benchmark")
+
+
+def synthetic_image(path: Path, size=(1792, 1024)):
+    img = Image.radial_gradient("L").resize(size).convert("RGB")
+    draw = ImageDraw.Draw(img)
+    draw.rectangle([size[0] // 4, size[1] // 3, 3 * size[0] // 4, 2 * size[1] // 3], fill=(204, 204, 204))
+    draw.text((size[0] // 4 + 40, size[1] // 2), "MJ Timeout", fill=(51, 51, 51))
+    img.save(path, format="PNG")
+
+
+def encode_moviepy(image_path: Path, output_path: Path, duration: int, fps: int, codec: str) -> bool:
+    clip = ImageClip(str(image_path), duration=duration)
+    clip.fps = fps
+    try:
+        clip.write_videofile(str(output_path), codec=codec, fps=fps, audio=False, logger=None, ffmpeg_params=["-loglevel", "error"])
+        return True
+    finally:
+        clip.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark mock video encoding: MoviePy ImageClip vs direct ffmpeg still-image path.')
+    parser.add_argument('--image', type=str, default=None, help='Source image (default: synthetic 1792x1024 placeholder).')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    config = ConfigManager()
+    duration = int(config.get("VIDEO.mock_duration", 10))
+    fps = int(config.get("VIDEO.mock_fps", 24))
+    fast_fps = int(config.get("VIDEO.mock_fast_fps", 5))
+    codec = config.get("VIDEO.mock_codec", "libx264")
+    preset = config.get("VIDEO.mock_preset", "veryfast")
+    crf = int(config.get("VIDEO.mock_crf", 28))
+
+    work_dir = Path(tempfile.mkdtemp(prefix="mock_video_bench_"))
+    image_path = Path(args.image) if args.image else work_dir / "placeholder.png"
+    if not args.image:
+        synthetic_image(image_path)
+
+    modes = {}
+    if ImageClip is not None:
+        modes["moviepy"] = lambda out: encode_moviepy(image_path, out, duration, fps, codec)
+    else:
+        print("MoviePy не установлен, режим moviepy пропущен.")
+    if find_ffmpeg():
+        modes["ffmpeg_same"] = lambda out: encode_still_video(str(image_path), str(out), duration, fps, codec, preset, crf)
+        modes["ffmpeg_fast"] = lambda out: encode_still_video(str(image_path), str(out), duration, fast_fps, codec, preset, crf)
+    else:
+        print("ffmpeg не найден, режимы ffmpeg пропущены.")
+    if not modes:
+        return 1
+
+    print(f"Картинка: {image_path.name}, {duration} c; MoviePy {fps} к/с, ffmpeg {preset} crf {crf}, быстрый путь {fast_fps} к/с")
+    print(f"{'Режим':<12} {'Успешно':>8} {'Среднее, c':>11} {'Мин, c':>8} {'Размер, КиБ':>12}")
+    for mode, encode in modes.items():
+        timings, size, ok = [], 0, 0
+        for attempt in range(args.repeat):
+            output = work_dir / f"{mode}_{attempt}.mp4"
+            started = time.perf_counter()
+            if encode(output):
+                ok += 1
+                timings.append(time.perf_counter() - started)
+                size = output.stat().st_size
+        if timings:
+            print(f"{mode:<12} {ok:>5}/{args.repeat:<2} {sum(timings) / len(timings):>11.2f} {min(timings):>8.2f} {size / 1024:>12.0f}")
+        else:
+            print(f"{mode:<12} {ok:>5}/{args.repeat:<2} ошибка кодирования")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
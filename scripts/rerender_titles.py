@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+# В файле scripts/rerender_titles.py
+"""
+Пакетная перерисовка изображений-заголовков (<ID>.png) после смены шрифтов, дымки или цвета.
+
+Для каждой группы из списка ID (--ids) или с префиксом ID (--prefix) в папках TITLE_RERENDER.folders
+из B2 берутся <ID>_title_base.png, <ID>_title.json (modules/title_render.py) и документ контента
+<ID>.json. Шрифт заново выбирается по текущему FOCUS_FONT_MAPPING, дымка - VIDEO.title_haze_opacity
+(или --haze-opacity), цвет - из параметров генерации (или --text-color).
+
+Порциями по TITLE_RERENDER.chunk_size: скачивание пулом потоков, отрисовка в ProcessPoolExecutor
+(в каждом процессе заранее построены шрифты всех размеров сетки подбора, modules/title_render.py),
+загрузка <ID>.png обратно пулом потоков по мере готовности.
+После каждой порции прогресс пакета сохраняется в B2 (TITLE_RERENDER.state_folder/<пакет>.json);
+повторный запуск той же команды пропускает уже загруженные группы (--restart - начать заново).
+Группы без <ID>_title_base.png (созданные до архивации исходников) пропускаются.
+
+Примеры:
+    python scripts/rerender_titles.py --prefix 202609 --haze-opacity 96
+    python scripts/rerender_titles.py --ids 20260915-1200,20260916-0800 --text-color "#222222"
+    python scripts/rerender_titles.py --prefix 2026 --dry-run --output-dir rerendered/
+"""
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+from pathlib import Path
+from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+if str(BASE_DIR) not in sys.path:
+    sys.path.append(str(BASE_DIR))
+
+try:
+    from botocore.exceptions import ClientError
+    from modules.logger import get_logger
+    from modules.config_manager import ConfigManager
+    from modules.api_clients import get_b2_client
+    from modules.utils import load_json_config, upload_to_b2, load_b2_json, save_b2_json
+    from modules.content_schema import decode_content_document
+    from modules.scratch import create_scratch_dir, remove_scratch_dir, scratch_path
+    from modules.title_render import (
+        TITLE_BASE_SUFFIX, TITLE_SPEC_SUFFIX, TITLE_FONT_SIZES, default_title_spec, resolve_title_font,
+        init_render_worker, render_title_job
+    )
+except ModuleNotFoundError as e:
+    print(f"Критическая Ошибка: Не найдены модули в rerender_titles: {e}", file=sys.stderr)
+    sys.exit(1)
+
+logger = get_logger("rerender_titles")
+
+ID_PATTERN = re.compile(r"^\d{8}-\d{4}$")
+CHUNK_REQUIRED_MIB_PER_GROUP = 12 # Картинка без текста + результат, PNG 1792x1024
+
+
+def find_groups(s3, bucket_name: str, folders: list[str], ids=None, prefix: str = "") -> tuple[dict, list]:
+    """
+    ({ID: папка} для групп с <ID>_title_base.png, [ID групп с <ID>.png, но без исходников]).
+    Группа берется из первой папки списка folders, где она найдена.
+    """
+    key_prefix = os.path.commonprefix(sorted(ids)) if ids else prefix
+    groups, titles = {}, {}
+    paginator = s3.get_paginator('list_objects_v2')
+    for folder in folders:
+        folder = folder.rstrip('/') + '/'
+        for page in paginator.paginate(Bucket=bucket_name, Prefix=f"{folder}{key_prefix}", Delimiter='/'):
+            for obj in page.get('Contents', []):
+                name = os.path.basename(obj['Key'])
+                if name.endswith(TITLE_BASE_SUFFIX):
+                    group_id, target = name[:-len(TITLE_BASE_SUFFIX)], groups
+                elif name.endswith(".png"):
+                    group_id, target = name[:-len(".png")], titles
+                else:
+                    continue
+                if ID_PATTERN.match(group_id) and (ids is None or group_id in ids):
+                    target.setdefault(group_id, folder)
+    return groups, sorted(set(titles) - set(groups))
+
+
+def read_b2_json(s3, bucket_name: str, key: str):
+    """JSON из B2 в память; None, если объекта нет или он невалиден."""
+    try:
+        return json.loads(s3.get_object(Bucket=bucket_name, Key=key)["Body"].read().decode("utf-8"))
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') not in ('NoSuchKey', '404'):
+            logger.warning(f"⚠️ Ошибка чтения {key}: {e}")
+    except (ValueError, UnicodeDecodeError) as e:
+        logger.warning(f"⚠️ Невалидный JSON {key}: {e}")
+    return None
+
+
+def fetch_group(s3, bucket_name: str, group_id: str, folder: str, work_dir: Path) -> dict:
+    """Скачивает картинку без текста, параметры заголовка и документ контента группы."""
+    base_path = work_dir / f"{group_id}{TITLE_BASE_SUFFIX}"
+    try:
+        s3.download_file(bucket_name, f"{folder}{group_id}{TITLE_BASE_SUFFIX}", str(base_path))
+    except Exception as e:
+        return {"generation_id": group_id, "folder": folder, "error": f"не скачана картинка без текста: {e}"}
+    return {"generation_id": group_id, "folder": folder, "base_path": base_path,
+            "spec": read_b2_json(s3, bucket_name, f"{folder}{group_id}{TITLE_SPEC_SUFFIX}"),
+            "content": read_b2_json(s3, bucket_name, f"{folder}{group_id}.json"), "error": None}
+
+
+def build_job(fetched: dict, fonts_mapping: dict, work_dir: Path, args, haze_opacity: int) -> tuple[dict | None, str | None]:
+    """Задание для render_title_job (или (None, причина))."""
+    document = decode_content_document(fetched["content"], strict=False)[0] if fetched["content"] else None
+    spec = fetched["spec"]
+    selected_focus = (document.selected_focus if document else None) or (spec or {}).get("selected_focus")
+    if not spec:
+        if not document or not document.topic:
+            return None, "нет ни параметров заголовка, ни темы в документе контента"
+        spec = default_title_spec(document.topic, selected_focus, haze_opacity)
+    font_path = args.font or resolve_title_font(fonts_mapping, selected_focus, BASE_DIR)
+    if not font_path:
+        return None, f"не найден шрифт для фокуса {selected_focus!r}"
+    group_id = fetched["generation_id"]
+    return {"generation_id": group_id, "base_path": str(fetched["base_path"]),
+            "output_path": str(work_dir / f"{group_id}.png"), "font_path": font_path, "spec": spec,
+            "text_color": args.text_color, "haze_opacity": haze_opacity}, None
+
+
+def load_fonts_mapping(config: ConfigManager) -> dict:
+    creative_config_path = Path(config.get('FILE_PATHS.creative_config', 'config/creative_config.json'))
+    if not creative_config_path.is_absolute(): creative_config_path = BASE_DIR / creative_config_path
+    return (load_json_config(str(creative_config_path)) or {}).get("FOCUS_FONT_MAPPING", {}) or {}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Re-render archived title images in bulk (process pool, concurrent B2 transfers, resumable).')
+    selection = parser.add_mutually_exclusive_group(required=True)
+    selection.add_argument('--ids', type=str, help='Comma-separated generation IDs.')
+    selection.add_argument('--prefix', type=str, help='Generation ID prefix, e.g. 202609 (empty string - all groups).')
+    parser.add_argument('--folders', type=str, default=None, help='Comma-separated B2 folders (default: TITLE_RERENDER.folders).')
+    parser.add_argument('--haze-opacity', type=int, default=None, help='Haze opacity 0-255 (default: VIDEO.title_haze_opacity).')
+    parser.add_argument('--text-color', type=str, default=None, help='Override text colour, e.g. "#222222".')
+    parser.add_argument('--font', type=str, default=None, help='Override font file for every title.')
+    parser.add_argument('--workers', type=int, default=None, help='Render processes (default: TITLE_RERENDER.render_workers, 0 - CPU count).')
+    parser.add_argument('--io-workers', type=int, default=None)
+    parser.add_argument('--chunk-size', type=int, default=None)
+    parser.add_argument('--batch', type=str, default=None, help='Batch name for the progress file (default: derived from the selection and settings).')
+    parser.add_argument('--restart', action='store_true', help='Ignore saved progress of the batch.')
+    parser.add_argument('--dry-run', action='store_true', help='Render only: no uploads, no progress file.')
+    parser.add_argument('--output-dir', type=str, default=None, help='Also copy rendered titles into this local folder.')
+    args = parser.parse_args()
+
+    config = ConfigManager()
+    bucket_name = config.get('API_KEYS.b2.bucket_name', os.getenv('B2_BUCKET_NAME'))
+    folders = [f.strip() for f in args.folders.split(",") if f.strip()] if args.folders \
+        else list(config.get("TITLE_RERENDER.folders", ["666/", "555/", "444/", "archive/"]))
+    ids = {i.strip() for i in args.ids.split(",") if i.strip()} if args.ids else None
+    haze_opacity = args.haze_opacity if args.haze_opacity is not None else int(config.get("VIDEO.title_haze_opacity", 128))
+    if args.font:
+        args.font = str(Path(args.font).resolve())
+        if not Path(args.font).is_file():
+            print(f"Шрифт не найден: {args.font}", file=sys.stderr)
+            return 1
+    render_workers = args.workers if args.workers is not None else int(config.get("TITLE_RERENDER.render_workers", 0))
+    render_workers = render_workers or os.cpu_count() or 1
+    io_workers = max(1, args.io_workers or int(config.get("TITLE_RERENDER.io_workers", 8)))
+    chunk_size = max(1, args.chunk_size or int(config.get("TITLE_RERENDER.chunk_size", 24)))
+    fonts_mapping = load_fonts_mapping(config)
+
+    # Имя пакета зависит от выборки и настроек отрисовки: та же команда продолжает тот же пакет,
+    # новая дымка/цвет/шрифты - новый пакет
+    settings = {"ids": sorted(ids) if ids else None, "prefix": args.prefix, "folders": folders,
+                "haze_opacity": haze_opacity, "text_color": args.text_color, "font": args.font,
+                "fonts_mapping": fonts_mapping}
+    batch = args.batch or "titles_" + hashlib.sha1(json.dumps(settings, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()[:12]
+    state_key = f"{config.get('TITLE_RERENDER.state_folder', 'rerender/').rstrip('/')}/{batch}.json"
+
+    s3 = get_b2_client()
+    state = None if args.restart or args.dry_run else load_b2_json(s3, bucket_name, state_key, str(scratch_path(f"{batch}_load.json")), default_value=None)
+    if not isinstance(state, dict):
+        state = {"batch": batch, "settings": settings, "created_at": datetime.now(timezone.utc).isoformat(),
+                 "done": {}, "failed": {}, "skipped": {}}
+
+    groups, without_sources = find_groups(s3, bucket_name, folders, ids=ids, prefix=args.prefix or "")
+    for group_id in without_sources:
+        state["skipped"][group_id] = "нет <ID>_title_base.png"
+    if ids:
+        for group_id in sorted(ids - set(groups) - set(without_sources)):
+            state["skipped"][group_id] = "группа не найдена"
+    pending = [group_id for group_id in sorted(groups) if group_id not in state["done"]]
+    logger.info(f"🖼️ Пакет {batch}: групп с исходниками {len(groups)}, уже готово {len(groups) - len(pending)}, "
+                f"к перерисовке {len(pending)}, без исходников {len(without_sources)}; "
+                f"процессов {render_workers}, потоков ввода-вывода {io_workers}, порция {chunk_size}.")
+    if args.output_dir: Path(args.output_dir).mkdir(parents=True, exist_ok=True)
+
+    font_paths = sorted({str(BASE_DIR / rel) for rel in fonts_mapping.values() if rel and (BASE_DIR / rel).is_file()} | ({args.font} if args.font else set()))
+    totals = {"rendered": 0, "uploaded": 0, "failed": 0, "fetch": 0.0, "render": 0.0, "upload": 0.0}
+    started = time.perf_counter()
+    try:
+        with ProcessPoolExecutor(max_workers=render_workers, initializer=init_render_worker, initargs=(font_paths, TITLE_FONT_SIZES)) as render_pool, \
+                ThreadPoolExecutor(max_workers=io_workers) as io_pool:
+            for chunk_start in range(0, len(pending), chunk_size):
+                chunk = pending[chunk_start:chunk_start + chunk_size]
+                work_dir = create_scratch_dir("rerender_titles", required_mib=len(chunk) * CHUNK_REQUIRED_MIB_PER_GROUP)
+                try:
+                    phase = time.perf_counter()
+                    fetched = list(io_pool.map(lambda group_id: fetch_group(s3, bucket_name, group_id, groups[group_id], work_dir), chunk))
+                    totals["fetch"] += time.perf_counter() - phase
+
+                    phase = time.perf_counter()
+                    render_futures = {}
+                    for item in fetched:
+                        job, reason = (None, item["error"]) if item["error"] else build_job(item, fonts_mapping, work_dir, args, haze_opacity)
+                        if job is None:
+                            state["failed"][item["generation_id"]] = reason; totals["failed"] += 1
+                            logger.warning(f"⚠️ {item['generation_id']}: {reason}")
+                            continue
+                        render_futures[render_pool.submit(render_title_job, job)] = job
+                    upload_futures = {}
+                    for future in as_completed(render_futures):
+                        job = render_futures[future]
+                        group_id = job["generation_id"]
+                        result = future.result()
+                        if not result["ok"]:
+                            state["failed"][group_id] = result["error"]; totals["failed"] += 1
+                            logger.error(f"❌ {group_id}: ошибка отрисовки: {result['error']}")
+                            continue
+                        totals["rendered"] += 1
+                        if args.output_dir: shutil.copy2(job["output_path"], Path(args.output_dir) / f"{group_id}.png")
+                        if not args.dry_run:
+                            upload_futures[io_pool.submit(upload_to_b2, s3, bucket_name, groups[group_id], job["output_path"], f"{group_id}.png")] = group_id
+                    totals["render"] += time.perf_counter() - phase
+
+                    phase = time.perf_counter()
+                    for future in as_completed(upload_futures):
+                        group_id = upload_futures[future]
+                        if future.result():
+                            state["done"][group_id] = groups[group_id]; state["failed"].pop(group_id, None); totals["uploaded"] += 1
+                        else:
+                            state["failed"][group_id] = "ошибка загрузки в B2"; totals["failed"] += 1
+                    totals["upload"] += time.perf_counter() - phase
+                finally:
+                    remove_scratch_dir(work_dir)
+                    if not args.dry_run:
+                        state["updated_at"] = datetime.now(timezone.utc).isoformat()
+                        save_b2_json(s3, bucket_name, state_key, str(scratch_path(f"{batch}_save.json")), state)
+                done_count = chunk_start + len(chunk)
+                elapsed = time.perf_counter() - started
+                logger.info(f"🔄 {done_count}/{len(pending)}: перерисовано {totals['rendered']}, "
+                            f"{totals['rendered'] / elapsed if elapsed else 0:.2f} изобр./с.")
+    except KeyboardInterrupt:
+        logger.warning(f"⏹️ Прервано. Прогресс сохранен после последней порции; продолжить: та же команда (пакет {batch}).")
+        return 130
+
+    elapsed = time.perf_counter() - started
+    print(f"Пакет {batch}: перерисовано {totals['rendered']}, загружено {totals['uploaded']}, ошибок {totals['failed']}, "
+          f"пропущено {len(state['skipped'])}, ранее готово {len(groups) - len(pending)}.")
+    print(f"{elapsed:.1f} c, {totals['rendered'] / elapsed if elapsed else 0:.2f} изобр./с "
+          f"(скачивание {totals['fetch']:.1f} c, отрисовка {totals['render']:.1f} c, ожидание загрузок {totals['upload']:.1f} c).")
+    return 0 if not totals["failed"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+# В файле scripts/runway_input_benchmark.py
+"""
+Сравнение способов передачи входного кадра в Runway (modules/runway_input.py).
+
+Режимы:
+    legacy         - исходный PNG целиком в base64 data URI (как раньше);
+    data_uri_jpeg  - кадр под ratio, JPEG RUNWAY_INPUT.quality, в data URI;
+    data_uri_webp  - то же в WebP;
+    presigned_url  - JPEG загружается в B2, в запросе presigned URL (только с --upload, нужны ключи B2).
+
+Для каждого режима: размер prompt_image и JSON-тела запроса, время подготовки и время отправки
+тела. Без --live тело отправляется POST-ом на локальный сервер с ограничением скорости
+--uplink-mbps (имитация канала до API Runway). С --live создается настоящая задача Runway
+(расходует кредиты!) и сразу удаляется; замеряется задержка image_to_video.create.
+
+Пример: python scripts/runway_input_benchmark.py --image upscaled.png --uplink-mbps 20
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+from pathlib import Path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+if str(BASE_DIR) not in sys.path:
+    sys.path.append(str(BASE_DIR))
+
+try:
+    from PIL import Image, ImageDraw
+    from modules.logger import get_logger
+    from modules.config_manager import ConfigManager
+    from modules.runway_input import get_runway_input_settings, build_prompt_image, encode_data_uri, delete_runway_input
+except ModuleNotFoundError as e:
+    print(f"Критическая Ошибка: Не найдены модули в runway_input_benchmark: {e}", file=sys.stderr)
+    sys.exit(1)
+
+logger = get_logger("runway_input_benchmark")
+
+PROMPT_TEXT = "Slow cinematic push-in, candle light flickering, dust in the air."
+
+
+class SinkHandler(BaseHTTPRequestHandler):
+    """Принимает тело запроса со скоростью bytes_per_second и отвечает 200."""
+    protocol_version = "HTTP/1.1"
+    bytes_per_second = 0
+
+    def do_POST(self):
+        remaining = int(self.headers.get("Content-Length", 0))
+        chunk = 64 * 1024
+        while remaining > 0:
+            piece = self.rfile.read(min(chunk, remaining))
+            if not piece:
+                break
+            remaining -= len(piece)
+            if self.bytes_per_second:
+                time.sleep(len(piece) / self.bytes_per_second)
+        body = b'{"id": "bench"}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_sink(uplink_mbps: float):
+    handler = type("BenchSinkHandler", (SinkHandler,), {"bytes_per_second": int(uplink_mbps * 1_000_000 / 8)})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1/image_to_video"
+
+
+def synthetic_upscale(path: Path, size=(1792, 1024)):
+    """PNG размером с апскейл MJ: градиент, шум и мелкие детали (PNG сжимает такой кадр плохо, как и реальный)."""
+    img = Image.radial_gradient("L").resize(size).convert("RGB")
+    noise = Image.effect_noise(size, 48).convert("RGB")
+    img = Image.blend(img, noise, 0.35)
+    draw = ImageDraw.Draw(img)
+    for index in range(0, size[0], 24):
+        draw.line([(index, 0), (size[0] - index, size[1])], fill=(180, 120 + index % 100, 60), width=2)
+    img.save(path, format="PNG")
+
+
+def measure_mode(mode: str, image_path: Path, ratio: str, settings: dict, sink_url: str | None, runway_client, s3_client, bucket):
+    started = time.perf_counter()
+    if mode == "legacy":
+        prepared = {"prompt_image": encode_data_uri(image_path), "mode": mode, "b2_key": None}
+        prepared["prepare_s"] = time.perf_counter() - started
+    else:
+        mode_settings = dict(settings)
+        mode_settings["mode"] = "presigned_url" if mode == "presigned_url" else "data_uri"
+        mode_settings["format"] = "webp" if mode == "data_uri_webp" else "jpeg"
+        prepared = build_prompt_image(image_path, ratio, mode_settings, s3_client=s3_client, bucket_name=bucket)
+        if prepared is None:
+            return None
+    params = {"model": "gen3a_turbo", "prompt_image": prepared["prompt_image"], "prompt_text": PROMPT_TEXT,
+              "duration": 5, "ratio": ratio}
+    body = json.dumps(params).encode("utf-8")
+    submit_started = time.perf_counter()
+    if runway_client is not None:
+        task = runway_client.image_to_video.create(**params)
+        submit_s = time.perf_counter() - submit_started
+        try:
+            runway_client.tasks.delete(task.id)
+        except Exception as e:
+            logger.warning(f"Не удалось удалить тестовую задачу Runway {getattr(task, 'id', '?')}: {e}")
+    else:
+        requests.post(sink_url, data=body, headers={"Content-Type": "application/json"}, timeout=600).raise_for_status()
+        submit_s = time.perf_counter() - submit_started
+    delete_runway_input(s3_client, bucket, prepared.get("b2_key"))
+    return {"mode": prepared["mode"], "payload": len(prepared["prompt_image"]), "body": len(body),
+            "prepare_s": prepared["prepare_s"], "submit_s": submit_s}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare Runway input payload modes: legacy PNG data URI vs compact frame vs presigned URL.')
+    parser.add_argument('--image', type=str, default=None, help='Upscaled frame (PNG). Default: synthetic 1792x1024.')
+    parser.add_argument('--ratio', type=str, default="1280:768")
+    parser.add_argument('--quality', type=int, default=None)
+    parser.add_argument('--uplink-mbps', type=float, default=20.0, help='Simulated uplink to the API, Mbit/s (0 - no limit).')
+    parser.add_argument('--upload', action='store_true', help='Include presigned_url mode (uploads to B2).')
+    parser.add_argument('--live', action='store_true', help='Create real Runway tasks (uses credits) and delete them.')
+    args = parser.parse_args()
+
+    config = ConfigManager()
+    settings = get_runway_input_settings(config)
+    if args.quality:
+        settings["quality"] = args.quality
+    work_dir = Path(tempfile.mkdtemp(prefix="runway_input_bench_"))
+    image_path = Path(args.image) if args.image else work_dir / "upscaled_for_runway.png"
+    if not args.image:
+        synthetic_upscale(image_path)
+
+    s3_client, bucket = None, None
+    modes = ["legacy", "data_uri_jpeg", "data_uri_webp"]
+    if args.upload:
+        from modules.api_clients import get_b2_client
+        s3_client = get_b2_client()
+        bucket = config.get('API_KEYS.b2.bucket_name', os.getenv('B2_BUCKET_NAME'))
+        if s3_client and bucket:
+            modes.append("presigned_url")
+        else:
+            print("B2 недоступен, режим presigned_url пропущен.", file=sys.stderr)
+    runway_client = None
+    if args.live:
+        from runwayml import RunwayML
+        runway_client = RunwayML(api_key=os.getenv("RUNWAY_API_KEY"))
+
+    server, sink_url = (None, None) if args.live else start_sink(args.uplink_mbps)
+    try:
+        with Image.open(image_path) as img:
+            source_size = img.size
+        channel = "Runway API (--live)" if args.live else f"локальный приемник {args.uplink_mbps} Мбит/с"
+        print(f"Кадр: {image_path.name} {source_size[0]}x{source_size[1]}, {image_path.stat().st_size / 1024:.0f} КиБ; "
+              f"ratio {args.ratio}, quality {settings['quality']}, max_width {settings['max_width']}; отправка: {channel}")
+        print(f"{'Режим':<15} {'prompt_image, КиБ':>18} {'Тело, КиБ':>10} {'Подготовка, c':>14} {'Отправка, c':>12}")
+        for mode in modes:
+            result = measure_mode(mode, image_path, args.ratio, settings, sink_url, runway_client, s3_client, bucket)
+            if result is None:
+                print(f"{mode:<15} ошибка подготовки")
+                continue
+            label = mode if result["mode"] != "data_uri_original" else f"{mode}*"
+            print(f"{label:<15} {result['payload'] / 1024:>18.1f} {result['body'] / 1024:>10.1f} "
+                  f"{result['prepare_s']:>14.3f} {result['submit_s']:>12.3f}")
+    finally:
+        if server:
+            server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
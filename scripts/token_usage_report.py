@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+# В файле scripts/token_usage_report.py
+"""
+Выводит накопительный отчет по токенам и задержкам вызовов OpenAI по шагам
+(TOKEN_ACCOUNTING.report_path в B2), который пишут generate_content.py и generate_media.py.
+
+Пример: python scripts/token_usage_report.py --last 10
+"""
+import os
+import sys
+import argparse
+from datetime import datetime, timezone
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+if str(BASE_DIR) not in sys.path:
+    sys.path.append(str(BASE_DIR))
+
+try:
+    from modules.config_manager import ConfigManager
+    from modules.logger import get_logger
+    from modules.utils import load_b2_json
+    from modules.api_clients import get_b2_client
+    from modules.token_accounting import format_summary_table, DEFAULT_REPORT_PATH
+except ModuleNotFoundError as e:
+    print(f"Критическая Ошибка: Не найдены модули проекта в token_usage_report: {e}", file=sys.stderr)
+    sys.exit(1)
+
+logger = get_logger("token_usage_report")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Show per-step OpenAI token/latency report.')
+    parser.add_argument('--last', type=int, default=5, help='How many recent generations to show.')
+    args = parser.parse_args()
+
+    config = ConfigManager()
+    bucket_name = config.get("API_KEYS.b2.bucket_name", os.getenv("B2_BUCKET_NAME"))
+    report_path = config.get("TOKEN_ACCOUNTING.report_path", DEFAULT_REPORT_PATH)
+    s3 = get_b2_client()
+    local_temp_path = f"token_usage_view_{datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S%f')}.json"
+    report = load_b2_json(s3, bucket_name, report_path, local_temp_path, default_value=None)
+    if not report:
+        print(f"Отчет {report_path} не найден или пуст.")
+        return 1
+
+    print(f"Отчет: {report_path} (обновлен {report.get('updated_at', '?')})")
+    print("\n=== Итого по шагам (все генерации) ===")
+    print(format_summary_table(report.get("steps", {})))
+    for entry in report.get("generations", [])[-args.last:]:
+        print(f"\n=== {entry.get('generation_id')} / {entry.get('script')} ({entry.get('finished_at_utc')}) ===")
+        print(format_summary_table(entry.get("steps", {})))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+# В файле scripts/vision_thumbnail_benchmark.py
+"""
+Сравнение vision-запросов: полноразмерные URL (как раньше) против локальных миниатюр data URI
+(modules/vision_images.py).
+
+Без ключа OpenAI считаются подготовка (скачивание + JPEG), размер полезной нагрузки и оценка
+токенов изображений по правилам OpenAI. С --live дополнительно выполняется запрос в стиле
+select_best_image (4 картинки) в обоих режимах: задержка и usage.prompt_tokens из ответа.
+
+Источники картинок:
+    --urls U1 U2 U3 U4   - реальные URL (например, temporary_image_urls из config_midjourney.json);
+    без --urls           - 4 синтетических PNG 1456x816, раздаваемых локальным HTTP-сервером
+                           (режим --live для них недоступен: API не видит localhost).
+
+Пример: python scripts/vision_thumbnail_benchmark.py --urls ... --live --repeat 3 --detail low
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import threading
+from functools import partial
+from pathlib import Path
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+if str(BASE_DIR) not in sys.path:
+    sys.path.append(str(BASE_DIR))
+
+try:
+    from PIL import Image, ImageDraw
+    from modules.logger import get_logger
+    from modules.config_manager import ConfigManager
+    from modules.vision_images import VisionImageCache, estimate_image_tokens
+except ModuleNotFoundError as e:
+    print(f"Критическая Ошибка: Не найдены модули в vision_thumbnail_benchmark: {e}", file=sys.stderr)
+    sys.exit(1)
+
+logger = get_logger("vision_thumbnail_benchmark")
+
+SELECTION_PROMPT = "Respond ONLY with the number (1, 2, 3, or 4) of the most cinematic image."
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def synthetic_images(folder: Path, size=(1456, 816), seed: int = 7) -> list[Path]:
+    """Четыре PNG с градиентом и шумом - по размеру как картинки MJ 16:9."""
+    rng = random.Random(seed)
+    paths = []
+    for index in range(4):
+        img = Image.radial_gradient("L").resize(size).convert("RGB")
+        draw = ImageDraw.Draw(img)
+        for _ in range(4000):
+            x, y = rng.randrange(size[0]), rng.randrange(size[1])
+            draw.rectangle([x, y, x + rng.randint(2, 12), y + rng.randint(2, 12)],
+                           fill=(rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+        path = folder / f"grid_{index + 1}.png"
+        img.save(path)
+        paths.append(path)
+    return paths
+
+
+def serve_folder(folder: Path):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(QuietHandler, directory=str(folder)))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def live_request(client, model: str, image_parts: list[dict]) -> tuple[float, int | None]:
+    content = [{"type": "text", "text": SELECTION_PROMPT}]
+    for index, part in enumerate(image_parts):
+        content.append({"type": "text", "text": f"Image {index + 1}:"})
+        content.append(part)
+    started = time.perf_counter()
+    response = client.chat.completions.create(model=model, messages=[{"role": "user", "content": content}],
+                                              max_tokens=5, temperature=0)
+    elapsed = time.perf_counter() - started
+    usage = getattr(response, "usage", None)
+    return elapsed, getattr(usage, "prompt_tokens", None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare full-size image URLs with local data-URI thumbnails for vision calls.')
+    parser.add_argument('--urls', nargs=4, default=None, help='Four image URLs (MJ grid).')
+    parser.add_argument('--max-side', type=int, default=None)
+    parser.add_argument('--jpeg-quality', type=int, default=None)
+    parser.add_argument('--detail', choices=["low", "high", "auto"], default=None)
+    parser.add_argument('--live', action='store_true', help='Send real requests (needs OPENAI_API_KEY and public URLs).')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    config = ConfigManager()
+    max_side = args.max_side or int(config.get("VISION_IMAGES.max_side", 768))
+    jpeg_quality = args.jpeg_quality or int(config.get("VISION_IMAGES.jpeg_quality", 80))
+    detail = args.detail or config.get("VISION_IMAGES.detail", "auto")
+    work_dir = Path(tempfile.mkdtemp(prefix="vision_bench_"))
+    server = None
+    urls = args.urls
+    if not urls:
+        if args.live:
+            print("--live требует --urls (API OpenAI не видит локальный сервер).", file=sys.stderr)
+            return 1
+        server, base_url = serve_folder(work_dir)
+        urls = [f"{base_url}/{path.name}" for path in synthetic_images(work_dir)]
+
+    try:
+        cache = VisionImageCache(work_dir / "cache", max_side=max_side, jpeg_quality=jpeg_quality, detail=detail)
+        started = time.perf_counter()
+        cache.prefetch(urls)
+        prepare_s = time.perf_counter() - started
+
+        url_tokens, thumb_tokens, original_bytes, thumb_bytes = 0, 0, 0, 0
+        print(f"Миниатюры: max_side={max_side}, quality={jpeg_quality}, detail={detail}")
+        print(f"{'#':<3} {'Оригинал':>12} {'КиБ':>7} {'~ток. URL':>10} {'Миниатюра':>10} {'КиБ':>6} {'~ток.':>6}")
+        for index, url in enumerate(urls):
+            original = cache.fetch(url)
+            thumb = cache.thumbnail(url)
+            if original is None or thumb is None:
+                print(f"{index + 1:<3} не удалось подготовить {url[:60]}")
+                continue
+            with Image.open(original) as img:
+                width, height = img.size
+            # URL без detail = "auto": модель обрабатывает полноразмерную картинку плитками
+            tokens_url = estimate_image_tokens(width, height, "auto")
+            size_kib = os.path.getsize(original) / 1024
+            url_tokens += tokens_url; thumb_tokens += thumb["tokens"]
+            original_bytes += os.path.getsize(original); thumb_bytes += thumb["bytes"]
+            original_size = f"{width}x{height}"
+            thumb_size = "{}x{}".format(*thumb["size"])
+            print(f"{index + 1:<3} {original_size:>12} {size_kib:>7.0f} {tokens_url:>10} "
+                  f"{thumb_size:>10} {thumb['bytes'] / 1024:>6.0f} {thumb['tokens']:>6}")
+        print(f"Подготовка 4 картинок (скачивание + JPEG, параллельно): {prepare_s:.2f} c")
+        print(f"Оценка токенов изображений: URL {url_tokens}, миниатюры {thumb_tokens} "
+              f"(-{100 * (1 - thumb_tokens / max(url_tokens, 1)):.0f}%); "
+              f"трафик к API: миниатюры {thumb_bytes / 1024:.0f} КиБ против {original_bytes / 1024:.0f} КиБ оригиналов")
+
+        if args.live:
+            from modules.llm_client import get_openai_client
+            client = get_openai_client()
+            if client is None:
+                return 1
+            model = config.get("OPENAI_SETTINGS.vision_model", "gpt-4o")
+            modes = {"url": [{"type": "image_url", "image_url": {"url": u}} for u in urls],
+                     "thumbnail": [cache.image_part(u) for u in urls]}
+            print(f"{'Режим':<10} {'Задержка, c':>12} {'prompt_tokens':>14}")
+            for mode, parts in modes.items():
+                runs = [live_request(client, model, parts) for _ in range(args.repeat)]
+                latency = sum(r[0] for r in runs) / len(runs)
+                tokens = [r[1] for r in runs if r[1] is not None]
+                avg_tokens = f"{sum(tokens) / len(tokens):.0f}" if tokens else "n/a"
+                label = f"{mode}" if mode == "url" else f"{mode}+{detail}"
+                print(f"{label:<10} {latency:>12.2f} {avg_tokens:>14}")
+    finally:
+        if server:
+            server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""
+Воспроизведение архивных ответов OpenAI (tests/stream_responses.json) через JsonStreamGuard
+с границами длины из config.json: реальный ответ не должен прерываться, затянувшийся - должен.
+"""
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+if str(BASE_DIR) not in sys.path:
+    sys.path.insert(0, str(BASE_DIR))
+
+from modules.json_stream import JsonStreamGuard, StreamAbort, resolve_max_chars, ABORT_LENGTH
+
+ARCHIVE = json.loads((BASE_DIR / "tests" / "stream_responses.json").read_text(encoding="utf-8"))["responses"]
+CAPS = json.loads((BASE_DIR / "config" / "config.json").read_text(encoding="utf-8"))["OPENAI_SETTINGS"].get(
+    "stream_max_output_chars") or {}
+CASES = [(key, text) for key, responses in ARCHIVE.items() for text in responses]
+
+
+def feed(guard: JsonStreamGuard, text: str, chunk: int = 8):
+    for start in range(0, len(text), chunk):
+        guard.feed(text[start:start + chunk])
+
+
+@pytest.mark.parametrize("key,text", CASES)
+def test_archived_response_passes_configured_cap(key, text):
+    guard = JsonStreamGuard(max_chars=resolve_max_chars(CAPS, key))
+    feed(guard, text)
+    assert guard.closed
+    assert json.loads(guard.text) == json.loads(text)
+
+
+@pytest.mark.parametrize("key", sorted(k for k in CAPS if k != "default" and CAPS[k]))
+def test_runaway_response_aborts_on_length(key):
+    cap = resolve_max_chars(CAPS, key)
+    runaway = '{"question": "' + "и снова " * cap
+    with pytest.raises(StreamAbort) as abort:
+        feed(JsonStreamGuard(max_chars=cap), runaway)
+    assert abort.value.kind == ABORT_LENGTH
+    assert cap < abort.value.received_chars <= cap + 8
+
+
+def test_structural_abort_is_not_a_length_abort():
+    with pytest.raises(StreamAbort) as abort:
+        feed(JsonStreamGuard(max_chars=100), "Конечно! Вот JSON: {}")
+    assert abort.value.kind != ABORT_LENGTH